@@ -22,6 +22,20 @@ Common code used by the admin libs
 from __future__ import absolute_import
 
 import os
+import sys
+
+
+# where the admin tools keep caches that are safe to throw away
+if sys.platform == 'darwin':
+    CACHE_DIR = os.path.expanduser('~/Library/Caches/com.googlecode.munki')
+else:
+    CACHE_DIR = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'munki')
+
+# the admin tools' persistent cache of installer item hashes
+HASH_CACHE_DB = os.path.join(CACHE_DIR, 'hashcache.sqlite')
+
 
 class AttributeDict(dict):
     '''Class that allow us to access foo['bar'] as foo.bar, and return None
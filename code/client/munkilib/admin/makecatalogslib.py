@@ -24,13 +24,24 @@ from __future__ import absolute_import, print_function
 # std libs
 import hashlib
 import os
+import re
+import tempfile
 
 # our libs
-from .common import list_items_of_kind, AttributeDict
+from .common import list_items_of_kind, AttributeDict, HASH_CACHE_DB
 
+from .. import compression
+from .. import deltautils
+from .. import munkihash
 from .. import munkirepo
 
-from ..wrappers import readPlistFromString, writePlistToString
+from ..wrappers import readPlistFromString, writePlistToString, is_a_string
+
+
+# only make deltas for installer items at least this big (in KB)
+DELTA_MINIMUM_ITEM_SIZE = 100 * 1024
+# don't offer a delta that is more than this fraction of the full item
+DELTA_MAXIMUM_RATIO = 0.5
 
 
 class MakeCatalogsError(Exception):
@@ -64,9 +75,37 @@ def hash_icons(repo, output_fn=None):
     return icons, errors
 
 
+class ItemIndex(object):
+    '''Exact-match and case-insensitive lookups of repo item paths, built
+    once from a list of items so each lookup is a hash table probe instead
+    of a scan of the whole list'''
+
+    def __init__(self, items):
+        self.items = set(items)
+        self.casefolded = {}
+        for item in items:
+            # first item wins, as with a scan of the list
+            self.casefolded.setdefault(item.casefold(), item)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def case_insensitive_match(self, item):
+        '''Returns the repo item that matches item ignoring case, or None'''
+        return self.casefolded.get(item.casefold())
+
+
 def verify_pkginfo(pkginfo_ref, pkginfo, pkgs_list, errors):
     '''Returns True if referenced installer items are present,
-    False otherwise. Adds errors/warnings to the errors list'''
+    False otherwise. Adds errors/warnings to the errors list.
+    pkgs_list should be an ItemIndex; a plain list of pkgs is indexed
+    on each call, so callers verifying many pkginfos should build the
+    index once.'''
+    if not isinstance(pkgs_list, ItemIndex):
+        pkgs_list = ItemIndex(pkgs_list)
     installer_type = pkginfo.get('installer_type')
     if installer_type in ['nopkg', 'apple_update_metadata']:
         # no associated installer item (pkg) for these types
@@ -93,20 +132,17 @@ def verify_pkginfo(pkginfo_ref, pkginfo, pkgs_list, errors):
     # Check if the installer item actually exists
     if not installeritempath in pkgs_list:
         # do a case-insensitive comparison
-        found_caseinsensitive_match = False
-        for repo_pkg in pkgs_list:
-            if installeritempath.lower() == repo_pkg.lower():
-                errors.append(
-                    "WARNING: %s refers to installer item: %s. "
-                    "The pathname of the item in the repo has "
-                    "different case: %s. This may cause issues "
-                    "depending on the case-sensitivity of the "
-                    "underlying filesystem."
-                    % (pkginfo_ref,
-                       pkginfo['installer_item_location'], repo_pkg))
-                found_caseinsensitive_match = True
-                break
-        if not found_caseinsensitive_match:
+        repo_pkg = pkgs_list.case_insensitive_match(installeritempath)
+        if repo_pkg:
+            errors.append(
+                "WARNING: %s refers to installer item: %s. "
+                "The pathname of the item in the repo has "
+                "different case: %s. This may cause issues "
+                "depending on the case-sensitivity of the "
+                "underlying filesystem."
+                % (pkginfo_ref,
+                   pkginfo['installer_item_location'], repo_pkg))
+        else:
             errors.append(
                 "WARNING: %s refers to missing installer item: %s"
                 % (pkginfo_ref, pkginfo['installer_item_location']))
@@ -135,20 +171,17 @@ def verify_pkginfo(pkginfo_ref, pkginfo, pkgs_list, errors):
         # Check if the uninstaller item actually exists
         if not uninstalleritempath in pkgs_list:
             # do a case-insensitive comparison
-            found_caseinsensitive_match = False
-            for repo_pkg in pkgs_list:
-                if uninstalleritempath.lower() == repo_pkg.lower():
-                    errors.append(
-                        "WARNING: %s refers to uninstaller item: %s. "
-                        "The pathname of the item in the repo has "
-                        "different case: %s. This may cause issues "
-                        "depending on the case-sensitivity of the "
-                        "underlying filesystem."
-                        % (pkginfo_ref,
-                           pkginfo['uninstaller_item_location'], repo_pkg))
-                    found_caseinsensitive_match = True
-                    break
-            if not found_caseinsensitive_match:
+            repo_pkg = pkgs_list.case_insensitive_match(uninstalleritempath)
+            if repo_pkg:
+                errors.append(
+                    "WARNING: %s refers to uninstaller item: %s. "
+                    "The pathname of the item in the repo has "
+                    "different case: %s. This may cause issues "
+                    "depending on the case-sensitivity of the "
+                    "underlying filesystem."
+                    % (pkginfo_ref,
+                       pkginfo['uninstaller_item_location'], repo_pkg))
+            else:
                 errors.append(
                     "WARNING: %s refers to missing uninstaller item: %s"
                     % (pkginfo_ref, pkginfo['uninstaller_item_location']))
@@ -158,6 +191,153 @@ def verify_pkginfo(pkginfo_ref, pkginfo, pkgs_list, errors):
     return True
 
 
+def verify_item_hashes(repo, pkgsinfo, errors, output_fn=None):
+    '''Checks installer_item_hash and uninstaller_item_hash values against
+    the actual files in the repo. pkgsinfo is a list of (pkginfo_ref, pkginfo)
+    tuples. Hashes are calculated in parallel and remembered in the persistent
+    hash cache, so only new or changed pkgs are actually read.
+    Returns a set of pkginfo_refs that failed verification. Adds
+    errors/warnings to the errors list'''
+    failed = set()
+    to_check = []
+    for pkginfo_ref, pkginfo in pkgsinfo:
+        for location_key, hash_key in (
+                ('installer_item_location', 'installer_item_hash'),
+                ('uninstaller_item_location', 'uninstaller_item_hash')):
+            if (pkginfo.get(hash_key) and
+                    is_a_string(pkginfo.get(location_key))):
+                resource = os.path.join('pkgs', pkginfo[location_key])
+                try:
+                    local_path = repo.local_path(resource)
+                except AttributeError:
+                    errors.append(
+                        "WARNING: Skipping hash verification: this repo "
+                        "plugin does not provide local file access")
+                    return failed
+                to_check.append(
+                    (pkginfo_ref, hash_key, pkginfo[location_key],
+                     pkginfo[hash_key], local_path))
+    if not to_check:
+        return failed
+
+    if output_fn:
+        output_fn("Verifying hashes of %s installer items..." % len(to_check))
+
+    def progress(local_path, dummy_hash):
+        '''Report items that actually had to be read'''
+        if output_fn:
+            output_fn("Hashed %s..." % local_path)
+
+    hashes = munkihash.cached_sha256hashes(
+        [item[4] for item in to_check], HASH_CACHE_DB, progress_fn=progress)
+    for (pkginfo_ref, hash_key, location, expected, local_path) in to_check:
+        actual = hashes.get(local_path)
+        if actual in (None, 'NOT A FILE'):
+            # missing items are reported by verify_pkginfo
+            continue
+        if actual == 'HASH_ERROR':
+            errors.append("WARNING: Could not read %s to verify %s in %s"
+                          % (location, hash_key, pkginfo_ref))
+            failed.add(pkginfo_ref)
+        elif actual != expected:
+            errors.append(
+                "WARNING: %s in %s does not match installer item: %s"
+                % (hash_key, pkginfo_ref, location))
+            failed.add(pkginfo_ref)
+    return failed
+
+
+def _version_key(version):
+    '''Sort key that orders version strings like 10.2 after 9.11'''
+    key = []
+    for part in re.split(r'(\d+)', str(version)):
+        if part.isdigit():
+            key.append((1, int(part), ''))
+        elif part.strip('.'):
+            key.append((0, 0, part))
+    return key
+
+
+def delta_location_for(target_pkginfo, base_pkginfo):
+    '''Returns the location (relative to pkgs) of the delta from the
+    installer item of base_pkginfo to that of target_pkginfo'''
+    return '%s.%s.munkidelta' % (target_pkginfo['installer_item_location'],
+                                 base_pkginfo['installer_item_hash'][:16])
+
+
+def _make_delta(repo, base_path, target_path, delta_ref, output_fn=None):
+    '''Makes a delta and saves it to the repo. Returns its hash.'''
+    if output_fn:
+        output_fn("Making %s..." % delta_ref)
+    fileref, temp_path = tempfile.mkstemp(suffix='.munkidelta')
+    os.close(fileref)
+    try:
+        deltautils.make_delta(base_path, target_path, temp_path)
+        delta_hash = munkihash.getsha256hash(temp_path)
+        repo.put_from_local_file(delta_ref, temp_path)
+    finally:
+        os.unlink(temp_path)
+    return delta_hash
+
+
+def add_deltas(repo, pkgsinfo, errors, output_fn=None):
+    '''For each large installer item with an older version in the repo,
+    makes a delta from the next older version's installer item if there
+    isn't one already, and describes it in the installer_item_deltas of
+    the newer item's pkginfo. pkgsinfo is a list of pkginfo dictionaries;
+    they are changed in place. Adds errors/warnings to the errors list.'''
+    versions = {}
+    for pkginfo in pkgsinfo:
+        if (pkginfo.get('installer_item_hash') and
+                is_a_string(pkginfo.get('installer_item_location'))):
+            versions.setdefault(pkginfo['name'], []).append(pkginfo)
+    for items in versions.values():
+        items.sort(key=lambda item: _version_key(item.get('version', '')))
+        for base, target in zip(items, items[1:]):
+            if (base.get('version') == target.get('version') or
+                    base['installer_item_hash'] ==
+                    target['installer_item_hash'] or
+                    target.get('installer_item_size', 0) <
+                    DELTA_MINIMUM_ITEM_SIZE):
+                continue
+            delta_location = delta_location_for(target, base)
+            delta_ref = os.path.join('pkgs', delta_location)
+            try:
+                base_path = repo.local_path(
+                    os.path.join('pkgs', base['installer_item_location']))
+                target_path = repo.local_path(
+                    os.path.join('pkgs', target['installer_item_location']))
+                delta_path = repo.local_path(delta_ref)
+            except AttributeError:
+                errors.append(
+                    "WARNING: Skipping deltas: this repo plugin does not "
+                    "provide local file access")
+                return
+            try:
+                if os.path.exists(delta_path):
+                    delta_hash = munkihash.cached_sha256hashes(
+                        [delta_path], HASH_CACHE_DB)[delta_path]
+                else:
+                    delta_hash = _make_delta(
+                        repo, base_path, target_path, delta_ref,
+                        output_fn=output_fn)
+                delta_size = int(os.path.getsize(delta_path) / 1024)
+            except (IOError, OSError, munkirepo.RepoError) as err:
+                errors.append(
+                    "WARNING: Could not make delta %s: %s"
+                    % (delta_location, err))
+                continue
+            if delta_size > (target['installer_item_size'] *
+                             DELTA_MAXIMUM_RATIO):
+                # not enough in common to be worth it
+                continue
+            target['installer_item_deltas'] = [
+                {'base_hash': base['installer_item_hash'],
+                 'delta_location': delta_location,
+                 'delta_hash': delta_hash,
+                 'delta_size': delta_size}]
+
+
 def process_pkgsinfo(repo, options, output_fn=None):
     '''Processes pkginfo files and returns a dictionary of catalogs'''
     errors = []
@@ -175,16 +355,13 @@ def process_pkgsinfo(repo, options, output_fn=None):
     if output_fn:
         output_fn("Getting list of pkgs...")
     try:
-        pkgs_list = list_items_of_kind(repo, 'pkgs')
+        pkgs_list = ItemIndex(list_items_of_kind(repo, 'pkgs'))
     except munkirepo.RepoError as err:
         raise MakeCatalogsError(
             u"Error getting list of pkgs items: %s" % err)
 
-    # start with empty catalogs dict
-    catalogs = {}
-    catalogs['all'] = []
-
     # Walk through the pkginfo files
+    pkgsinfo = []
     for pkginfo_ref in pkgsinfo_list:
         # Try to read the pkginfo file
         try:
@@ -217,6 +394,21 @@ def process_pkgsinfo(repo, options, output_fn=None):
                 # Skip this pkginfo unless we're running with force flag
                 continue
 
+        pkgsinfo.append((pkginfo_ref, pkginfo))
+
+    # optionally check item hashes against the actual pkgs
+    if options.verify_hashes:
+        failed = verify_item_hashes(
+            repo, pkgsinfo, errors, output_fn=output_fn)
+        if failed and not options.force:
+            # Skip these pkginfos unless we're running with force flag
+            pkgsinfo = [item for item in pkgsinfo if item[0] not in failed]
+
+    # start with empty catalogs dict
+    catalogs = {}
+    catalogs['all'] = []
+
+    for pkginfo_ref, pkginfo in pkgsinfo:
         # append the pkginfo to the relevant catalogs
         catalogs['all'].append(pkginfo)
         for catalogname in pkginfo.get("catalogs", []):
@@ -231,10 +423,12 @@ def process_pkgsinfo(repo, options, output_fn=None):
                 output_fn("Adding %s to %s..." % (pkginfo_ref, catalogname))
 
     # look for catalog names that differ only in case
-    duplicate_catalogs = []
+    catalog_name_counts = {}
     for key in catalogs:
-        if key.lower() in [item.lower() for item in catalogs if item != key]:
-            duplicate_catalogs.append(key)
+        catalog_name_counts[key.lower()] = (
+            catalog_name_counts.get(key.lower(), 0) + 1)
+    duplicate_catalogs = [key for key in catalogs
+                          if catalog_name_counts[key.lower()] > 1]
     if duplicate_catalogs:
         errors.append("WARNING: There are catalogs with names that differ only "
                       "by case. This may cause issues depending on the case-"
@@ -247,7 +441,11 @@ def process_pkgsinfo(repo, options, output_fn=None):
 def makecatalogs(repo, options, output_fn=None):
     '''Assembles all pkginfo files into catalogs.
     User calling this needs to be able to write to the repo/catalogs
-    directory.'''
+    directory. If options.verify_hashes is set, item hashes are checked
+    against the pkgs in the repo as well. If options.make_deltas is set,
+    deltas from the previous version of each large installer item are made
+    and added to the catalogs. If options.precompress is set, compressed
+    variants of each catalog are written next to it.'''
 
     if isinstance(options, dict):
         options = AttributeDict(options)
@@ -259,44 +457,65 @@ def makecatalogs(repo, options, output_fn=None):
 
     errors.extend(catalog_errors)
 
-    # clear out old catalogs
-    try:
-        catalog_list = repo.itemlist('catalogs')
-    except munkirepo.RepoError:
-        catalog_list = []
-    for catalog_name in catalog_list:
-        if catalog_name not in list(catalogs.keys()):
-            catalog_ref = os.path.join('catalogs', catalog_name)
-            try:
-                repo.delete(catalog_ref)
-            except munkirepo.RepoError:
-                errors.append('Could not delete catalog %s' % catalog_name)
+    # write everything as one batch (a single commit for GitFileRepo)
+    with munkirepo.transaction(repo):
+        if options.make_deltas:
+            add_deltas(repo, catalogs['all'], errors, output_fn=output_fn)
 
-    # write the new catalogs
-    for key in catalogs:
-        catalogpath = os.path.join("catalogs", key)
-        if catalogs[key] != "":
-            catalog_data = writePlistToString(catalogs[key])
+        encodings = []
+        if options.precompress:
+            encodings = compression.available_encodings()
+        catalog_names = set(catalogs.keys())
+        for encoding in encodings:
+            catalog_names.update(
+                key + compression.SUFFIXES[encoding] for key in catalogs)
+
+        # clear out old catalogs (and variants we no longer make)
+        try:
+            catalog_list = repo.itemlist('catalogs')
+        except munkirepo.RepoError:
+            catalog_list = []
+        for catalog_name in catalog_list:
+            if catalog_name not in catalog_names:
+                catalog_ref = os.path.join('catalogs', catalog_name)
+                try:
+                    repo.delete(catalog_ref)
+                except munkirepo.RepoError:
+                    errors.append('Could not delete catalog %s' % catalog_name)
+
+        # write the new catalogs
+        for key in catalogs:
+            catalogpath = os.path.join("catalogs", key)
+            if catalogs[key] != "":
+                catalog_data = writePlistToString(catalogs[key])
+                try:
+                    repo.put(catalogpath, catalog_data)
+                    if output_fn:
+                        output_fn("Created %s..." % catalogpath)
+                    for encoding in encodings:
+                        variantpath = catalogpath + compression.SUFFIXES[
+                            encoding]
+                        repo.put(variantpath, compression.compress(
+                            catalog_data, encoding))
+                        if output_fn:
+                            output_fn("Created %s..." % variantpath)
+                except munkirepo.RepoError as err:
+                    errors.append(
+                        u'Failed to create catalog %s: %s' % (key, err))
+            else:
+                errors.append(
+                    "WARNING: Did not create catalog %s because it is empty"
+                    % key)
+
+        if icons:
+            icon_hashes_plist = os.path.join("icons", "_icon_hashes.plist")
+            icon_hashes = writePlistToString(icons)
             try:
-                repo.put(catalogpath, catalog_data)
-                if output_fn:
-                    output_fn("Created %s..." % catalogpath)
+                repo.put(icon_hashes_plist, icon_hashes)
+                print("Created %s..." % (icon_hashes_plist))
             except munkirepo.RepoError as err:
                 errors.append(
-                    u'Failed to create catalog %s: %s' % (key, err))
-        else:
-            errors.append(
-                "WARNING: Did not create catalog %s because it is empty" % key)
-
-    if icons:
-        icon_hashes_plist = os.path.join("icons", "_icon_hashes.plist")
-        icon_hashes = writePlistToString(icons)
-        try:
-            repo.put(icon_hashes_plist, icon_hashes)
-            print("Created %s..." % (icon_hashes_plist))
-        except munkirepo.RepoError as err:
-            errors.append(
-                u'Failed to create %s: %s' % (icon_hashes_plist, err))
+                    u'Failed to create %s: %s' % (icon_hashes_plist, err))
 
     # Return any errors
     return errors
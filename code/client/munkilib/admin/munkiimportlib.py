@@ -27,11 +27,15 @@ Routines used by munkimport to import items into Munki repo
 from __future__ import absolute_import, print_function
 
 # std lib imports
+import hashlib
+import json
 import os
+import sqlite3
 import sys
+import weakref
 
 # our lib imports
-from .common import list_items_of_kind
+from .common import list_items_of_kind, CACHE_DIR, HASH_CACHE_DB
 from .. import iconutils
 from .. import dmgutils
 from .. import munkihash
@@ -48,6 +52,38 @@ class RepoCopyError(Exception):
     #pass
 
 
+# listings of repo items, per repo object, for repos without local file access
+_REPO_LISTINGS = weakref.WeakKeyDictionary()
+
+
+def repo_item_exists(repo, kind, resource_identifier):
+    '''Returns True if resource_identifier (example: 'pkgs/apps/Foo.dmg')
+    exists in the repo. Repos with local file access are checked directly;
+    for others, the listing of kind is fetched once and remembered.'''
+    try:
+        return os.path.exists(repo.local_path(resource_identifier))
+    except AttributeError:
+        # no guarantee all repo plugins have the local_path method
+        pass
+    listings = _REPO_LISTINGS.setdefault(repo, {})
+    if kind not in listings:
+        try:
+            listings[kind] = set(list_items_of_kind(repo, kind))
+        except munkirepo.RepoError as err:
+            raise RepoCopyError(u'Unable to get list of current %s: %s'
+                                % (kind, err)) from err
+    return resource_identifier in listings[kind]
+
+
+def note_repo_item_added(repo, kind, resource_identifier):
+    '''Records that we added resource_identifier to the repo, so remembered
+    listings stay current'''
+    try:
+        _REPO_LISTINGS[repo][kind].add(resource_identifier)
+    except (KeyError, TypeError):
+        pass
+
+
 def determine_arch(pkginfo) -> str:
     """Determine a supported architecture string"""
     # If there is exactly one supported architecture, return a string with it
@@ -83,23 +119,34 @@ def copy_item_to_repo(repo, itempath, vers, subdirectory=''):
             destination_path_name = os.path.join(destination_path, item_name)
 
     index = 0
-    try:
-        pkgs_list = list_items_of_kind(repo, 'pkgs')
-    except munkirepo.RepoError as err:
-        raise RepoCopyError(u'Unable to get list of current pkgs: %s' % err) from err
-    while destination_path_name in pkgs_list:
+    while repo_item_exists(repo, 'pkgs', destination_path_name):
         #print 'File %s already exists...' % destination_path_name
         # try appending numbers until we have a unique name
         index += 1
         item_name = '%s__%s%s' % (name, index, ext)
         destination_path_name = os.path.join(destination_path, item_name)
 
+    # makepkginfo has usually just hashed the item; if so, it can be copied
+    # by the kernel (or cloned) without reading it through a hash
+    itemhash = munkihash.known_sha256hash(itempath, HASH_CACHE_DB)
     try:
-        repo.put_from_local_file(destination_path_name, itempath)
+        if itemhash or not hasattr(repo, 'put_from_local_file_with_hash'):
+            repo.put_from_local_file(destination_path_name, itempath)
+        else:
+            # hash the item as it is copied
+            itemhash = repo.put_from_local_file_with_hash(
+                destination_path_name, itempath)
+        if itemhash and hasattr(repo, 'local_path'):
+            # remember the hash so the new repo copy doesn't need to be
+            # read again
+            munkihash.remember_sha256hash(
+                repo.local_path(destination_path_name), itemhash,
+                HASH_CACHE_DB)
     except munkirepo.RepoError as err:
         raise RepoCopyError(u'Unable to copy %s to %s: %s'
                             % (itempath, destination_path_name, err)) from err
     else:
+        note_repo_item_added(repo, 'pkgs', destination_path_name)
         return destination_path_name
 
 
@@ -118,11 +165,7 @@ def copy_pkginfo_to_repo(repo, pkginfo, subdirectory=''):
                             arch, pkginfo_ext)
     pkginfo_path = os.path.join(destination_path, pkginfo_name)
     index = 0
-    try:
-        pkgsinfo_list = list_items_of_kind(repo, 'pkgsinfo')
-    except munkirepo.RepoError as err:
-        raise RepoCopyError(u'Unable to get list of current pkgsinfo: %s' % err) from err
-    while pkginfo_path in pkgsinfo_list:
+    while repo_item_exists(repo, 'pkgsinfo', pkginfo_path):
         index += 1
         pkginfo_name = '%s-%s%s__%s%s' % (pkginfo['name'], pkginfo['version'],
                                         arch, index, pkginfo_ext)
@@ -134,10 +177,15 @@ def copy_pkginfo_to_repo(repo, pkginfo, subdirectory=''):
         raise RepoCopyError(err) from err
     try:
         repo.put(pkginfo_path, pkginfo_str)
-        return pkginfo_path
     except munkirepo.RepoError as err:
         raise RepoCopyError(u'Unable to save pkginfo to %s: %s'
                             % (pkginfo_path, err)) from err
+    note_repo_item_added(repo, 'pkgsinfo', pkginfo_path)
+    # let later imports in this run match against the new item
+    import_index = _IMPORT_INDEXES.get(repo)
+    if import_index is not None:
+        import_index.add_pkginfo(pkginfo, pkginfo_str)
+    return pkginfo_path
 
 
 class CatalogDBException(Exception):
@@ -155,18 +203,10 @@ class CatalogDecodeException(CatalogDBException):
     #pass
 
 
-def make_catalog_db(repo):
-    """Returns a dict we can use like a database"""
-
-    try:
-        plist = repo.get('catalogs/all')
-    except munkirepo.RepoError as err:
-        raise CatalogReadException(err) from err
-
-    try:
-        catalogitems = FoundationPlist.readPlistFromString(plist)
-    except FoundationPlist.NSPropertyListSerializationException as err:
-        raise CatalogDecodeException(err) from err
+def make_catalog_tables(catalogitems):
+    """Returns a dict of lookup tables for a list of pkginfo items. Each
+    table maps a hash, receipt, application path, installer item name or
+    PayloadIdentifier to the indexes of the items in catalogitems"""
 
     pkgid_table = {}
     app_table = {}
@@ -240,23 +280,314 @@ def make_catalog_db(repo):
                 profile_table[item['PayloadIdentifier']][vers] = []
             profile_table[item['PayloadIdentifier']][vers].append(itemindex)
 
-    pkgdb = {}
-    pkgdb['hashes'] = hash_table
-    pkgdb['receipts'] = pkgid_table
-    pkgdb['applications'] = app_table
-    pkgdb['installer_items'] = installer_item_table
-    pkgdb['profiles'] = profile_table
-    pkgdb['items'] = catalogitems
+    tables = {}
+    tables['hashes'] = hash_table
+    tables['receipts'] = pkgid_table
+    tables['applications'] = app_table
+    tables['installer_items'] = installer_item_table
+    tables['profiles'] = profile_table
+    return tables
+
 
+def read_all_catalog(repo, data=None):
+    """Returns the list of pkginfo items in catalogs/all"""
+    if data is None:
+        try:
+            data = repo.get('catalogs/all')
+        except munkirepo.RepoError as err:
+            raise CatalogReadException(err) from err
+
+    try:
+        return FoundationPlist.readPlistFromString(data)
+    except FoundationPlist.NSPropertyListSerializationException as err:
+        raise CatalogDecodeException(err) from err
+
+
+def make_catalog_db(repo):
+    """Returns a dict we can use like a database"""
+    catalogitems = read_all_catalog(repo)
+    pkgdb = make_catalog_tables(catalogitems)
+    pkgdb['items'] = catalogitems
     return pkgdb
 
 
+IMPORT_INDEX_TABLES_CREATE = (
+    'CREATE TABLE IF NOT EXISTS meta ('
+    'key TEXT PRIMARY KEY,'
+    'value TEXT'
+    ')',
+    # items were once stored by position in catalogs/all
+    'DROP TABLE IF EXISTS items',
+    'CREATE TABLE IF NOT EXISTS pkginfo_items ('
+    'item_key TEXT PRIMARY KEY,'
+    'digest TEXT,'
+    'plist BLOB'
+    ')')
+
+
+def _item_key(pkginfo, used_keys):
+    """Returns a key for a pkginfo item that doesn't depend on where it is
+    in catalogs/all, and adds it to used_keys. catalogs/all doesn't record
+    which pkginfo file each item came from, so the item is identified the
+    way its pkginfo file is: by name, version and installer item. Duplicates
+    get a numeric suffix."""
+    base_key = u'%s-%s:%s' % (pkginfo.get('name'), pkginfo.get('version'),
+                              pkginfo.get('installer_item_location', ''))
+    key = base_key
+    count = 1
+    while key in used_keys:
+        count += 1
+        key = u'%s#%s' % (base_key, count)
+    used_keys.add(key)
+    return key
+
+
+def _jsonable_tables(tables):
+    """Returns a copy of lookup tables with every key as a plain str"""
+    result = {}
+    for table_name, table in tables.items():
+        result[table_name] = {}
+        for key, value in table.items():
+            if isinstance(value, dict):
+                value = dict((str(vers), indexes)
+                             for (vers, indexes) in value.items())
+            result[table_name][str(key)] = value
+    return result
+
+
+class ImportIndex(object):
+    """A persistent local index of a repo's catalogs/all, used to match
+    items being imported against existing pkginfo. It holds the lookup
+    tables from make_catalog_tables and each pkginfo item as plist data, so
+    a lookup only decodes the candidate items. The index is revalidated
+    against the size and modification time of catalogs/all (for repos with
+    local file access) or its SHA-256 hash, and only changed items are
+    rewritten when catalogs/all changes. If the index database can't be used,
+    the index is kept in memory only."""
+
+    def __init__(self, repo, database=None):
+        self.repo = repo
+        if database is None:
+            repo_id = getattr(repo, 'baseurl', None) or repr(repo)
+            database = os.path.join(
+                CACHE_DIR, 'importindex-%s.sqlite'
+                % hashlib.sha256(repo_id.encode('UTF-8')).hexdigest()[:16])
+        self.database = database
+        self.tables = None
+        self.item_count = 0
+        self.item_keys = []
+        self._used_keys = set()
+        self._current_stat = None
+        self._decoded = {}
+        self._memory_items = None
+        try:
+            dir_path = os.path.dirname(self.database)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path, 0o755)
+            self.conn = sqlite3.connect(self.database)
+            for sql in IMPORT_INDEX_TABLES_CREATE:
+                self.conn.execute(sql)
+            self.conn.commit()
+        except (OSError, sqlite3.Error):
+            self.conn = None
+
+    def __getitem__(self, table_name):
+        return self.tables[table_name]
+
+    def _get_meta(self, key):
+        """Returns a value from the meta table, or None"""
+        if not self.conn:
+            return None
+        row = self.conn.execute(
+            'SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        """Stores a value in the meta table; caller commits"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def _catalog_stat(self):
+        """Returns a size/mtime signature for catalogs/all if the repo has
+        local file access, otherwise None"""
+        try:
+            stat_info = os.stat(self.repo.local_path('catalogs/all'))
+        except (AttributeError, OSError):
+            return None
+        return '%s:%s' % (stat_info.st_size, stat_info.st_mtime_ns)
+
+    def load(self):
+        """Makes sure the index reflects the current catalogs/all.
+        Raises CatalogReadException or CatalogDecodeException"""
+        try:
+            self._load()
+        except sqlite3.Error as err:
+            print(u'WARNING: could not use import index %s: %s'
+                  % (self.database, err), file=sys.stderr)
+            self.conn = None
+            self._load()
+
+    def _load(self):
+        """Does the work for load()"""
+        catalog_stat = self._catalog_stat()
+        if self.tables is not None and catalog_stat and (
+                catalog_stat == self._current_stat):
+            # nothing changed since we last looked
+            return
+        if (catalog_stat and catalog_stat == self._get_meta('catalog_stat')
+                and self._load_tables()):
+            self._current_stat = catalog_stat
+            return
+
+        try:
+            data = self.repo.get('catalogs/all')
+        except munkirepo.RepoError as err:
+            raise CatalogReadException(err) from err
+        catalog_hash = hashlib.sha256(data).hexdigest()
+        if (catalog_hash != self._get_meta('catalog_hash') or
+                not self._load_tables()):
+            self._rebuild(read_all_catalog(self.repo, data=data))
+            if self.conn:
+                self._set_meta('catalog_hash', catalog_hash)
+        if self.conn:
+            self._set_meta('catalog_stat', catalog_stat)
+            self.conn.commit()
+        self._current_stat = catalog_stat
+
+    def _load_tables(self):
+        """Loads the lookup tables from the database. Returns False if they
+        aren't there"""
+        tables = self._get_meta('tables')
+        item_count = self._get_meta('item_count')
+        item_keys = self._get_meta('item_keys')
+        if tables is None or item_count is None or item_keys is None:
+            return False
+        self.tables = json.loads(tables)
+        self.item_count = int(item_count)
+        self.item_keys = json.loads(item_keys)
+        self._used_keys = set(self.item_keys)
+        self._decoded = {}
+        return True
+
+    def _rebuild(self, catalogitems):
+        """Rebuilds the index from the list of items in catalogs/all,
+        rewriting only items that were added or changed"""
+        self.tables = _jsonable_tables(make_catalog_tables(catalogitems))
+        self.item_count = len(catalogitems)
+        self._used_keys = set()
+        self.item_keys = [_item_key(item, self._used_keys)
+                          for item in catalogitems]
+        self._decoded = dict(enumerate(catalogitems))
+        if not self.conn:
+            self._memory_items = list(catalogitems)
+            return
+        existing = dict(self.conn.execute(
+            'SELECT item_key, digest FROM pkginfo_items'))
+        changed = []
+        for key, item in zip(self.item_keys, catalogitems):
+            plist = FoundationPlist.writePlistToString(item)
+            digest = hashlib.sha256(plist).hexdigest()
+            if existing.get(key) != digest:
+                changed.append((key, digest, plist))
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO pkginfo_items VALUES (?, ?, ?)', changed)
+        self.conn.executemany(
+            'DELETE FROM pkginfo_items WHERE item_key=?',
+            [(key,) for key in set(existing) - self._used_keys])
+        self._set_meta('tables', json.dumps(self.tables))
+        self._set_meta('item_count', str(self.item_count))
+        self._set_meta('item_keys', json.dumps(self.item_keys))
+
+    def _scan_catalog(self, err):
+        """Stops using the index database after an error, reading items
+        from catalogs/all instead"""
+        print(u'WARNING: could not use import index %s: %s'
+              % (self.database, err), file=sys.stderr)
+        self.conn = None
+        items = read_all_catalog(self.repo)
+        # items added since makecatalogs last ran aren't in catalogs/all;
+        # those added in this run are still decoded, others can't be had
+        items.extend(self._decoded.get(position, {})
+                     for position in range(len(items), self.item_count))
+        self._memory_items = items
+
+    def item(self, position):
+        """Returns the pkginfo item at position. Raises
+        CatalogReadException or CatalogDecodeException if the item has to
+        be read from catalogs/all and can't be"""
+        if position not in self._decoded:
+            if self._memory_items is not None:
+                return self._memory_items[position]
+            try:
+                row = self.conn.execute(
+                    'SELECT plist FROM pkginfo_items WHERE item_key=?',
+                    (self.item_keys[position],)).fetchone()
+                if row is None:
+                    raise sqlite3.DatabaseError(
+                        'item %s is missing' % position)
+            except sqlite3.Error as err:
+                self._scan_catalog(err)
+                return self._memory_items[position]
+            self._decoded[position] = FoundationPlist.readPlistFromString(
+                row[0])
+        return self._decoded[position]
+
+    def add_pkginfo(self, pkginfo, plist):
+        """Adds a newly imported pkginfo item (and its plist data) to the
+        index, so later imports match it before makecatalogs is run"""
+        if self.tables is None:
+            return
+        position = self.item_count
+        new_tables = _jsonable_tables(make_catalog_tables([pkginfo]))
+        for table_name, table in new_tables.items():
+            for key, value in table.items():
+                if isinstance(value, dict):
+                    for vers in value:
+                        self.tables[table_name].setdefault(
+                            key, {}).setdefault(vers, []).append(position)
+                else:
+                    self.tables[table_name].setdefault(
+                        key, []).append(position)
+        self.item_count += 1
+        key = _item_key(pkginfo, self._used_keys)
+        self.item_keys.append(key)
+        self._decoded[position] = pkginfo
+        if self._memory_items is not None:
+            self._memory_items.append(pkginfo)
+        if self.conn:
+            try:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO pkginfo_items VALUES (?, ?, ?)',
+                    (key, hashlib.sha256(plist).hexdigest(), plist))
+                self._set_meta('tables', json.dumps(self.tables))
+                self._set_meta('item_count', str(self.item_count))
+                self._set_meta('item_keys', json.dumps(self.item_keys))
+                self.conn.commit()
+            except sqlite3.Error:
+                pass
+
+
+# import indexes, per repo object, reused across imports in one process
+_IMPORT_INDEXES = weakref.WeakKeyDictionary()
+
+
+def get_import_index(repo):
+    """Returns an up-to-date ImportIndex for repo.
+    Raises CatalogReadException or CatalogDecodeException"""
+    index = _IMPORT_INDEXES.get(repo)
+    if index is None:
+        index = ImportIndex(repo)
+        _IMPORT_INDEXES[repo] = index
+    index.load()
+    return index
+
+
 def find_matching_pkginfo(repo, pkginfo):
     """Looks through repo catalogs looking for matching pkginfo
     Returns a pkginfo dictionary, or an empty dict"""
 
     try:
-        catdb = make_catalog_db(repo)
+        catdb = get_import_index(repo)
     except CatalogReadException as err:
         # could not retrieve catalogs/all
         # do we have any existing pkgsinfo items?
@@ -273,11 +604,22 @@ def find_matching_pkginfo(repo, pkginfo):
                % err)
         return {}
 
+    try:
+        return _match_pkginfo(catdb, pkginfo)
+    except CatalogDBException as err:
+        # the index failed and catalogs/all couldn't be read instead
+        print(u'Could not get a list of existing items from the repo: %s'
+              % err)
+        return {}
+
+
+def _match_pkginfo(catdb, pkginfo):
+    """Does the matching for find_matching_pkginfo"""
     if 'installer_item_hash' in pkginfo:
         matchingindexes = catdb['hashes'].get(
             pkginfo['installer_item_hash'])
         if matchingindexes:
-            return catdb['items'][matchingindexes[0]]
+            return catdb.item(matchingindexes[0])
 
     if 'receipts' in pkginfo:
         pkgids = [item['packageid']
@@ -292,7 +634,7 @@ def find_matching_pkginfo(repo, pkginfo):
                 for versionkey in versionlist:
                     testpkgindexes = possiblematches[versionkey]
                     for pkgindex in testpkgindexes:
-                        testpkginfo = catdb['items'][pkgindex]
+                        testpkginfo = catdb.item(pkgindex)
                         testpkgids = [item['packageid'] for item in
                                       testpkginfo.get('receipts', [])
                                       if 'packageid' in item]
@@ -310,7 +652,7 @@ def find_matching_pkginfo(repo, pkginfo):
                 versionlist = list(possiblematches.keys())
                 versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
                 indexes = catdb['applications'][app][versionlist[0]]
-                return catdb['items'][indexes[0]]
+                return catdb.item(indexes[0])
 
     if 'PayloadIdentifier' in pkginfo:
         identifier = pkginfo['PayloadIdentifier']
@@ -319,7 +661,7 @@ def find_matching_pkginfo(repo, pkginfo):
             versionlist = list(possiblematches.keys())
             versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
             indexes = catdb['profiles'][identifier][versionlist[0]]
-            return catdb['items'][indexes[0]]
+            return catdb.item(indexes[0])
 
     # no matches by receipts or installed applications,
     # let's try to match based on installer_item_name
@@ -330,7 +672,7 @@ def find_matching_pkginfo(repo, pkginfo):
         versionlist = list(possiblematches.keys())
         versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
         indexes = catdb['installer_items'][installer_item_name][versionlist[0]]
-        return catdb['items'][indexes[0]]
+        return catdb.item(indexes[0])
 
     # if we get here, we found no matches
     return {}
@@ -347,20 +689,15 @@ def get_icon_path(pkginfo):
 def icon_exists_in_repo(repo, pkginfo):
     """Returns True if there is an icon for this item in the repo"""
     icon_path = get_icon_path(pkginfo)
-    try:
-        icon_list = list_items_of_kind(repo, 'icons')
-    except munkirepo.RepoError as err:
-        raise RepoCopyError(u'Unable to get list of current icons: %s' % err) from err
-    if icon_path in icon_list:
-        return True
-    return False
+    return repo_item_exists(repo, 'icons', icon_path)
 
 
 def add_icon_hash_to_pkginfo(pkginfo):
     """Adds the icon hash tp pkginfo if the icon exists in repo"""
     icon_path = get_icon_path(pkginfo)
     if os.path.isfile(icon_path):
-        pkginfo['icon_hash'] = munkihash.getsha256hash(icon_path)
+        pkginfo['icon_hash'] = munkihash.cached_sha256hash(
+            icon_path, HASH_CACHE_DB)
 
 
 def generate_png_from_startosinstall_item(repo, dmg_path, pkginfo):
@@ -483,11 +820,7 @@ def copy_icon_to_repo(repo, iconpath):
     icon_name = os.path.basename(iconpath)
     destination_path_name = os.path.join(destination_path, icon_name)
 
-    try:
-        icon_list = list_items_of_kind(repo, 'icons')
-    except munkirepo.RepoError as err:
-        raise RepoCopyError(u'Unable to get list of current icons: %s' % err) from err
-    if destination_path_name in icon_list:
+    if repo_item_exists(repo, 'icons', destination_path_name):
         # remove any existing icon in the repo
         try:
             repo.delete(destination_path_name)
@@ -497,6 +830,7 @@ def copy_icon_to_repo(repo, iconpath):
     print(u'Copying %s to %s...' % (icon_name, destination_path_name))
     try:
         repo.put_from_local_file(destination_path_name, iconpath)
+        note_repo_item_added(repo, 'icons', destination_path_name)
         return destination_path_name
     except munkirepo.RepoError as err:
         raise RepoCopyError(u'Unable to copy %s to %s: %s'
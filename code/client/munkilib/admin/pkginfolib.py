@@ -40,7 +40,7 @@ from Foundation import NSDate, NSUserName
 # pylint: enable=E0611,E0401
 
 # our libs
-from .common import AttributeDict
+from .common import AttributeDict, HASH_CACHE_DB
 
 from .. import dateutils
 from .. import dmgutils
@@ -412,7 +412,8 @@ def makepkginfo(installeritem, options):
         if os.path.isfile(installeritem):
             itemsize = int(os.path.getsize(installeritem)/1024)
             try:
-                itemhash = munkihash.getsha256hash(installeritem)
+                itemhash = munkihash.cached_sha256hash(
+                    installeritem, HASH_CACHE_DB)
             except OSError as err:
                 raise PkgInfoGenerationError(err) from err
 
@@ -534,7 +535,8 @@ def makepkginfo(installeritem, options):
                     location = os.path.split(uninstallerpath)[1]
                 pkginfo['uninstaller_item_location'] = location
                 itemsize = int(os.path.getsize(uninstallerpath))
-                itemhash = munkihash.getsha256hash(uninstallerpath)
+                itemhash = munkihash.cached_sha256hash(
+                    uninstallerpath, HASH_CACHE_DB)
                 pkginfo['uninstaller_item_size'] = int(itemsize/1024)
                 pkginfo['uninstaller_item_hash'] = itemhash
             else:
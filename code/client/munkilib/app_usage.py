@@ -26,10 +26,14 @@ Much code lifted from the application_usage scripts created by Google MacOps:
 from __future__ import absolute_import, print_function
 
 # standard Python libs
+import atexit
+import collections
 import logging
 import os
 import sqlite3
+import threading
 import time
+import weakref
 
 # our libs
 #from . import display
@@ -76,7 +80,7 @@ APPLICATION_USAGE_TABLE_UPDATE = (
     'app_version=?,'
     'app_path=?,'
     'last_time=?,'
-    'number_times=number_times+1 '
+    'number_times=number_times+? '
     'WHERE event=? and bundle_id=?'
     )
 
@@ -113,29 +117,120 @@ INSTALL_REQUEST_TABLE_UPDATE = (
     'UPDATE install_requests SET '
     'item_version=?,'
     'last_time=?,'
-    'number_times=number_times+1 '
+    'number_times=number_times+? '
     'WHERE event=? and item_name=?'
     )
 
+# Events are queued in memory and written in one transaction once this
+# many have been queued...
+APPLICATION_USAGE_BATCH_SIZE = 100
+# ...or once the oldest queued event is this many seconds old
+APPLICATION_USAGE_FLUSH_INTERVAL = 5
+
+# most keys to look up in one query; SQLite allows 999 parameters
+QUERY_CHUNK_SIZE = 500
+
+# recorders whose queued events are written when the process exits
+_RECORDERS = weakref.WeakSet()
+
+
+def _close_recorders():
+    """Writes the events still queued by any recorder"""
+    for recorder in list(_RECORDERS):
+        recorder.close()
+
+
+atexit.register(_close_recorders)
+
 
 class ApplicationUsageRecorder(object):
     """Tracks application launches, activations, and quits.
-    Also tracks Munki selfservice install and removal requests."""
+    Also tracks Munki selfservice install and removal requests.
+
+    Events are queued and written in batched transactions over a single
+    connection to the database, which uses write-ahead logging. Repeats of
+    the same event for the same app (or item) within a batch are written as
+    one row update. Queued events are written when the batch is full, when
+    the oldest has waited flush_interval seconds (a timer sees to this if
+    no more events arrive), on flush() or close(), and when the process
+    exits normally. Safe to share between threads."""
+
+    def __init__(self, database_name=None, batch_size=None,
+                 flush_interval=None, clock=time.time):
+        """Args:
+          database_name: str, default APPLICATION_USAGE_DB
+          batch_size: int, default APPLICATION_USAGE_BATCH_SIZE; 1 writes
+                      each event as it is logged
+          flush_interval: seconds, default APPLICATION_USAGE_FLUSH_INTERVAL
+          clock: function returning the current time, for testing
+        """
+        self.database = database_name or APPLICATION_USAGE_DB
+        self.batch_size = batch_size or APPLICATION_USAGE_BATCH_SIZE
+        if flush_interval is None:
+            flush_interval = APPLICATION_USAGE_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._conn = None
+        self._lock = threading.RLock()
+        # (event, bundle_id) or (event, item_name): merged event dict
+        self._app_events = collections.OrderedDict()
+        self._install_events = collections.OrderedDict()
+        self._queued = 0
+        self._oldest = None
+        self._retry_after = None
+        self._timer = None
+        _RECORDERS.add(self)
 
     def _connect(self, database_name=None):
         """Connect to database.
         Args:
-          database_name: str, default APPLICATION_USAGE_DB
+          database_name: str, default self.database
         Returns:
           sqlite3.Connection instance
         """
-        # pylint: disable=no-self-use
         if database_name is None:
-            database_name = APPLICATION_USAGE_DB
+            database_name = self.database
 
-        conn = sqlite3.connect(database_name)
+        # we use our own lock, so the connection may be used from whichever
+        # thread flushes the queue
+        conn = sqlite3.connect(database_name, check_same_thread=False)
         return conn
 
+    def _open(self):
+        """Returns our connection, opening it and making sure the tables
+        exist the first time.
+        Returns:
+          sqlite3.Connection instance
+        Raises:
+          sqlite3.Error: if error occurs
+        """
+        if self._conn is None:
+            conn = self._connect()
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                # with write-ahead logging, a crash or power loss can lose
+                # the last transactions, but can't corrupt the database
+                conn.execute('PRAGMA synchronous=NORMAL')
+                if not self._detect_application_usage_table(conn):
+                    self._create_application_usage_table(conn)
+                if not self._detect_install_request_table(conn):
+                    self._create_install_request_table(conn)
+                conn.commit()
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self._conn = conn
+        return self._conn
+
+    def _disconnect(self):
+        """Closes our connection, if open"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
     def _close(self, conn):
         """Close database.
         Args:
@@ -200,7 +295,8 @@ class ApplicationUsageRecorder(object):
         # pylint: disable=no-self-use
         conn.execute(APPLICATION_USAGE_TABLE_CREATE)
 
-    def _insert_application_usage(self, conn, event, app_dict):
+    def _insert_application_usage(self, conn, event, app_dict,
+                                  now=None, number_times=1):
         """Insert usage data into application usage table.
         Args:
           conn: sqlite3.Connection object
@@ -208,6 +304,8 @@ class ApplicationUsageRecorder(object):
           app_dict: {bundle_id: str,
                      version: str,
                      path: str}
+          now: int time of the (last) event, default now
+          number_times: int, how many times the event happened
         """
         # pylint: disable=no-self-use
         # this looks weird, but it's the simplest way to do an update or insert
@@ -215,14 +313,14 @@ class ApplicationUsageRecorder(object):
         # figure out.  plus we avoid using transactions and multiple SQL
         # statements in most cases.
 
-        now = int(time.time())
+        if now is None:
+            now = int(time.time())
         bundle_id = app_dict.get('bundle_id', 'UNKNOWN_APP')
         app_version = app_dict.get('version', '0')
         app_path = app_dict.get('path', '')
-        data = (app_version, app_path, now, event, bundle_id)
+        data = (app_version, app_path, now, number_times, event, bundle_id)
         query = conn.execute(APPLICATION_USAGE_TABLE_UPDATE, data)
         if query.rowcount == 0:
-            number_times = 1
             data = (event, bundle_id, app_version, app_path, now, number_times)
             conn.execute(APPLICATION_USAGE_TABLE_INSERT, data)
 
@@ -236,13 +334,16 @@ class ApplicationUsageRecorder(object):
         # pylint: disable=no-self-use
         conn.execute(INSTALL_REQUEST_TABLE_CREATE)
 
-    def _insert_install_request(self, conn, request_dict):
+    def _insert_install_request(self, conn, request_dict,
+                                now=None, number_times=1):
         """Insert usage data into application usage table.
         Args:
           conn: sqlite3.Connection object
-          event: str
-          request_dict: {name: str,
+          request_dict: {event: str,
+                         name: str,
                          version: str}
+          now: int time of the (last) request, default now
+          number_times: int, how many times the request was made
         """
         # pylint: disable=no-self-use
         # this looks weird, but it's the simplest way to do an update or insert
@@ -250,14 +351,14 @@ class ApplicationUsageRecorder(object):
         # figure out.  plus we avoid using transactions and multiple SQL
         # statements in most cases.
 
-        now = int(time.time())
+        if now is None:
+            now = int(time.time())
         event = request_dict.get('event', 'UNKNOWN_EVENT')
         item_name = request_dict.get('name', 'UNKNOWN_ITEM')
         item_version = request_dict.get('version', '0')
-        data = (item_version, now, event, item_name)
+        data = (item_version, now, number_times, event, item_name)
         query = conn.execute(INSTALL_REQUEST_TABLE_UPDATE, data)
         if query.rowcount == 0:
-            number_times = 1
             data = (event, item_name, item_version, now, number_times)
             conn.execute(INSTALL_REQUEST_TABLE_INSERT, data)
 
@@ -268,6 +369,8 @@ class ApplicationUsageRecorder(object):
           and written into new one
         """
         recovered = 0
+        # our connection would keep using the old file
+        self._disconnect()
 
         tables = [{'select_sql': APPLICATION_USAGE_TABLE_SELECT,
                    'create_sql': APPLICATION_USAGE_TABLE_CREATE,
@@ -296,7 +399,7 @@ class ApplicationUsageRecorder(object):
             logging.error('Unhandled error reading existing db: %s', str(err))
             return recovered
 
-        usage_db_tmp = '%s.tmp.%d' % (APPLICATION_USAGE_DB, os.getpid())
+        usage_db_tmp = '%s.tmp.%d' % (self.database, os.getpid())
 
         recovered = 0
         try:
@@ -315,8 +418,13 @@ class ApplicationUsageRecorder(object):
                         logging.error(
                             'Ignored error: %s: %s', str(err), str(row))
             self._close(conn)
-            os.unlink(APPLICATION_USAGE_DB)
-            os.rename(usage_db_tmp, APPLICATION_USAGE_DB)
+            os.unlink(self.database)
+            # a write-ahead log left from the old database must not be
+            # applied to the new one
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(self.database + suffix):
+                    os.unlink(self.database + suffix)
+            os.rename(usage_db_tmp, self.database)
         except sqlite3.Error as err:
             logging.error('Unhandled error: %s', str(err))
             recovered = 0
@@ -345,6 +453,108 @@ class ApplicationUsageRecorder(object):
         else:
             logging.info('Database is OK.')
 
+    def _queue(self, events, key, event_dict):
+        """Queues an event, merging it with an earlier one for the same key,
+        and writes the queue if it's time to"""
+        now = int(self.clock())
+        with self._lock:
+            queued = events.pop(key, None)
+            event_dict = dict(event_dict, time=now,
+                              count=(queued or {}).get('count', 0) + 1)
+            # keep the queue in order of the latest event
+            events[key] = event_dict
+            self._queued += 1
+            if self._oldest is None:
+                self._oldest = now
+            if self._retry_after is None or now >= self._retry_after:
+                if (self._queued >= self.batch_size or
+                        now - self._oldest >= self.flush_interval):
+                    self.flush()
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Starts a timer to write the queue flush_interval seconds from now,
+        so a lone event isn't left queued until the next one arrives"""
+        with self._lock:
+            if self._timer is None and self._queued:
+                self._timer = threading.Timer(
+                    self.flush_interval, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _timed_flush(self):
+        """Writes the queue when its timer fires"""
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                # the queue was written, or the timer replaced, meanwhile
+                return
+            self._timer = None
+            self.flush()
+            # if the database was busy, try again later
+            self._schedule_flush()
+
+    def _cancel_timer(self):
+        """Stops the timer, if there is one"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def flush(self):
+        """Writes the queued events to the database in one transaction.
+        Returns:
+          int number of events written
+        """
+        with self._lock:
+            if not self._queued:
+                return 0
+            try:
+                conn = self._open()
+                # commits, or rolls back if anything fails
+                with conn:
+                    for (event, _), app_dict in self._app_events.items():
+                        self._insert_application_usage(
+                            conn, event, app_dict, now=app_dict['time'],
+                            number_times=app_dict['count'])
+                    for request_dict in self._install_events.values():
+                        self._insert_install_request(
+                            conn, request_dict, now=request_dict['time'],
+                            number_times=request_dict['count'])
+            except sqlite3.OperationalError as err:
+                # the database may be locked or busy; keep the events and
+                # try again after a while
+                logging.error('Error writing %s events to database: %s',
+                              self._queued, err)
+                self._retry_after = int(self.clock()) + self.flush_interval
+                return 0
+            except sqlite3.DatabaseError as err:
+                logging.error('Database error: %s', err)
+                if err.args[0] == 'database disk image is malformed':
+                    self._recreate_database()
+                written = 0
+            else:
+                written = self._queued
+            self._app_events.clear()
+            self._install_events.clear()
+            self._queued = 0
+            self._oldest = None
+            self._retry_after = None
+            self._cancel_timer()
+            return written
+
+    def close(self):
+        """Writes the queued events and closes the database"""
+        with self._lock:
+            self.flush()
+            self._cancel_timer()
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def log_application_usage(self, event, app_dict):
         """Log application usage.
         Args:
@@ -360,19 +570,8 @@ class ApplicationUsageRecorder(object):
                       app_dict.get('bundle_id'),
                       app_dict.get('version'),
                       app_dict.get('path'))
-        try:
-            conn = self._connect()
-            if not self._detect_application_usage_table(conn):
-                self._create_application_usage_table(conn)
-            self._insert_application_usage(conn, event, app_dict)
-            conn.commit()
-        except sqlite3.OperationalError as err:
-            logging.error('Error writing %s event to database: %s', event, err)
-        except sqlite3.DatabaseError as err:
-            if err.args[0] == 'database disk image is malformed':
-                self._recreate_database()
-            logging.error('Database error: %s', err)
-        self._close(conn)
+        self._queue(self._app_events, (event, app_dict['bundle_id']),
+                    app_dict)
 
     def log_install_request(self, request_dict):
         """Log install request.
@@ -392,29 +591,18 @@ class ApplicationUsageRecorder(object):
                       request_dict.get('event'),
                       request_dict.get('name'),
                       request_dict.get('version'))
-
-        try:
-            conn = self._connect()
-            if not self._detect_install_request_table(conn):
-                self._create_install_request_table(conn)
-            self._insert_install_request(conn, request_dict)
-            conn.commit()
-        except sqlite3.OperationalError as err:
-            logging.error('Error writing install request to database: %s', err)
-        except sqlite3.DatabaseError as err:
-            if err.args[0] == 'database is malformed':
-                self._recreate_database()
-            logging.error('Database error: %s', err)
-        self._close(conn)
+        self._queue(self._install_events,
+                    (request_dict['event'], request_dict['name']),
+                    request_dict)
 
 
 class ApplicationUsageQuery(object):
     '''A class to query our application usage db to determine the last time
     an application was activated'''
 
-    def __init__(self):
+    def __init__(self, database_name=None):
         '''Open connection to DB'''
-        self.database = APPLICATION_USAGE_DB
+        self.database = database_name or APPLICATION_USAGE_DB
         self.day_in_seconds = 24 * 60 * 60
         try:
             self.conn = sqlite3.connect(self.database)
@@ -435,8 +623,7 @@ class ApplicationUsageQuery(object):
         '''Returns how many days of data we have on file'''
 
         oldest_record_query = (
-            'SELECT last_time FROM application_usage '
-            'ORDER BY last_time ASC LIMIT 1'
+            'SELECT MIN(last_time) FROM application_usage'
         )
 
         if not self.conn:
@@ -444,6 +631,9 @@ class ApplicationUsageQuery(object):
         try:
             query = self.conn.execute(oldest_record_query)
             row = query.fetchone()
+            if not row or row[0] is None:
+                # no records yet
+                return 0
             time_diff = int(time.time()) - int(row[0])
             return int(time_diff/self.day_in_seconds)
         except sqlite3.Error as err:
@@ -507,6 +697,58 @@ class ApplicationUsageQuery(object):
                 'Error querying %s: %s', self.database, str(err))
             return None
 
+    def _days_since_last_events(self, table, key_column, event, keys):
+        '''Returns a dictionary of key: number of days since the last event
+        for each of keys with a record of the event, or for every key with a
+        record of the event if keys is None. Returns None if database is
+        missing or broken.'''
+        select = ('SELECT %s, last_time FROM %s WHERE event=?'
+                  % (key_column, table))
+
+        if not self.conn:
+            return None
+        try:
+            if keys is None:
+                rows = self.conn.execute(select, (event,)).fetchall()
+            else:
+                # (event, key) is the primary key, so these are index
+                # lookups
+                keys = sorted(set(keys))
+                rows = []
+                for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+                    chunk = keys[start:start + QUERY_CHUNK_SIZE]
+                    rows.extend(self.conn.execute(
+                        select + ' AND %s IN (%s)'
+                        % (key_column, ', '.join('?' * len(chunk))),
+                        [event] + chunk).fetchall())
+        except sqlite3.Error as err:
+            logging.error(
+                'Error querying %s: %s', self.database, str(err))
+            return None
+        now = int(time.time())
+        return dict((key, int((now - int(last_time))/self.day_in_seconds))
+                    for key, last_time in rows)
+
+    def days_since_last_usage_events(self, event, bundle_ids=None):
+        '''Like days_since_last_usage_event, for many bundle_ids in one
+        pass. Returns None if database is missing or broken;
+        Returns a dictionary of bundle_id: int number of days since the last
+        event otherwise. bundle_ids with no event record are left out; if
+        bundle_ids is None, every bundle_id with an event record is
+        included.'''
+        return self._days_since_last_events(
+            'application_usage', 'bundle_id', event, bundle_ids)
+
+    def days_since_last_install_events(self, event, item_names=None):
+        '''Like days_since_last_install_event, for many item_names in one
+        pass. Returns None if database is missing or broken;
+        Returns a dictionary of item_name: int number of days since the last
+        event otherwise. item_names with no event record are left out; if
+        item_names is None, every item_name with an event record is
+        included.'''
+        return self._days_since_last_events(
+            'install_requests', 'item_name', event, item_names)
+
 
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
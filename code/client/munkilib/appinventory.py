@@ -0,0 +1,159 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+appinventory.py
+
+Remembers what we learned about installed applications between runs.
+
+info.app_data needs the name, bundle id and version of every installed
+app. Reading every app's Info.plist on every run is slow, so the results
+are saved along with the modification time and size of each app's
+Info.plist (or of the app itself, for apps that aren't bundles). On the
+next run only apps that are new or whose Info.plist changed are read
+again, a few at a time.
+
+AppIndex indexes a list of app info by name and bundle id, for
+compare.compare_application_version.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import os
+import plistlib
+import tempfile
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# name of the cache file in ManagedInstallDir
+INVENTORY_FILE_NAME = 'AppInventoryCache.plist'
+
+# how many apps to read at once
+INVENTORY_WORKERS = 4
+
+
+def app_key(path):
+    '''Returns [mtime, size] of an app's Info.plist, or of the app itself if
+    it has none, or None if neither exists'''
+    for candidate in (os.path.join(path, 'Contents', 'Info.plist'), path):
+        try:
+            info = os.stat(candidate)
+        except OSError:
+            continue
+        return [info.st_mtime, info.st_size]
+    return None
+
+
+class AppInventory(object):
+    '''Info on installed apps, saved at path. read_app(path) returns a dict
+    of info for the app at path, or None if it can't be read; it may be
+    called from several threads at once.'''
+
+    def __init__(self, path, read_app, max_workers=None):
+        self.path = path
+        self.read_app = read_app
+        self.max_workers = max_workers or INVENTORY_WORKERS
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._apps = self._read()
+
+    def _read(self):
+        '''Returns the saved app info'''
+        try:
+            with open(self.path, 'rb') as fileobj:
+                apps = plistlib.load(fileobj).get('apps', {})
+        except (IOError, OSError, ValueError, AttributeError,
+                plistlib.InvalidFileException):
+            return {}
+        if not isinstance(apps, dict):
+            return {}
+        return apps
+
+    def save(self):
+        '''Writes the cache file'''
+        with self._lock:
+            try:
+                data = plistlib.dumps({'apps': self._apps})
+            except (TypeError, ValueError, OverflowError):
+                # something in an Info.plist we can't save; we'll read
+                # everything again next time
+                return
+        try:
+            fileref, temp_path = tempfile.mkstemp(
+                prefix='.' + INVENTORY_FILE_NAME,
+                dir=os.path.dirname(self.path) or None)
+            with os.fdopen(fileref, 'wb') as fileobj:
+                fileobj.write(data)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def apps(self, paths):
+        '''Returns a list of info for the apps at paths that could be read.
+        Saved info is used for apps that haven't changed; the others are
+        read again. Apps no longer in paths, or no longer there, are
+        forgotten.'''
+        paths = sorted(set(paths))
+        keys = dict((path, app_key(path)) for path in paths)
+        with self._lock:
+            for path in list(self._apps):
+                if keys.get(path) is None:
+                    del self._apps[path]
+            changed = [path for path in paths
+                       if keys[path] is not None and
+                       self._apps.get(path, {}).get('key') != keys[path]]
+        if futures and self.max_workers > 1 and len(changed) > 1:
+            with futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers) as executor:
+                results = list(executor.map(self.read_app, changed))
+        else:
+            results = [self.read_app(path) for path in changed]
+        with self._lock:
+            self.hits += len([path for path in paths
+                              if keys[path] is not None]) - len(changed)
+            self.misses += len(changed)
+            for path, iteminfo in zip(changed, results):
+                # remember apps we couldn't read too, so we don't keep
+                # trying until they change
+                self._apps[path] = {'key': keys[path],
+                                    'info': iteminfo or {}}
+            return [dict(self._apps[path]['info']) for path in paths
+                    if keys[path] is not None and
+                    self._apps.get(path, {}).get('info')]
+
+
+class AppIndex(object):
+    '''A list of app info dicts, indexed by name and bundleid'''
+
+    def __init__(self, app_list):
+        self.app_list = list(app_list)
+        self.by_name = {}
+        self.by_bundleid = {}
+        for index, item in enumerate(self.app_list):
+            self.by_name.setdefault(item.get('name'), []).append(index)
+            self.by_bundleid.setdefault(item.get('bundleid'), []).append(index)
+
+    def matching(self, name='', bundleid=''):
+        '''Returns the apps, in their original order, whose bundleid is
+        bundleid or, if name is given, whose name is name'''
+        indexes = set(self.by_bundleid.get(bundleid, []))
+        if name:
+            indexes.update(self.by_name.get(name, []))
+        return [self.app_list[index] for index in sorted(indexes)]
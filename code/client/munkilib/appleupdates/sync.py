@@ -58,6 +58,7 @@ from .. import info
 from .. import osutils
 from .. import prefs
 from .. import processes
+from .. import sumetadata
 from .. import FoundationPlist
 from ..wrappers import unicode_or_str
 
@@ -327,45 +328,6 @@ class AppleUpdateSync(object):
             return full_url  # url is already local, so just return it.
         return local_base_url + self._get_url_path(full_url)
 
-    def rewrite_product_urls(self, product, rewrite_pkg_urls=False):
-        """Rewrites URLs in the product to point to our local cache.
-
-        Args:
-          product: list, of dicts, product info. This dict is changed by
-              this function.
-          rewrite_pkg_urls: bool, default False, if True package URLs are
-              rewritten, otherwise only MetadataURLs are rewritten.
-        """
-        if 'ServerMetadataURL' in product:
-            product['ServerMetadataURL'] = self.rewrite_url(
-                product['ServerMetadataURL'])
-        for package in product.get('Packages', []):
-            if rewrite_pkg_urls and 'URL' in package:
-                package['URL'] = self.rewrite_url(package['URL'])
-            if 'MetadataURL' in package:
-                package['MetadataURL'] = self.rewrite_url(
-                    package['MetadataURL'])
-        distributions = product['Distributions']
-        # coerce distributions.keys() to list so we don't mutate the dictionary
-        # while enumerating it in Python 3
-        for dist_lang in list(distributions.keys()):
-            distributions[dist_lang] = self.rewrite_url(
-                distributions[dist_lang])
-
-    def rewrite_catalog_urls(self, catalog, rewrite_pkg_urls=False):
-        """Rewrites URLs in a catalog to point to our local replica.
-
-        Args:
-          rewrite_pkg_urls: Boolean, if True package URLs are rewritten,
-              otherwise only MetadataURLs are rewritten.
-        """
-        if not 'Products' in catalog:
-            return
-
-        for product_key in catalog['Products'].keys():
-            product = catalog['Products'][product_key]
-            self.rewrite_product_urls(product, rewrite_pkg_urls=rewrite_pkg_urls)
-
     def retrieve_url_to_cache_dir(self, full_url, copy_only_if_missing=False):
         """Downloads a URL and stores it in the same relative path on our
         filesystem. Returns a path to the replicated file.
@@ -386,7 +348,9 @@ class AppleUpdateSync(object):
             try:
                 os.makedirs(local_dir_path)
             except OSError as oserr:
-                raise ReplicationError(oserr)
+                # another download may have just made it
+                if not os.path.isdir(local_dir_path):
+                    raise ReplicationError(oserr)
         try:
             self.get_su_resource(
                 full_url, local_file_path, resume=True)
@@ -429,58 +393,39 @@ class AppleUpdateSync(object):
                 '"Products" not found in %s', self.extracted_catalog_path)
             return
 
-        for product_key in product_ids:
-            if processes.stop_requested():
-                return
-            if product_key not in catalog['Products']:
-                if product_key.startswith("MSU_UPDATE_"):
-                    # BigSur+ updates don't have metadata in the sucatalog
-                    display.display_info(
-                        'Skipping metadata caching for product ID %s'
-                        % product_key)
-                else:
-                    display.display_warning(
-                        'Could not cache metadata for product ID %s'
-                        % product_key)
-                continue
-            display.display_status_minor(
-                'Caching metadata for product ID %s', product_key)
-            product = catalog['Products'][product_key]
-            if 'ServerMetadataURL' in product:
-                self.retrieve_url_to_cache_dir(
-                    product['ServerMetadataURL'], copy_only_if_missing=True)
-
-            for package in product.get('Packages', []):
-                if processes.stop_requested():
-                    return
-                if 'MetadataURL' in package:
-                    display.display_status_minor(
-                        'Caching package metadata for product ID %s',
-                        product_key)
-                    self.retrieve_url_to_cache_dir(
-                        package['MetadataURL'], copy_only_if_missing=True)
-                # if 'URL' in package:
-                #    display.display_status_minor(
-                #        'Caching package for product ID %s',
-                #        product_key)
-                #    self.retrieve_url_to_cache_dir(
-                #        package['URL'], copy_only_if_missing=True)
-
-            distributions = product['Distributions']
-            for dist_lang in distributions.keys():
-                if processes.stop_requested():
-                    return
-                display.display_status_minor(
-                    'Caching %s distribution for product ID %s',
-                    dist_lang, product_key)
-                dist_url = distributions[dist_lang]
-                try:
-                    self.retrieve_url_to_cache_dir(
-                        dist_url, copy_only_if_missing=True)
-                except ReplicationError:
-                    display.display_warning(
-                        'Could not cache %s distribution for product ID %s',
-                        dist_lang, product_key)
+        metadata_files, missing = sumetadata.metadata_files(
+            catalog, product_ids)
+        for product_key in missing:
+            if product_key.startswith("MSU_UPDATE_"):
+                # BigSur+ updates don't have metadata in the sucatalog
+                display.display_info(
+                    'Skipping metadata caching for product ID %s'
+                    % product_key)
+            else:
+                display.display_warning(
+                    'Could not cache metadata for product ID %s'
+                    % product_key)
+
+        def distribution_error(metadata_file, err):
+            '''A missing distribution isn't fatal; other files are'''
+            if (metadata_file.kind != sumetadata.DISTRIBUTION or
+                    not isinstance(err, ReplicationError)):
+                return False
+            display.display_warning(
+                'Could not cache %s distribution for product ID %s',
+                metadata_file.language, metadata_file.product_key)
+            return True
+
+        display.display_status_minor(
+            'Caching metadata for %s update(s)',
+            len(set(item.product_key for item in metadata_files)))
+        if not sumetadata.replicate(
+                metadata_files,
+                lambda url: self.retrieve_url_to_cache_dir(
+                    url, copy_only_if_missing=True),
+                stop_requested=processes.stop_requested,
+                on_error=distribution_error):
+            return
 
         if not os.path.exists(self.local_catalog_dir):
             try:
@@ -488,15 +433,15 @@ class AppleUpdateSync(object):
             except OSError as oserr:
                 raise ReplicationError(oserr)
 
-        # rewrite metadata URLs to point to local caches.
-        self.rewrite_catalog_urls(catalog, rewrite_pkg_urls=False)
+        # one pass builds both catalogs: the download catalog's metadata
+        # URLs point to local caches, and the install catalog's package URLs
+        # do too.
+        download_catalog, install_catalog = sumetadata.local_catalogs(
+            catalog, self.rewrite_url)
         FoundationPlist.writePlist(
-            catalog, self.local_download_catalog_path)
-
-        # rewrite all URLs, including pkgs, to point to local caches.
-        self.rewrite_catalog_urls(catalog, rewrite_pkg_urls=True)
+            download_catalog, self.local_download_catalog_path)
         FoundationPlist.writePlist(
-            catalog, self.local_catalog_path)
+            install_catalog, self.local_catalog_path)
 
     def _preferred_localization(self, list_of_localizations):
         '''Picks the best localization from a list of available
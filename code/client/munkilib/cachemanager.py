@@ -0,0 +1,251 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+cachemanager.py
+
+Keeps the installer item Cache within a size budget.
+
+An index file in the Cache directory records the size of each cached item
+and when it was last used, so we don't need to stat every item to decide
+what to remove. When room is needed, items are removed least recently used
+first, but items we expect to use again (precache items, say) only once
+nothing else is left. Items that are needed for pending installs or
+removals, or that were used during this session, are never removed.
+
+Delta bases the content store keeps for installed items count against the
+budget too. They only save a download we may never need, so they go
+first, oldest first.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import os
+import plistlib
+import tempfile
+import threading
+import time
+
+# our libs
+from . import contentstore
+
+# name of the index file in the Cache directory
+INDEX_FILE_NAME = '.cacheindex.plist'
+
+# suffixes of files in the Cache directory that aren't complete items
+PARTIAL_SUFFIXES = ('.download', '.link', '.delta')
+
+
+def is_cache_item(name):
+    '''True if name in the Cache directory is a complete installer item'''
+    return (not name.startswith('.') and
+            not name.endswith(PARTIAL_SUFFIXES))
+
+
+class CacheManager(object):
+    '''Tracks and evicts items in a Cache directory. budget is in KB;
+    0 means no limit. Safe to share between threads.'''
+
+    def __init__(self, cachedir, budget=0, clock=time.time):
+        self.cachedir = cachedir
+        self.budget = budget or 0
+        self.clock = clock
+        self.session_start = clock()
+        self.index_path = os.path.join(cachedir, INDEX_FILE_NAME)
+        self.store = contentstore.ContentStore(cachedir)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.evicted_kb = 0
+        self._lock = threading.RLock()
+        self._items = self._read_index()
+        self.reconcile()
+
+    def _read_index(self):
+        '''Returns the items dictionary from the index file'''
+        try:
+            with open(self.index_path, 'rb') as fileobj:
+                items = plistlib.load(fileobj).get('items', {})
+        except (IOError, OSError, ValueError, AttributeError,
+                plistlib.InvalidFileException):
+            return {}
+        if not isinstance(items, dict):
+            return {}
+        return items
+
+    def save(self):
+        '''Writes the index file'''
+        with self._lock:
+            data = plistlib.dumps({'items': self._items})
+        try:
+            fileref, temp_path = tempfile.mkstemp(
+                prefix=INDEX_FILE_NAME, dir=self.cachedir)
+            with os.fdopen(fileref, 'wb') as fileobj:
+                fileobj.write(data)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError):
+            pass
+
+    def reconcile(self):
+        '''Brings the index up to date with the Cache directory. Only items
+        not already in the index are stat'ed.'''
+        try:
+            names = set(name for name in os.listdir(self.cachedir)
+                        if is_cache_item(name))
+        except OSError:
+            names = set()
+        with self._lock:
+            for name in list(self._items):
+                if name not in names:
+                    del self._items[name]
+            for name in names - set(self._items):
+                try:
+                    info = os.stat(os.path.join(self.cachedir, name))
+                except OSError:
+                    continue
+                self._items[name] = {'size': int(info.st_size / 1024),
+                                     'last_used': info.st_mtime,
+                                     'uses': 0}
+
+    def _record(self, name):
+        '''Records use of an item, adding it to the index if needed'''
+        path = os.path.join(self.cachedir, name)
+        try:
+            size = int(os.path.getsize(path) / 1024)
+        except OSError:
+            self._items.pop(name, None)
+            return
+        entry = self._items.setdefault(name, {'uses': 0})
+        entry['size'] = size
+        entry['last_used'] = self.clock()
+        entry['uses'] = entry.get('uses', 0) + 1
+
+    def record_hit(self, name):
+        '''An item was wanted and was already in the cache'''
+        with self._lock:
+            self.hits += 1
+            self._record(name)
+
+    def record_miss(self, name):
+        '''An item was wanted and had to be downloaded'''
+        with self._lock:
+            self.misses += 1
+            self._record(name)
+
+    def _bases(self):
+        '''Returns (name, size in KB) for each delta base taking space of
+        its own, oldest first'''
+        return [(base['name'], base['size'])
+                for base in self.store.kept_bases() if base['size']]
+
+    def size(self):
+        '''Returns the total size of the cached items and delta bases in
+        KB'''
+        with self._lock:
+            return (sum(entry.get('size', 0)
+                        for entry in self._items.values()) +
+                    sum(size for _, size in self._bases()))
+
+    def _candidates(self, protected, expected_reuse):
+        '''Returns the names of items that may be removed, in the order
+        they should go'''
+        candidates = [
+            name for name, entry in self._items.items()
+            if name not in protected and
+            entry.get('last_used', 0) < self.session_start]
+        candidates.sort(key=lambda name: (
+            name in expected_reuse, self._items[name].get('last_used', 0)))
+        return candidates
+
+    def _available(self, bases, candidates):
+        '''Returns the KB that removing bases and candidates would free'''
+        return (sum(size for _, size in bases) +
+                sum(self._items[name].get('size', 0) for name in candidates))
+
+    def evict(self, space_needed, protected=(), expected_reuse=()):
+        '''Removes delta bases, then items, to free space_needed KB. If
+        that much can't be freed, removes nothing. Returns the KB freed.'''
+        protected = set(protected)
+        expected_reuse = set(expected_reuse)
+        with self._lock:
+            bases = self._bases()
+            candidates = self._candidates(protected, expected_reuse)
+            available = self._available(bases, candidates)
+            if space_needed <= 0 or available < space_needed:
+                return 0
+            freed = 0
+            for name, size in bases:
+                if freed >= space_needed:
+                    break
+                self.store.drop_base(name)
+                freed += size
+                self.evicted_kb += size
+            for name in candidates:
+                if freed >= space_needed:
+                    break
+                try:
+                    os.unlink(os.path.join(self.cachedir, name))
+                except OSError:
+                    if os.path.exists(os.path.join(self.cachedir, name)):
+                        continue
+                size = self._items.pop(name).get('size', 0)
+                freed += size
+                self.evicted += 1
+                self.evicted_kb += size
+        self.store.collect_garbage()
+        return freed
+
+    def make_room(self, item_size, protected=(), expected_reuse=()):
+        '''Evicts items as needed so an item of item_size KB fits within
+        the budget. Returns False if it can't be made to fit.'''
+        if not self.budget:
+            return True
+        overage = self.size() + item_size - self.budget
+        if overage <= 0:
+            return True
+        if item_size > self.budget:
+            return False
+        return self.evict(overage, protected=protected,
+                          expected_reuse=expected_reuse) > 0
+
+    def enforce_budget(self, protected=(), expected_reuse=()):
+        '''Evicts items until the cache is within budget, if it can be'''
+        if not self.budget:
+            return
+        overage = self.size() - self.budget
+        if overage <= 0:
+            return
+        with self._lock:
+            # free what we can, even if it isn't enough
+            available = self._available(
+                self._bases(),
+                self._candidates(set(protected), set(expected_reuse)))
+        self.evict(min(overage, available), protected=protected,
+                   expected_reuse=expected_reuse)
+
+    def stats(self):
+        '''Returns statistics suitable for the report'''
+        with self._lock:
+            requests = self.hits + self.misses
+            hit_rate = 0.0
+            if requests:
+                hit_rate = round(float(self.hits) / requests, 3)
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': hit_rate,
+                    'evicted_items': self.evicted,
+                    'evicted_kb': self.evicted_kb,
+                    'size_kb': self.size(),
+                    'budget_kb': self.budget}
@@ -0,0 +1,140 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+checkscripts.py
+
+Runs installcheck and uninstallcheck scripts ahead of time.
+
+During a check for updates these scripts are run one at a time as each
+item is analyzed, and a check with many nopkg items spends most of its
+time waiting on them. Nothing is installed or removed while updates are
+checked for, so a check script gives the same result whenever in the
+check it is run. CheckScriptResults runs the scripts a few at a time
+before the analysis starts and keeps their exit status and output for
+installationstate to use in place of running them again.
+
+Results are kept by script text, so items sharing a script run it once.
+Scripts are run to completion, as they would be when needed; one that
+can't be run has no result kept and is run as usual when it is needed.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# our libs
+from . import utils
+
+# how many scripts to run at once
+CHECK_SCRIPT_WORKERS = 4
+
+
+def run_script_text(script_text, temp_dir=None):
+    '''Writes script_text to a file in temp_dir and runs it. Returns the
+    exit status and a list of output lines, stdout and stderr interleaved
+    as scriptutils.run_script reads them. Raises
+    utils.RunExternalScriptError if it can't be run.'''
+    fileref, path = tempfile.mkstemp(prefix='checkscript-', dir=temp_dir)
+    try:
+        with os.fdopen(fileref, 'wb') as fileobj:
+            # line-by-line, as scriptutils does, for UNIX line endings
+            for line in script_text.splitlines():
+                fileobj.write(line.encode('UTF-8') + b'\n')
+        os.chmod(path, 0o700)
+        proc = subprocess.Popen([path], shell=False,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+    except (IOError, OSError) as err:
+        raise utils.RunExternalScriptError(
+            'Error %s when attempting to run check script' % err)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return proc.returncode, output.decode('UTF-8', 'replace').splitlines()
+
+
+class CheckScriptResults(object):
+    '''Exit status and output of check scripts run ahead of time.
+    run_script(script_text, temp_dir) returns a script's exit status and
+    output lines as run_script_text does; it is called from several
+    threads at once.'''
+
+    def __init__(self, run_script=None, max_workers=None):
+        self.run_script = run_script or run_script_text
+        self.max_workers = max_workers or CHECK_SCRIPT_WORKERS
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _run(self, script_text, temp_dir, stop_requested):
+        '''Runs a script; keeps its result if it ran'''
+        if stop_requested and stop_requested():
+            return
+        try:
+            result = self.run_script(script_text, temp_dir)
+        except utils.RunExternalScriptError:
+            return
+        with self._lock:
+            self._results[script_text] = result
+
+    def evaluate(self, scripts, stop_requested=None):
+        '''Runs scripts, a list of script texts, that haven't been run
+        already. Stops starting scripts once stop_requested() is true.'''
+        pending = []
+        with self._lock:
+            seen = set(self._results)
+        for script_text in scripts:
+            if script_text and script_text not in seen:
+                seen.add(script_text)
+                pending.append(script_text)
+        if not pending:
+            return
+        temp_dir = tempfile.mkdtemp(prefix='munki-checkscripts-')
+        try:
+            if futures and self.max_workers > 1 and len(pending) > 1:
+                with futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers) as executor:
+                    for script_text in pending:
+                        executor.submit(
+                            self._run, script_text, temp_dir, stop_requested)
+            else:
+                for script_text in pending:
+                    self._run(script_text, temp_dir, stop_requested)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def result(self, script_text):
+        '''Returns (exit status, output lines) for script_text, or None if
+        it wasn't run ahead of time'''
+        with self._lock:
+            return self._results.get(script_text)
+
+    def clear(self):
+        '''Forgets all results'''
+        with self._lock:
+            self._results.clear()
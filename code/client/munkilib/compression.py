@@ -0,0 +1,126 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+compression.py
+
+Precompressed variants of catalogs.
+
+makecatalogs can write catalogs/all.gz (and catalogs/all.zst, if the
+zstandard module is installed) next to catalogs/all, so servers that don't
+compress on the fly can still send less. Clients ask for the variants they
+can decompress and fall back to the uncompressed file.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import gzip
+import io
+import os
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# file name suffix for each encoding
+SUFFIXES = {
+    GZIP: '.gz',
+    ZSTD: '.zst',
+}
+
+READ_SIZE = 256 * 1024
+
+
+class DecompressionError(Exception):
+    '''Error to raise when a compressed file can't be decompressed'''
+    #pass
+
+
+def available_encodings():
+    '''Returns the encodings we can handle, most preferred first'''
+    if zstandard is not None:
+        return [ZSTD, GZIP]
+    return [GZIP]
+
+
+def variant_suffixes():
+    '''Returns the file name suffixes of all variants, whether or not we
+    can handle them'''
+    return list(SUFFIXES.values())
+
+
+def compress(data, encoding):
+    '''Returns data compressed with encoding'''
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    fileobj = io.BytesIO()
+    # a fixed mtime, so unchanged data gives an unchanged file
+    with gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0) as gzfile:
+        gzfile.write(data)
+    return fileobj.getvalue()
+
+
+def _decompressor(encoding):
+    '''Returns an object with decompress() and flush() methods'''
+    if encoding == ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj()
+    # gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def decompress_file(source, destination, encoding):
+    '''Decompresses the file at source to destination a chunk at a time.
+    destination is replaced only once it is complete.'''
+    destination_dir = os.path.dirname(destination)
+    fileref, temp_path = tempfile.mkstemp(
+        prefix='.', dir=destination_dir or None)
+    try:
+        decompressor = _decompressor(encoding)
+        with open(source, 'rb') as infile, os.fdopen(fileref, 'wb') as out:
+            while True:
+                data = infile.read(READ_SIZE)
+                if not data:
+                    break
+                out.write(decompressor.decompress(data))
+            out.write(decompressor.flush())
+        if not getattr(decompressor, 'eof', True):
+            raise zlib.error('compressed data is truncated')
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, destination)
+    except (zlib.error, EnvironmentError) as err:
+        _unlink(temp_path)
+        raise DecompressionError('Could not decompress %s: %s'
+                                 % (source, err))
+    except Exception as err:
+        _unlink(temp_path)
+        if zstandard is not None and isinstance(err, zstandard.ZstdError):
+            raise DecompressionError('Could not decompress %s: %s'
+                                     % (source, err))
+        raise
+
+
+def _unlink(path):
+    '''Removes path if it exists'''
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,231 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+conditionscripts.py
+
+Runs the admin-provided condition scripts for info.get_conditions.
+
+Condition scripts have always added their facts to ConditionalItems.plist
+in the ManagedInstallDir. As they share that file, they are run one after
+another. A script may instead write its facts to the plist named by the
+MUNKI_CONDITION_OUTPUT environment variable; such a script has an output
+of its own, so it is run alongside the others. Scripts that mention
+MUNKI_CONDITION_OUTPUT are taken to be of this kind.
+
+A script with its own output can also set a munki_condition_ttl key to
+the number of seconds its facts stay true. Its facts are then saved and
+used instead of running it again until they expire or the script changes.
+
+Every script gets a timeout, and how long each one took is returned for
+the report.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import functools
+import os
+import plistlib
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# our libs
+from . import utils
+
+# environment variable naming a script's own output plist
+OUTPUT_ENV_VAR = 'MUNKI_CONDITION_OUTPUT'
+
+# key a script sets in its own output to have its facts cached
+TTL_KEY = 'munki_condition_ttl'
+
+# name of the cache file in ManagedInstallDir
+CACHE_FILE_NAME = 'ConditionScriptCache.plist'
+
+# how many scripts to run at once
+CONDITION_SCRIPT_WORKERS = 4
+
+# seconds a script may run before it is killed
+CONDITION_SCRIPT_TIMEOUT = 120
+
+
+def writes_own_output(path):
+    '''Returns True if the script at path mentions OUTPUT_ENV_VAR'''
+    try:
+        with open(path, 'rb') as fileobj:
+            return OUTPUT_ENV_VAR.encode('UTF-8') in fileobj.read()
+    except (IOError, OSError):
+        return False
+
+
+def script_key(path):
+    '''Returns [mtime, size] of the script at path, or None if it's gone'''
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return [info.st_mtime, info.st_size]
+
+
+def read_facts(path):
+    '''Returns the dict in the plist at path, or None if there isn't a
+    valid one'''
+    try:
+        with open(path, 'rb') as fileobj:
+            facts = plistlib.load(fileobj)
+    except (IOError, OSError, ValueError, plistlib.InvalidFileException):
+        return None
+    if not isinstance(facts, dict):
+        return None
+    return facts
+
+
+def _run_external_script(path, env, timeout):
+    '''Runs the script at path; returns its exit status'''
+    return utils.runExternalScript(path, env=env, timeout=timeout)[0]
+
+
+class ConditionScriptRunner(object):
+    '''Runs condition scripts, saving facts declared with a TTL at
+    cache_path. run_script(path, env, timeout) runs a script and returns
+    its exit status, raising the errors utils.runExternalScript does; it
+    is called from several threads at once.'''
+
+    def __init__(self, cache_path, run_script=None, timeout=None,
+                 max_workers=None, clock=time.time):
+        self.cache_path = cache_path
+        self.run_script = run_script or _run_external_script
+        self.timeout = timeout or CONDITION_SCRIPT_TIMEOUT
+        self.max_workers = max_workers or CONDITION_SCRIPT_WORKERS
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._cache = self._read_cache()
+
+    def _read_cache(self):
+        '''Returns the saved facts'''
+        cache = read_facts(self.cache_path) or {}
+        scripts = cache.get('scripts', {})
+        if not isinstance(scripts, dict):
+            return {}
+        return scripts
+
+    def save(self):
+        '''Writes the cache file'''
+        with self._lock:
+            try:
+                data = plistlib.dumps({'scripts': self._cache})
+            except (TypeError, ValueError, OverflowError):
+                # facts we can't save; the scripts will just run next time
+                data = plistlib.dumps({'scripts': {}})
+        try:
+            fileref, temp_path = tempfile.mkstemp(
+                prefix='.' + CACHE_FILE_NAME,
+                dir=os.path.dirname(self.cache_path) or None)
+            with os.fdopen(fileref, 'wb') as fileobj:
+                fileobj.write(data)
+            os.rename(temp_path, self.cache_path)
+        except (IOError, OSError):
+            pass
+
+    def _timed_run(self, path, env):
+        '''Runs the script at path. Returns a dict for the report.'''
+        timing = {'name': os.path.basename(path)}
+        start = time.time()
+        try:
+            timing['returncode'] = self.run_script(path, env, self.timeout)
+            timing['status'] = 'ran'
+        except utils.ScriptNotFoundError:
+            timing['status'] = 'missing'
+        except utils.ScriptTimeoutError as err:
+            timing['status'] = 'timed out'
+            timing['error'] = str(err)
+        except utils.RunExternalScriptError as err:
+            timing['status'] = 'failed'
+            timing['error'] = str(err)
+        timing['seconds'] = round(time.time() - start, 3)
+        return timing
+
+    def _run_shared(self, paths):
+        '''Runs the scripts writing to ConditionalItems.plist, in turn'''
+        return {}, [self._timed_run(path, None) for path in paths]
+
+    def _run_own(self, path, output_dir):
+        '''Runs a script with its own output, unless its saved facts are
+        still good. Returns its facts and timing.'''
+        name = os.path.basename(path)
+        key = script_key(path)
+        now = self.clock()
+        with self._lock:
+            saved = self._cache.get(path, {})
+        if (key is not None and saved.get('key') == key and
+                now < saved.get('expires', 0)):
+            return (dict(saved.get('facts', {})),
+                    [{'name': name, 'status': 'cached', 'seconds': 0.0}])
+        output = os.path.join(output_dir, name + '.plist')
+        env = dict(os.environ)
+        env[OUTPUT_ENV_VAR] = output
+        timing = self._timed_run(path, env)
+        facts = read_facts(output) or {}
+        ttl = facts.pop(TTL_KEY, None)
+        with self._lock:
+            if (timing.get('returncode') == 0 and key is not None and
+                    isinstance(ttl, (int, float)) and
+                    not isinstance(ttl, bool) and ttl > 0):
+                self._cache[path] = {
+                    'key': key, 'expires': now + ttl, 'facts': facts}
+            else:
+                self._cache.pop(path, None)
+        return facts, [timing]
+
+    def run(self, scripts):
+        '''Runs scripts, a list of paths, and saves the cache. Returns the
+        facts from the scripts with their own output, merged in script
+        name order so later scripts win, and a list of timings in script
+        name order.'''
+        scripts = sorted(scripts, key=os.path.basename)
+        own = [path for path in scripts if writes_own_output(path)]
+        shared = [path for path in scripts if path not in own]
+        with self._lock:
+            for path in list(self._cache):
+                if path not in own:
+                    del self._cache[path]
+        output_dir = tempfile.mkdtemp(prefix='munki-conditions-')
+        try:
+            calls = [functools.partial(self._run_own, path, output_dir)
+                     for path in own]
+            if shared:
+                calls.insert(0, functools.partial(self._run_shared, shared))
+            if futures and self.max_workers > 1 and len(calls) > 1:
+                with futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers) as executor:
+                    results = list(executor.map(lambda call: call(), calls))
+            else:
+                results = [call() for call in calls]
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        self.save()
+        facts = {}
+        timings = []
+        for script_facts, script_timings in results:
+            facts.update(script_facts)
+            timings.extend(script_timings)
+        timings.sort(key=lambda timing: timing['name'])
+        return facts, timings
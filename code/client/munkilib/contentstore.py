@@ -0,0 +1,238 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+contentstore.py
+
+A content-addressed store for downloaded installer items.
+
+Installer items are still found by name in the Cache directory, but each
+verified item is also hard-linked into Cache/.objects under its SHA-256
+hash. When an item with a known hash is needed we can link it into place
+from the store instead of downloading it again, no matter what it was called
+before. Since the name and the object are the same file, this costs no
+extra disk space.
+
+An object whose only link is the one in the store isn't used by anything
+any more; collect_garbage() removes those.
+
+Once an item is installed its name is removed from the Cache, but if
+delta updates are in use its object can be kept as the base for a delta
+update to the next version. keep_base() links it into Cache/.deltabases
+under the item's name, which keeps collect_garbage() away from it; only
+the most recently installed version of each item is kept. The cache
+manager counts kept bases against the cache size limit and drops them
+before any cached item, and bases for items no longer managed are dropped
+after each check.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import errno
+import os
+import shutil
+import xattr
+
+# XATTR name storing the sha256 of a file; the same attribute fetch uses.
+XATTR_SHA = 'com.googlecode.munki.sha256'
+
+# name of the store directory inside the Cache directory
+OBJECTS_DIR_NAME = '.objects'
+
+# name of the directory of delta bases inside the Cache directory
+BASES_DIR_NAME = '.deltabases'
+
+
+def _stored_hash(path):
+    '''Returns the sha256 recorded with path, or None'''
+    try:
+        return xattr.getxattr(path, XATTR_SHA).decode('UTF-8')
+    except (KeyError, IOError, OSError, UnicodeDecodeError):
+        return None
+
+
+def _is_hash(hexdigest):
+    '''True if hexdigest looks like a sha256 hex digest'''
+    if not hexdigest or len(hexdigest) != 64:
+        return False
+    try:
+        int(hexdigest, 16)
+    except ValueError:
+        return False
+    return True
+
+
+class ContentStore(object):
+    '''The content-addressed store inside a Cache directory'''
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.objects_dir = os.path.join(cachedir, OBJECTS_DIR_NAME)
+        self.bases_dir = os.path.join(cachedir, BASES_DIR_NAME)
+
+    def object_path(self, hexdigest):
+        '''Returns the path of the object for a hash'''
+        hexdigest = hexdigest.lower()
+        return os.path.join(self.objects_dir, hexdigest[:2], hexdigest)
+
+    def has(self, hexdigest):
+        '''True if we have an object with this hash'''
+        return _is_hash(hexdigest) and os.path.isfile(
+            self.object_path(hexdigest))
+
+    def link_to(self, hexdigest, path):
+        '''Makes path a link to the object with this hash, replacing
+        whatever was at path. Returns True if path now has the wanted
+        content.'''
+        if not self.has(hexdigest):
+            return False
+        object_path = self.object_path(hexdigest)
+        try:
+            if os.path.samefile(object_path, path):
+                return True
+        except OSError:
+            pass
+        temp_path = '%s.link' % path
+        try:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            os.link(object_path, temp_path)
+            os.rename(temp_path, path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def adopt(self, path, hexdigest):
+        '''Adds the file at path to the store, if its recorded hash (written
+        when it was verified) matches hexdigest. If the store already has
+        the content, path is replaced with a link to it. Returns True if
+        path is now in the store.'''
+        if not _is_hash(hexdigest) or not os.path.isfile(path):
+            return False
+        if _stored_hash(path) != hexdigest.lower():
+            return False
+        if self.has(hexdigest):
+            return self.link_to(hexdigest, path)
+        object_path = self.object_path(hexdigest)
+        try:
+            os.makedirs(os.path.dirname(object_path), 0o755)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                return False
+        try:
+            os.link(path, object_path)
+        except OSError:
+            # another process got there first, or hard links aren't
+            # possible here
+            return self.link_to(hexdigest, path)
+        return True
+
+    def _base_dir(self, name):
+        '''Returns the directory holding the delta base for an item'''
+        return os.path.join(self.bases_dir, name.replace(os.sep, '_'))
+
+    def keep_base(self, name, path):
+        '''Keeps the content of the installer item at path, once it has been
+        installed, as the base for delta updates to the item called name.
+        Replaces the base kept for name before. Returns True if it is
+        kept.'''
+        hexdigest = _stored_hash(path)
+        if not name or not self.adopt(path, hexdigest):
+            return False
+        base_dir = self._base_dir(name)
+        base_path = os.path.join(base_dir, hexdigest)
+        if os.path.exists(base_path):
+            # the same version again; it's now the newest base
+            os.utime(base_dir, None)
+            return True
+        self.drop_base(name)
+        try:
+            os.makedirs(base_dir, 0o755)
+            os.link(self.object_path(hexdigest), base_path)
+        except OSError:
+            self.drop_base(name)
+            return False
+        return True
+
+    def drop_base(self, name):
+        '''Stops keeping a delta base for the item called name. Its object
+        goes at the next collect_garbage() if nothing else links to it.'''
+        shutil.rmtree(self._base_dir(name), ignore_errors=True)
+
+    def drop_bases_except(self, names):
+        '''Stops keeping delta bases for items not named in names'''
+        keep = set(name.replace(os.sep, '_') for name in names)
+        for base in self.kept_bases():
+            if base['name'] not in keep:
+                self.drop_base(base['name'])
+
+    def kept_bases(self):
+        '''Returns a list of dicts describing the kept delta bases, oldest
+        first. size is in KB, and 0 for a base that is also a cached item,
+        as it takes no space of its own.'''
+        bases = []
+        try:
+            names = os.listdir(self.bases_dir)
+        except OSError:
+            return bases
+        for name in names:
+            base_dir = os.path.join(self.bases_dir, name)
+            try:
+                kept = os.stat(base_dir).st_mtime
+                hexdigests = [hexdigest for hexdigest in os.listdir(base_dir)
+                              if _is_hash(hexdigest)]
+                if not hexdigests:
+                    continue
+                info = os.stat(os.path.join(base_dir, hexdigests[0]))
+            except OSError:
+                continue
+            size = 0
+            # links: the object, this one and any name in the Cache
+            if info.st_nlink < 3:
+                size = int(info.st_size / 1024)
+            bases.append({'name': name, 'hash': hexdigests[0],
+                          'size': size, 'kept': kept})
+        bases.sort(key=lambda base: base['kept'])
+        return bases
+
+    def collect_garbage(self):
+        '''Removes objects no name in the Cache links to any more. Returns
+        the number of KB freed.'''
+        freed = 0
+        if not os.path.isdir(self.objects_dir):
+            return freed
+        for subdir in os.listdir(self.objects_dir):
+            subdir_path = os.path.join(self.objects_dir, subdir)
+            if not os.path.isdir(subdir_path):
+                continue
+            for name in os.listdir(subdir_path):
+                object_path = os.path.join(subdir_path, name)
+                try:
+                    info = os.lstat(object_path)
+                    if info.st_nlink < 2:
+                        os.unlink(object_path)
+                        freed += info.st_size
+                except OSError:
+                    pass
+            try:
+                os.rmdir(subdir_path)
+            except OSError:
+                # not empty
+                pass
+        return int(freed / 1024)
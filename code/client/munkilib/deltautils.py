@@ -0,0 +1,245 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+deltautils.py
+
+Binary deltas between two versions of an installer item.
+
+Both files are split into content-defined chunks: a chunk ends after an
+occurrence of a short marker sequence (within minimum and maximum chunk
+sizes), so an insertion or removal only changes the chunks around it rather
+than shifting every chunk boundary after it. Chunks of the new file that
+also occur in the old one are encoded as copies from the old file;
+everything else is included literally.
+
+A delta file is MAGIC followed by records:
+    b'C' offset length       copy length bytes from offset in the base file
+    b'D' length data         length bytes of literal data
+    b'E' size                end; size is the total size of the result
+Offsets, lengths and sizes are big-endian unsigned 64-bit integers.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import hashlib
+import os
+import struct
+
+MAGIC = b'MUNKIDELTA1\n'
+
+# a chunk ends after this sequence; in random-looking data (which compressed
+# installer payloads are) it occurs on average every 64KB
+CHUNK_MARKER = b'\xc7\x1d'
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+READ_SIZE = 8 * 1024 * 1024
+
+# literal data is written out once this much is pending
+MAX_LITERAL_SIZE = 4 * 1024 * 1024
+
+_LENGTH = struct.Struct('>Q')
+_COPY = struct.Struct('>QQ')
+
+
+class DeltaError(Exception):
+    '''Error to raise when a delta can't be made or applied'''
+    #pass
+
+
+def _chunk_end(buf, start, final):
+    '''Returns the end of the chunk starting at start in buf, or None if we
+    need more data to tell'''
+    limit = start + MAX_CHUNK_SIZE
+    index = buf.find(CHUNK_MARKER, start + MIN_CHUNK_SIZE, limit)
+    if index != -1:
+        return index + len(CHUNK_MARKER)
+    if len(buf) >= limit:
+        return limit
+    if final and start < len(buf):
+        return len(buf)
+    return None
+
+
+def chunks(fileobj):
+    '''Generator that yields (offset, data) for each content-defined chunk
+    of fileobj'''
+    buf = b''
+    offset = 0
+    while True:
+        data = fileobj.read(READ_SIZE)
+        buf = buf + data
+        start = 0
+        while True:
+            end = _chunk_end(buf, start, final=not data)
+            if end is None:
+                break
+            yield offset + start, buf[start:end]
+            start = end
+        buf = buf[start:]
+        offset += start
+        if not data:
+            break
+
+
+def _digest(data):
+    '''Identifies a chunk'''
+    return hashlib.sha1(data).digest()
+
+
+class _DeltaWriter(object):
+    '''Writes delta records, coalescing adjacent copies and literals'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.copy = None
+        self.literal = []
+        self.literal_size = 0
+        self.size = 0
+        self.fileobj.write(MAGIC)
+
+    def add_copy(self, offset, length):
+        '''Adds a copy from the base file'''
+        self._flush_literal()
+        if self.copy and self.copy[0] + self.copy[1] == offset:
+            self.copy = (self.copy[0], self.copy[1] + length)
+        else:
+            self._flush_copy()
+            self.copy = (offset, length)
+        self.size += length
+
+    def add_literal(self, data):
+        '''Adds literal data'''
+        self._flush_copy()
+        self.literal.append(data)
+        self.literal_size += len(data)
+        self.size += len(data)
+        if self.literal_size >= MAX_LITERAL_SIZE:
+            self._flush_literal()
+
+    def _flush_copy(self):
+        if self.copy:
+            self.fileobj.write(b'C' + _COPY.pack(*self.copy))
+            self.copy = None
+
+    def _flush_literal(self):
+        if self.literal:
+            self.fileobj.write(b'D' + _LENGTH.pack(self.literal_size))
+            for data in self.literal:
+                self.fileobj.write(data)
+            self.literal = []
+            self.literal_size = 0
+
+    def close(self):
+        '''Writes any pending records and the end record'''
+        self._flush_copy()
+        self._flush_literal()
+        self.fileobj.write(b'E' + _LENGTH.pack(self.size))
+
+
+def make_delta(base_path, target_path, delta_path):
+    '''Writes a delta to delta_path that turns the file at base_path into
+    the file at target_path. Returns a dictionary with the number of bytes
+    copied from the base and included literally.'''
+    index = {}
+    with open(base_path, 'rb') as base:
+        for offset, data in chunks(base):
+            index.setdefault(_digest(data), (offset, len(data)))
+    stats = {'copied': 0, 'literal': 0}
+    try:
+        with open(target_path, 'rb') as target, \
+                open(delta_path, 'wb') as fileobj:
+            writer = _DeltaWriter(fileobj)
+            for dummy_offset, data in chunks(target):
+                match = index.get(_digest(data))
+                if match:
+                    writer.add_copy(match[0], match[1])
+                    stats['copied'] += len(data)
+                else:
+                    writer.add_literal(data)
+                    stats['literal'] += len(data)
+            writer.close()
+    except (IOError, OSError):
+        try:
+            os.unlink(delta_path)
+        except OSError:
+            pass
+        raise
+    return stats
+
+
+def _read_exactly(fileobj, length):
+    '''Reads length bytes from fileobj, or raises DeltaError'''
+    data = fileobj.read(length)
+    if len(data) != length:
+        raise DeltaError('Delta is truncated')
+    return data
+
+
+def _copy_bytes(source, destination, length):
+    '''Copies length bytes from source to destination'''
+    while length:
+        data = source.read(min(length, READ_SIZE))
+        if not data:
+            raise DeltaError('Delta refers past the end of its data')
+        destination.write(data)
+        length -= len(data)
+
+
+def apply_delta(base_path, delta_path, output_path):
+    '''Applies the delta at delta_path to the file at base_path, writing the
+    result to output_path. Returns the size of the result. Raises DeltaError
+    if the delta is malformed or doesn't fit the base file.'''
+    base_size = os.path.getsize(base_path)
+    size = 0
+    try:
+        with open(base_path, 'rb') as base, \
+                open(delta_path, 'rb') as delta, \
+                open(output_path, 'wb') as output:
+            if delta.read(len(MAGIC)) != MAGIC:
+                raise DeltaError('%s is not a delta file' % delta_path)
+            while True:
+                record = _read_exactly(delta, 1)
+                if record == b'C':
+                    offset, length = _COPY.unpack(
+                        _read_exactly(delta, _COPY.size))
+                    if offset + length > base_size:
+                        raise DeltaError(
+                            'Delta does not match the base file')
+                    base.seek(offset)
+                    _copy_bytes(base, output, length)
+                    size += length
+                elif record == b'D':
+                    length, = _LENGTH.unpack(
+                        _read_exactly(delta, _LENGTH.size))
+                    _copy_bytes(delta, output, length)
+                    size += length
+                elif record == b'E':
+                    expected, = _LENGTH.unpack(
+                        _read_exactly(delta, _LENGTH.size))
+                    if expected != size:
+                        raise DeltaError(
+                            'Delta produced %s bytes instead of %s'
+                            % (size, expected))
+                    return size
+                else:
+                    raise DeltaError('Delta is corrupt')
+    except DeltaError:
+        try:
+            os.unlink(output_path)
+        except OSError:
+            pass
+        raise
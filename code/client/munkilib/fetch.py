@@ -44,25 +44,19 @@ except ImportError:
     # Python 3
     from urllib.parse import urlparse, urlsplit
 
-# Cocoa libs via PyObjC
-# PyLint cannot properly find names inside Cocoa libraries, so issues bogus
-# No name 'Foo' in module 'Bar' warnings. Disable them.
-# pylint: disable=E0611
-from Foundation import NSHTTPURLResponse
-# pylint: enable=E0611
-
 #our libs
+from . import compression
 from . import constants
 from . import display
+from . import fetchbackend
+from . import fetchscheduler
 from . import info
 from . import keychain
 from . import munkihash
 from . import munkilog
 from . import osutils
 from . import prefs
-
-
-from .gurl import Gurl
+from . import reports
 
 # Disable PyLint complaining about 'invalid' camelCase names
 # pylint: disable=C0103
@@ -130,6 +124,92 @@ if not ignore_middleware:
     import_middleware()
 
 
+_backend = None
+_portable_backend = None
+_scheduler = None
+
+# preferences setting bandwidth limits, in KB/sec
+BANDWIDTH_LIMIT_PREFS = ('DownloadBandwidthLimit',
+                         'DownloadBandwidthLimitPerHost',
+                         'PrecacheBandwidthLimit')
+
+
+def get_backend():
+    """Returns the HTTP backend used for this run, creating it on first use.
+    The FetchBackend preference chooses it by name; by default Gurl is used
+    on macOS and the portable backend elsewhere. The same backend (and so
+    the same pool of connections) is used for every request."""
+    global _backend
+    if _backend is None:
+        _backend = fetchbackend.create_backend(
+            prefs.pref('FetchBackend'), **_backend_options())
+        display.display_debug1('Using %s fetch backend', _backend.name)
+    return _backend
+
+
+def get_portable_backend():
+    """Returns a PortableBackend: the run's backend if it is one, otherwise
+    a second backend kept just for the requests only it can make, like the
+    byte ranges of a segmented download."""
+    global _portable_backend
+    backend = get_backend()
+    if isinstance(backend, fetchbackend.PortableBackend):
+        return backend
+    if _portable_backend is None:
+        _portable_backend = fetchbackend.PortableBackend(**_backend_options())
+    return _portable_backend
+
+
+def get_scheduler():
+    """Returns the scheduler that admits and throttles every HTTP request
+    this run. Configured by the MaximumConcurrentDownloads,
+    MaximumConcurrentDownloadsPerHost, DownloadBandwidthLimit,
+    DownloadBandwidthLimitPerHost and PrecacheBandwidthLimit preferences
+    (limits in KB/sec; 0 is unlimited). Bandwidth limits can only be
+    enforced by a backend that can throttle its connections (the portable
+    one); with any other, they are ignored with a warning."""
+    global _scheduler
+    if _scheduler is None:
+        limits = dict((pref_name, int(prefs.pref(pref_name) or 0) * 1024)
+                      for pref_name in BANDWIDTH_LIMIT_PREFS)
+        backend = get_backend()
+        if not backend.can_throttle and any(limits.values()):
+            display.display_warning(
+                '%s can\'t be enforced with the %s fetch backend, so it '
+                'is ignored. Set FetchBackend to "%s" to enforce it.',
+                ', '.join(pref_name for pref_name in BANDWIDTH_LIMIT_PREFS
+                          if limits[pref_name]),
+                backend.name, fetchbackend.PortableBackend.name)
+            limits = dict.fromkeys(limits, 0)
+        _scheduler = fetchscheduler.Scheduler(
+            max_concurrent=prefs.pref('MaximumConcurrentDownloads'),
+            max_per_host=prefs.pref('MaximumConcurrentDownloadsPerHost'),
+            bandwidth_limit=limits['DownloadBandwidthLimit'],
+            per_host_bandwidth_limit=limits['DownloadBandwidthLimitPerHost'],
+            class_bandwidth_limits={
+                fetchscheduler.PRIORITY_PRECACHE:
+                    limits['PrecacheBandwidthLimit']})
+    return _scheduler
+
+
+def _backend_options():
+    """Returns the certificate settings for a fetch backend"""
+    cert_info = keychain.get_munki_server_cert_info()
+    cert_info.update(keychain.get_munki_client_cert_info())
+    return {'ca_cert_path': cert_info['ca_cert_path'],
+            'ca_dir_path': cert_info['ca_dir_path'],
+            'client_cert_path': cert_info['client_cert_path'],
+            'client_key_path': cert_info['client_key_path']}
+
+
+def set_backend(backend):
+    """Replaces the HTTP backend used for this run, closing the old one"""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+
+
 class Error(Exception):
     """Base exception for fetch errors"""
     pass
@@ -205,33 +285,104 @@ def header_dict_from_list(array):
     return header_dict
 
 
+def wait_for_connection(connection, message=None, transfer=None):
+    """Starts a connection from a fetch backend and waits for it to finish,
+    displaying progress as it goes. Raises GurlError if something goes wrong
+    along the way; HTTP and connection errors are left in the connection
+    object for the caller to examine.
+    If a scheduler transfer is given, the bytes received are counted against
+    it and, for connections that support it, throttled by it."""
+    stored_percent_complete = -1
+    stored_bytes_received = 0
+    counted_bytes = None
+    count_progress = False
+    if transfer is not None:
+        if hasattr(connection, 'throttle'):
+            connection.throttle = transfer.received
+        else:
+            # this connection receives data on its own; we can only count it
+            count_progress = True
+    connection.start()
+    try:
+        while True:
+            # if we did `while not connection.isDone()` we'd miss printing
+            # messages and displaying percentages if we exit the loop first
+            connection_done = connection.isDone()
+            if count_progress and connection.status:
+                if counted_bytes is None:
+                    # don't count the part of a resumed download we had
+                    counted_bytes = 0
+                    if getattr(connection, 'resume', False):
+                        counted_bytes = connection.bytesReceived
+                if connection.bytesReceived > counted_bytes:
+                    transfer.received(
+                        connection.bytesReceived - counted_bytes,
+                        throttle=False)
+                    counted_bytes = connection.bytesReceived
+            if message and connection.status and connection.status != 304:
+                # log always, display if verbose is 1 or more
+                # also display in MunkiStatus detail field
+                display.display_status_minor(message)
+                # now clear message so we don't display it again
+                message = None
+            if (str(connection.status).startswith('2')
+                    and connection.percentComplete != -1):
+                if connection.percentComplete != stored_percent_complete:
+                    # display percent done if it has changed
+                    stored_percent_complete = connection.percentComplete
+                    display.display_percent_done(
+                        stored_percent_complete, 100)
+            elif connection.bytesReceived != stored_bytes_received:
+                # if we don't have percent done info, log bytes received
+                stored_bytes_received = connection.bytesReceived
+                display.display_detail(
+                    'Bytes received: %s', stored_bytes_received)
+            if connection_done:
+                break
+
+    except (KeyboardInterrupt, SystemExit):
+        # safely kill the connection then re-raise
+        connection.cancel()
+        raise
+    except Exception as err:  # too general, I know
+        # Let us out! ... Safely! Unexpectedly quit dialogs are annoying...
+        connection.cancel()
+        # Re-raise the error as a GurlError
+        raise GurlError(-1, str(err))
+
+
 def get_url(url, destinationpath,
             custom_headers=None, message=None, onlyifnewer=False,
-            resume=False, follow_redirects=False, pkginfo=None):
+            resume=False, follow_redirects=False, pkginfo=None,
+            max_connections=1, priority=fetchscheduler.PRIORITY_METADATA):
     """Gets an HTTP or HTTPS URL and stores it in
     destination path. Returns a dictionary of headers, which includes
     http_result_code and http_result_description.
     Will raise ConnectionError if Gurl has a connection error.
     Will raise HTTPError if HTTP Result code is not 2xx or 304.
     Will raise GurlError if Gurl has some other error.
+    The request is made through the backend returned by get_backend().
     If destinationpath already exists, you can set 'onlyifnewer' to true to
     indicate you only want to download the file only if it's newer on the
     server.
     If you set resume to True, Gurl will attempt to resume an
-    interrupted download."""
+    interrupted download.
+    If max_connections is more than 1, the file is fetched as byte ranges
+    over up to that many connections at once (falling back to a single
+    connection if that fails before any data arrives).
+    The request waits its turn with the scheduler (see get_scheduler) in its
+    priority class: one of the fetchscheduler.PRIORITY_* constants."""
 
     tempdownloadpath = destinationpath + '.download'
     if os.path.exists(tempdownloadpath) and not resume:
         os.remove(tempdownloadpath)
 
+    backend = get_backend()
     cache_data = None
     if onlyifnewer and os.path.exists(destinationpath):
-        # create a temporary Gurl object so we can extract the
-        # stored caching data so we can download only if the
+        # extract the stored caching data so we can download only if the
         # file has changed on the server
-        gurl_obj = Gurl.alloc().initWithOptions_({'file': destinationpath})
-        cache_data = gurl_obj.getStoredHeaders()
-        del gurl_obj
+        cache_data = backend.stored_headers(destinationpath)
 
     # only works with NSURLSession (10.9 and newer)
     ignore_system_proxy = prefs.pref('IgnoreSystemProxies')
@@ -256,45 +407,28 @@ def get_url(url, destinationpath,
         options = middleware.process_request_options(options)
         display.display_debug2('Options: %s' % options)
 
-    connection = Gurl.alloc().initWithOptions_(options)
-    stored_percent_complete = -1
-    stored_bytes_received = 0
-    connection.start()
+    scheduler = get_scheduler()
     try:
-        while True:
-            # if we did `while not connection.isDone()` we'd miss printing
-            # messages and displaying percentages if we exit the loop first
-            connection_done = connection.isDone()
-            if message and connection.status and connection.status != 304:
-                # log always, display if verbose is 1 or more
-                # also display in MunkiStatus detail field
-                display.display_status_minor(message)
-                # now clear message so we don't display it again
-                message = None
-            if (str(connection.status).startswith('2')
-                    and connection.percentComplete != -1):
-                if connection.percentComplete != stored_percent_complete:
-                    # display percent done if it has changed
-                    stored_percent_complete = connection.percentComplete
-                    display.display_percent_done(
-                        stored_percent_complete, 100)
-            elif connection.bytesReceived != stored_bytes_received:
-                # if we don't have percent done info, log bytes received
-                stored_bytes_received = connection.bytesReceived
-                display.display_detail(
-                    'Bytes received: %s', stored_bytes_received)
-            if connection_done:
-                break
-
-    except (KeyboardInterrupt, SystemExit):
-        # safely kill the connection then re-raise
-        connection.cancel()
-        raise
-    except Exception as err:  # too general, I know
-        # Let us out! ... Safely! Unexpectedly quit dialogs are annoying...
-        connection.cancel()
-        # Re-raise the error as a GurlError
-        raise GurlError(-1, str(err))
+        with scheduler.transfer(options['url'], priority) as transfer:
+            connection = None
+            if max_connections > 1:
+                connection = fetchbackend.SegmentedConnection(
+                    get_portable_backend(), options, max_connections)
+                wait_for_connection(connection, message, transfer)
+                if (connection.error is not None
+                        and not connection.bytesReceived):
+                    # couldn't even get started; the server or network may
+                    # not be happy with ranged requests
+                    display.display_detail(
+                        'Segmented download failed: %s; retrying with a '
+                        'single connection',
+                        connection.error.localizedDescription())
+                    connection = None
+            if connection is None:
+                connection = backend.connection(options)
+                wait_for_connection(connection, message, transfer)
+    finally:
+        reports.report['DownloadStats'] = scheduler.stats()
 
     if connection.error is not None:
         # gurl returned an error
@@ -319,8 +453,7 @@ def get_url(url, destinationpath,
 
     temp_download_exists = os.path.isfile(tempdownloadpath)
     connection.headers['http_result_code'] = str(connection.status)
-    description = NSHTTPURLResponse.localizedStringForStatusCode_(
-        connection.status)
+    description = backend.status_description(connection.status)
     connection.headers['http_result_description'] = description
 
     if str(connection.status).startswith('2') and temp_download_exists:
@@ -353,7 +486,9 @@ def getResourceIfChangedAtomically(url,
                                    resume=False,
                                    verify=False,
                                    follow_redirects=False,
-                                   pkginfo=None):
+                                   pkginfo=None,
+                                   max_connections=1,
+                                   priority=fetchscheduler.PRIORITY_METADATA):
     """Gets file from a URL.
        Checks first if there is already a file with the necessary checksum.
        Then checks if the file has changed on the server, resuming or
@@ -361,7 +496,8 @@ def getResourceIfChangedAtomically(url,
 
        If the file has changed verify the pkg hash if so configured.
 
-       Supported schemes are http, https, file.
+       Supported schemes are http, https, file. For http and https,
+       max_connections > 1 allows a segmented download (see get_url).
 
        Returns True if a new download was required; False if the
        item is already in the local cache.
@@ -404,7 +540,8 @@ def getResourceIfChangedAtomically(url,
             url, destinationpath,
             custom_headers=custom_headers,
             message=message, resume=resume, follow_redirects=follow_redirects,
-            pkginfo=pkginfo)
+            pkginfo=pkginfo, max_connections=max_connections,
+            priority=priority)
     elif url_parse.scheme == 'file':
         changed = getFileIfChangedAtomically(url_parse.path, destinationpath)
     else:
@@ -429,11 +566,14 @@ def getResourceIfChangedAtomically(url,
 
 def munki_resource(
         url, destinationpath, message=None, resume=False, expected_hash=None,
-        verify=False, pkginfo=None):
+        verify=False, pkginfo=None, max_connections=1,
+        priority=fetchscheduler.PRIORITY_METADATA):
 
     '''The high-level function for getting resources from the Munki repo.
     Gets a given URL from the Munki server.
-    Adds any additional headers to the request if present'''
+    Adds any additional headers to the request if present.
+    priority is the request's class for the download scheduler; the
+    default is for metadata like catalogs and manifests.'''
 
     # Add any additional headers specified in ManagedInstalls.plist.
     # AdditionalHttpHeaders must be an array of strings with valid HTTP
@@ -452,7 +592,69 @@ def munki_resource(
                                           message=message,
                                           resume=resume,
                                           verify=verify,
-                                          pkginfo=pkginfo)
+                                          pkginfo=pkginfo,
+                                          max_connections=max_connections,
+                                          priority=priority)
+
+
+# (server, directory, encoding) for which we've found there are no
+# precompressed variants this run, so we don't ask again for every file
+_MISSING_VARIANTS = set()
+
+
+def _variant_key(url, encoding):
+    '''Identifies the location of precompressed variants of url'''
+    url_parts = urlparse(url)
+    return (url_parts.netloc, os.path.dirname(url_parts.path), encoding)
+
+
+def munki_metadata_resource(url, destinationpath, message=None):
+    '''Like munki_resource, but for catalogs, which makecatalogs may also
+    publish precompressed (url + '.gz', say) alongside each catalog it
+    writes. Gets the most preferred variant the server has, keeping it
+    next to destinationpath so it can be revalidated on its own, and
+    decompresses it to destinationpath. Falls back to url itself.
+    Manifests are edited by hand with no variants kept in step, so they
+    are fetched with munki_resource.
+    Returns True if destinationpath was changed.'''
+    for encoding in compression.available_encodings():
+        key = _variant_key(url, encoding)
+        if key in _MISSING_VARIANTS:
+            continue
+        suffix = compression.SUFFIXES[encoding]
+        variantpath = destinationpath + suffix
+        try:
+            changed = munki_resource(url + suffix, variantpath,
+                                     message=message)
+            if changed or not os.path.exists(destinationpath):
+                compression.decompress_file(
+                    variantpath, destinationpath, encoding)
+                changed = True
+        except ConnectionError:
+            raise
+        except (Error, compression.DecompressionError) as err:
+            display.display_debug1(
+                'No usable %s variant of %s: %s', encoding, url, err)
+            _MISSING_VARIANTS.add(key)
+            if os.path.exists(variantpath):
+                os.unlink(variantpath)
+            continue
+        _remove_variants(destinationpath, keep=variantpath)
+        return changed
+    changed = munki_resource(url, destinationpath, message=message)
+    _remove_variants(destinationpath)
+    return changed
+
+
+def _remove_variants(destinationpath, keep=None):
+    '''Removes stale precompressed variants of destinationpath'''
+    for suffix in compression.variant_suffixes():
+        variantpath = destinationpath + suffix
+        if variantpath != keep and os.path.exists(variantpath):
+            try:
+                os.unlink(variantpath)
+            except OSError:
+                pass
 
 
 def getFileIfChangedAtomically(path, destinationpath):
@@ -513,7 +715,9 @@ def getHTTPfileIfChangedAtomically(url, destinationpath,
                                    custom_headers=None,
                                    message=None, resume=False,
                                    follow_redirects=False,
-                                   pkginfo=None):
+                                   pkginfo=None,
+                                   max_connections=1,
+                                   priority=fetchscheduler.PRIORITY_METADATA):
     """Gets file from HTTP URL, checking first to see if it has changed on the
        server.
 
@@ -539,7 +743,9 @@ def getHTTPfileIfChangedAtomically(url, destinationpath,
                          onlyifnewer=getonlyifnewer,
                          resume=resume,
                          follow_redirects=follow_redirects,
-                         pkginfo=pkginfo)
+                         pkginfo=pkginfo,
+                         max_connections=max_connections,
+                         priority=priority)
 
     except ConnectionError:
         # connection errors should be handled differently; don't re-raise
@@ -0,0 +1,1200 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+fetchbackend.py
+
+HTTP backends for fetch.get_url.
+
+A backend turns a dictionary of request options (the same dictionary that
+is handed to middleware) into a connection object with the interface fetch
+has always used with Gurl: start(), cancel(), isDone() and the status,
+headers, error, SSLerror, redirection, bytesReceived and percentComplete
+attributes.
+
+Two backends are provided:
+    gurl: the NSURLSession-based Gurl class (macOS only).
+    portable: http.client based; keeps a pool of keep-alive connections
+        per host for the whole run, and blocks on the socket rather than
+        polling a run loop.
+
+SegmentedConnection fetches one large item over several connections at
+once, as byte ranges, using the portable backend's connections.
+
+Both backends keep the download metadata (etag, last-modified and
+expected-length) in the same extended attribute, so partial downloads and
+only-if-changed checks carry over from one backend to the other.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import base64
+import http.client
+import os
+import plistlib
+import re
+import socket
+import ssl
+import sys
+import threading
+import time
+import xattr
+
+try:
+    # Python 2
+    from urlparse import urljoin, urlsplit
+    from urllib import getproxies, proxy_bypass
+except ImportError:
+    # Python 3
+    from urllib.parse import urljoin, urlsplit
+    from urllib.request import getproxies, proxy_bypass
+
+# Disable PyLint complaining about 'invalid' camelCase names; the connection
+# API mirrors Gurl's
+# pylint: disable=C0103
+
+# XATTR name storing the headers we need to resume a download or to check
+# whether a file has changed on the server. Shared with Gurl.
+DOWNLOAD_DATA_XATTR = 'com.googlecode.munki.downloadData'
+# XATTR name storing the progress of a segmented download
+DOWNLOAD_SEGMENTS_XATTR = 'com.googlecode.munki.downloadSegments'
+
+# bytes read from the socket per isDone() call
+READ_CHUNK_SIZE = 256 * 1024
+# idle keep-alive connections kept per host
+MAX_IDLE_CONNECTIONS_PER_HOST = 4
+# seconds an idle connection may sit in the pool before we drop it
+IDLE_CONNECTION_TIMEOUT = 30
+MAX_REDIRECTS = 10
+# size of each byte range fetched by a SegmentedConnection
+SEGMENT_SIZE = 32 * 1024 * 1024
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# NSURLError codes, so callers see the same codes from either backend
+NSURLErrorUnknown = -1
+NSURLErrorCancelled = -999
+NSURLErrorTimedOut = -1001
+NSURLErrorUnsupportedURL = -1002
+NSURLErrorCannotFindHost = -1003
+NSURLErrorCannotConnectToHost = -1004
+NSURLErrorNetworkConnectionLost = -1005
+NSURLErrorHTTPTooManyRedirects = -1007
+NSURLErrorSecureConnectionFailed = -1200
+NSURLErrorServerCertificateUntrusted = -1202
+
+# kTLSProtocol constants as used by Gurl's minimum_tls_protocol option
+TLS_VERSIONS = {
+    4: ssl.TLSVersion.TLSv1,
+    7: ssl.TLSVersion.TLSv1_1,
+    8: ssl.TLSVersion.TLSv1_2,
+}
+
+
+class Error(Exception):
+    """Base exception for fetch backend errors"""
+    #pass
+
+
+class UnknownBackendError(Error):
+    """No backend is registered under the requested name"""
+    #pass
+
+
+def get_stored_headers(path):
+    '''Returns the download metadata stored with path, or an empty dict'''
+    try:
+        stored_plist_bytestr = xattr.getxattr(path, DOWNLOAD_DATA_XATTR)
+    except (KeyError, IOError, OSError):
+        return {}
+    try:
+        data = plistlib.loads(stored_plist_bytestr)
+    except Exception:
+        # stored data is garbage; treat it like no stored data
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+
+def store_headers(path, headers, log=None):
+    '''Stores download metadata with path'''
+    try:
+        byte_string = plistlib.dumps(headers, fmt=plistlib.FMT_XML)
+    except (TypeError, ValueError, OverflowError):
+        byte_string = b''
+    try:
+        xattr.setxattr(path, DOWNLOAD_DATA_XATTR, byte_string)
+    except (IOError, OSError) as err:
+        if log:
+            log('Could not store metadata to %s: %s' % (path, err))
+
+
+class ConnectionFailure(object):
+    '''Describes why a request failed. Has the code() and
+    localizedDescription() methods of the NSError objects Gurl reports, so
+    fetch can treat errors from either backend the same way.'''
+
+    def __init__(self, code, description):
+        self._code = code
+        self._description = description
+
+    def code(self):
+        '''Returns the NSURLError-style error code'''
+        return self._code
+
+    def localizedDescription(self):
+        '''Returns a description of the error'''
+        return self._description
+
+    def __repr__(self):
+        return 'ConnectionFailure(%s, %r)' % (self._code, self._description)
+
+
+class _TooManyRedirects(http.client.HTTPException):
+    '''Raised when redirects exceed MAX_REDIRECTS'''
+    #pass
+
+
+class _UnsupportedURL(http.client.HTTPException):
+    '''Raised for URLs that aren't http or https'''
+    #pass
+
+
+def failure_from_exception(err):
+    '''Returns a (ConnectionFailure, ssl_error) tuple for a socket, SSL or
+    http.client exception'''
+    if isinstance(err, _TooManyRedirects):
+        return (ConnectionFailure(
+            NSURLErrorHTTPTooManyRedirects, 'too many HTTP redirects'), None)
+    if isinstance(err, _UnsupportedURL):
+        return (ConnectionFailure(
+            NSURLErrorUnsupportedURL, 'unsupported URL: %s' % err), None)
+    if isinstance(err, socket.timeout):
+        return (ConnectionFailure(
+            NSURLErrorTimedOut, 'The request timed out.'), None)
+    if isinstance(err, socket.gaierror):
+        return (ConnectionFailure(
+            NSURLErrorCannotFindHost,
+            'A server with the specified hostname could not be found.'), None)
+    if isinstance(err, ssl.SSLCertVerificationError):
+        return (ConnectionFailure(
+            NSURLErrorServerCertificateUntrusted,
+            'The certificate for this server is invalid.'),
+                (err.verify_code, err.verify_message))
+    if isinstance(err, ssl.SSLError):
+        return (ConnectionFailure(
+            NSURLErrorSecureConnectionFailed,
+            'An SSL error has occurred and a secure connection to the '
+            'server cannot be made.'), (err.errno, err.reason or str(err)))
+    if isinstance(err, ConnectionRefusedError):
+        return (ConnectionFailure(
+            NSURLErrorCannotConnectToHost,
+            'Could not connect to the server.'), None)
+    if isinstance(err, (http.client.IncompleteRead,
+                        http.client.RemoteDisconnected,
+                        ConnectionResetError, BrokenPipeError)):
+        return (ConnectionFailure(
+            NSURLErrorNetworkConnectionLost,
+            'The network connection was lost.'), None)
+    return (ConnectionFailure(NSURLErrorUnknown, str(err)), None)
+
+
+class ConnectionPool(object):
+    '''Idle keep-alive connections, keyed by (scheme, host, port, proxy).
+    Safe to share between threads.'''
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_CONNECTIONS_PER_HOST,
+                 idle_timeout=IDLE_CONNECTION_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, key):
+        '''Returns an idle connection for key, or None'''
+        now = time.time()
+        stale = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    connection = candidate
+                    self.reused += 1
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        return connection
+
+    def put(self, key, connection):
+        '''Returns a connection to the pool for reuse'''
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def note_created(self):
+        '''Counts a newly opened connection'''
+        with self._lock:
+            self.created += 1
+
+    def close(self):
+        '''Closes all idle connections'''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, dummy_released_at in connections:
+                connection.close()
+
+
+class Backend(object):
+    '''Interface for fetch backends'''
+
+    name = None
+    # True if connections call a throttle function as data arrives, so the
+    # scheduler can hold them to a bandwidth limit
+    can_throttle = False
+
+    def connection(self, options):
+        '''Returns an unstarted connection object for the request options'''
+        raise NotImplementedError
+
+    def stored_headers(self, path):
+        '''Returns stored download metadata for path'''
+        return get_stored_headers(path)
+
+    def status_description(self, status):
+        '''Returns a description for an HTTP status code'''
+        if status is None:
+            return ''
+        return http.client.responses.get(status, '').lower()
+
+    def close(self):
+        '''Releases any resources held by the backend'''
+        pass
+
+
+class GurlBackend(Backend):
+    '''Downloads with Gurl (NSURLSession). macOS only.'''
+
+    name = 'gurl'
+
+    def __init__(self, **_kwargs):
+        # import here so this module can be used without PyObjC
+        # pylint: disable=import-outside-toplevel
+        from .gurl import Gurl
+        from Foundation import NSHTTPURLResponse
+        # pylint: enable=import-outside-toplevel
+        self._gurl_class = Gurl
+        self._response_class = NSHTTPURLResponse
+
+    def connection(self, options):
+        return self._gurl_class.alloc().initWithOptions_(options)
+
+    def stored_headers(self, path):
+        gurl_obj = self._gurl_class.alloc().initWithOptions_({'file': path})
+        return gurl_obj.getStoredHeaders()
+
+    def status_description(self, status):
+        return self._response_class.localizedStringForStatusCode_(status)
+
+
+class PortableBackend(Backend):
+    '''Downloads with http.client, reusing connections across requests'''
+
+    name = 'portable'
+    can_throttle = True
+
+    def __init__(self, ca_cert_path=None, ca_dir_path=None,
+                 client_cert_path=None, client_key_path=None, pool=None):
+        self.ca_cert_path = ca_cert_path
+        self.ca_dir_path = ca_dir_path
+        self.client_cert_path = client_cert_path
+        self.client_key_path = client_key_path
+        self.pool = pool or ConnectionPool()
+        self._ssl_contexts = {}
+        self._lock = threading.Lock()
+
+    def connection(self, options):
+        return PortableConnection(self, options)
+
+    def ssl_context(self, minimum_tls_protocol=None):
+        '''Returns a (cached) SSL context for our certificate settings'''
+        with self._lock:
+            context = self._ssl_contexts.get(minimum_tls_protocol)
+            if context is None:
+                context = ssl.create_default_context(
+                    cafile=self.ca_cert_path, capath=self.ca_dir_path)
+                if self.client_cert_path:
+                    context.load_cert_chain(
+                        self.client_cert_path, keyfile=self.client_key_path)
+                if minimum_tls_protocol in TLS_VERSIONS:
+                    context.minimum_version = TLS_VERSIONS[
+                        minimum_tls_protocol]
+                self._ssl_contexts[minimum_tls_protocol] = context
+            return context
+
+    def close(self):
+        self.pool.close()
+
+
+class PortableConnection(object):
+    '''A single request made through the PortableBackend. Mirrors the parts
+    of the Gurl interface fetch uses. All work happens in the calling thread:
+    start() sends the request and reads the response headers, and each call
+    to isDone() blocks until the next chunk of the body arrives.'''
+
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.follow_redirects = options.get('follow_redirects', False)
+        self.ignore_system_proxy = options.get('ignore_system_proxy', False)
+        self.destination_path = options.get('file')
+        self.can_resume = options.get('can_resume', False)
+        self.url = options.get('url')
+        self.additional_headers = options.get('additional_headers') or {}
+        self.username = options.get('username')
+        self.password = options.get('password')
+        self.download_only_if_changed = options.get(
+            'download_only_if_changed', False)
+        self.cache_data = options.get('cache_data')
+        self.connection_timeout = options.get('connection_timeout', 60)
+        self.minimum_tls_protocol = options.get('minimum_tls_protocol')
+        self.log = options.get('logging_function') or (lambda message: None)
+
+        self.resume = False
+        self.response = None
+        self.headers = {}
+        self.status = None
+        self.error = None
+        self.SSLerror = None
+        self.done = False
+        self.redirection = []
+        self.destination = None
+        self.bytesReceived = 0
+        self.expectedLength = -1
+        self.percentComplete = 0
+        self.final_url = None
+        # if set, called with the size of each chunk received
+        self.throttle = None
+
+        self._connection = None
+        self._pool_key = None
+        self._download_data = {}
+
+    def getStoredHeaders(self):
+        '''Returns any stored headers for self.destination_path'''
+        return get_stored_headers(self.destination_path)
+
+    def storeHeaders_(self, headers):
+        '''Stores headers with self.destination_path'''
+        store_headers(self.destination_path, headers, log=self.log)
+
+    def start(self):
+        '''Send the request and read the response headers'''
+        if not self.destination_path:
+            self.log('No output file specified.')
+            self.done = True
+            return
+        try:
+            self._start()
+        except (OSError, http.client.HTTPException) as err:
+            self._fail(err)
+
+    def cancel(self):
+        '''Cancel the connection'''
+        if not self.done:
+            self._discard_connection()
+            self._close_destination()
+            self.error = ConnectionFailure(NSURLErrorCancelled, 'cancelled')
+            self.done = True
+
+    def isDone(self):
+        '''Check if the request is complete. Blocks until the next chunk of
+        the response body has been received and written.'''
+        if self.done:
+            return self.done
+        try:
+            data = self.response.read1(READ_CHUNK_SIZE)
+        except (OSError, http.client.HTTPException) as err:
+            self._fail(err)
+            return self.done
+        if data:
+            self._handle_received_data(data)
+        if not data or self.response.length == 0:
+            self._finish()
+        return self.done
+
+    def _start(self):
+        '''Sends the request (following redirects as allowed) and handles
+        the response headers'''
+        request_headers = self._request_headers()
+        url = self.url
+        while True:
+            response = self._send(url, request_headers)
+            if (response.status == 401 and self.username
+                    and 'Authorization' not in request_headers):
+                # retry with the credentials we were given
+                self._release(response)
+                credentials = base64.b64encode(
+                    ('%s:%s' % (self.username, self.password or '')
+                    ).encode('UTF-8')).decode('ascii')
+                request_headers['Authorization'] = 'Basic ' + credentials
+                continue
+            location = response.getheader('Location')
+            if response.status in REDIRECT_STATUSES and location:
+                new_url = urljoin(url, location)
+                self.redirection.append([new_url, dict(response.getheaders())])
+                if self._redirect_allowed(new_url):
+                    self.log('Allowing redirect to: %s' % new_url)
+                    self._release(response)
+                    if len(self.redirection) > MAX_REDIRECTS:
+                        raise _TooManyRedirects()
+                    url = new_url
+                    continue
+                self.log('Denying redirect to: %s' % new_url)
+            break
+        self.final_url = url
+        self._handle_response(response)
+
+    def _request_headers(self):
+        '''Returns the headers for our request, adding Range and
+        conditional headers as needed'''
+        request_headers = dict(self.additional_headers)
+        if os.path.isfile(self.destination_path):
+            stored_data = self.getStoredHeaders()
+            if (self.can_resume and 'expected-length' in stored_data and
+                    ('last-modified' in stored_data or 'etag' in stored_data)):
+                # we have a partial file and we're allowed to resume
+                self.resume = True
+                local_filesize = os.path.getsize(self.destination_path)
+                request_headers['Range'] = 'bytes=%s-' % local_filesize
+        if self.download_only_if_changed and not self.resume:
+            stored_data = self.cache_data or self.getStoredHeaders()
+            if 'last-modified' in stored_data:
+                request_headers['If-Modified-Since'] = stored_data[
+                    'last-modified']
+            if 'etag' in stored_data:
+                request_headers['If-None-Match'] = stored_data['etag']
+        return request_headers
+
+    def _redirect_allowed(self, new_url):
+        '''Applies the follow_redirects policy'''
+        if self.follow_redirects is True or self.follow_redirects == 'all':
+            return True
+        return (self.follow_redirects == 'https'
+                and urlsplit(new_url).scheme == 'https')
+
+    def _proxy_for(self, url_parts):
+        '''Returns (host, port) of the proxy to use for a URL, or None'''
+        if self.ignore_system_proxy is True:
+            return None
+        proxy = getproxies().get(url_parts.scheme)
+        if not proxy or proxy_bypass(url_parts.hostname):
+            return None
+        proxy_parts = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+        return (proxy_parts.hostname, proxy_parts.port or 80)
+
+    def _new_connection(self, url_parts, proxy):
+        '''Opens a new http.client connection for a URL'''
+        port = url_parts.port
+        if url_parts.scheme == 'https':
+            context = self.backend.ssl_context(self.minimum_tls_protocol)
+            if proxy:
+                connection = http.client.HTTPSConnection(
+                    proxy[0], proxy[1], timeout=self.connection_timeout,
+                    context=context)
+                connection.set_tunnel(url_parts.hostname, port or 443)
+            else:
+                connection = http.client.HTTPSConnection(
+                    url_parts.hostname, port or 443,
+                    timeout=self.connection_timeout, context=context)
+        else:
+            host, port = proxy or (url_parts.hostname, port or 80)
+            connection = http.client.HTTPConnection(
+                host, port, timeout=self.connection_timeout)
+        self.backend.pool.note_created()
+        return connection
+
+    def _send(self, url, request_headers):
+        '''Sends a GET request for url and returns the response. A pooled
+        connection the server has since closed is retried once on a new
+        connection.'''
+        url_parts = urlsplit(url)
+        if url_parts.scheme not in ('http', 'https') or not url_parts.hostname:
+            raise _UnsupportedURL(url)
+        proxy = self._proxy_for(url_parts)
+        self._pool_key = (url_parts.scheme, url_parts.hostname,
+                          url_parts.port, proxy)
+        selector = url_parts.path or '/'
+        if url_parts.query:
+            selector += '?' + url_parts.query
+        if proxy and url_parts.scheme == 'http':
+            # plain http proxies want the absolute URL
+            selector = '%s://%s%s' % (
+                url_parts.scheme, url_parts.netloc, selector)
+
+        connection = self.backend.pool.get(self._pool_key)
+        if connection is not None:
+            try:
+                connection.request('GET', selector, headers=request_headers)
+                self._connection = connection
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError, http.client.CannotSendRequest,
+                    http.client.BadStatusLine):
+                # the server dropped the idle connection; use a new one
+                connection.close()
+        connection = self._new_connection(url_parts, proxy)
+        self._connection = connection
+        connection.request('GET', selector, headers=request_headers)
+        return connection.getresponse()
+
+    def _release(self, response):
+        '''Reads what is left of a response we don't want and returns its
+        connection to the pool'''
+        try:
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self._discard_connection()
+            return
+        self._release_connection(response)
+
+    def _release_connection(self, response):
+        '''Returns our connection to the pool if it can be reused'''
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        if response.will_close:
+            connection.close()
+        else:
+            self.backend.pool.put(self._pool_key, connection)
+
+    def _discard_connection(self):
+        '''Closes our connection without returning it to the pool'''
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+
+    def _handle_response(self, response):
+        '''Handle the response headers, opening the destination file if
+        there's content to save'''
+        self.response = response
+        self.status = response.status
+        self.headers = dict(
+            (key.lower(), value) for key, value in response.getheaders())
+        self.bytesReceived = 0
+        self.percentComplete = -1
+        try:
+            self.expectedLength = int(self.headers.get('content-length', -1))
+        except ValueError:
+            self.expectedLength = -1
+
+        download_data = {}
+        if 'last-modified' in self.headers:
+            download_data['last-modified'] = self.headers['last-modified']
+        if 'etag' in self.headers:
+            download_data['etag'] = self.headers['etag']
+        download_data['expected-length'] = self.expectedLength
+
+        if self.status == 206 and self.resume:
+            stored_data = self.getStoredHeaders()
+            local_filesize = os.path.getsize(self.destination_path)
+            content_range = self.headers.get('content-range', '')
+            if (not stored_data or
+                    stored_data.get('etag') != download_data.get('etag') or
+                    stored_data.get('last-modified') != download_data.get(
+                        'last-modified') or
+                    not content_range.startswith(
+                        'bytes %s-' % local_filesize)):
+                # file on server is different than the one
+                # we have a partial for
+                self.log('Can\'t resume download; file on server has changed.')
+                self._discard_connection()
+                self.log('Removing %s' % self.destination_path)
+                os.unlink(self.destination_path)
+                # restart and attempt to download the entire file
+                self.log('Restarting download of %s' % self.destination_path)
+                self.resume = False
+                self.redirection = []
+                self._start()
+                return
+            # try to resume
+            self.log('Resuming download for %s' % self.destination_path)
+            self.bytesReceived = local_filesize
+            if self.expectedLength != -1:
+                self.expectedLength += local_filesize
+            self.destination = open(self.destination_path, 'ab')
+        elif str(self.status).startswith('2'):
+            # not resuming, just open the file for writing
+            self.resume = False
+            self.destination = open(self.destination_path, 'wb')
+            # store some headers with the file for use if we need to resume
+            # the download and for future checking if the file on the server
+            # has changed
+            self.storeHeaders_(download_data)
+        else:
+            # nothing to save; drain the body so the connection can be reused
+            self._release(response)
+            self.done = True
+
+    def _handle_received_data(self, data):
+        '''Write received data and update our progress'''
+        self.destination.write(data)
+        self.bytesReceived += len(data)
+        if self.throttle:
+            self.throttle(len(data))
+        if self.expectedLength > 0:
+            self.percentComplete = int(
+                float(self.bytesReceived) / float(self.expectedLength) * 100.0)
+
+    def _finish(self):
+        '''The whole body has been received'''
+        self._close_destination()
+        # the body has been read, so this leaves the connection open
+        self.response.close()
+        self._release_connection(self.response)
+        # clear the expected size so we don't attempt to resume the
+        # download next time
+        headers = self.getStoredHeaders()
+        if 'expected-length' in headers:
+            del headers['expected-length']
+            self.storeHeaders_(headers)
+        self.done = True
+
+    def _fail(self, err):
+        '''Record an error and end the request. Any partial download is
+        left in place so it can be resumed.'''
+        self.error, self.SSLerror = failure_from_exception(err)
+        self.log('Request for %s failed: %s' % (self.url, err))
+        self._discard_connection()
+        self._close_destination()
+        self.done = True
+
+    def _close_destination(self):
+        '''Closes the destination file if it's open'''
+        if self.destination:
+            self.destination.close()
+            self.destination = None
+
+
+class _RangeRequest(PortableConnection):
+    '''A PortableConnection for one byte range of a SegmentedConnection.
+    Sends the given range headers and leaves the response body for the
+    caller to read.'''
+
+    def __init__(self, backend, options, range_headers):
+        PortableConnection.__init__(self, backend, options)
+        self.range_headers = range_headers
+
+    def _request_headers(self):
+        request_headers = dict(self.additional_headers)
+        request_headers.update(self.range_headers)
+        return request_headers
+
+    def _handle_response(self, response):
+        self.response = response
+        self.status = response.status
+        self.headers = dict(
+            (key.lower(), value) for key, value in response.getheaders())
+
+    def content_range(self):
+        '''Returns (first, last, total) from the Content-Range header, or
+        None'''
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)$',
+                         self.headers.get('content-range', '').strip())
+        if not match:
+            return None
+        return tuple(int(value) for value in match.groups())
+
+    def finish(self):
+        '''The body has been read; keep the connection for reuse'''
+        self.response.close()
+        self._release_connection(self.response)
+
+    def abandon(self):
+        '''Drop the connection along with any unread body'''
+        self._discard_connection()
+
+
+class _SegmentError(Exception):
+    '''A segment can't be used: the server sent something other than the
+    byte range we asked for'''
+    #pass
+
+
+class SegmentedConnection(object):
+    '''Downloads a file as byte ranges over up to max_connections
+    connections at once, writing each range into place in a preallocated
+    file. Has the same interface as PortableConnection, so fetch.get_url
+    can use either.
+
+    Completed segments are recorded in an xattr on the file, so an
+    interrupted download resumes with just the missing ranges. Every range
+    request carries If-Range, so if the item changes on the server midway
+    the download starts over rather than mixing versions. Servers that
+    don't support ranges get a single ordinary download.'''
+
+    def __init__(self, backend, options, max_connections,
+                 segment_size=SEGMENT_SIZE):
+        self.backend = backend
+        self.options = dict(options)
+        self.max_connections = max(1, max_connections)
+        self.segment_size = segment_size
+        self.destination_path = options.get('file')
+        self.can_resume = options.get('can_resume', False)
+        self.download_only_if_changed = options.get(
+            'download_only_if_changed', False)
+        self.cache_data = options.get('cache_data')
+        self.log = options.get('logging_function') or (lambda message: None)
+
+        self.resume = False
+        self.response = None
+        self.headers = {}
+        self.status = None
+        self.error = None
+        self.SSLerror = None
+        self.done = False
+        self.redirection = []
+        self.bytesReceived = 0
+        self.expectedLength = -1
+        self.percentComplete = -1
+        # if set, called with the size of each chunk received; may be
+        # called from several threads at once
+        self.throttle = None
+
+        self._state = None
+        self._pending = []
+        self._validator = {}
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        '''Start the download in the background'''
+        if not self.destination_path:
+            self.log('No output file specified.')
+            self.done = True
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        '''Cancel the download. Completed segments are kept for resuming.'''
+        with self._condition:
+            self._cancelled = True
+            if not self.done:
+                self.error = ConnectionFailure(NSURLErrorCancelled, 'cancelled')
+                self.done = True
+            self._condition.notify_all()
+
+    def isDone(self):
+        '''Check if the download is complete. Waits up to a second for
+        progress to be made.'''
+        with self._condition:
+            if not self.done:
+                self._condition.wait(1.0)
+            return self.done
+
+    def _run(self):
+        '''Probe with the first range, then fetch the rest concurrently'''
+        self._guarded(self._download)
+
+    def _guarded(self, function, *args):
+        '''Calls function, recording any failure as our error. Every thread
+        we start runs through here.'''
+        try:
+            function(*args)
+        except _ConnectionFailed as err:
+            self._fail(err.failure, err.ssl_error)
+        except (OSError, http.client.HTTPException) as err:
+            self.log('Segmented download of %s failed: %s'
+                     % (self.options.get('url'), err))
+            self._fail(*failure_from_exception(err))
+        except _SegmentError as err:
+            # start over next time
+            self.log('Can\'t resume download: %s' % err)
+            self._clear_state()
+            self._fail(ConnectionFailure(
+                NSURLErrorNetworkConnectionLost, str(err)), None)
+
+    def _fail(self, error, ssl_error):
+        '''Ends the download with an error; the first error wins'''
+        with self._condition:
+            if not self.done:
+                self.error, self.SSLerror = error, ssl_error
+                self.done = True
+            self._condition.notify_all()
+
+    def _request(self, range_headers, options=None):
+        '''Starts a range request and returns it'''
+        request = _RangeRequest(
+            self.backend, options or self.options, range_headers)
+        request.start()
+        if request.error is not None:
+            raise _ConnectionFailed(request.error, request.SSLerror)
+        return request
+
+    def _download(self):
+        '''Does the work of the download'''
+        self._load_state()
+        probe = self._probe()
+        if probe is None:
+            return
+        first, last, total = probe.content_range()
+        self.status = probe.status
+        self.headers = dict(probe.headers)
+        self.headers.pop('content-range', None)
+        self.headers['content-length'] = str(total)
+        # fetch the remaining segments from where the probe ended up, so we
+        # don't repeat any redirects
+        segment_options = dict(self.options)
+        segment_options['url'] = probe.final_url or self.options['url']
+        segment_options['follow_redirects'] = False
+
+        workers = []
+        worker_count = min(self.max_connections - 1, len(self._pending))
+        for dummy_index in range(worker_count):
+            worker = threading.Thread(
+                target=self._guarded, args=(self._worker, segment_options))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        self._guarded(self._read_segment, probe, first, last)
+        self._guarded(self._worker, segment_options)
+        for worker in workers:
+            worker.join()
+        if self._cancelled or self.done:
+            return
+        if self._pending or not all(self._state['completed']):
+            raise _SegmentError('not all segments were received')
+        self._finish(total)
+
+    def _probe(self):
+        '''Requests the first segment we need. Returns the request if we
+        should carry on with a segmented download, or None if the request
+        has been completed some other way.'''
+        if self._state:
+            # resume with the first missing segment, if the item on the
+            # server hasn't changed
+            index = self._pending.pop(0)
+            first, last = self._segment_range(index)
+            range_headers = dict(self._validator)
+            range_headers['Range'] = 'bytes=%s-%s' % (first, last)
+        else:
+            range_headers = {'Range': 'bytes=0-%s' % (self.segment_size - 1)}
+            if self.download_only_if_changed:
+                stored_data = self.cache_data or {}
+                if 'last-modified' in stored_data:
+                    range_headers['If-Modified-Since'] = stored_data[
+                        'last-modified']
+                if 'etag' in stored_data:
+                    range_headers['If-None-Match'] = stored_data['etag']
+        probe = self._request(range_headers)
+        self.redirection = probe.redirection
+        self.response = probe.response
+
+        if probe.status == 206 and probe.content_range():
+            first, last, total = probe.content_range()
+            if self._state:
+                if (total == self._state['total-length']
+                        and (first, last) == self._segment_range(index)):
+                    self.resume = True
+                    self.log('Resuming segmented download for %s'
+                             % self.destination_path)
+                    return probe
+                # not what we asked for; start over
+                probe.abandon()
+                self._clear_state()
+                self._pending = []
+                return self._probe()
+            if first == 0:
+                self._new_state(probe.headers, total)
+                self._pending.remove(0)
+                return probe
+        if probe.status == 206:
+            probe.abandon()
+            raise _SegmentError('unexpected range in response for %s'
+                                % self.options.get('url'))
+        if probe.status == 200:
+            # the server doesn't do ranges, or the item has changed since
+            # we got our segments
+            self._clear_state()
+            self._download_whole(probe)
+            return None
+        # an error or 304; nothing to save
+        probe.abandon()
+        self.status = probe.status
+        self.headers = dict(probe.headers)
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+        return None
+
+    def _worker(self, segment_options):
+        '''Fetches pending segments until there are none left'''
+        while True:
+            with self._condition:
+                if self._cancelled or self.done or not self._pending:
+                    return
+                index = self._pending.pop(0)
+            first, last = self._segment_range(index)
+            range_headers = dict(self._validator)
+            range_headers['Range'] = 'bytes=%s-%s' % (first, last)
+            request = self._request(range_headers, segment_options)
+            if (request.status != 206 or
+                    request.content_range() != (
+                        first, last, self._state['total-length'])):
+                request.abandon()
+                raise _SegmentError('%s changed on the server'
+                                    % self.options.get('url'))
+            self._read_segment(request, first, last)
+
+    def _read_segment(self, request, first, last):
+        '''Reads a range response into place in the file'''
+        fileref = os.open(self.destination_path, os.O_WRONLY)
+        try:
+            offset = first
+            while offset <= last:
+                if self._cancelled or self.done:
+                    request.abandon()
+                    return
+                data = request.response.read1(
+                    min(READ_CHUNK_SIZE, last + 1 - offset))
+                if not data:
+                    raise http.client.IncompleteRead(b'', last + 1 - offset)
+                os.pwrite(fileref, data, offset)
+                offset += len(data)
+                self._note_progress(len(data))
+        finally:
+            os.close(fileref)
+        request.finish()
+        self._segment_completed(first // self._state['segment-size'])
+
+    def _download_whole(self, request):
+        '''Reads an entire (200) response into the file'''
+        self.status = request.status
+        self.headers = dict(request.headers)
+        self.bytesReceived = 0
+        try:
+            self.expectedLength = int(self.headers.get('content-length', -1))
+        except ValueError:
+            self.expectedLength = -1
+        with open(self.destination_path, 'wb') as fileobj:
+            while not self._cancelled:
+                data = request.response.read1(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                fileobj.write(data)
+                self._note_progress(len(data))
+        if self._cancelled:
+            request.abandon()
+            return
+        request.finish()
+        self._store_download_data()
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    def _note_progress(self, count):
+        '''Updates bytesReceived and percentComplete'''
+        with self._condition:
+            self.bytesReceived += count
+            if self.expectedLength > 0:
+                percent = int(float(self.bytesReceived) /
+                              float(self.expectedLength) * 100.0)
+                if percent != self.percentComplete:
+                    self.percentComplete = percent
+                    self._condition.notify_all()
+        if self.throttle:
+            self.throttle(count)
+
+    def _segment_range(self, index):
+        '''Returns the (first, last) bytes of a segment'''
+        first = index * self._state['segment-size']
+        last = min(first + self._state['segment-size'],
+                   self._state['total-length']) - 1
+        return (first, last)
+
+    def _load_state(self):
+        '''Loads the progress of an interrupted segmented download'''
+        self._state = None
+        self._pending = []
+        if not self.can_resume or not os.path.isfile(self.destination_path):
+            return
+        try:
+            data = xattr.getxattr(
+                self.destination_path, DOWNLOAD_SEGMENTS_XATTR)
+            state = plistlib.loads(data)
+            total = state['total-length']
+            segment_size = state['segment-size']
+            completed = bytearray(state['completed'])
+        except Exception:
+            # no saved progress, or it's unusable
+            return
+        segment_count = (total + segment_size - 1) // segment_size
+        if (len(completed) != segment_count or
+                os.path.getsize(self.destination_path) != total or
+                not (state.get('etag') or state.get('last-modified'))):
+            return
+        state['completed'] = completed
+        self._state = state
+        self._pending = [
+            index for index, done in enumerate(completed) if not done]
+        if not self._pending:
+            # we finished but didn't get to tidy up; revalidate the last
+            # segment
+            completed[-1] = 0
+            self._pending = [segment_count - 1]
+        self.expectedLength = total
+        self.bytesReceived = 0
+        for index, done in enumerate(completed):
+            if done:
+                first, last = self._segment_range(index)
+                self.bytesReceived += last + 1 - first
+        self._set_validator()
+
+    def _new_state(self, headers, total):
+        '''Sets up a new download of total bytes'''
+        self._state = {'total-length': total,
+                       'segment-size': self.segment_size}
+        for key in ('etag', 'last-modified'):
+            if key in headers:
+                self._state[key] = headers[key]
+        segment_count = (total + self.segment_size - 1) // self.segment_size
+        self._state['completed'] = bytearray(segment_count)
+        self._pending = list(range(segment_count))
+        self._set_validator()
+        self.expectedLength = total
+        self.bytesReceived = 0
+        # preallocate the file, so every segment can be written in place
+        with open(self.destination_path, 'wb') as fileobj:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fileobj.fileno(), 0, total)
+                except OSError:
+                    fileobj.truncate(total)
+            else:
+                fileobj.truncate(total)
+        self._save_state()
+
+    def _set_validator(self):
+        '''If-Range makes the server send the whole (new) item instead of a
+        range if it has changed'''
+        if self._state.get('etag') and not self._state['etag'].startswith(
+                'W/'):
+            self._validator = {'If-Range': self._state['etag']}
+        elif self._state.get('last-modified'):
+            self._validator = {'If-Range': self._state['last-modified']}
+        else:
+            self._validator = {}
+
+    def _segment_completed(self, index):
+        '''Records a completed segment'''
+        with self._condition:
+            self._state['completed'][index] = 1
+            self._save_state()
+
+    def _save_state(self):
+        '''Stores our progress with the file'''
+        state = dict(self._state)
+        state['completed'] = bytes(self._state['completed'])
+        try:
+            xattr.setxattr(self.destination_path, DOWNLOAD_SEGMENTS_XATTR,
+                           plistlib.dumps(state, fmt=plistlib.FMT_XML))
+        except (IOError, OSError) as err:
+            self.log('Could not store segment progress to %s: %s'
+                     % (self.destination_path, err))
+
+    def _clear_state(self):
+        '''Forgets any stored progress'''
+        self._state = None
+        try:
+            xattr.removexattr(self.destination_path, DOWNLOAD_SEGMENTS_XATTR)
+        except (KeyError, IOError, OSError):
+            pass
+
+    def _store_download_data(self):
+        '''Stores the headers an only-if-changed request needs, as a
+        PortableConnection or Gurl would'''
+        download_data = {}
+        for key in ('etag', 'last-modified'):
+            if key in self.headers:
+                download_data[key] = self.headers[key]
+        store_headers(self.destination_path, download_data, log=self.log)
+
+    def _finish(self, total):
+        '''All segments are in place'''
+        if os.path.getsize(self.destination_path) != total:
+            raise _SegmentError('downloaded file is the wrong size')
+        self._clear_state()
+        self._store_download_data()
+        with self._condition:
+            self.status = 200
+            self.percentComplete = 100
+            self.done = True
+            self._condition.notify_all()
+
+
+class _ConnectionFailed(OSError):
+    '''A range request failed; carries its ConnectionFailure'''
+
+    def __init__(self, failure, ssl_error):
+        OSError.__init__(self, failure.localizedDescription())
+        self.failure = failure
+        self.ssl_error = ssl_error
+
+
+# registered backend classes, by name
+BACKENDS = {
+    GurlBackend.name: GurlBackend,
+    PortableBackend.name: PortableBackend,
+}
+
+
+def register_backend(backend_class):
+    '''Registers a Backend subclass under its name'''
+    BACKENDS[backend_class.name] = backend_class
+
+
+def default_backend_name():
+    '''Gurl on macOS, the portable backend everywhere else'''
+    if sys.platform == 'darwin':
+        return GurlBackend.name
+    return PortableBackend.name
+
+
+def create_backend(name=None, **kwargs):
+    '''Returns a new backend instance. If name is None the platform default
+    is used; if the default Gurl backend can't be loaded, the portable
+    backend is used instead.'''
+    if not name:
+        name = default_backend_name()
+        try:
+            return BACKENDS[name](**kwargs)
+        except ImportError:
+            return PortableBackend(**kwargs)
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise UnknownBackendError('Unknown fetch backend: %s' % name)
+    return backend_class(**kwargs)
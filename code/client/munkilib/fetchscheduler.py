@@ -0,0 +1,272 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+fetchscheduler.py
+
+Decides when requests made through fetch.get_url may run and how fast they
+may go.
+
+Every request belongs to a priority class. When more requests want to run
+than the concurrency limits allow, the waiting request in the most urgent
+class goes first. Metadata requests (catalogs, manifests and the like) are
+small and everything else depends on them, so they are never held back by
+the concurrency limits, overall or per host. While a more urgent transfer is running, less
+urgent ones pause between chunks to leave it the bandwidth.
+
+Bandwidth ceilings, overall and per host, are enforced with token buckets
+as each chunk is received. Each request's queueing, transfer and throttling
+time is recorded, per class, for the report.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import contextlib
+import itertools
+import threading
+import time
+
+try:
+    # Python 2
+    from urlparse import urlsplit
+except ImportError:
+    # Python 3
+    from urllib.parse import urlsplit
+
+
+PRIORITY_METADATA = 0
+PRIORITY_INSTALLS = 1
+PRIORITY_PRECACHE = 2
+PRIORITY_ICONS = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_METADATA: 'metadata',
+    PRIORITY_INSTALLS: 'installs',
+    PRIORITY_PRECACHE: 'precache',
+    PRIORITY_ICONS: 'icons',
+}
+
+# longest a transfer pauses at a time to make way for a more urgent one;
+# short enough that servers don't give up on the paused connection
+YIELD_TIMEOUT = 5.0
+
+
+class TokenBucket(object):
+    '''Limits a byte stream to rate bytes per second, allowing bursts of up
+    to burst bytes. Safe to share between threads.'''
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        '''Takes count bytes from the bucket. Returns the number of seconds
+        the caller should wait before receiving more.'''
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class Transfer(object):
+    '''A request admitted by a Scheduler'''
+
+    def __init__(self, scheduler, url, priority, sequence):
+        self.scheduler = scheduler
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.priority = priority
+        self.sequence = sequence
+        self.queued_at = scheduler.clock()
+        self.started_at = None
+        self.bytes = 0
+
+    def received(self, count, throttle=True):
+        '''Records count bytes received. If throttle is True, sleeps as
+        needed to keep within the bandwidth limits and to make way for more
+        urgent transfers.'''
+        self.scheduler.received(self, count, throttle=throttle)
+
+
+class Scheduler(object):
+    '''Admits requests by priority within concurrency limits, and throttles
+    them to bandwidth limits: overall, per host, and per priority class
+    (class_bandwidth_limits maps a priority to a limit). Limits of 0 or
+    None mean unlimited; bandwidth limits are in bytes per second.'''
+
+    def __init__(self, max_concurrent=4, max_per_host=2, bandwidth_limit=0,
+                 per_host_bandwidth_limit=0, class_bandwidth_limits=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_concurrent = max_concurrent or 0
+        self.max_per_host = max_per_host or 0
+        self.per_host_bandwidth_limit = per_host_bandwidth_limit or 0
+        self.clock = clock
+        self.sleep = sleep
+        self._bucket = None
+        if bandwidth_limit:
+            self._bucket = TokenBucket(bandwidth_limit, clock=clock)
+        self._host_buckets = {}
+        # limits shared by all the transfers of a priority class
+        self._class_buckets = {}
+        for priority, limit in (class_bandwidth_limits or {}).items():
+            if limit:
+                self._class_buckets[priority] = TokenBucket(limit, clock=clock)
+        self._waiting = []
+        self._active = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {}
+
+    @contextlib.contextmanager
+    def transfer(self, url, priority=PRIORITY_METADATA):
+        '''Context manager that waits until a request for url may run, and
+        yields its Transfer'''
+        transfer = Transfer(self, url, priority, next(self._sequence))
+        self._admit(transfer)
+        try:
+            yield transfer
+        finally:
+            self._release(transfer)
+
+    def _can_start(self, transfer):
+        '''True if transfer is the most urgent waiting request that the
+        limits allow to start now'''
+        limited = [item for item in self._active
+                   if item.priority != PRIORITY_METADATA]
+        for candidate in sorted(self._waiting,
+                                key=lambda item: (item.priority,
+                                                  item.sequence)):
+            if candidate.priority != PRIORITY_METADATA:
+                if (self.max_per_host and
+                        len([item for item in limited
+                             if item.host == candidate.host]
+                           ) >= self.max_per_host):
+                    continue
+                if (self.max_concurrent and
+                        len(limited) >= self.max_concurrent):
+                    continue
+            return candidate is transfer
+        return False
+
+    def host_concurrency(self):
+        '''Returns how many requests other than metadata may run at once
+        to one host, or 0 if there's no limit; more threads than this
+        making such requests would only wait'''
+        limits = [limit for limit in (self.max_concurrent, self.max_per_host)
+                  if limit]
+        if not limits:
+            return 0
+        return min(limits)
+
+    def _admit(self, transfer):
+        '''Waits until transfer may start'''
+        with self._condition:
+            self._waiting.append(transfer)
+            while not self._can_start(transfer):
+                self._condition.wait()
+            self._waiting.remove(transfer)
+            self._active.append(transfer)
+            transfer.started_at = self.clock()
+            stats = self._class_stats(transfer.priority)
+            stats['requests'] += 1
+            stats['queued_seconds'] += transfer.started_at - transfer.queued_at
+            concurrent = len([item for item in self._active
+                              if item.priority == transfer.priority])
+            stats['peak_concurrent'] = max(stats['peak_concurrent'],
+                                           concurrent)
+            # others may be able to start too (a different host, say)
+            self._condition.notify_all()
+
+    def _release(self, transfer):
+        '''A transfer is finished'''
+        with self._condition:
+            self._active.remove(transfer)
+            stats = self._class_stats(transfer.priority)
+            stats['transfer_seconds'] += self.clock() - transfer.started_at
+            self._condition.notify_all()
+
+    def _host_bucket(self, host):
+        '''Returns the TokenBucket for a host, or None if unlimited'''
+        if not self.per_host_bandwidth_limit:
+            return None
+        with self._condition:
+            if host not in self._host_buckets:
+                self._host_buckets[host] = TokenBucket(
+                    self.per_host_bandwidth_limit, clock=self.clock)
+            return self._host_buckets[host]
+
+    def _more_urgent_active(self, transfer):
+        '''True if a more urgent transfer is running'''
+        return any(item.priority < transfer.priority
+                   for item in self._active)
+
+    def received(self, transfer, count, throttle=True):
+        '''Records bytes received by transfer, and throttles it'''
+        with self._condition:
+            transfer.bytes += count
+            self._class_stats(transfer.priority)['bytes'] += count
+        if not throttle:
+            return
+        started = self.clock()
+        with self._condition:
+            if self._more_urgent_active(transfer):
+                self._condition.wait_for(
+                    lambda: not self._more_urgent_active(transfer),
+                    YIELD_TIMEOUT)
+        delay = 0.0
+        for bucket in (self._bucket, self._host_bucket(transfer.host),
+                       self._class_buckets.get(transfer.priority)):
+            if bucket is not None:
+                delay = max(delay, bucket.reserve(count))
+        if delay:
+            self.sleep(delay)
+        waited = self.clock() - started
+        if waited:
+            with self._condition:
+                self._class_stats(transfer.priority)[
+                    'throttled_seconds'] += waited
+
+    def _class_stats(self, priority):
+        '''Returns the stats dict for a priority class; call with the
+        condition held'''
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        if name not in self._stats:
+            self._stats[name] = {'requests': 0,
+                                 'bytes': 0,
+                                 'queued_seconds': 0.0,
+                                 'transfer_seconds': 0.0,
+                                 'throttled_seconds': 0.0,
+                                 'peak_concurrent': 0}
+        return self._stats[name]
+
+    def stats(self):
+        '''Returns a copy of the per-class stats, suitable for the report'''
+        with self._condition:
+            stats = {}
+            for name, class_stats in self._stats.items():
+                stats[name] = dict(class_stats)
+                for key in ('queued_seconds', 'transfer_seconds',
+                            'throttled_seconds'):
+                    stats[name][key] = round(stats[name][key], 3)
+            return stats
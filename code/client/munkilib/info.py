@@ -31,6 +31,7 @@ import select
 import struct
 import subprocess
 import sys
+import threading
 
 # Apple's libs
 import objc
@@ -44,6 +45,8 @@ from Foundation import NSString, NSUTF8StringEncoding
 # pylint: enable=E0611
 
 # our libs
+from . import appinventory
+from . import conditionscripts
 from . import dateutils
 from . import display
 from . import munkilog
@@ -52,6 +55,7 @@ from . import pkgutils
 from . import powermgr
 from . import prefs
 from . import reports
+from . import tracing
 from . import utils
 from . import FoundationPlist
 from .wrappers import unicode_or_str
@@ -505,41 +509,61 @@ def sp_application_data():
     return application_data
 
 
+# sp_application_data may be wanted by several threads reading app info,
+# but system_profiler should run only once
+_SP_APPLICATION_DATA_LOCK = threading.Lock()
+
+
+def _read_app_info(pathname):
+    """Returns a dict containing path, name, version and bundleid for the
+    app at pathname, or None if we can't get its info"""
+    iteminfo = {}
+    iteminfo['name'] = os.path.splitext(os.path.basename(pathname))[0]
+    iteminfo['path'] = pathname
+    plistpath = os.path.join(pathname, 'Contents', 'Info.plist')
+    if os.path.exists(plistpath):
+        try:
+            plist = FoundationPlist.readPlist(plistpath)
+            iteminfo['bundleid'] = plist.get('CFBundleIdentifier', '')
+            if 'CFBundleName' in plist:
+                iteminfo['name'] = plist['CFBundleName']
+            iteminfo['version'] = pkgutils.getBundleVersion(pathname)
+            return iteminfo
+        except BaseException:
+            return None
+    # possibly a non-bundle app. Use system_profiler data
+    # to get app name and version
+    with _SP_APPLICATION_DATA_LOCK:
+        sp_app_data = sp_application_data()
+    if pathname in sp_app_data:
+        item = sp_app_data[pathname]
+        iteminfo['bundleid'] = ''
+        iteminfo['version'] = item.get('version') or '0.0.0.0.0'
+        if item.get('_name'):
+            iteminfo['name'] = item['_name']
+        return iteminfo
+    return None
+
+
 @utils.Memoize
 def app_data():
     """Gets info on currently installed apps.
-    Returns a list of dicts containing path, name, version and bundleid"""
-    application_data = []
+    Returns a list of dicts containing path, name, version and bundleid.
+    Info saved by earlier runs is used for apps whose Info.plist hasn't
+    changed since."""
     display.display_debug1(
         'Getting info on currently installed applications...')
     applist = set(launchservices_installed_apps())
     applist.update(spotlight_installed_apps())
-    for pathname in applist:
-        iteminfo = {}
-        iteminfo['name'] = os.path.splitext(os.path.basename(pathname))[0]
-        iteminfo['path'] = pathname
-        plistpath = os.path.join(pathname, 'Contents', 'Info.plist')
-        if os.path.exists(plistpath):
-            try:
-                plist = FoundationPlist.readPlist(plistpath)
-                iteminfo['bundleid'] = plist.get('CFBundleIdentifier', '')
-                if 'CFBundleName' in plist:
-                    iteminfo['name'] = plist['CFBundleName']
-                iteminfo['version'] = pkgutils.getBundleVersion(pathname)
-                application_data.append(iteminfo)
-            except BaseException:
-                pass
-        else:
-            # possibly a non-bundle app. Use system_profiler data
-            # to get app name and version
-            sp_app_data = sp_application_data()
-            if pathname in sp_app_data:
-                item = sp_app_data[pathname]
-                iteminfo['bundleid'] = ''
-                iteminfo['version'] = item.get('version') or '0.0.0.0.0'
-                if item.get('_name'):
-                    iteminfo['name'] = item['_name']
-                application_data.append(iteminfo)
+    inventory = appinventory.AppInventory(
+        os.path.join(prefs.pref('ManagedInstallDir'),
+                     appinventory.INVENTORY_FILE_NAME),
+        _read_app_info)
+    application_data = inventory.apps(applist)
+    inventory.save()
+    display.display_debug1(
+        'Read info for %s new or changed of %s applications',
+        inventory.misses, len(applist))
     return application_data
 
 
@@ -552,6 +576,18 @@ def filtered_app_data():
                     not item['path'].startswith('/Users/Shared/'))]
 
 
+@utils.Memoize
+def app_index():
+    '''Returns an appinventory.AppIndex of app_data'''
+    return appinventory.AppIndex(app_data())
+
+
+@utils.Memoize
+def filtered_app_index():
+    '''Returns an appinventory.AppIndex of filtered_app_data'''
+    return appinventory.AppIndex(filtered_app_data())
+
+
 @utils.Memoize
 def get_version():
     """Returns version of munkitools, reading version.plist"""
@@ -799,13 +835,6 @@ def getMachineFacts():
     return machine
 
 
-def valid_plist(path):
-    """Uses plutil to determine if path contains a valid plist.
-    Returns True or False."""
-    retcode = subprocess.call(['/usr/bin/plutil', '-lint', '-s', path])
-    return retcode == 0
-
-
 @utils.Memoize
 def get_conditions():
     """Fetches key/value pairs from condition scripts
@@ -814,14 +843,16 @@ def get_conditions():
     # admin created scripts
     scriptdir = os.path.realpath(os.path.dirname(sys.argv[0]))
     conditionalscriptdir = os.path.join(scriptdir, "conditions")
+    managedinstallbase = prefs.pref('ManagedInstallDir')
     # define path to ConditionalItems.plist
     conditionalitemspath = os.path.join(
-        prefs.pref('ManagedInstallDir'), 'ConditionalItems.plist')
+        managedinstallbase, 'ConditionalItems.plist')
     try:
         # delete ConditionalItems.plist so that we're starting fresh
         os.unlink(conditionalitemspath)
     except (OSError, IOError):
         pass
+    conditionalscripts = []
     if os.path.exists(conditionalscriptdir):
         for conditionalscript in sorted(osutils.listdir(conditionalscriptdir)):
             if conditionalscript.startswith('.'):
@@ -832,26 +863,37 @@ def get_conditions():
             if os.path.isdir(conditionalscriptpath):
                 # skip directories in conditions directory
                 continue
-            try:
-                # attempt to execute condition script
-                dummy_result, dummy_stdout, dummy_stderr = (
-                    utils.runExternalScript(conditionalscriptpath))
-            except utils.ScriptNotFoundError:
-                pass  # script is not required, so pass
-            except utils.RunExternalScriptError as err:
-                print(unicode_or_str(err), file=sys.stderr)
+            conditionalscripts.append(conditionalscriptpath)
     else:
         # /usr/local/munki/conditions does not exist
         pass
-    if (os.path.exists(conditionalitemspath) and
-            valid_plist(conditionalitemspath)):
-        # import conditions into conditions dict
-        conditions = FoundationPlist.readPlist(conditionalitemspath)
-        os.unlink(conditionalitemspath)
-    else:
-        # either ConditionalItems.plist does not exist
-        # or does not pass validation
-        conditions = {}
+    facts = {}
+    timings = []
+    if conditionalscripts:
+        runner = conditionscripts.ConditionScriptRunner(
+            os.path.join(managedinstallbase,
+                         conditionscripts.CACHE_FILE_NAME),
+            timeout=prefs.pref('ConditionScriptTimeout'))
+        facts, timings = runner.run(conditionalscripts)
+        for timing in timings:
+            if 'error' in timing:
+                print(timing['error'], file=sys.stderr)
+    reports.report['ConditionScripts'] = timings
+    conditions = {}
+    if os.path.exists(conditionalitemspath):
+        try:
+            # import conditions into conditions dict
+            conditions = dict(FoundationPlist.readPlist(conditionalitemspath))
+        except (FoundationPlist.NSPropertyListSerializationException,
+                TypeError, ValueError):
+            # not a valid plist, or not a dictionary
+            pass
+        try:
+            os.unlink(conditionalitemspath)
+        except (OSError, IOError):
+            pass
+    # facts from scripts with their own output win, in script name order
+    conditions.update(facts)
     return conditions
 
 
@@ -953,6 +995,7 @@ def predicate_info_object():
     return info_object
 
 
+@tracing.traced('predicate_evaluation', predicate=0)
 def predicate_evaluates_as_true(predicate_string, additional_info=None):
     '''Evaluates predicate against our info object'''
     display.display_debug1('Evaluating predicate: %s', predicate_string)
@@ -43,6 +43,7 @@ from . import rmpkgs
 
 from .. import adobeutils
 from .. import constants
+from .. import contentstore
 from .. import display
 from .. import dmgutils
 from .. import munkistatus
@@ -55,6 +56,7 @@ from .. import processes
 from .. import profiles
 from .. import reports
 from .. import scriptutils
+from .. import tracing
 from .. import FoundationPlist
 
 from ..updatecheck import catalogs
@@ -67,6 +69,7 @@ reports.report['InstallResults'] = []
 reports.report['RemovalResults'] = []
 
 
+@tracing.traced('remove_copied_items')
 def remove_copied_items(itemlist):
     '''Removes filesystem items based on info in itemlist.
     These items were typically installed via DMG'''
@@ -162,6 +165,7 @@ def requires_restart(item):
             item.get("RestartAction") == "RecommendRestart")
 
 
+@tracing.traced('package_install', item=0)
 def handle_apple_package_install(item, itempath):
     '''Process an Apple package for install. Returns retcode, needs_restart'''
     needs_restart = False
@@ -212,6 +216,7 @@ def handle_apple_package_install(item, itempath):
     return (retcode, needs_restart)
 
 
+@tracing.traced('installs')
 def install_with_info(
         dirpath, installlist, only_unattended=False, applesus=False):
     """
@@ -437,6 +442,14 @@ def install_with_info(
             # now remove the item from the install cache
             # (if it's still there)
             itempath = os.path.join(dirpath, current_installer_item)
+            # but keep its content as the base for a delta update to the
+            # next version, if we use deltas and have a cache size limit
+            # to keep the bases within
+            if ((item.get('installer_item_deltas') or
+                 prefs.pref('KeepDeltaBases')) and
+                    prefs.pref('CacheSizeLimit')):
+                contentstore.ContentStore(dirpath).keep_base(
+                    item['name'], itempath)
             if os.path.exists(itempath):
                 if os.path.isdir(itempath):
                     retcode = subprocess.call(["/bin/rm", "-rf", itempath])
@@ -448,6 +461,9 @@ def install_with_info(
                         if os.path.exists(shadowfile):
                             retcode = subprocess.call(["/bin/rm", shadowfile])
 
+    # free the space used by the items we've removed from the cache
+    contentstore.ContentStore(dirpath).collect_garbage()
+
     return (restartflag, skipped_installs)
 
 
@@ -479,11 +495,14 @@ def skipped_items_that_require_this(item, skipped_items):
     return matched_skipped_items
 
 
+@tracing.traced('removals')
 def process_removals(removallist, only_unattended=False):
     '''processes removals from the removal list'''
     restart_flag = False
     index = 0
     skipped_removals = []
+    store = contentstore.ContentStore(
+        os.path.join(prefs.pref('ManagedInstallDir'), 'Cache'))
     for item in removallist:
         if only_unattended:
             if not item.get('unattended_uninstall'):
@@ -640,6 +659,8 @@ def process_removals(removallist, only_unattended=False):
             success_msg = "Removal of %s: SUCCESSFUL" % display_name
             munkilog.log(success_msg, "Install.log")
             manifestutils.remove_from_selfserve_uninstalls(item['name'])
+            # no delta update will be wanted for it now
+            store.drop_base(item['name'])
         else:
             failure_msg = "Removal of %s: " % display_name + \
                           " FAILED with return code: %s" % retcode
@@ -656,6 +677,9 @@ def process_removals(removallist, only_unattended=False):
         }
         reports.report['RemovalResults'].append(removal_result)
 
+    # free the space used by the delta bases we've dropped
+    store.collect_garbage()
+
     return (restart_flag, skipped_removals)
 
 
@@ -675,6 +699,7 @@ def run(only_unattended=False):
     managedinstallbase = prefs.pref('ManagedInstallDir')
     installdir = os.path.join(managedinstallbase, 'Cache')
 
+    reports.start_timings()
     removals_need_restart = installs_need_restart = False
 
     if only_unattended:
@@ -785,6 +810,7 @@ def run(only_unattended=False):
     else:
         munkilog.log("###    End managed installer session    ###")
 
+    reports.record_timings('install')
     reports.savereport()
     if removals_need_restart or installs_need_restart:
         return constants.POSTACTION_RESTART
@@ -33,6 +33,7 @@ from .. import display
 from .. import dmgutils
 from .. import osutils
 from .. import pkgutils
+from .. import tracing
 
 
 def set_permissions(item, full_destpath):
@@ -278,6 +279,7 @@ def copy_items_from_mountpoint(mountpoint, itemlist):
     return 0
 
 
+@tracing.traced('copy_from_dmg', dmg=0)
 def copy_app_from_dmg(dmgpath):
     '''copies application from DMG to /Applications
     This type of installer_type is deprecated and should be
@@ -320,6 +322,7 @@ def copy_app_from_dmg(dmgpath):
         return -1
 
 
+@tracing.traced('copy_from_dmg', dmg=0)
 def copy_from_dmg(dmgpath, itemlist):
     '''copies items from DMG to local disk'''
     if not itemlist:
@@ -35,6 +35,7 @@ from .. import osutils
 from .. import pkgutils
 from .. import prefs
 from .. import processes
+from .. import tracing
 from .. import FoundationPlist
 
 
@@ -784,6 +785,7 @@ def remove_filesystem_items(removalpaths, forcedeletebundles):
         display.display_info(removalerrors)
 
 
+@tracing.traced('remove_packages')
 def removepackages(pkgnames, forcedeletebundles=False, listfiles=False,
                    rebuildpkgdb=False, noremovereceipts=False,
                    noupdateapplepkgdb=False):
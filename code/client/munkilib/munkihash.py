@@ -25,6 +25,42 @@ from __future__ import absolute_import, print_function
 
 import hashlib
 import os
+import sqlite3
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+
+# size of the buffer used when reading files to hash
+HASH_BUFFER_SIZE = 2**20
+
+HASH_CACHE_TABLE_CREATE = (
+    'CREATE TABLE IF NOT EXISTS hashes ('
+    'path TEXT PRIMARY KEY,'
+    'size INTEGER,'
+    'mtime INTEGER,'
+    'inode INTEGER,'
+    'sha256 TEXT'
+    ')')
+
+HASH_CACHE_SELECT = (
+    'SELECT size, mtime, inode, sha256 FROM hashes WHERE path=?')
+
+HASH_CACHE_INSERT = (
+    'INSERT OR REPLACE INTO hashes VALUES ('
+    '?, '  # path
+    '?, '  # size
+    '?, '  # mtime
+    '?, '  # inode
+    '? '   # sha256
+    ')'
+    )
+
+# default number of threads used to hash cache misses
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+
 
 def gethash(filename, hash_function):
     """
@@ -41,13 +77,14 @@ def gethash(filename, hash_function):
     if not os.path.isfile(filename):
         return 'NOT A FILE'
     try:
-        fileref = open(filename, 'rb')
-        while True:
-            chunk = fileref.read(2**16)
-            if not chunk:
-                break
-            hash_function.update(chunk)
-        fileref.close()
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(filename, 'rb', buffering=0) as fileref:
+            while True:
+                count = fileref.readinto(buffer)
+                if not count:
+                    break
+                hash_function.update(view[:count])
         return hash_function.hexdigest()
     except (OSError, IOError):
         return 'HASH_ERROR'
@@ -69,5 +106,238 @@ def getsha256hash(filename):
     return gethash(filename, hash_function)
 
 
+def _stat_key(filename):
+    """Returns a (size, mtime, inode) tuple for filename, or None if it
+    is not a regular file"""
+    try:
+        stat_info = os.stat(filename)
+    except OSError:
+        return None
+    if not os.path.isfile(filename):
+        return None
+    return (stat_info.st_size, stat_info.st_mtime_ns, stat_info.st_ino)
+
+
+def _resource_key(size, mtime):
+    """Returns a (size, mtime, inode) tuple for a repo resource that has no
+    local path. There is no inode, so -1 stands in for one."""
+    return (int(size), int(round(mtime * 1000000000)), -1)
+
+
+class HashCache(object):
+    """A persistent cache of SHA-256 hashes of files, keyed on each file's
+    path, size, modification time and inode. Any change to a file gives it
+    a new key, so a stale hash is never returned. If the cache database can't
+    be opened or written to, hashes are simply calculated every time."""
+
+    def __init__(self, database):
+        """Open (and create if needed) the cache database.
+        Args:
+          database: str, path of the SQLite database
+        """
+        self.database = database
+        self.hits = 0
+        self.misses = 0
+        try:
+            dir_path = os.path.dirname(self.database)
+            if dir_path and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, 0o755)
+            self.conn = sqlite3.connect(self.database)
+            self.conn.execute(HASH_CACHE_TABLE_CREATE)
+            self.conn.commit()
+        except (OSError, sqlite3.Error):
+            self.conn = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close connection to DB"""
+        if getattr(self, 'conn', None):
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+
+    def _lookup(self, path, key):
+        """Returns the cached hash for path if it matches key, else None"""
+        if not self.conn or key is None:
+            return None
+        try:
+            row = self.conn.execute(HASH_CACHE_SELECT, (path,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row and tuple(row[:3]) == key:
+            return row[3]
+        return None
+
+    def _store(self, records):
+        """Stores a list of (path, key, hash) records"""
+        if not self.conn or not records:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    HASH_CACHE_INSERT,
+                    [(path,) + key + (itemhash,)
+                     for (path, key, itemhash) in records])
+        except sqlite3.Error:
+            pass
+
+    def known_hash(self, filename):
+        """Returns the cached SHA-256 hash of filename if the file hasn't
+        changed since it was hashed, or None. Never reads the file."""
+        path = os.path.abspath(filename)
+        return self._lookup(path, _stat_key(path))
+
+    def remember(self, filename, hexdigest):
+        """Stores a SHA-256 hash for filename that was calculated elsewhere
+        (for example while the file was being copied)"""
+        path = os.path.abspath(filename)
+        key = _stat_key(path)
+        if key is not None:
+            self._store([(path, key, hexdigest)])
+
+    def resource_hash(self, identifier, size, mtime):
+        """Returns the cached SHA-256 hash of a resource in a repo that has
+        no local path, keyed on an identifier (such as the repo URL and
+        resource path) and the size and mtime the repo lists for it, or None
+        if it must be hashed."""
+        cached = self._lookup(identifier, _resource_key(size, mtime))
+        if cached:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return cached
+
+    def remember_resource(self, identifier, size, mtime, hexdigest):
+        """Stores the SHA-256 hash of a resource in a repo that has no local
+        path, for resource_hash"""
+        self._store([(identifier, _resource_key(size, mtime), hexdigest)])
+
+    def getsha256hash(self, filename):
+        """Returns the SHA-256 hash value of a file as a hex string, using
+        a cached value if the file has not changed since it was last hashed.
+        """
+        return self.getsha256hashes([filename], max_workers=1)[filename]
+
+    def getsha256hashes(self, filenames, max_workers=None, progress_fn=None,
+                        executor=None):
+        """Returns a dictionary of filename: SHA-256 hash for each filename.
+        Files not already in the cache are hashed concurrently.
+        Args:
+          filenames: list of file paths
+          max_workers: number of files to hash at once, default HASH_WORKERS
+          progress_fn: optional function called with (filename, hash) as
+                       each cache miss is hashed
+          executor: optional concurrent.futures.Executor to hash misses
+                    with (for example a ProcessPoolExecutor); if not given,
+                    a thread pool of max_workers threads is used
+        """
+        results = {}
+        misses = []
+        for filename in filenames:
+            if filename in results:
+                continue
+            path = os.path.abspath(filename)
+            key = _stat_key(path)
+            cached = self._lookup(path, key)
+            if cached:
+                self.hits += 1
+                results[filename] = cached
+            elif key is None:
+                results[filename] = 'NOT A FILE'
+            else:
+                self.misses += 1
+                results[filename] = None
+                misses.append((filename, path, key))
+
+        max_workers = max_workers or HASH_WORKERS
+        our_executor = None
+        paths = [path for (_, path, _) in misses]
+        if executor and paths:
+            hashed = executor.map(_hash_for_cache, paths)
+        elif futures and max_workers > 1 and len(paths) > 1:
+            our_executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+            hashed = our_executor.map(_hash_for_cache, paths)
+        else:
+            hashed = (_hash_for_cache(path) for path in paths)
+
+        records = []
+        try:
+            for (filename, path, key), (itemhash, new_key) in zip(
+                    misses, hashed):
+                results[filename] = itemhash
+                if progress_fn:
+                    progress_fn(filename, itemhash)
+                # don't remember a hash for a file that changed while we
+                # read it
+                if new_key == key and itemhash not in (
+                        'NOT A FILE', 'HASH_ERROR'):
+                    records.append((path, key, itemhash))
+        finally:
+            if our_executor:
+                our_executor.shutdown()
+            self._store(records)
+        return results
+
+
+def _hash_for_cache(path):
+    """Hashes path; returns a tuple of the hash and the (size, mtime, inode)
+    of the file once hashing is done. Module-level so it can be sent to a
+    process pool."""
+    return (getsha256hash(path), _stat_key(path))
+
+
+# HashCaches shared within this process, by database path
+_SHARED_HASH_CACHES = {}
+
+
+def shared_hash_cache(database):
+    """Returns the HashCache shared within this process for database"""
+    cache = _SHARED_HASH_CACHES.get(database)
+    if cache is None:
+        cache = _SHARED_HASH_CACHES[database] = HashCache(database)
+    return cache
+
+
+def cached_sha256hash(filename, database):
+    """
+    Returns the SHA-256 hash value of a file as a hex string, using the
+    shared persistent hash cache in database. Intended for the admin tools,
+    which hash the same large installer items over and over.
+    """
+    return shared_hash_cache(database).getsha256hash(filename)
+
+
+def known_sha256hash(filename, database):
+    """
+    Returns the SHA-256 hash of a file from the shared persistent hash cache
+    in database if it is there and the file hasn't changed since, or None.
+    The file isn't read.
+    """
+    return shared_hash_cache(database).known_hash(filename)
+
+
+def remember_sha256hash(filename, hexdigest, database):
+    """
+    Stores a SHA-256 hash calculated elsewhere in the shared persistent hash
+    cache in database, so the file doesn't need to be read again to hash it.
+    """
+    shared_hash_cache(database).remember(filename, hexdigest)
+
+
+def cached_sha256hashes(filenames, database, max_workers=None,
+                        progress_fn=None, executor=None):
+    """
+    Returns a dictionary of SHA-256 hashes for filenames, using the shared
+    persistent hash cache in database and hashing any misses in parallel.
+    """
+    return shared_hash_cache(database).getsha256hashes(
+        filenames, max_workers=max_workers, progress_fn=progress_fn,
+        executor=executor)
+
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
@@ -7,12 +7,22 @@
 
 from __future__ import absolute_import, print_function
 
+import ctypes
+import ctypes.util
 import errno
 import getpass
+import hashlib
+import json
 import os
-import shutil
 import subprocess
 import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 try:
     # Python 2
@@ -29,6 +39,8 @@ except ImportError:
     from urllib.parse import urlparse
 
 from munkilib.munkirepo import Repo, RepoError
+from munkilib.admin.common import CACHE_DIR
+from munkilib.cliutils import pref
 from munkilib.wrappers import get_input
 
 
@@ -154,6 +166,211 @@ def mount_share_with_credentials(share_url, username, password):
     return str(mountpoints[0])
 
 
+# Linux ioctl to make a copy-on-write clone of a file (reflink)
+FICLONE = 0x40049409
+# copyfile(3) flag to copy just the ACL
+COPYFILE_ACL = 1 << 0
+# extended attribute holding a file's ACL on Linux
+POSIX_ACL_XATTR = 'system.posix_acl_access'
+# size of the buffer used when copying through user space
+COPY_BUFFER_SIZE = 2**20
+
+
+def _new_file_mode(destination):
+    '''Returns the permissions a file written at destination would get:
+    those of the existing file, or the default for new files'''
+    try:
+        return os.stat(destination).st_mode & 0o7777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _resolve_destination(destination):
+    '''Returns the file a write to destination should replace: if
+    destination is a symlink, the file it points to, so the link is kept'''
+    if os.path.islink(destination):
+        return os.path.realpath(destination)
+    return destination
+
+
+def _copy_acl(source, destination):
+    '''Copies the ACL of source, if any, to destination. Failures are
+    ignored.'''
+    if sys.platform == 'darwin':
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.copyfile(source.encode('UTF-8'), destination.encode('UTF-8'),
+                          None, COPYFILE_ACL)
+        except (OSError, AttributeError):
+            pass
+    elif hasattr(os, 'getxattr'):
+        try:
+            os.setxattr(destination, POSIX_ACL_XATTR,
+                        os.getxattr(source, POSIX_ACL_XATTR))
+        except OSError:
+            pass
+
+
+def _set_attributes(tmp_path, destination, mode):
+    '''Gives the new file at tmp_path the permissions in mode and, if
+    destination exists, its owner, group and ACL, so that replacing
+    destination changes only its content. Only root can give a file to
+    another user, so otherwise the new file is owned by us (and keeps
+    destination's group if we are a member), as a newly created file would
+    be.'''
+    try:
+        stat_info = os.stat(destination)
+    except OSError:
+        stat_info = None
+    if stat_info is not None:
+        try:
+            os.chown(tmp_path, stat_info.st_uid, stat_info.st_gid)
+        except OSError:
+            try:
+                os.chown(tmp_path, -1, stat_info.st_gid)
+            except OSError:
+                pass
+    # after chown, which can clear setuid and setgid bits
+    os.chmod(tmp_path, mode)
+    if stat_info is not None:
+        _copy_acl(destination, tmp_path)
+
+
+def _temp_path_for(destination):
+    '''Returns an unused temporary pathname next to destination. It starts
+    with a period, so repo listings skip it if it is left behind.'''
+    dir_path, name = os.path.split(destination)
+    return os.path.join(
+        dir_path, '.%s.%s.tmp' % (name, os.urandom(6).hex()))
+
+
+def _clonefile(source, destination):
+    '''Makes a copy-on-write clone of source at destination (which must not
+    exist) using macOS's clonefile(2). Returns True on success.'''
+    if sys.platform != 'darwin':
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        result = libc.clonefile(
+            source.encode('UTF-8'), destination.encode('UTF-8'), 0)
+    except (OSError, AttributeError):
+        return False
+    return result == 0
+
+
+def _kernel_copy(src_fd, dst_fd):
+    '''Copies a whole file between two file descriptors without passing the
+    data through user space: a reflink clone where the filesystem supports
+    it, otherwise copy_file_range or sendfile. Returns False if none of
+    these are available, so the caller can fall back to a buffered copy.'''
+    if not sys.platform.startswith('linux'):
+        # macOS clones by path (see _clonefile) and its sendfile only
+        # writes to sockets
+        return False
+    if fcntl:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return True
+        except OSError:
+            pass
+    size = os.fstat(src_fd).st_size
+    copy_fns = []
+    if hasattr(os, 'copy_file_range'):
+        copy_fns.append(lambda offset: os.copy_file_range(
+            src_fd, dst_fd, size - offset, offset, offset))
+    copy_fns.append(lambda offset: os.sendfile(
+        dst_fd, src_fd, offset, size - offset))
+    for copy_fn in copy_fns:
+        offset = 0
+        try:
+            while offset < size:
+                copied = copy_fn(offset)
+                if not copied:
+                    raise OSError(errno.EIO, 'Unexpected end of file')
+                offset += copied
+            return True
+        except OSError:
+            if offset:
+                # partway through; don't paper over a real I/O error
+                raise
+    return False
+
+
+def _copy_data(source_ref, dest_ref, hash_function=None):
+    '''Copies all data from the source file object to the dest file object.
+    If hash_function is given, the data is read once through a large buffer
+    and hashed as it is copied; otherwise kernel fast paths are tried
+    first.'''
+    if hash_function is None and _kernel_copy(
+            source_ref.fileno(), dest_ref.fileno()):
+        return
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = source_ref.readinto(buffer)
+        if not count:
+            break
+        if hash_function is not None:
+            hash_function.update(view[:count])
+        dest_ref.write(view[:count])
+
+
+def atomic_copy(source, destination, hash_function=None):
+    '''Copies source to destination so that destination is only ever
+    complete or absent: data is written to a temporary file next to
+    destination, flushed to disk, and then renamed over destination. An
+    existing destination keeps its permissions, owner, group and ACL (see
+    _set_attributes); if it is a symlink, the file it points to is
+    replaced instead. If hash_function (e.g. hashlib.sha256()) is given,
+    it is updated with the data as it is copied.'''
+    destination = _resolve_destination(destination)
+    mode = _new_file_mode(destination)
+    tmp_path = _temp_path_for(destination)
+    try:
+        if hash_function is not None or not _clonefile(source, tmp_path):
+            with open(source, 'rb', buffering=0) as source_ref:
+                with open(tmp_path, 'xb', buffering=0) as dest_ref:
+                    _copy_data(source_ref, dest_ref, hash_function)
+                    os.fsync(dest_ref.fileno())
+        _set_attributes(tmp_path, destination, mode)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(destination, content):
+    '''Writes content to destination via a temporary file and a rename, so
+    a crash never leaves a truncated file at destination. Attributes and
+    symlinks are kept as atomic_copy keeps them.'''
+    destination = _resolve_destination(destination)
+    mode = _new_file_mode(destination)
+    tmp_path = _temp_path_for(destination)
+    try:
+        with open(tmp_path, 'xb') as fileref:
+            fileref.write(content)
+            fileref.flush()
+            os.fsync(fileref.fileno())
+        _set_attributes(tmp_path, destination, mode)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# directories modified this recently (in seconds) before a listing snapshot
+# was taken are always re-read, to allow for coarse filesystem timestamps
+SNAPSHOT_MTIME_SLOP = 2
+
+
 def mount_share_url(share_url):
     '''Mount a share url under /Volumes, prompting for password if needed
     Raises ShareMountException if there's an error'''
@@ -228,29 +445,145 @@ class FileRepo(Repo):
         if not os.path.exists(self.root):
             raise RepoError(u'%s does not exist' % self.root)
 
+    def _snapshot_path(self, kind):
+        '''Returns the path of the listing snapshot for kind'''
+        repo_id = hashlib.sha256(
+            os.path.join(self.root, kind).encode('UTF-8')).hexdigest()[:16]
+        return os.path.join(CACHE_DIR, 'listing-%s-%s.json' % (kind, repo_id))
+
+    def _read_snapshot(self, kind):
+        '''Returns the saved listing snapshot for kind, or an empty one'''
+        try:
+            with open(self._snapshot_path(kind), 'r') as fileref:
+                snapshot = json.load(fileref)
+            if isinstance(snapshot.get('dirs'), dict):
+                return snapshot
+        except (OSError, IOError, ValueError, AttributeError):
+            pass
+        return {'scanned_at': 0, 'dirs': {}}
+
+    def _write_snapshot(self, kind, snapshot):
+        '''Saves a listing snapshot for kind; failures are ignored'''
+        snapshot_path = self._snapshot_path(kind)
+        try:
+            if not os.path.isdir(CACHE_DIR):
+                os.makedirs(CACHE_DIR, 0o755)
+            fileref, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+            with os.fdopen(fileref, 'w') as fileobj:
+                json.dump(snapshot, fileobj)
+            os.replace(tmp_path, snapshot_path)
+        except (OSError, IOError):
+            pass
+
+    def _scan(self, kind, old_snapshot=None):
+        '''Walks the kind directory with os.scandir, following symlinks and
+        skipping names that start with a period. Returns a snapshot dict,
+        whose 'dirs' maps each relative directory path to its mtime, subdirs
+        and files (with size and mtime). If old_snapshot is given, directories
+        whose mtime hasn't changed since it was taken are not re-read.'''
+        search_dir = os.path.join(self.root, kind)
+        old_dirs = {}
+        trust_before = 0
+        if old_snapshot:
+            old_dirs = old_snapshot['dirs']
+            trust_before = (
+                old_snapshot.get('scanned_at', 0) - SNAPSHOT_MTIME_SLOP)
+        new_snapshot = {'scanned_at': time.time(), 'dirs': {}}
+        # directories being scanned, from search_dir down to the current one
+        ancestors = set()
+
+        def scan_dir(rel_dir):
+            '''Adds rel_dir and its subdirectories to the new snapshot'''
+            abs_dir = os.path.join(search_dir, rel_dir)
+            try:
+                stat_info = os.stat(abs_dir)
+            except OSError:
+                return
+            dir_id = (stat_info.st_dev, stat_info.st_ino)
+            if dir_id in ancestors:
+                # symlink loop; a directory reached by more than one path
+                # is otherwise listed under each, as os.walk would
+                return
+            old = old_dirs.get(rel_dir)
+            if (old and old['mtime'] == stat_info.st_mtime_ns and
+                    stat_info.st_mtime < trust_before):
+                entry_info = {'mtime': old['mtime'], 'dirs': old['dirs'],
+                              'files': old['files']}
+            else:
+                entry_info = {'mtime': stat_info.st_mtime_ns,
+                              'dirs': [], 'files': []}
+                try:
+                    entries = list(os.scandir(abs_dir))
+                except OSError:
+                    entries = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        # don't include files or directories that start
+                        # with a period
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        entry_info['dirs'].append(entry.name)
+                        continue
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        # broken symlink, most likely
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    entry_info['files'].append(
+                        [entry.name, entry_stat.st_size,
+                         entry_stat.st_mtime])
+            new_snapshot['dirs'][rel_dir] = entry_info
+            ancestors.add(dir_id)
+            for name in entry_info['dirs']:
+                scan_dir(os.path.join(rel_dir, name))
+            ancestors.discard(dir_id)
+
+        scan_dir('')
+        return new_snapshot
+
+    def _listing(self, kind):
+        '''Returns a list of (relative path, size, mtime) tuples for kind,
+        using and updating a persisted listing snapshot if the
+        RepoListingSnapshots preference is set'''
+        kind = unicodeize(kind)
+        use_snapshot = bool(pref('RepoListingSnapshots'))
+        old_snapshot = self._read_snapshot(kind) if use_snapshot else None
+        snapshot = self._scan(kind, old_snapshot=old_snapshot)
+        if use_snapshot and snapshot['dirs'] != old_snapshot['dirs']:
+            self._write_snapshot(kind, snapshot)
+
+        listing = []
+
+        def add_dir(rel_dir):
+            '''Adds files in rel_dir, then in its subdirs, in os.walk order'''
+            entry_info = snapshot['dirs'].get(rel_dir)
+            if entry_info is None:
+                return
+            for (name, size, mtime) in entry_info['files']:
+                listing.append((os.path.join(rel_dir, name), size, mtime))
+            for name in entry_info['dirs']:
+                add_dir(os.path.join(rel_dir, name))
+
+        add_dir('')
+        return listing
+
     def itemlist(self, kind):
         '''Returns a list of identifiers for each item of kind.
         Kind might be 'catalogs', 'manifests', 'pkgsinfo', 'pkgs', or 'icons'.
         For a file-backed repo this would be a list of pathnames.'''
-        kind = unicodeize(kind)
-        search_dir = os.path.join(self.root, kind)
-        file_list = []
-        try:
-            for (dirpath, dirnames, filenames) in os.walk(search_dir,
-                                                          followlinks=True):
-                # don't recurse into directories that start with a period.
-                dirnames[:] = [name
-                               for name in dirnames if not name.startswith('.')]
-                for name in filenames:
-                    if name.startswith('.'):
-                        # skip files that start with a period as well
-                        continue
-                    abs_path = os.path.join(dirpath, name)
-                    rel_path = abs_path[len(search_dir):].lstrip("/")
-                    file_list.append(rel_path)
-            return file_list
-        except (OSError, IOError) as err:
-            raise RepoError(err) from err
+        return [item[0] for item in self._listing(kind)]
+
+    def itemlist_with_info(self, kind):
+        '''Like itemlist, but returns a dictionary of identifier: (size,
+        mtime) for each item of kind. When listing snapshots are in use, the
+        size and mtime of a file rewritten in place (without being renamed
+        or replaced) may be out of date.'''
+        return dict((item[0], (item[1], item[2]))
+                    for item in self._listing(kind))
 
     def get(self, resource_identifier):
         '''Returns the content of item with given resource_identifier.
@@ -280,7 +613,7 @@ class FileRepo(Repo):
         repo_filepath = os.path.join(self.root, resource_identifier)
         local_file_path = unicodeize(local_file_path)
         try:
-            shutil.copyfile(repo_filepath, local_file_path)
+            atomic_copy(repo_filepath, local_file_path)
         except (OSError, IOError) as err:
             raise RepoError(err) from err
 
@@ -295,9 +628,7 @@ class FileRepo(Repo):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path, 0o755)
         try:
-            fileref = open(repo_filepath, 'wb')
-            fileref.write(content)
-            fileref.close()
+            atomic_write(repo_filepath, content)
         except (OSError, IOError) as err:
             raise RepoError(err) from err
 
@@ -306,19 +637,38 @@ class FileRepo(Repo):
         resource_identifier. For a file-backed repo, a resource_identifier
         of 'pkgsinfo/apps/Firefox-52.0.plist' would result in the content
         being saved to <repo_root>/pkgsinfo/apps/Firefox-52.0.plist.'''
+        self._put_from_local_file(resource_identifier, local_file_path)
+
+    def put_from_local_file_with_hash(self, resource_identifier,
+                                      local_file_path):
+        '''Like put_from_local_file, but also returns the SHA-256 hash of
+        the content, calculated while it is copied'''
+        hash_function = hashlib.sha256()
+        if self._put_from_local_file(resource_identifier, local_file_path,
+                                     hash_function=hash_function):
+            return hash_function.hexdigest()
+        return None
+
+    def _put_from_local_file(self, resource_identifier, local_file_path,
+                             hash_function=None):
+        '''Does the work for put_from_local_file. The new file appears in
+        the repo only once it is complete. Returns True if anything was
+        copied.'''
         resource_identifier = unicodeize(resource_identifier)
         repo_filepath = os.path.join(self.root, resource_identifier)
         local_file_path = unicodeize(local_file_path)
         if os.path.normpath(local_file_path) == os.path.normpath(repo_filepath):
             # nothing to do!
-            return
+            return False
         dir_path = os.path.dirname(repo_filepath)
         if not os.path.exists(dir_path):
             os.makedirs(dir_path, 0o755)
         try:
-            shutil.copyfile(local_file_path, repo_filepath)
+            atomic_copy(local_file_path, repo_filepath,
+                        hash_function=hash_function)
         except (OSError, IOError) as err:
             raise RepoError(err) from err
+        return True
 
     def local_path(self, resource_identifier):
         '''Returns the local file path for resource_identifier'''
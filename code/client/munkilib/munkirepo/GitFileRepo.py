@@ -2,6 +2,7 @@
 '''Subclasses FileRepo to do git commits of file changes'''
 from __future__ import absolute_import, print_function
 
+import contextlib
 import inspect
 import os
 import pwd
@@ -57,16 +58,20 @@ class MunkiGit(object):
         self.run_git(['status', '-z', a_path])
         return self.results['returncode'] == 0
 
+    def toolname(self):
+        """Returns the name of the tool in use, for commit messages"""
+        try:
+            return os.path.basename(inspect.stack()[-1][1])
+        except IndexError:
+            return 'Munki command-line tools'
+
     def commit_file_at_path(self, a_path):
         """Commits the file at 'a_path'. This method will also automatically
         generate the commit log appropriate for the status of a_path where
         status would be 'modified', 'new file', or 'deleted'"""
 
         # figure out the name of the tool in use
-        try:
-            toolname = os.path.basename(inspect.stack()[-1][1])
-        except IndexError:
-            toolname = 'Munki command-line tools'
+        toolname = self.toolname()
 
         # get the status of the file at a_path
         self.git_repo_dir = os.path.dirname(a_path)
@@ -115,6 +120,88 @@ class MunkiGit(object):
         else:
             print("%s is not in a git repo." % a_path, file=sys.stderr)
 
+    def commit_changes(self, changes):
+        """Stages and commits a batch of changes with a single git add, a
+        single git rm and a single commit per git repo. changes is a list of
+        (path, action) tuples where action is 'created', 'modified' or
+        'deleted'. Returns 0 on success, -1 on failure."""
+        # group the paths by the git repo they belong to
+        toplevels = {}
+        by_repo = {}
+        for a_path, action in changes:
+            dir_path = os.path.dirname(a_path)
+            if dir_path not in toplevels:
+                self.git_repo_dir = dir_path
+                self.run_git(['rev-parse', '--show-toplevel'])
+                if self.results['returncode'] == 0:
+                    toplevels[dir_path] = self.results['output'].strip()
+                else:
+                    toplevels[dir_path] = None
+            if toplevels[dir_path] is None:
+                print("%s is not in a git repo." % a_path, file=sys.stderr)
+                continue
+            by_repo.setdefault(toplevels[dir_path], []).append(
+                (a_path, action))
+
+        result = 0
+        for toplevel, repo_changes in by_repo.items():
+            if self._commit_changes_in_repo(toplevel, repo_changes) != 0:
+                result = -1
+        return result
+
+    def _commit_changes_in_repo(self, toplevel, changes):
+        """Commits changes (see commit_changes) that are all in the git repo
+        at toplevel"""
+        self.git_repo_dir = toplevel
+        added = [a_path for (a_path, action) in changes
+                 if action != 'deleted']
+        deleted = [a_path for (a_path, action) in changes
+                   if action == 'deleted']
+
+        if added:
+            # leave out ignored files
+            self.run_git(['check-ignore', '--'] + added)
+            if self.results['returncode'] == 0:
+                ignored = set(self.results['output'].splitlines())
+                added = [a_path for a_path in added if a_path not in ignored]
+                changes = [(a_path, action) for (a_path, action) in changes
+                           if a_path not in ignored]
+        if added:
+            self.run_git(['add', '--'] + added)
+            if self.results['returncode'] != 0:
+                print("Git error: %s" % self.results['error'], file=sys.stderr)
+                return -1
+        if deleted:
+            self.run_git(['rm', '--cached', '--ignore-unmatch', '--quiet',
+                          '--'] + deleted)
+            if self.results['returncode'] != 0:
+                print("Git error: %s" % self.results['error'], file=sys.stderr)
+                return -1
+        if not changes:
+            return 0
+
+        username = pwd.getpwuid(os.getuid()).pw_name
+        details = []
+        for a_path, action in changes:
+            itempath = a_path
+            if a_path.startswith(self.munki_repo_dir):
+                itempath = a_path[len(self.munki_repo_dir)+1:]
+            details.append('%s \'%s\'' % (action, itempath))
+        if len(details) == 1:
+            log_msg = '%s %s via %s' % (username, details[0], self.toolname())
+        else:
+            log_msg = '%s changed %s files via %s\n\n%s' % (
+                username, len(details), self.toolname(), '\n'.join(details))
+        print("Doing git commit: %s" % log_msg.splitlines()[0])
+        self.run_git(['commit', '-m', log_msg])
+        if self.results['returncode'] != 0:
+            if 'nothing to commit' in self.results['output']:
+                return 0
+            print("Failed to commit changes to %s" % toplevel, file=sys.stderr)
+            print(self.results['error'], file=sys.stderr)
+            return -1
+        return 0
+
     def add_file_at_path(self, a_path):
         """Commits a file to the Git repo."""
         self._add_remove_file_at_path(a_path, 'add')
@@ -125,20 +212,88 @@ class MunkiGit(object):
 
 
 class GitFileRepo(FileRepo):
-    '''A subclass of FileRepo that does git commits for pkginfo files'''
+    '''A subclass of FileRepo that does git commits for pkginfo files.
+    Changes made inside a transaction() block are committed together in a
+    single commit when the (outermost) block exits, unless it exits with an
+    exception.'''
+
+    _transaction_depth = 0
+    _pending_changes = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Batches put/delete operations into a single git commit'''
+        if not self._transaction_depth:
+            self._pending_changes = []
+        self._transaction_depth += 1
+        failed = False
+        try:
+            yield self
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                changes, self._pending_changes = self._pending_changes, None
+                if changes and failed:
+                    # don't commit half a batch; the changed files are left
+                    # uncommitted for the admin to review
+                    print("Not committing changes to %s file(s) after an "
+                          "error." % len(self._coalesce(changes)),
+                          file=sys.stderr)
+                elif changes:
+                    MunkiGit(self).commit_changes(self._coalesce(changes))
+
+    @staticmethod
+    def _coalesce(changes):
+        '''Collapses several changes to the same path into one'''
+        actions = {}
+        order = []
+        for a_path, action in changes:
+            if a_path not in actions:
+                order.append(a_path)
+                actions[a_path] = action
+            elif action == 'deleted' or actions[a_path] == 'deleted':
+                actions[a_path] = action
+        return [(a_path, actions[a_path]) for a_path in order]
+
+    def _record_change(self, repo_filepath, action):
+        '''Commits the change now, or saves it for the end of the current
+        transaction'''
+        if self._transaction_depth:
+            self._pending_changes.append((repo_filepath, action))
+        elif action == 'deleted':
+            MunkiGit(self).delete_file_at_path(repo_filepath)
+        else:
+            MunkiGit(self).add_file_at_path(repo_filepath)
 
     def put(self, resource_identifier, content):
-        super(GitFileRepo, self).put(resource_identifier, content)
         repo_filepath = os.path.join(self.root, resource_identifier)
-        MunkiGit(self).add_file_at_path(repo_filepath)
+        existed = os.path.exists(repo_filepath)
+        super(GitFileRepo, self).put(resource_identifier, content)
+        self._record_change(
+            repo_filepath, 'modified' if existed else 'created')
 
     def put_from_local_file(self, resource_identifier, local_file_path):
+        repo_filepath = os.path.join(self.root, resource_identifier)
+        existed = os.path.exists(repo_filepath)
         super(GitFileRepo, self).put_from_local_file(
             resource_identifier, local_file_path)
+        self._record_change(
+            repo_filepath, 'modified' if existed else 'created')
+
+    def put_from_local_file_with_hash(self, resource_identifier,
+                                      local_file_path):
         repo_filepath = os.path.join(self.root, resource_identifier)
-        MunkiGit(self).add_file_at_path(repo_filepath)
+        existed = os.path.exists(repo_filepath)
+        itemhash = super(GitFileRepo, self).put_from_local_file_with_hash(
+            resource_identifier, local_file_path)
+        self._record_change(
+            repo_filepath, 'modified' if existed else 'created')
+        return itemhash
 
     def delete(self, resource_identifier):
         super(GitFileRepo, self).delete(resource_identifier)
         repo_filepath = os.path.join(self.root, resource_identifier)
-        MunkiGit(self).delete_file_at_path(repo_filepath)
+        self._record_change(repo_filepath, 'deleted')
@@ -1,6 +1,7 @@
 '''Base bits for repo plugins'''
 from __future__ import absolute_import, print_function
 
+import contextlib
 import importlib.util
 import os
 import sys
@@ -69,3 +70,12 @@ def connect(repo_url, plugin_name):
         return plugin(repo_url)
     else:
         raise RepoError('Could not find repo plugin named: %s' % plugin_name)
+
+
+def transaction(repo):
+    '''Returns a context manager that batches put/delete operations on repo.
+    Works with plugins that don't subclass Repo, where it does nothing.'''
+    try:
+        return repo.transaction()
+    except AttributeError:
+        return contextlib.nullcontext(repo)
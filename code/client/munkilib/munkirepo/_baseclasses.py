@@ -1,6 +1,8 @@
 # encoding: utf-8
 """Base classes for repo plugins"""
 
+import contextlib
+
 class RepoError(Exception):
     '''Base exception for repo errors'''
     pass
@@ -12,4 +14,11 @@ class Repo(object):
     def __init__(self, url):
         '''Override in subclasses'''
         pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Context manager wrapping a batch of put/delete operations.
+        Plugins that record changes (like GitFileRepo) can override this
+        to record the whole batch at once; by default it does nothing.'''
+        yield self
 # pylint: enable=too-few-public-methods
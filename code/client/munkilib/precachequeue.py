@@ -0,0 +1,143 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+precachequeue.py
+
+Remembers the progress of the precaching agent between runs.
+
+The agent is stopped whenever managedsoftwareupdate starts, so it often
+doesn't get through its list. The state of each item is saved as it
+changes; when the agent starts again, items it already finished are
+skipped without being checked again, and items that were partly
+downloaded go first so their partial downloads are put to use.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import os
+import plistlib
+import tempfile
+import threading
+import time
+
+# name of the progress file in ManagedInstallDir
+PROGRESS_FILE_NAME = 'PrecacheProgress.plist'
+
+STATE_STARTED = 'started'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+def item_key(item):
+    '''Identifies a precache item: the same installer item at the same
+    location is the same item'''
+    return '%s|%s' % (item.get('installer_item_location', ''),
+                      item.get('installer_item_hash') or
+                      item.get('version', ''))
+
+
+class PrecacheQueue(object):
+    '''The saved state of precache items, and a disk budget (in KB; 0 means
+    no limit) shared by the items being precached. Safe to share between
+    threads.'''
+
+    def __init__(self, path, budget=0, clock=time.time):
+        self.path = path
+        self.budget = budget or 0
+        self.clock = clock
+        self.reserved = 0
+        self._lock = threading.Lock()
+        self._states = self._read()
+
+    def _read(self):
+        '''Returns the saved item states'''
+        try:
+            with open(self.path, 'rb') as fileobj:
+                states = plistlib.load(fileobj).get('items', {})
+        except (IOError, OSError, ValueError, AttributeError,
+                plistlib.InvalidFileException):
+            return {}
+        if not isinstance(states, dict):
+            return {}
+        return states
+
+    def _save(self):
+        '''Writes the progress file; call with the lock held'''
+        data = plistlib.dumps({'items': self._states})
+        try:
+            fileref, temp_path = tempfile.mkstemp(
+                prefix='.' + PROGRESS_FILE_NAME,
+                dir=os.path.dirname(self.path) or None)
+            with os.fdopen(fileref, 'wb') as fileobj:
+                fileobj.write(data)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def state(self, item):
+        '''Returns the saved state of an item, or None'''
+        with self._lock:
+            return self._states.get(item_key(item), {}).get('state')
+
+    def order(self, items, is_cached, is_partial):
+        '''Returns the items that still need precaching, in the order to
+        precache them. items is in priority order. is_cached(item) should
+        cheaply tell if an item is in the cache; is_partial(item) if part of
+        it is. Forgets the state of items that are no longer wanted.'''
+        with self._lock:
+            keys = set(item_key(item) for item in items)
+            for key in list(self._states):
+                if key not in keys:
+                    del self._states[key]
+            self._save()
+        partial = []
+        pending = []
+        failed = []
+        for item in items:
+            state = self.state(item)
+            if state == STATE_DONE and is_cached(item):
+                continue
+            if is_partial(item):
+                partial.append(item)
+            elif state == STATE_FAILED:
+                # give everything else a chance first
+                failed.append(item)
+            else:
+                pending.append(item)
+        return partial + pending + failed
+
+    def mark(self, item, state):
+        '''Records and saves the state of an item'''
+        with self._lock:
+            self._states[item_key(item)] = {'state': state,
+                                            'updated': self.clock()}
+            self._save()
+
+    def reserve(self, size, already_used=0):
+        '''Reserves size KB of the disk budget for an item. already_used is
+        the KB used by precached items already in the cache. Returns False
+        if the item doesn't fit.'''
+        with self._lock:
+            if (self.budget and
+                    already_used + self.reserved + size > self.budget):
+                return False
+            self.reserved += size
+            return True
+
+    def release(self, size):
+        '''Returns a reservation that wasn't used'''
+        with self._lock:
+            self.reserved = max(self.reserved - size, 0)
@@ -56,14 +56,19 @@ DEFAULT_PREFS = {
     'AggressiveUpdateNotificationDays': 14,
     'AppleSoftwareUpdatesIncludeMajorOSUpdates': False,
     'AppleSoftwareUpdatesOnly': False,
+    'CacheSizeLimit': 0,
     'CatalogURL': None,
     'ClientCertificatePath': None,
     'ClientIdentifier': '',
     'ClientKeyPath': None,
     'ClientResourcesFilename': None,
     'ClientResourceURL': None,
+    'ConditionScriptTimeout': 120,
     'DaysBetweenNotifications': 1,
+    'DownloadBandwidthLimit': 0,
+    'DownloadBandwidthLimitPerHost': 0,
     'EmulateProfileSupport': False,
+    'FetchBackend': None,
     'FollowHTTPRedirects': 'none',
     'HelpURL': None,
     'IconURL': None,
@@ -71,6 +76,7 @@ DEFAULT_PREFS = {
     'IgnoreSystemProxies': False,
     'InstallRequiresLogout': False,
     'InstallAppleSoftwareUpdates': False,
+    'KeepDeltaBases': False,
     'LastNotifiedDate': NSDate.dateWithTimeIntervalSince1970_(0),
     'LocalOnlyManifest': None,
     'LogFile': '/Library/Managed Installs/Logs/ManagedSoftwareUpdate.log',
@@ -78,10 +84,17 @@ DEFAULT_PREFS = {
     'LogToSyslog': False,
     'ManagedInstallDir': '/Library/Managed Installs',
     'ManifestURL': None,
+    'MaximumConcurrentDownloads': 4,
+    'MaximumConcurrentDownloadsPerHost': 2,
     'PackageURL': None,
     'PackageVerificationMode': 'hash',
     'PerformAuthRestarts': False,
+    'PrecacheBandwidthLimit': 0,
+    'PrecacheConcurrency': 1,
+    'PrecacheDiskBudget': 0,
+    'RecordTimings': False,
     'RecoveryKeyFile': None,
+    'SegmentedDownloadConnections': 1,
     'ShowOptionalInstallsForHigherOSVersions': False,
     'SoftwareRepoCACertificate': None,
     'SoftwareRepoCAPath': None,
@@ -91,6 +104,7 @@ DEFAULT_PREFS = {
     'SuppressLoginwindowInstall': False,
     'SuppressStopButtonOnInstall': False,
     'SuppressUserNotification': False,
+    'TimingsTraceFile': None,
     'UnattendedAppleUpdates': False,
     'UseClientCertificate': False,
     'UseClientCertificateCNAsClientIdentifier': False,
@@ -30,61 +30,32 @@ import subprocess
 
 from .constants import LOGINWINDOW
 from . import display
+from . import proctable
 
 
 def get_running_processes():
     """Returns a list of paths of running processes"""
-    proc = subprocess.Popen(['/bin/ps', '-axo', 'comm='],
-                            shell=False, stdin=subprocess.PIPE,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    output = proc.communicate()[0].decode('UTF-8')
-    if proc.returncode == 0:
-        proc_list = [item for item in output.splitlines()
-                     if item.startswith('/')]
-        launchcfmapp = ('/System/Library/Frameworks/Carbon.framework'
-                        '/Versions/A/Support/LaunchCFMApp')
-        if launchcfmapp in proc_list:
-            # we have a really old Carbon app
-            proc = subprocess.Popen(['/bin/ps', '-axwwwo', 'args='],
-                                    shell=False, stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output = proc.communicate()[0].decode('UTF-8')
-            if proc.returncode == 0:
-                carbon_apps = [item[len(launchcfmapp)+1:]
-                               for item in output.splitlines()
-                               if item.startswith(launchcfmapp)]
-                if carbon_apps:
-                    proc_list.extend(carbon_apps)
-        return proc_list
-    # else
-    return []
+    return proctable.ps_source()
+
+
+# snapshots of the process table, so checking many applications in a row
+# doesn't run ps for each one. get_running_processes is looked up on each
+# snapshot so it can be replaced for testing.
+_PROCESS_SNAPSHOTS = proctable.ProcessSnapshots(
+    source=lambda: get_running_processes())
+
+
+def running_process_table():
+    """Returns a proctable.ProcessTable of the running processes, taken no
+    more than proctable.PROCESS_SNAPSHOT_TTL seconds ago"""
+    return _PROCESS_SNAPSHOTS.get()
 
 
 def is_app_running(appname):
     """Tries to determine if the application in appname is currently
     running"""
     display.display_detail('Checking if %s is running...' % appname)
-    proc_list = get_running_processes()
-    matching_items = []
-    if appname.startswith('/'):
-        # search by exact path
-        matching_items = [item for item in proc_list
-                          if item == appname]
-    elif appname.endswith('.app'):
-        # search by filename
-        matching_items = [item for item in proc_list
-                          if '/'+ appname + '/Contents/MacOS/' in item]
-    else:
-        # check executable name
-        matching_items = [item for item in proc_list
-                          if item.endswith('/' + appname)]
-    if not matching_items:
-        # try adding '.app' to the name and check again
-        matching_items = [item for item in proc_list
-                          if '/'+ appname + '.app/Contents/MacOS/' in item]
-
+    matching_items = running_process_table().matching(appname)
     if matching_items:
         # it's running!
         display.display_debug1('Matching process list: %s' % matching_items)
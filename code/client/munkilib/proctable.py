@@ -0,0 +1,199 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+proctable.py
+
+Snapshots of the process table for processes.is_app_running.
+
+Listing processes means running ps, so a snapshot is taken once and reused
+for a couple of seconds; checking the blocking applications of many items
+then costs one ps instead of one (or two) per application. Each snapshot is
+indexed by path, executable name and app bundle name, so a lookup doesn't
+scan the whole process list.
+
+Where the process list comes from is pluggable: ps, as on macOS, or /proc
+on Linux, which lets this be tested and benchmarked there.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# how long a snapshot of the process table is used, in seconds
+PROCESS_SNAPSHOT_TTL = 2
+
+LAUNCHCFMAPP = ('/System/Library/Frameworks/Carbon.framework'
+                '/Versions/A/Support/LaunchCFMApp')
+
+APP_EXECUTABLE_DIR = '/Contents/MacOS/'
+
+
+def _ps(args):
+    '''Runs /bin/ps with args. Returns its output, or None if it failed.'''
+    try:
+        proc = subprocess.Popen(['/bin/ps'] + args,
+                                shell=False, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    output = proc.communicate()[0].decode('UTF-8')
+    if proc.returncode != 0:
+        return None
+    return output
+
+
+def ps_source():
+    '''Returns a list of paths of running processes, from ps'''
+    output = _ps(['-axo', 'comm='])
+    if output is None:
+        return []
+    proc_list = [item for item in output.splitlines()
+                 if item.startswith('/')]
+    if LAUNCHCFMAPP in proc_list:
+        # we have a really old Carbon app
+        output = _ps(['-axwwwo', 'args='])
+        if output is not None:
+            proc_list.extend(item[len(LAUNCHCFMAPP)+1:]
+                             for item in output.splitlines()
+                             if item.startswith(LAUNCHCFMAPP))
+    return proc_list
+
+
+def proc_source(proc_dir='/proc'):
+    '''Returns a list of paths of running processes, from /proc. The path
+    is the executable if we may read it, or else the command, if it is
+    given as an absolute path.'''
+    proc_list = []
+    try:
+        pids = [name for name in os.listdir(proc_dir) if name.isdigit()]
+    except OSError:
+        return proc_list
+    for pid in pids:
+        path = None
+        try:
+            path = os.readlink(os.path.join(proc_dir, pid, 'exe'))
+        except OSError:
+            try:
+                with open(os.path.join(proc_dir, pid, 'cmdline'),
+                          'rb') as fileobj:
+                    path = fileobj.read().split(b'\0')[0].decode(
+                        'UTF-8', 'replace')
+            except (IOError, OSError):
+                # the process has gone away
+                continue
+        if path and path.startswith('/'):
+            proc_list.append(path)
+    return proc_list
+
+
+def default_source():
+    '''Returns the process list source for this platform'''
+    if sys.platform.startswith('linux') and os.path.isdir('/proc/self'):
+        return proc_source
+    return ps_source
+
+
+class ProcessTable(object):
+    '''A snapshot of the running processes, indexed for lookups'''
+
+    def __init__(self, proc_list):
+        self.proc_list = list(proc_list)
+        self.paths = set(self.proc_list)
+        self.by_name = {}
+        self.by_bundle = {}
+        for path in self.proc_list:
+            self.by_name.setdefault(
+                path.rsplit('/', 1)[-1], []).append(path)
+            # a path may be inside more than one app bundle, as helper apps
+            # are
+            start = 0
+            while True:
+                index = path.find(APP_EXECUTABLE_DIR, start)
+                if index == -1:
+                    break
+                bundle = path[:index].rsplit('/', 1)[-1]
+                if bundle.endswith('.app'):
+                    self.by_bundle.setdefault(bundle, []).append(path)
+                start = index + 1
+
+    def matching(self, appname):
+        '''Returns the paths of the processes that match appname, which may
+        be a full path to an executable, the name of an app bundle
+        (Foo.app), or an executable name. If nothing matches, '.app' is
+        added to appname and the bundles checked for that.'''
+        if appname.startswith('/'):
+            # search by exact path
+            matching_items = [appname] if appname in self.paths else []
+        elif appname.endswith('.app'):
+            if '/' in appname:
+                matching_items = [
+                    item for item in self.proc_list
+                    if '/' + appname + APP_EXECUTABLE_DIR in item]
+            else:
+                # search by bundle name
+                matching_items = self.by_bundle.get(appname, [])
+        elif '/' in appname:
+            matching_items = [item for item in self.proc_list
+                              if item.endswith('/' + appname)]
+        else:
+            # check executable name
+            matching_items = self.by_name.get(appname, [])
+        if not matching_items and not appname.startswith('/'):
+            # try adding '.app' to the name and check again
+            if '/' in appname:
+                matching_items = [
+                    item for item in self.proc_list
+                    if '/' + appname + '.app' + APP_EXECUTABLE_DIR in item]
+            else:
+                matching_items = self.by_bundle.get(appname + '.app', [])
+        return list(matching_items)
+
+
+class ProcessSnapshots(object):
+    '''Provides snapshots of the process table from source, a function
+    returning a list of process paths. A snapshot is reused for ttl
+    seconds. Safe to share between threads.'''
+
+    def __init__(self, source=None, ttl=PROCESS_SNAPSHOT_TTL,
+                 clock=time.time):
+        self.source = source or default_source()
+        self.ttl = ttl
+        self.clock = clock
+        self.snapshots_taken = 0
+        self._table = None
+        self._taken = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''Returns a ProcessTable no older than ttl seconds'''
+        with self._lock:
+            now = self.clock()
+            if (self._table is None or
+                    not self._taken <= now < self._taken + self.ttl):
+                self._table = ProcessTable(self.source())
+                self._taken = now
+                self.snapshots_taken += 1
+            return self._table
+
+    def invalidate(self):
+        '''Makes the next get() take a new snapshot'''
+        with self._lock:
+            self._table = None
@@ -30,6 +30,7 @@ import time
 
 from . import munkilog
 from . import prefs
+from . import tracing
 from . import FoundationPlist
 
 # This code is largely still compatible with Python 2, so for now, turn off
@@ -71,6 +72,31 @@ def savereport():
             prefs.pref('ManagedInstallDir'), 'ManagedInstallReport.plist'))
 
 
+def start_timings():
+    """Starts recording timings if RecordTimings or TimingsTraceFile is
+    set"""
+    if prefs.pref('RecordTimings') or prefs.pref('TimingsTraceFile'):
+        tracing.start(record_events=bool(prefs.pref('TimingsTraceFile')))
+
+
+def record_timings(phase):
+    """Adds the timings recorded since start_timings to the Timings section
+    of the report under phase, and writes them as a Chrome trace if
+    TimingsTraceFile is set; the phase name is added to the file name"""
+    if not tracing.enabled():
+        return
+    tracing.stop()
+    if 'Timings' not in report:
+        report['Timings'] = {}
+    report['Timings'][phase] = tracing.timings()
+    tracefile = prefs.pref('TimingsTraceFile')
+    if tracefile:
+        (base, ext) = os.path.splitext(tracefile)
+        tracepath = '%s-%s%s' % (base, phase, ext or '.json')
+        if not tracing.write_chrome_trace(tracepath):
+            _warn('Could not write trace file %s' % tracepath)
+
+
 def readreport():
     """Read report data from file"""
     global report
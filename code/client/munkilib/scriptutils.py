@@ -30,6 +30,7 @@ from . import osutils
 from . import display
 from . import munkilog
 from . import munkistatus
+from . import tracing
 
 
 def _writefile(stringdata, path):
@@ -47,6 +48,7 @@ def _writefile(stringdata, path):
         return ""
 
 
+@tracing.traced('embedded_script', script=0, item=1)
 def run_embedded_script(scriptname, pkginfo_item, suppress_error=False):
     '''Runs a script embedded in the pkginfo.
     Returns the result code.'''
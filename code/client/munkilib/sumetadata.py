@@ -0,0 +1,177 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+sumetadata.py
+
+Replicates Apple Software Update metadata for appleupdates.sync.
+
+The ServerMetadata (.smd), package Metadata (.pkm) and Distribution (.dist)
+files for the available updates are small, and there are many of them, so
+they are fetched a few at a time instead of one after another. The local
+sucatalogs that point at the replicated files are both built in one pass
+over the Apple catalog.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import collections
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# how many metadata files to fetch at once
+METADATA_WORKERS = 4
+
+SERVER_METADATA = 'ServerMetadataURL'
+PACKAGE_METADATA = 'MetadataURL'
+DISTRIBUTION = 'Distribution'
+
+# a file to replicate. language is set only for distributions.
+MetadataFile = collections.namedtuple(
+    'MetadataFile', ['product_key', 'kind', 'language', 'url'])
+
+
+def metadata_files(catalog, product_ids):
+    '''Returns a list of MetadataFile for the products in product_ids, in
+    product order, and a list of the product ids not in the catalog'''
+    files = []
+    missing = []
+    products = catalog.get('Products', {})
+    for product_key in product_ids:
+        if product_key not in products:
+            missing.append(product_key)
+            continue
+        product = products[product_key]
+        if SERVER_METADATA in product:
+            files.append(MetadataFile(
+                product_key, SERVER_METADATA, None,
+                product[SERVER_METADATA]))
+        for package in product.get('Packages', []):
+            if PACKAGE_METADATA in package:
+                files.append(MetadataFile(
+                    product_key, PACKAGE_METADATA, None,
+                    package[PACKAGE_METADATA]))
+        distributions = product.get('Distributions', {})
+        for language in distributions.keys():
+            files.append(MetadataFile(
+                product_key, DISTRIBUTION, language, distributions[language]))
+    return files, missing
+
+
+def replicate(files, retrieve, stop_requested=lambda: False,
+              on_error=None, max_workers=None):
+    '''Calls retrieve(url) for each MetadataFile, up to max_workers at a
+    time. stop_requested() is checked before each file is started; once it
+    returns True no more are started. If retrieve raises, no more are
+    started and the exception is re-raised once the ones already running
+    have finished, unless on_error(metadata_file, err) is given and returns
+    True to carry on. Returns False if stopped, True otherwise.'''
+    max_workers = max_workers or METADATA_WORKERS
+    if not futures or max_workers < 2 or len(files) < 2:
+        for metadata_file in files:
+            if stop_requested():
+                return False
+            try:
+                retrieve(metadata_file.url)
+            except Exception as err:
+                if not (on_error and on_error(metadata_file, err)):
+                    raise
+        return True
+
+    pending = list(reversed(files))
+    running = {}
+    failure = None
+    stopped = False
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # keep at most max_workers files in flight, so a stop request
+            # or a failure leaves little more than that to wait for
+            while (pending and len(running) < max_workers and
+                   failure is None and not stopped):
+                if stop_requested():
+                    stopped = True
+                    break
+                metadata_file = pending.pop()
+                running[executor.submit(
+                    retrieve, metadata_file.url)] = metadata_file
+            if not running:
+                break
+            done, _ = futures.wait(
+                running, return_when=futures.FIRST_COMPLETED)
+            for result in done:
+                metadata_file = running.pop(result)
+                err = result.exception()
+                if (err is not None and failure is None and
+                        not (on_error and on_error(metadata_file, err))):
+                    failure = err
+    if failure is not None:
+        raise failure
+    return not stopped
+
+
+def _rewritten_product(product, rewrite_url):
+    '''Returns copies of product for the download catalog (metadata URLs
+    rewritten) and the install catalog (package URLs rewritten too)'''
+    download_product = dict(product)
+    install_product = dict(product)
+    if SERVER_METADATA in product:
+        download_product[SERVER_METADATA] = install_product[
+            SERVER_METADATA] = rewrite_url(product[SERVER_METADATA])
+    if 'Packages' in product:
+        download_packages = []
+        install_packages = []
+        for package in product['Packages']:
+            download_package = dict(package)
+            if PACKAGE_METADATA in package:
+                download_package[PACKAGE_METADATA] = rewrite_url(
+                    package[PACKAGE_METADATA])
+            install_package = dict(download_package)
+            if 'URL' in package:
+                install_package['URL'] = rewrite_url(package['URL'])
+            download_packages.append(download_package)
+            install_packages.append(install_package)
+        download_product['Packages'] = download_packages
+        install_product['Packages'] = install_packages
+    if 'Distributions' in product:
+        distributions = product['Distributions']
+        download_product['Distributions'] = install_product[
+            'Distributions'] = dict(
+                (language, rewrite_url(distributions[language]))
+                for language in distributions.keys())
+    return download_product, install_product
+
+
+def local_catalogs(catalog, rewrite_url):
+    '''Returns the local download and install catalogs for catalog, built
+    in a single pass. In the download catalog, metadata and distribution
+    URLs point to the local replica, and package URLs still point to the
+    software update server. In the install catalog every URL points to the
+    local replica. catalog itself is not changed.'''
+    download_catalog = dict(catalog)
+    install_catalog = dict(catalog)
+    if 'Products' in catalog:
+        download_products = {}
+        install_products = {}
+        products = catalog['Products']
+        for product_key in products.keys():
+            (download_products[product_key],
+             install_products[product_key]) = _rewritten_product(
+                 products[product_key], rewrite_url)
+        download_catalog['Products'] = download_products
+        install_catalog['Products'] = install_products
+    return download_catalog, install_catalog
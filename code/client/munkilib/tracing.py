@@ -0,0 +1,259 @@
+# encoding: utf-8
+#
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+tracing.py
+
+Records where a managedsoftwareupdate run spends its time.
+
+Code marks the work it does with spans, either as a block:
+
+    with tracing.span('catalog_parse', catalog=catalogname):
+        ...
+
+or a whole function, with the traced decorator. Counters count things.
+Spans with the same name are totalled (count, seconds and longest) for
+the Timings section of the report; if asked, each span is also kept as an
+event so the run can be saved as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+
+Nothing is recorded until start() is called. Until then span() returns
+one shared do-nothing object and traced functions just call through, so
+leaving the spans in place costs next to nothing.
+"""
+from __future__ import absolute_import, print_function
+
+# standard libs
+import functools
+import json
+import os
+import threading
+import time
+
+# most events kept for a Chrome trace; spans after this are only totalled
+TRACE_EVENT_LIMIT = 200000
+
+
+class _NullSpan(object):
+    '''What span() returns when we're not recording'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    '''Times a block of code for a Tracer'''
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.tracer.add_span(
+            self.name, self.start, self.tracer.clock(), self.args)
+        return False
+
+
+def _describe(value):
+    '''Returns value as recorded in a trace event: pkginfo, installs and
+    receipt dicts by their name, path or package id, anything else as a
+    string'''
+    if isinstance(value, dict):
+        return (value.get('name') or value.get('path') or
+                value.get('packageid') or '')
+    return '%s' % (value,)
+
+
+class Tracer(object):
+    '''Totals spans and counters, optionally keeping each span as a
+    Chrome trace event. Safe to share between threads.'''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.enabled = False
+        self.record_events = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        '''Forgets everything recorded'''
+        self._spans = {}
+        self._counters = {}
+        self._events = []
+        self._started = self.clock()
+
+    def start(self, record_events=False):
+        '''Starts recording afresh; keeps trace events if record_events'''
+        with self._lock:
+            self._reset()
+            self.record_events = record_events
+            self.enabled = True
+
+    def stop(self):
+        '''Stops recording. What was recorded is kept until the next
+        start().'''
+        self.enabled = False
+
+    def span(self, name, **args):
+        '''Returns a context manager timing a block of code as name. args
+        are kept with its trace event.'''
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def add_span(self, name, start, end, args=None):
+        '''Records a span that ran from start to end'''
+        seconds = end - start
+        with self._lock:
+            if not self.enabled:
+                return
+            totals = self._spans.get(name)
+            if totals is None:
+                self._spans[name] = [1, seconds, seconds]
+            else:
+                totals[0] += 1
+                totals[1] += seconds
+                if seconds > totals[2]:
+                    totals[2] = seconds
+            if self.record_events and len(self._events) < TRACE_EVENT_LIMIT:
+                event = {'name': name, 'ph': 'X',
+                         'ts': int((start - self._started) * 1000000),
+                         'dur': int(seconds * 1000000),
+                         'pid': os.getpid(),
+                         'tid': threading.current_thread().ident}
+                if args:
+                    event['args'] = dict(
+                        (key, _describe(value))
+                        for key, value in args.items())
+                self._events.append(event)
+
+    def count(self, name, value=1):
+        '''Adds value to the counter name'''
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self._counters.get(name, 0) + value
+            self._counters[name] = total
+            if self.record_events and len(self._events) < TRACE_EVENT_LIMIT:
+                self._events.append(
+                    {'name': name, 'ph': 'C',
+                     'ts': int((self.clock() - self._started) * 1000000),
+                     'pid': os.getpid(),
+                     'args': {name: total}})
+
+    def timings(self):
+        '''Returns the span totals and counters, for the report'''
+        with self._lock:
+            return {
+                'spans': dict(
+                    (name, {'count': count,
+                            'seconds': round(seconds, 6),
+                            'max_seconds': round(longest, 6)})
+                    for name, (count, seconds, longest)
+                    in self._spans.items()),
+                'counters': dict(self._counters),
+            }
+
+    def chrome_trace(self):
+        '''Returns the recorded events as a Chrome trace'''
+        with self._lock:
+            return {'traceEvents': list(self._events),
+                    'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        '''Saves the recorded events as a Chrome trace JSON file at path.
+        Returns True if it was written.'''
+        try:
+            with open(path, 'w') as fileobj:
+                json.dump(self.chrome_trace(), fileobj)
+        except (IOError, OSError, TypeError, ValueError):
+            return False
+        return True
+
+
+# the Tracer used by the functions below
+_TRACER = Tracer()
+
+
+def start(record_events=False):
+    '''Starts recording spans and counters'''
+    _TRACER.start(record_events=record_events)
+
+
+def stop():
+    '''Stops recording spans and counters'''
+    _TRACER.stop()
+
+
+def enabled():
+    '''Returns True if spans and counters are being recorded'''
+    return _TRACER.enabled
+
+
+def span(name, **args):
+    '''Returns a context manager timing a block of code as name'''
+    if not _TRACER.enabled:
+        return NULL_SPAN
+    return _TRACER.span(name, **args)
+
+
+def count(name, value=1):
+    '''Adds value to the counter name'''
+    if _TRACER.enabled:
+        _TRACER.count(name, value)
+
+
+def traced(name, **arg_positions):
+    '''Decorator timing each call of a function as name. arg_positions
+    maps names to the positions of arguments to keep with trace events:
+    @traced('process_install', item=0)'''
+    def decorator(func):
+        '''Wraps func'''
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            '''Calls func in a span, if we're recording'''
+            if not _TRACER.enabled:
+                return func(*args, **kwargs)
+            span_args = {}
+            if _TRACER.record_events:
+                for arg_name, position in arg_positions.items():
+                    if position < len(args):
+                        span_args[arg_name] = args[position]
+            with _TRACER.span(name, **span_args):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timings():
+    '''Returns the span totals and counters, for the report'''
+    return _TRACER.timings()
+
+
+def write_chrome_trace(path):
+    '''Saves the recorded events as a Chrome trace JSON file at path'''
+    return _TRACER.write_chrome_trace(path)
@@ -44,6 +44,7 @@ from .. import munkilog
 from .. import osinstaller
 from .. import prefs
 from .. import processes
+from .. import tracing
 from ..wrappers import is_a_string
 
 
@@ -303,6 +304,7 @@ def process_optional_install(manifestitem, cataloglist, installinfo):
     installinfo['optional_installs'].append(iteminfo)
 
 
+@tracing.traced('process_install', item=0)
 def process_install(manifestitem, cataloglist, installinfo,
                     is_managed_update=False,
                     is_optional_install=False):
@@ -519,7 +521,8 @@ def process_install(manifestitem, cataloglist, installinfo,
                 'precache',
                 'display_name_staged', # used w/ stage_os_installer
                 'description_staged',
-                'installed_size_staged'
+                'installed_size_staged',
+                'installer_item_deltas'  # keep a delta base once installed
             ]
 
             if (is_optional_install and
@@ -762,6 +765,119 @@ def process_manifest_for_key(manifest, manifest_key, installinfo,
                 installinfo['featured_items'].append(item)
 
 
+def predicted_items(manifest, parentcatalogs=None):
+    """Returns a list of (manifest key, item_pl) tuples for the items in
+    manifest the analysis is expected to look at, so that work for them
+    can be done ahead of it.
+
+    Follows included manifests and conditional_items as
+    process_manifest_for_key does, along with the items that installs
+    require, which are listed under the key of the item requiring them.
+    For removals the newest version is listed. This is only a prediction:
+    items missed here are dealt with when they are analyzed, as usual.
+    """
+    items = []
+    seen = set()
+
+    def add_install(manifestitem, cataloglist, key):
+        """Adds an item to be installed, and the items it requires"""
+        if (manifestitem, tuple(cataloglist)) in seen:
+            return
+        seen.add((manifestitem, tuple(cataloglist)))
+        item_pl = catalogs.get_item_detail(
+            manifestitem, cataloglist, suppress_warnings=True)
+        if not item_pl:
+            return
+        items.append((key, item_pl))
+        dependencies = item_pl.get('requires', [])
+        if is_a_string(dependencies):
+            dependencies = [dependencies]
+        for item in dependencies:
+            add_install(item, cataloglist, key)
+
+    def add_removal(manifestitem, cataloglist):
+        """Adds the newest version of an item to be removed"""
+        name, version = catalogs.split_name_and_version(
+            os.path.split(manifestitem)[1])
+        if version:
+            item_pl = catalogs.get_item_detail(
+                name, cataloglist, version, suppress_warnings=True)
+        else:
+            item_pl = (catalogs.get_all_items_with_name(
+                name, cataloglist) or [None])[0]
+        if item_pl:
+            items.append(('managed_uninstalls', item_pl))
+
+    def add_manifest(manifestdata, parentcatalogs):
+        """Adds the items in a manifest and those it includes"""
+        cataloglist = manifestdata.get('catalogs')
+        if cataloglist:
+            catalogs.get_catalogs(cataloglist)
+        else:
+            cataloglist = parentcatalogs
+        if not cataloglist:
+            return
+        for item in manifestdata.get('included_manifests', []):
+            if item:
+                try:
+                    nestedmanifestpath = manifestutils.get_manifest(
+                        item, suppress_errors=True)
+                except manifestutils.ManifestException:
+                    # process_manifest_for_key will report this
+                    continue
+                if nestedmanifestpath:
+                    add_manifest(
+                        manifestutils.get_manifest_data(nestedmanifestpath),
+                        cataloglist)
+        for item in manifestdata.get('conditional_items', []):
+            try:
+                predicate = item['condition']
+            except (AttributeError, KeyError, TypeError):
+                continue
+            if info.predicate_evaluates_as_true(
+                    predicate, additional_info={'catalogs': cataloglist}):
+                add_manifest(item, cataloglist)
+        for key in ('managed_installs', 'managed_updates',
+                    'optional_installs'):
+            for item in manifestdata.get(key, []):
+                add_install(item, cataloglist, key)
+        for item in manifestdata.get('managed_uninstalls', []):
+            add_removal(item, cataloglist)
+
+    if is_a_string(manifest):
+        manifest = manifestutils.get_manifest_data(manifest)
+    add_manifest(manifest, parentcatalogs)
+    return items
+
+
+def check_script_items(items):
+    """Returns a list of (scriptname, item_pl) tuples for those of items,
+    as returned by predicted_items, that have installcheck or
+    uninstallcheck scripts, so that installationstate can run them ahead
+    of the analysis."""
+    script_items = []
+    for key, item_pl in items:
+        if key == 'managed_uninstalls':
+            scriptnames = ('uninstallcheck_script', 'installcheck_script')
+        else:
+            scriptnames = ('installcheck_script',)
+        for scriptname in scriptnames:
+            if item_pl.get(scriptname):
+                script_items.append((scriptname, item_pl))
+                break
+    return script_items
+
+
+def unused_software_items(items):
+    """Returns the pkginfo of those of items, as returned by
+    predicted_items, that are optional installs which may be removed for
+    lack of use"""
+    return [item_pl for key, item_pl in items
+            if key == 'optional_installs' and
+            item_pl.get('unused_software_removal_info')]
+
+
+@tracing.traced('process_removal', item=0)
 def process_removal(manifestitem, cataloglist, installinfo):
     """Processes a manifest item; attempts to determine if it
     needs to be removed, and if it can be removed.
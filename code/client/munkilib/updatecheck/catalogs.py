@@ -31,15 +31,18 @@ import unicodedata
 
 from . import download
 
+from .. import compression
 from .. import display
 from .. import info
 from .. import pkgutils
 from .. import prefs
+from .. import tracing
 from .. import utils
 from .. import FoundationPlist
 from ..wrappers import is_a_string
 
 
+@tracing.traced('make_catalog_db')
 def make_catalog_db(catalogitems):
     """Takes an array of catalog items and builds some indexes so we can
     get our common data faster. Returns a dict we can use like a database"""
@@ -629,7 +632,8 @@ def get_catalogs(cataloglist):
             catalogpath = download.download_catalog(catalogname)
             if catalogpath:
                 try:
-                    catalogdata = FoundationPlist.readPlist(catalogpath)
+                    with tracing.span('catalog_parse', catalog=catalogname):
+                        catalogdata = FoundationPlist.readPlist(catalogpath)
                 except FoundationPlist.NSPropertyListSerializationException:
                     display.display_error(
                         'Retrieved catalog %s is invalid.', catalogname)
@@ -646,7 +650,13 @@ def clean_up():
     catalog_dir = os.path.join(prefs.pref('ManagedInstallDir'),
                                'catalogs')
     for item in os.listdir(catalog_dir):
-        if item not in _CATALOG:
+        name = item
+        # keep precompressed variants of catalogs we keep
+        for suffix in compression.variant_suffixes():
+            if item.endswith(suffix) and item[:-len(suffix)] in _CATALOG:
+                name = item[:-len(suffix)]
+                break
+        if name not in _CATALOG:
             os.unlink(os.path.join(catalog_dir, item))
 
 
@@ -29,6 +29,7 @@ from .. import display
 from .. import munkihash
 from .. import info
 from .. import pkgutils
+from .. import tracing
 from .. import utils
 from .. import FoundationPlist
 
@@ -98,11 +99,9 @@ def compare_application_version(app):
         (name, bundleid, versionstring))
 
     # find installed apps that match this item by name or bundleid
-    appdata = info.filtered_app_data()
-    appinfo = [item for item in appdata
-               if (item['path'] and
-                   (item['bundleid'] == bundleid or
-                    (name and item['name'] == name)))]
+    appinfo = [item for item in
+               info.filtered_app_index().matching(name, bundleid)
+               if item['path']]
 
     if not appinfo:
         # No matching apps found
@@ -275,6 +274,7 @@ def filesystem_item_exists(item):
     raise utils.Error('No path specified for filesystem item.')
 
 
+@tracing.traced('installs_comparison', item=0)
 def compare_item_version(item):
     '''Compares an installs_item with what's on the startup disk.
     Wraps other comparison functions.
@@ -308,6 +308,7 @@ def compare_item_version(item):
     raise utils.Error('Unknown installs item type: %s' % itemtype)
 
 
+@tracing.traced('receipt_comparison', item=0)
 def compare_receipt_version(item):
     """Determines if the given package is already installed.
 
@@ -388,14 +389,9 @@ def get_installed_version(item_plist):
                 except (KeyError,
                         FoundationPlist.NSPropertyListSerializationException):
                     # that didn't work, fall through to the slow way
-                    appinfo = []
-                    appdata = info.app_data()
-                    if appdata:
-                        for ad_item in appdata:
-                            if bundleid and ad_item['bundleid'] == bundleid:
-                                appinfo.append(ad_item)
-                            elif name and ad_item['name'] == name:
-                                appinfo.append(ad_item)
+                    # (an empty bundleid matches nothing here)
+                    appinfo = info.app_index().matching(
+                        name, bundleid or None)
 
                     maxversion = '0.0.0.0.0'
                     for ai_item in appinfo:
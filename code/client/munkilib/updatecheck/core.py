@@ -34,10 +34,13 @@ from . import analyze
 from . import autoconfig
 from . import catalogs
 from . import download
+from . import installationstate
 from . import licensing
 from . import manifestutils
 from . import selfservice
+from . import unused_software
 
+from .. import contentstore
 from .. import display
 from .. import info
 from .. import keychain
@@ -49,6 +52,7 @@ from .. import powermgr
 from .. import prefs
 from .. import processes
 from .. import reports
+from .. import tracing
 from .. import FoundationPlist
 
 
@@ -62,6 +66,18 @@ def check(client_id='', localmanifestpath=None):
     installer items if needed. Returns 1 if there are available updates,
     0 if there are no available updates, and -1 if there were errors."""
 
+    reports.start_timings()
+    try:
+        return _check(client_id, localmanifestpath)
+    finally:
+        # if the check stopped early or failed, still stop the tracer and
+        # keep what was timed; does nothing if _check recorded the timings
+        reports.record_timings('check')
+
+
+def _check(client_id, localmanifestpath):
+    """Does the work of check()"""
+
     # Auto-detect a Munki repo if one isn't defined in preferences
     autoconfig.autodetect_repo_url_if_needed()
 
@@ -118,6 +134,24 @@ def check(client_id='', localmanifestpath=None):
         # recreate if still valid
         osinstaller.remove_staged_os_installer_info()
 
+        # run the installcheck and uninstallcheck scripts we expect to need
+        # a few at a time, ahead of the analysis
+        predicted_items = analyze.predicted_items(mainmanifestpath)
+        installationstate.reset_check_scripts()
+        with tracing.span('check_scripts_ahead'):
+            installationstate.precheck_scripts(
+                analyze.check_script_items(predicted_items),
+                stop_requested=processes.stop_requested)
+        if processes.stop_requested():
+            return 0
+
+        # and decide which optional installs are unused, reading the
+        # application usage data once
+        unused_software.reset_removal_decisions()
+        with tracing.span('unused_software_ahead'):
+            unused_software.decide_removals(
+                analyze.unused_software_items(predicted_items))
+
         display.display_detail('**Checking for installs**')
         analyze.process_manifest_for_key(
             mainmanifestpath, 'managed_installs', installinfo)
@@ -411,6 +445,9 @@ def check(client_id='', localmanifestpath=None):
              if item.get('precache')])
         cachedir = os.path.join(managed_install_dir, 'Cache')
         for item in osutils.listdir(cachedir):
+            if item.startswith('.'):
+                # the content store and the cache index
+                continue
             if item.endswith('.download'):
                 # we have a partial download here
                 # remove the '.download' from the end of the filename
@@ -429,6 +466,24 @@ def check(client_id='', localmanifestpath=None):
             elif item not in cache_list:
                 display.display_detail('Removing %s from cache', item)
                 os.unlink(os.path.join(cachedir, item))
+        # drop delta bases for items we no longer manage, then anything in
+        # the content store nothing points to now
+        store = contentstore.ContentStore(cachedir)
+        store.drop_bases_except(
+            [catalogs.split_name_and_version(name)[0]
+             for name in installinfo.get('processed_installs', []) +
+             installinfo.get('managed_updates', [])] +
+            [item['name'] for item in installinfo.get('optional_installs', [])
+             if item.get('installed')])
+        store.collect_garbage()
+        # keep what's left within the cache size limit
+        manager = download.cache_manager()
+        manager.reconcile()
+        protected, expected_reuse = download.cache_item_names(installinfo)
+        manager.enforce_budget(protected=protected,
+                               expected_reuse=expected_reuse)
+        manager.save()
+        reports.report['CacheStats'] = manager.stats()
 
         # write out install list so our installer
         # can use it to install things in the right order
@@ -470,6 +525,7 @@ def check(client_id='', localmanifestpath=None):
             reports.report['ItemsToRemove'] = \
                 installinfo.get('removals', [])
 
+    reports.record_timings('check')
     reports.savereport()
     munkilog.log('###    End managed software check    ###')
 
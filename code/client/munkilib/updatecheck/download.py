@@ -24,6 +24,12 @@ Functions for downloading resources from the Munki server
 from __future__ import absolute_import, print_function
 
 import os
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
 
 try:
     # Python 2
@@ -38,19 +44,36 @@ except ImportError:
     # Python 3
     from urllib.parse import urlparse
 
+from .. import cachemanager
+from .. import contentstore
+from .. import deltautils
 from .. import display
 from .. import fetch
+from .. import fetchscheduler
 from .. import info
 from .. import launchd
 from .. import munkihash
 from .. import osutils
+from .. import precachequeue
 from .. import prefs
 from .. import reports
+from .. import tracing
 from .. import FoundationPlist
 
 
 ICON_HASHES_PLIST_NAME = '_icon_hashes.plist'
 
+_CACHE_MANAGER = None
+_CACHE_MANAGER_LOCK = threading.Lock()
+
+# installer items smaller than this (in KB) are always downloaded over a
+# single connection
+SEGMENTED_DOWNLOAD_MINIMUM_SIZE = 256 * 1024
+
+# most icons to check and download at once; fewer if the download
+# scheduler wouldn't let that many requests run at once
+ICON_DOWNLOAD_WORKERS = 4
+
 def get_url_basename(url):
     """For a URL, absolute or relative, return the basename string.
 
@@ -123,6 +146,100 @@ def enough_disk_space(item_pl, installlist=None,
     return False
 
 
+def download_connections(item_pl, uninstalling=False):
+    """Returns the number of connections to use to download an (un)installer
+    item. More than one means a segmented download, which we only do for
+    large items that have a hash to verify the reassembled download against.
+    The SegmentedDownloadConnections preference caps the connections used
+    for any one item; it defaults to 1, which turns segmented downloads
+    off."""
+    max_connections = int(prefs.pref('SegmentedDownloadConnections') or 1)
+    if max_connections < 2:
+        return 1
+    item_hash_key = 'installer_item_hash'
+    item_size_key = 'installer_item_size'
+    if uninstalling and 'uninstaller_item_location' in item_pl:
+        item_hash_key = 'uninstaller_item_hash'
+        item_size_key = 'uninstaller_item_size'
+    if not item_pl.get(item_hash_key):
+        return 1
+    if int(item_pl.get(item_size_key, 0)) < SEGMENTED_DOWNLOAD_MINIMUM_SIZE:
+        return 1
+    return max_connections
+
+
+def package_url(item_pl, location):
+    """Returns the URL for an item location relative to the pkgs directory,
+    using the pkginfo's PackageURL if it has one"""
+    downloadbaseurl = item_pl.get('PackageURL') or \
+                      prefs.pref('PackageURL') or \
+                      prefs.pref('SoftwareRepoURL') + '/pkgs/'
+    if not downloadbaseurl.endswith('/'):
+        downloadbaseurl = downloadbaseurl + '/'
+    return downloadbaseurl + quote(location.encode('UTF-8'))
+
+
+def download_delta(item_pl, destinationpath, store, precaching=False):
+    """Tries to build the installer item at destinationpath from a
+    version of it we already have in the content store and a delta.
+    Returns True if it succeeded; if not, the caller should download the
+    full item."""
+    expected_hash = item_pl.get('installer_item_hash')
+    if not expected_hash:
+        return False
+    if precaching:
+        priority = fetchscheduler.PRIORITY_PRECACHE
+    else:
+        priority = fetchscheduler.PRIORITY_INSTALLS
+    for delta in item_pl.get('installer_item_deltas', []):
+        base_hash = delta.get('base_hash')
+        delta_location = delta.get('delta_location')
+        if not (base_hash and delta_location and store.has(base_hash)):
+            continue
+        deltapath = get_download_cache_path(delta_location)
+        temppath = destinationpath + '.delta'
+        try:
+            fetch.munki_resource(
+                package_url(item_pl, delta_location), deltapath,
+                resume=True,
+                message='Downloading update for %s...' % item_pl.get('name'),
+                expected_hash=delta.get('delta_hash'),
+                verify=True,
+                priority=priority)
+            deltautils.apply_delta(
+                store.object_path(base_hash), deltapath, temppath)
+            if munkihash.getsha256hash(temppath) != expected_hash:
+                raise deltautils.DeltaError(
+                    'result does not match installer_item_hash')
+            os.rename(temppath, destinationpath)
+            fetch.writeCachedChecksum(destinationpath, expected_hash)
+        except (fetch.Error, deltautils.DeltaError, IOError, OSError) as err:
+            display.display_detail(
+                'Could not update %s from a previous version: %s',
+                item_pl.get('name'), err)
+            continue
+        finally:
+            for path in (deltapath, temppath):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        delta_bytes = int(delta.get('delta_size', 0)) * 1024
+        item_bytes = os.path.getsize(destinationpath)
+        reports.report.setdefault('DeltaDownloads', []).append(
+            {'name': item_pl.get('name'),
+             'version': item_pl.get('version'),
+             'delta_bytes': delta_bytes,
+             'bytes_saved': max(item_bytes - delta_bytes, 0)})
+        display.display_detail(
+            'Updated %s from a previous version, saving %sMB',
+            item_pl.get('name'),
+            int(max(item_bytes - delta_bytes, 0) / 1024 / 1024))
+        return True
+    return False
+
+
+@tracing.traced('download', item=0)
 def download_installeritem(item_pl,
                            installinfo, uninstalling=False, precaching=False):
     """Downloads an (un)installer item.
@@ -141,21 +258,13 @@ def download_installeritem(item_pl,
             "No %s in item info." % download_item_key)
 
     # allow pkginfo preferences to override system munki preferences
-    downloadbaseurl = item_pl.get('PackageCompleteURL') or \
-                      item_pl.get('PackageURL') or \
-                      prefs.pref('PackageURL') or \
-                      prefs.pref('SoftwareRepoURL') + '/pkgs/'
-
     # build a URL, quoting the the location to encode reserved characters
     if item_pl.get('PackageCompleteURL'):
-        pkgurl = downloadbaseurl
+        pkgurl = item_pl['PackageCompleteURL']
     else:
-        if not downloadbaseurl.endswith('/'):
-            downloadbaseurl = downloadbaseurl + '/'
-        pkgurl = downloadbaseurl + quote(location.encode('UTF-8'))
+        pkgurl = package_url(item_pl, location)
 
     pkgname = get_url_basename(location)
-    display.display_debug2('Download base URL is: %s', downloadbaseurl)
     display.display_debug2('Package name is: %s', pkgname)
     display.display_debug2('Download URL is: %s', pkgurl)
 
@@ -164,6 +273,18 @@ def download_installeritem(item_pl,
 
     display.display_detail('Downloading %s from %s', pkgname, location)
 
+    expected_hash = item_pl.get(item_hash_key, None)
+    store = contentstore.ContentStore(os.path.dirname(destinationpath))
+    manager = cache_manager()
+    cache_name = os.path.basename(destinationpath)
+    if expected_hash and store.link_to(expected_hash, destinationpath):
+        # we already have this content, perhaps under another name
+        display.display_detail(
+            '%s is already in the cache', pkgname)
+        manager.record_hit(cache_name)
+        manager.save()
+        return False
+
     if not os.path.exists(destinationpath):
         # check to see if there is enough free space to download and install
         if not enough_disk_space(item_pl,
@@ -172,25 +293,59 @@ def download_installeritem(item_pl,
                                  precaching=precaching):
             raise fetch.DownloadError(
                 'Insufficient disk space to download and install %s' % pkgname)
+        # and room within the cache size limit
+        protected, expected_reuse = cache_item_names(installinfo)
+        if uninstalling and 'uninstaller_item_size' in item_pl:
+            item_size = int(item_pl['uninstaller_item_size'])
         else:
+            item_size = int(item_pl.get('installer_item_size', 0))
+        if not manager.make_room(item_size, protected=protected,
+                                 expected_reuse=expected_reuse):
+            if precaching:
+                raise fetch.DownloadError(
+                    'Not enough room within the cache size limit to '
+                    'precache %s' % pkgname)
             display.display_detail(
-                'Downloading %s from %s', pkgname, location)
+                '%s will take the cache over its size limit', pkgname)
+        if not uninstalling and download_delta(
+                item_pl, destinationpath, store, precaching=precaching):
+            store.adopt(destinationpath, expected_hash)
+            manager.record_miss(cache_name)
+            manager.save()
+            return True
+        display.display_detail(
+            'Downloading %s from %s', pkgname, location)
 
     dl_message = 'Downloading %s...' % pkgname
-    expected_hash = item_pl.get(item_hash_key, None)
-    return fetch.munki_resource(pkgurl, destinationpath,
-                                resume=True,
-                                message=dl_message,
-                                expected_hash=expected_hash,
-                                verify=True,
-                                pkginfo=item_pl)
+    if precaching:
+        priority = fetchscheduler.PRIORITY_PRECACHE
+    else:
+        priority = fetchscheduler.PRIORITY_INSTALLS
+    changed = fetch.munki_resource(pkgurl, destinationpath,
+                                   resume=True,
+                                   message=dl_message,
+                                   expected_hash=expected_hash,
+                                   verify=True,
+                                   pkginfo=item_pl,
+                                   max_connections=download_connections(
+                                       item_pl, uninstalling=uninstalling),
+                                   priority=priority)
+    if expected_hash:
+        store.adopt(destinationpath, expected_hash)
+    if changed:
+        manager.record_miss(cache_name)
+    else:
+        manager.record_hit(cache_name)
+    manager.save()
+    return changed
 
 
 def clean_up_icons_dir(icons_to_keep):
     '''Remove any cached/downloaded icons that aren't in the list of ones to
     keep'''
     # remove no-longer needed icons from the local directory
-    icons_to_keep.append(ICON_HASHES_PLIST_NAME)
+    icons_to_keep = set(icons_to_keep)
+    icons_to_keep.add(ICON_HASHES_PLIST_NAME)
     icon_dir = os.path.join(prefs.pref('ManagedInstallDir'), 'icons')
     for (dirpath, dummy_dirnames, filenames) in os.walk(
             icon_dir, topdown=False):
@@ -202,7 +357,7 @@ def clean_up_icons_dir(icons_to_keep):
                     os.unlink(icon_path)
                 except (IOError, OSError):
                     pass
-        if osutils.listdir(dirpath):
+        if dirpath != icon_dir and not osutils.listdir(dirpath):
             # did we empty out this directory (or is it already empty)?
             # if so, remove it
             try:
@@ -219,17 +374,53 @@ def get_icon_hashes(icon_base_url):
     icon_hashes_plist = os.path.join(icon_dir, ICON_HASHES_PLIST_NAME)
     try:
         fetch.munki_resource(icon_hashes_url, icon_hashes_plist,
-                             message="Getting list of available icons")
+                             message="Getting list of available icons",
+                             priority=fetchscheduler.PRIORITY_ICONS)
         icon_hashes = FoundationPlist.readPlist(icon_hashes_plist)
     except (fetch.Error, FoundationPlist.FoundationPlistException):
         pass
     return icon_hashes
 
 
+def local_icon_hash(icon_path):
+    '''Returns the hash of a downloaded icon, 'nonexistent' if there isn't
+    one. Uses the hash remembered in the icon's xattr if it has one, so
+    icons are only hashed once.'''
+    if not os.path.isfile(icon_path):
+        return 'nonexistent'
+    local_hash = fetch.getxattr(icon_path, fetch.XATTR_SHA)
+    if local_hash:
+        # make sure it's a string and not a bytearray
+        return local_hash.decode("UTF-8")
+    local_hash = munkihash.getsha256hash(icon_path)
+    fetch.writeCachedChecksum(icon_path, local_hash)
+    return local_hash
+
+
+def sync_icon(icon_base_url, icon_name, icon_path, server_icon_hash,
+              item_name):
+    '''Downloads an icon unless the copy we have matches the server's'''
+    if server_icon_hash == local_icon_hash(icon_path):
+        return
+    icon_url = icon_base_url + quote(icon_name.encode('UTF-8'))
+    try:
+        fetch.munki_resource(
+            icon_url,
+            icon_path,
+            message='Getting icon %s for %s...' % (icon_name, item_name),
+            priority=fetchscheduler.PRIORITY_ICONS
+        )
+        fetch.writeCachedChecksum(icon_path)
+    except fetch.Error as err:
+        display.display_debug1(
+            'Error when retrieving icon %s from the server: %s',
+            icon_name, err)
+
+
 def download_icons(item_list):
     '''Attempts to download icons (actually image files) for items in
        item_list'''
-    icons_to_keep = []
+    icons_to_keep = set()
     icon_known_exts = ['.bmp', '.gif', '.icns', '.jpg', '.jpeg', '.png', '.psd',
                        '.tga', '.tif', '.tiff', '.yuv']
     icon_base_url = (prefs.pref('IconURL') or
@@ -240,26 +431,24 @@ def download_icons(item_list):
     icon_dir = os.path.join(prefs.pref('ManagedInstallDir'), 'icons')
     icon_hashes = get_icon_hashes(icon_base_url)
 
+    # work out which icons we need; several items may share one
+    icons_to_sync = []
     for item in item_list:
         icon_name = item.get('icon_name') or item['name']
         if not os.path.splitext(icon_name)[1] in icon_known_exts:
             icon_name += '.png'
+        if icon_name in icons_to_keep:
+            continue
+        icons_to_keep.add(icon_name)
+        if icon_hashes and icon_name not in icon_hashes:
+            # if we have a list of icon hashes, and the icon name is not
+            # in that list, then there's no point in attempting to
+            # download this icon
+            continue
         server_icon_hash = item.get('icon_hash')
         if not server_icon_hash and icon_hashes:
             server_icon_hash = icon_hashes.get(icon_name)
-        icons_to_keep.append(icon_name)
         icon_path = os.path.join(icon_dir, icon_name)
-        if os.path.isfile(icon_path):
-            # have we already downloaded it? If so get the hash
-            local_hash = fetch.getxattr(icon_path, fetch.XATTR_SHA)
-            if not local_hash:
-                local_hash = munkihash.getsha256hash(icon_path)
-                fetch.writeCachedChecksum(icon_path, local_hash)
-            else:
-                # make sure it's a string and not a bytearray
-                local_hash = local_hash.decode("UTF-8")
-        else:
-            local_hash = 'nonexistent'
         icon_subdir = os.path.dirname(icon_path)
         if not os.path.isdir(icon_subdir):
             try:
@@ -267,26 +456,23 @@ def download_icons(item_list):
             except OSError as err:
                 display.display_error('Could not create %s' % icon_subdir)
                 return
-        if server_icon_hash != local_hash:
-            # hashes don't match, so download the icon
-            if icon_hashes and icon_name not in icon_hashes:
-                # if we have a list of icon hashes, and the icon name is not
-                # in that list, then there's no point in attempting to
-                # download this icon
-                continue
-            item_name = item.get('display_name') or item['name']
-            icon_url = icon_base_url + quote(icon_name.encode('UTF-8'))
-            try:
-                fetch.munki_resource(
-                    icon_url,
-                    icon_path,
-                    message='Getting icon %s for %s...' % (icon_name, item_name)
-                )
-                fetch.writeCachedChecksum(icon_path)
-            except fetch.Error as err:
-                display.display_debug1(
-                    'Error when retrieving icon %s from the server: %s',
-                    icon_name, err)
+        icons_to_sync.append(
+            (icon_base_url, icon_name, icon_path, server_icon_hash,
+             item.get('display_name') or item['name']))
+
+    # check and download them a few at a time; the download scheduler
+    # keeps these behind more urgent requests
+    if futures and len(icons_to_sync) > 1:
+        workers = min(ICON_DOWNLOAD_WORKERS,
+                      fetch.get_scheduler().host_concurrency() or
+                      ICON_DOWNLOAD_WORKERS)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for result in [executor.submit(sync_icon, *args)
+                           for args in icons_to_sync]:
+                result.result()
+    else:
+        for args in icons_to_sync:
+            sync_icon(*args)
 
     # delete any previously downloaded icons we no longer need
     clean_up_icons_dir(icons_to_keep)
@@ -331,7 +517,8 @@ def download_client_resources():
         resource_url = resource_base_url + quote(filename.encode('UTF-8'))
         try:
             fetch.munki_resource(
-                resource_url, resource_archive_path, message=message)
+                resource_url, resource_archive_path, message=message,
+                priority=fetchscheduler.PRIORITY_ICONS)
             downloaded_resource_path = resource_archive_path
             break
         except fetch.Error as err:
@@ -348,6 +535,7 @@ def download_client_resources():
                     'Could not remove stale %s: %s', resource_archive_path, err)
 
 
+@tracing.traced('catalog_download', catalog=0)
 def download_catalog(catalogname):
     '''Attempt to download a catalog from the Munki server, Returns the path to
     the downloaded catalog file'''
@@ -362,7 +550,7 @@ def download_catalog(catalogname):
     display.display_detail('Getting catalog %s...', catalogname)
     message = 'Retrieving catalog "%s"...' % catalogname
     try:
-        fetch.munki_resource(catalogurl, catalogpath, message=message)
+        fetch.munki_metadata_resource(catalogurl, catalogpath, message=message)
         return catalogpath
     except fetch.Error as err:
         display.display_error(
@@ -383,6 +571,35 @@ def _installinfo():
         return {}
 
 
+def cache_manager():
+    '''Returns the CacheManager for our Cache directory'''
+    global _CACHE_MANAGER
+    with _CACHE_MANAGER_LOCK:
+        if _CACHE_MANAGER is None:
+            cachedir = os.path.join(prefs.pref('ManagedInstallDir'), 'Cache')
+            # CacheSizeLimit is in MB
+            budget = int(prefs.pref('CacheSizeLimit') or 0) * 1024
+            _CACHE_MANAGER = cachemanager.CacheManager(cachedir, budget=budget)
+        return _CACHE_MANAGER
+
+
+def cache_item_names(install_info):
+    '''Returns two sets of names of items in the Cache directory: those
+    needed for pending installs and removals, and those we expect to need
+    later (precache items)'''
+    protected = set(item['installer_item']
+                    for item in install_info.get('managed_installs', [])
+                    if item.get('installer_item'))
+    protected.update(item['uninstaller_item']
+                     for item in install_info.get('removals', [])
+                     if item.get('uninstaller_item'))
+    expected_reuse = set(
+        get_url_basename(item['installer_item_location'])
+        for item in _items_to_precache(install_info)
+        if item.get('installer_item_location'))
+    return protected, expected_reuse
+
+
 def _items_to_precache(install_info):
     '''Returns a list of items from InstallInfo.plist's optional_installs
     that have precache=True and (installed=False or needs_update=True)'''
@@ -394,79 +611,86 @@ def _items_to_precache(install_info):
     return precache_items
 
 
+def precache_item(item, install_info, queue, already_cached_kb):
+    '''Precaches a single item, within the precache disk budget'''
+    size = int(item.get('installer_item_size', 0))
+    if not queue.reserve(size, already_used=already_cached_kb):
+        display.display_info(
+            u'Skipping precaching %s: not enough room within '
+            'PrecacheDiskBudget', item['name'])
+        return
+    queue.mark(item, precachequeue.STATE_STARTED)
+    try:
+        download_installeritem(item, install_info, precaching=True)
+    except fetch.Error as err:
+        queue.release(size)
+        queue.mark(item, precachequeue.STATE_FAILED)
+        display.display_warning(
+            u'Failed to precache the installer for %s because %s',
+            item['name'], err)
+    else:
+        queue.mark(item, precachequeue.STATE_DONE)
+
+
 def cache():
-    '''Download any applicable precache items into our Cache folder'''
+    '''Download any applicable precache items into our Cache folder,
+    PrecacheConcurrency at a time, within PrecacheDiskBudget (MB) and
+    PrecacheBandwidthLimit (KB/sec; see fetch.get_scheduler).'''
     display.display_info("###   Beginning precaching session   ###")
     install_info = _installinfo()
-    for item in _items_to_precache(install_info):
-        try:
-            download_installeritem(item, install_info, precaching=True)
-        except fetch.Error as err:
-            display.display_warning(
-                u'Failed to precache the installer for %s because %s',
-                item['name'], err)
+    items = _items_to_precache(install_info)
+    managed_install_dir = prefs.pref('ManagedInstallDir')
+    queue = precachequeue.PrecacheQueue(
+        os.path.join(managed_install_dir, precachequeue.PROGRESS_FILE_NAME),
+        budget=int(prefs.pref('PrecacheDiskBudget') or 0) * 1024)
+
+    def cache_path(item):
+        '''Where an item goes in the cache'''
+        return get_download_cache_path(item['installer_item_location'])
+
+    items = [item for item in items if item.get('installer_item_location')]
+    to_do = queue.order(
+        items,
+        is_cached=lambda item: os.path.exists(cache_path(item)),
+        is_partial=lambda item: os.path.exists(
+            cache_path(item) + '.download'))
+    # what's already precached counts against the disk budget
+    already_cached_kb = sum(int(item.get('installer_item_size', 0))
+                            for item in items if item not in to_do and
+                            os.path.exists(cache_path(item)))
+    workers = max(int(prefs.pref('PrecacheConcurrency') or 1), 1)
+    if futures and workers > 1 and len(to_do) > 1:
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for result in [executor.submit(precache_item, item, install_info,
+                                           queue, already_cached_kb)
+                           for item in to_do]:
+                result.result()
+    else:
+        for item in to_do:
+            precache_item(item, install_info, queue, already_cached_kb)
     display.display_info("###    Ending precaching session     ###")
 
 
 def uncache(space_needed_in_kb):
-    '''Discard precached items to free up space for managed installs'''
-    install_info = _installinfo()
-    # make a list of names of precachable items
-    precachable_items = [
-        [os.path.basename(item['installer_item_location'])]
-        for item in _items_to_precache(install_info)
-        if item.get('installer_item_location')]
-    if not precachable_items:
-        return
-
+    '''Discard cached items to free up space for managed installs. Items
+    needed for pending installs and removals are kept; precache items go
+    only after everything else.'''
     cachedir = os.path.join(prefs.pref('ManagedInstallDir'), 'Cache')
-    # now filter our list to items actually downloaded
-    items_in_cache = osutils.listdir(cachedir)
-    precached_items = [item for item in precachable_items
-                       if item in items_in_cache]
-    if not precached_items:
-        return
-
-    precached_size = 0
-    for item in precached_items:
-        # item is [itemname]
-        item_path = os.path.join(cachedir, item[0])
-        try:
-            itemsize = int(os.path.getsize(item_path)/1024)
-        except OSError as err:
-            display.display_warning("Could not get size of %s: %s"
-                                    % (item_path, err))
-            itemsize = 0
-        precached_size += itemsize
-        item.append(itemsize)
-        # item is now [itemname, itemsize]
-
-    if precached_size < space_needed_in_kb:
-        # we can't clear enough space, so don't bother removing anything.
-        # otherwise we'll clear some space, but still can't download the large
-        # managed install, but then we'll have enough space to redownload the
-        # precachable items and so we will (and possibly do this over and
-        # over -- delete some, redownload, delete some, redownload...)
+    store = contentstore.ContentStore(cachedir)
+    # content no longer linked to any name is the first thing to go
+    space_needed_in_kb -= store.collect_garbage()
+    if space_needed_in_kb <= 0:
         return
-
-    # sort reversed by size; smallest at end
-    precached_items.sort(key=lambda x: x[1], reverse=True)
-    deleted_kb = 0
-    while precached_items:
-        if deleted_kb >= space_needed_in_kb:
-            break
-        # remove and return last item in precached_items
-        # we delete the smallest item first, proceeding until we've freed up
-        # enough space or deleted all the items
-        item = precached_items.pop()
-        item_path = os.path.join(cachedir, item[0])
-        item_size = item[1]
-        try:
-            os.remove(item_path)
-            deleted_kb += item_size
-        except OSError as err:
-            display.display_error(
-                "Could not remove precached item %s: %s" % (item_path, err))
+    # if we can't clear enough space, the cache manager doesn't remove
+    # anything. otherwise we'd clear some space, but still couldn't download
+    # the large managed install, but then we'd have enough space to
+    # redownload the precachable items and so we would (and possibly do this
+    # over and over -- delete some, redownload, delete some, redownload...)
+    protected, expected_reuse = cache_item_names(_installinfo())
+    manager = cache_manager()
+    manager.evict(space_needed_in_kb, protected=protected,
+                  expected_reuse=expected_reuse)
+    manager.save()
 
 
 PRECACHING_AGENT_LABEL = "com.googlecode.munki.precache_agent"
@@ -32,14 +32,51 @@ import os
 from . import catalogs
 from . import compare
 
+from .. import checkscripts
 from .. import display
 from .. import osutils
 from .. import profiles
 from .. import scriptutils
+from .. import tracing
 from .. import utils
 from ..wrappers import unicode_or_str
 
 
+# results of installcheck and uninstallcheck scripts run ahead of time
+_CHECK_SCRIPTS = checkscripts.CheckScriptResults()
+
+
+def precheck_scripts(items, stop_requested=None):
+    """Runs the check scripts of items, a list of (scriptname, item_pl)
+    tuples, a few at a time, keeping the results for the functions below.
+    """
+    _CHECK_SCRIPTS.evaluate(
+        [item_pl.get(scriptname) for scriptname, item_pl in items],
+        stop_requested=stop_requested)
+
+
+def reset_check_scripts():
+    """Forgets check script results from an earlier check"""
+    _CHECK_SCRIPTS.clear()
+
+
+def run_check_script(scriptname, item_pl):
+    """Returns the exit status of item_pl's scriptname, run ahead of time by
+    precheck_scripts if it was, or run now if not"""
+    result = _CHECK_SCRIPTS.result(item_pl.get(scriptname))
+    if result is None:
+        tracing.count('check_scripts_run')
+        return scriptutils.run_embedded_script(
+            scriptname, item_pl, suppress_error=True)
+    tracing.count('check_scripts_run_ahead')
+    retcode, output = result
+    display.display_detail(
+        'Running %s for %s ', scriptname, item_pl.get('name'))
+    for line in output:
+        display.display_info(line)
+    return retcode
+
+
 def installed_state(item_pl):
     """Checks to see if the item described by item_pl (or a newer version) is
     currently installed
@@ -57,8 +94,7 @@ def installed_state(item_pl):
         return 0
 
     if item_pl.get('installcheck_script'):
-        retcode = scriptutils.run_embedded_script(
-            'installcheck_script', item_pl, suppress_error=True)
+        retcode = run_check_script('installcheck_script', item_pl)
         display.display_debug1('installcheck_script returned %s', retcode)
         # retcode 0 means install is needed
         if retcode == 0:
@@ -180,8 +216,7 @@ def some_version_installed(item_pl):
         return False
 
     if item_pl.get('installcheck_script'):
-        retcode = scriptutils.run_embedded_script(
-            'installcheck_script', item_pl, suppress_error=True)
+        retcode = run_check_script('installcheck_script', item_pl)
         display.display_debug1(
             'installcheck_script returned %s', retcode)
         # retcode 0 means install is needed
@@ -249,8 +284,7 @@ def evidence_this_is_installed(item_pl):
         return False
 
     if item_pl.get('uninstallcheck_script'):
-        retcode = scriptutils.run_embedded_script(
-            'uninstallcheck_script', item_pl, suppress_error=True)
+        retcode = run_check_script('uninstallcheck_script', item_pl)
         display.display_debug1(
             'uninstallcheck_script returned %s', retcode)
         # retcode 0 means uninstall is needed
@@ -262,8 +296,7 @@ def evidence_this_is_installed(item_pl):
         return False
 
     if item_pl.get('installcheck_script'):
-        retcode = scriptutils.run_embedded_script(
-            'installcheck_script', item_pl, suppress_error=True)
+        retcode = run_check_script('installcheck_script', item_pl)
         display.display_debug1(
             'installcheck_script returned %s', retcode)
         # retcode 0 means install is needed
@@ -38,6 +38,7 @@ from .. import info
 from .. import keychain
 from .. import prefs
 from .. import reports
+from .. import tracing
 from .. import FoundationPlist
 from ..wrappers import unicode_or_str
 
@@ -75,6 +76,7 @@ def set_manifest(name, path):
     _MANIFESTS[name] = path
 
 
+@tracing.traced('manifest_fetch', manifest=0)
 def get_manifest(manifest_name, suppress_errors=False):
     """Gets a manifest from the server.
 
@@ -34,15 +34,17 @@ from .. import app_usage
 from .. import display
 
 
+def running_bundleids():
+    '''Returns the set of bundle identifiers of the running applications'''
+    workspace = NSWorkspace.sharedWorkspace()
+    return set(app.bundleIdentifier()
+               for app in workspace.runningApplications())
+
+
 def bundleid_is_running(app_bundleid):
     '''Returns a boolean indicating if the application with the given
     bundleid is currently running.'''
-    workspace = NSWorkspace.sharedWorkspace()
-    running_apps = workspace.runningApplications()
-    for app in running_apps:
-        if app.bundleIdentifier() == app_bundleid:
-            return True
-    return False
+    return app_bundleid in running_bundleids()
 
 
 def bundleids_from_installs_list(pkginfo_pl):
@@ -57,17 +59,47 @@ def bundleids_from_installs_list(pkginfo_pl):
     return bundle_ids
 
 
-def should_be_removed(item_pl):
-    """Determines if an optional install item should be removed due to lack of
-    use.
+def _bundleids_to_check(item_pl):
+    '''Returns the application bundle_ids whose use keeps an item'''
+    removal_info = item_pl.get('unused_software_removal_info') or {}
+    if 'bundle_ids' in removal_info:
+        return removal_info['bundle_ids']
+    # get application bundle_ids from installs list
+    return bundleids_from_installs_list(item_pl)
+
+
+class UsageSnapshot(object):
+    '''Application usage data and the running applications, read once so
+    any number of items can be checked against them. If bundle_ids or
+    item_names is None, usage is read for every app or item with a
+    record.'''
+
+    def __init__(self, bundle_ids=None, item_names=None):
+        usage = app_usage.ApplicationUsageQuery()
+        self.days_of_data = usage.days_of_data()
+        self.days_since_activation = usage.days_since_last_usage_events(
+            'activate', bundle_ids)
+        self.days_since_install_request = (
+            usage.days_since_last_install_events('install', item_names))
+        self.running = running_bundleids()
+
+
+# item name: removal decision, made by decide_removals for this update check
+_DECISIONS = {}
+
+
+def reset_removal_decisions():
+    '''Forgets the removal decisions made during an earlier update check'''
+    _DECISIONS.clear()
+
+
+def _judge(item_pl, snapshot):
+    """Determines from snapshot if an optional install item should be
+    removed due to lack of use.
     Returns a boolean."""
 
     name = item_pl['name']
     removal_info = item_pl.get('unused_software_removal_info')
-    # do we have unused_software_removal_info?
-    if not removal_info:
-        return False
-
     display.display_debug1(
         '\tChecking to see if %s should be removed due to lack of use...', name)
     try:
@@ -81,9 +113,7 @@ def should_be_removed(item_pl):
 
     display.display_debug1(
         '\t\tNumber of days until removal is %s', removal_days)
-    usage = app_usage.ApplicationUsageQuery()
-    usage_data_days = usage.days_of_data()
-    if usage_data_days is None or usage_data_days < removal_days:
+    if snapshot.days_of_data is None or snapshot.days_of_data < removal_days:
         # we don't have usage data old enough to judge
         display.display_debug1(
             '\t\tApplication usage data covers fewer than %s days.',
@@ -91,21 +121,16 @@ def should_be_removed(item_pl):
         return False
 
     # check to see if we have an install request within the removal_days
-    days_since_install_request = usage.days_since_last_install_event(
-        'install', name)
+    days_since_install_request = (
+        snapshot.days_since_install_request or {}).get(name)
     if (days_since_install_request is not None and
-            days_since_install_request != -1 and
             days_since_install_request <= removal_days):
         display.display_debug1('\t\t%s had an install request %s days ago.',
                                name, days_since_install_request)
         return False
 
     # get list of application bundle_ids to check
-    if 'bundle_ids' in removal_info:
-        bundle_ids = removal_info['bundle_ids']
-    else:
-        # get application bundle_ids from installs list
-        bundle_ids = bundleids_from_installs_list(item_pl)
+    bundle_ids = _bundleids_to_check(item_pl)
     if not bundle_ids:
         display.display_debug1('\\tNo application bundle_ids to check.')
         return False
@@ -114,16 +139,19 @@ def should_be_removed(item_pl):
     # activated in the past removal_days days
     display.display_debug1('\t\tChecking bundle_ids: %s', bundle_ids)
     for bundle_id in bundle_ids:
-        if bundleid_is_running(bundle_id):
+        if bundle_id in snapshot.running:
             display.display_debug1(
                 '\t\tApplication %s is currently running.' % bundle_id)
             return False
-        days_since_last_activation = usage.days_since_last_usage_event(
-            'activate', bundle_id)
+        if snapshot.days_since_activation is None:
+            # usage data is missing or broken
+            return False
+        days_since_last_activation = snapshot.days_since_activation.get(
+            bundle_id, -1)
         if days_since_last_activation == -1:
             display.display_debug1(
                 '\t\t%s has not been activated in more than %s days...',
-                bundle_id, usage.days_of_data())
+                bundle_id, snapshot.days_of_data)
         elif days_since_last_activation <= removal_days:
             display.display_debug1('\t\t%s was last activated %s days ago',
                                    bundle_id, days_since_last_activation)
@@ -134,8 +162,56 @@ def should_be_removed(item_pl):
 
     # if we get this far we must not have found any apps used in the past
     # removal_days days, so we should set up a removal
-    display.display_info('Will add %s to the removal list since it has been '
-                         'unused for at least %s days...', name, removal_days)
+    display.display_debug1(
+        '\t\t%s has been unused for at least %s days.', name, removal_days)
+    return True
+
+
+def removal_decisions(items):
+    """Determines which of a list of optional install items should be
+    removed due to lack of use. Usage data is read with one query for each
+    kind of check and the running applications are listed once, however
+    many items there are.
+    Returns a dictionary of item name: boolean."""
+    candidates = [item_pl for item_pl in items
+                  if item_pl.get('unused_software_removal_info')]
+    decisions = dict((item_pl['name'], False) for item_pl in items)
+    if not candidates:
+        return decisions
+    bundle_ids = set()
+    for item_pl in candidates:
+        bundle_ids.update(_bundleids_to_check(item_pl))
+    snapshot = UsageSnapshot(
+        bundle_ids=bundle_ids,
+        item_names=[item_pl['name'] for item_pl in candidates])
+    for item_pl in candidates:
+        decisions[item_pl['name']] = _judge(item_pl, snapshot)
+    return decisions
+
+
+def decide_removals(items):
+    """Makes the removal decisions for a list of optional install items in
+    one pass over the usage data, ahead of the analysis, for
+    should_be_removed to use."""
+    _DECISIONS.update(removal_decisions(items))
+
+
+def should_be_removed(item_pl):
+    """Determines if an optional install item should be removed due to lack of
+    use, using the decision made by decide_removals if there was one.
+    Returns a boolean."""
+    # do we have unused_software_removal_info?
+    if not item_pl.get('unused_software_removal_info'):
+        return False
+    name = item_pl['name']
+    if name not in _DECISIONS:
+        _DECISIONS.update(removal_decisions([item_pl]))
+    if not _DECISIONS[name]:
+        return False
+    display.display_info(
+        'Will add %s to the removal list since it has been unused for at '
+        'least %s days...', name,
+        item_pl['unused_software_removal_info'].get('removal_days'))
     return True
 
 
@@ -27,6 +27,7 @@ from __future__ import absolute_import, print_function
 
 import grp
 import os
+import signal
 import subprocess
 import stat
 
@@ -58,6 +59,10 @@ class ScriptNotFoundError(RunExternalScriptError):
     """The script was not found at the given path."""
 
 
+class ScriptTimeoutError(RunExternalScriptError):
+    """The script did not finish in time and was killed."""
+
+
 class VerifyFilePermissionsError(Error):
     """There was an error verifying file permissions."""
 
@@ -110,17 +115,21 @@ def verifyFileOnlyWritableByMunkiAndRoot(file_path):
             '%s is not secure! %s' % (file_path, err.args[0]))
 
 
-def runExternalScript(script, allow_insecure=False, script_args=()):
+def runExternalScript(script, allow_insecure=False, script_args=(),
+                      env=None, timeout=None):
     """Run a script (e.g. preflight/postflight) and return its exit status.
 
     Args:
       script: string path to the script to execute.
       allow_insecure: bool skip the permissions check of executable.
       args: args to pass to the script.
+      env: dict environment for the script, or None to inherit ours.
+      timeout: seconds to wait for the script, or None to wait forever.
     Returns:
       Tuple. (integer exit status from script, str stdout, str stderr).
     Raises:
       ScriptNotFoundError: the script was not found at the given path.
+      ScriptTimeoutError: the script ran longer than timeout.
       RunExternalScriptError: there was an error running the script.
     """
     if not os.path.exists(script):
@@ -145,11 +154,23 @@ def runExternalScript(script, allow_insecure=False, script_args=()):
         proc = subprocess.Popen(cmd, shell=False,
                                 stdin=subprocess.PIPE,
                                 stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
+                                stderr=subprocess.PIPE,
+                                env=env,
+                                # so we can kill anything it starts, too
+                                start_new_session=timeout is not None)
     except (OSError, IOError) as err:
         raise RunExternalScriptError(
             u'Error %s when attempting to run %s' % (err, script))
-    (stdout, stderr) = proc.communicate()
+    try:
+        (stdout, stderr) = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            proc.kill()
+        proc.communicate()
+        raise ScriptTimeoutError(
+            '%s did not finish in %s seconds' % (script, timeout))
     return (proc.returncode, stdout.decode('UTF-8', 'replace'),
             stderr.decode('UTF-8', 'replace'))
 
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+bench_app_usage.py
+
+Throughput benchmark for app_usage.ApplicationUsageRecorder. Logs synthetic
+launch, activate and quit events for a few hundred apps, first writing
+each event as it is logged, then in batches. For comparison, a smaller
+number of events is also written the old way, with a new connection, a
+table check and a commit per event.
+
+Run from the code/client directory:
+
+    python -m tests.benchmarks.bench_app_usage [event_count]
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from munkilib import app_usage
+
+APP_COUNT = 300
+EVENTS = ('launch', 'activate', 'quit')
+
+
+def events(count):
+    '''Yields count synthetic (event, app_dict) pairs'''
+    for index in range(count):
+        app_index = (index * 7919) % APP_COUNT
+        yield (EVENTS[index % len(EVENTS)],
+               {'bundle_id': 'com.example.App%03d' % app_index,
+                'version': '1.%s' % (index % 5),
+                'path': '/Applications/App%03d.app' % app_index})
+
+
+def run_recorder(database, count, batch_size):
+    '''Returns seconds taken to record count events'''
+    start = time.time()
+    recorder = app_usage.ApplicationUsageRecorder(
+        database, batch_size=batch_size)
+    for event, app_dict in events(count):
+        recorder.log_application_usage(event, app_dict)
+    recorder.close()
+    return time.time() - start
+
+
+def run_per_event_connection(database, count):
+    '''Returns seconds taken to record count events with a connection, a
+    table check and a commit for each'''
+    recorder = app_usage.ApplicationUsageRecorder(database)
+    start = time.time()
+    for event, app_dict in events(count):
+        conn = sqlite3.connect(database)
+        if not recorder._detect_application_usage_table(conn):
+            recorder._create_application_usage_table(conn)
+        recorder._insert_application_usage(conn, event, app_dict)
+        conn.commit()
+        conn.close()
+    return time.time() - start
+
+
+def total_events(database):
+    '''Returns the sum of number_times in database'''
+    conn = sqlite3.connect(database)
+    total = conn.execute(
+        'SELECT SUM(number_times) FROM application_usage').fetchone()[0]
+    conn.close()
+    return total
+
+
+def main():
+    '''Print throughput for each way of recording'''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('%-26s %8s %10s %12s' % ('mode', 'events', 'seconds',
+                                       'events/sec'))
+        runs = [
+            ('connection per event', min(count, 2000),
+             run_per_event_connection),
+            ('batch_size=1', count,
+             lambda database, count: run_recorder(database, count, 1)),
+            ('batch_size=%s' % app_usage.APPLICATION_USAGE_BATCH_SIZE, count,
+             lambda database, count: run_recorder(database, count, None)),
+        ]
+        for index, (mode, run_count, run) in enumerate(runs):
+            database = os.path.join(tmpdir, '%s.sqlite' % index)
+            elapsed = run(database, run_count)
+            assert total_events(database) == run_count
+            print('%-26s %8d %10.3f %12.0f'
+                  % (mode, run_count, elapsed, run_count / elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
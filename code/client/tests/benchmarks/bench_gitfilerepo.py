@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+bench_gitfilerepo.py
+
+Benchmark for GitFileRepo: writes a batch of catalog-sized files to a
+scratch git repo one commit per file, then again inside a transaction
+(one commit for the batch), and reports time taken and commits made.
+
+Run from the code/client directory:
+
+    python -m tests.benchmarks.bench_gitfilerepo [file_count]
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from munkilib import munkirepo
+from munkilib.munkirepo.GitFileRepo import GITCMD, GitFileRepo
+
+
+def make_scratch_repo():
+    '''Creates a scratch git repo with a munki repo layout'''
+    root = tempfile.mkdtemp(prefix='bench_gitfilerepo.')
+    for kind in ('catalogs', 'pkgsinfo'):
+        os.mkdir(os.path.join(root, kind))
+    for args in (['init', '-q'],
+                 ['config', 'user.name', 'bench'],
+                 ['config', 'user.email', 'bench@example.com'],
+                 ['commit', '-q', '--allow-empty', '-m', 'initial']):
+        subprocess.check_call([GITCMD] + args, cwd=root)
+    return root
+
+
+def commit_count(root):
+    '''Returns the number of commits in the scratch repo'''
+    output = subprocess.check_output(
+        [GITCMD, 'rev-list', '--count', 'HEAD'], cwd=root)
+    return int(output.strip())
+
+
+def write_files(repo, count, batched):
+    '''Writes count files (and deletes one) to the repo'''
+    context = (munkirepo.transaction(repo) if batched
+               else contextlib.nullcontext())
+    with context:
+        for index in range(count):
+            repo.put('catalogs/catalog%s' % index,
+                     (b'<plist>%s</plist>\n' % str(time.time()).encode()) * 500)
+        repo.delete('catalogs/catalog0')
+
+
+def main():
+    '''Time unbatched and batched writes'''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    for batched in (False, True):
+        root = make_scratch_repo()
+        try:
+            repo = GitFileRepo('file://' + root)
+            before = commit_count(root)
+            start = time.time()
+            # GitFileRepo prints a line per commit; keep the output readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                write_files(repo, count, batched)
+            elapsed = time.time() - start
+            print('%-10s %4d files: %7.2f seconds, %4d commits'
+                  % ('batched' if batched else 'unbatched', count + 1,
+                     elapsed, commit_count(root) - before))
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+bench_makecatalogs.py
+
+Scaling benchmark for makecatalogslib.verify_pkginfo. Times payload checks
+of synthetic pkginfos against synthetic pkgs listings of growing size; with
+an indexed pkgs listing the time per pkginfo should stay flat.
+
+Run from the code/client directory:
+
+    python -m tests.benchmarks.bench_makecatalogs
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import time
+
+from munkilib.admin import makecatalogslib
+
+
+def run(pkg_count, pkginfo_count):
+    '''Returns seconds taken to verify pkginfo_count pkginfos against a
+    listing of pkg_count pkgs. A tenth of the pkginfos refer to pkgs with
+    different case, and a tenth to missing pkgs, so the slow paths are
+    exercised too.'''
+    pkgs = ['pkgs/apps/Item%06d-1.0.dmg' % index for index in range(pkg_count)]
+    pkginfos = []
+    for index in range(pkginfo_count):
+        location = 'apps/Item%06d-1.0.dmg' % (index % pkg_count)
+        if index % 10 == 1:
+            location = location.upper()
+        elif index % 10 == 2:
+            location = 'apps/Missing%06d.dmg' % index
+        pkginfos.append(('pkgsinfo/%s' % index,
+                         {'name': 'Item%s' % index,
+                          'installer_item_location': location}))
+    start = time.time()
+    pkgs_index = makecatalogslib.ItemIndex(pkgs)
+    errors = []
+    for pkginfo_ref, pkginfo in pkginfos:
+        makecatalogslib.verify_pkginfo(pkginfo_ref, pkginfo, pkgs_index, errors)
+    return time.time() - start
+
+
+def main():
+    '''Print timings for growing repo sizes'''
+    print('%8s %10s %10s %14s' % ('pkgs', 'pkginfos', 'seconds', 'usec/pkginfo'))
+    for scale in (1250, 2500, 5000, 10000, 20000, 40000):
+        pkginfo_count = scale * 3 // 4
+        elapsed = run(scale, pkginfo_count)
+        print('%8d %10d %10.3f %14.2f'
+              % (scale, pkginfo_count, elapsed,
+                 elapsed / pkginfo_count * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+bench_proctable.py
+
+Benchmark for blocking application checks. Times looking up a few
+applications for each of a number of items, first listing the processes
+and scanning the list for every lookup, as processes.is_app_running used
+to, then with proctable snapshots. Uses /proc on Linux and ps elsewhere.
+
+Run from the code/client directory:
+
+    python -m tests.benchmarks.bench_proctable [item_count]
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+
+from munkilib import proctable
+
+# blocking applications checked for each item
+APPNAMES = ['Firefox.app', 'Microsoft Word', 'python3', '/usr/sbin/cron']
+
+
+def linear_matching(proc_list, appname):
+    '''Matches appname by scanning every process'''
+    if appname.startswith('/'):
+        matching_items = [item for item in proc_list if item == appname]
+    elif appname.endswith('.app'):
+        matching_items = [item for item in proc_list
+                          if '/' + appname + '/Contents/MacOS/' in item]
+    else:
+        matching_items = [item for item in proc_list
+                          if item.endswith('/' + appname)]
+    if not matching_items:
+        matching_items = [item for item in proc_list
+                          if '/' + appname + '.app/Contents/MacOS/' in item]
+    return matching_items
+
+
+def run_per_lookup(source, item_count):
+    '''Returns seconds taken listing processes for every lookup'''
+    start = time.time()
+    for _ in range(item_count):
+        for appname in APPNAMES:
+            linear_matching(source(), appname)
+    return time.time() - start
+
+
+def run_snapshots(source, item_count):
+    '''Returns seconds taken using snapshots, and how many were taken'''
+    start = time.time()
+    snapshots = proctable.ProcessSnapshots(source=source)
+    for _ in range(item_count):
+        table = snapshots.get()
+        for appname in APPNAMES:
+            table.matching(appname)
+    return time.time() - start, snapshots.snapshots_taken
+
+
+def main():
+    '''Print timings for both ways of checking'''
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    source = proctable.default_source()
+    print('source: %s, %s processes, %s items, %s lookups each'
+          % (source.__name__, len(source()), item_count, len(APPNAMES)))
+    elapsed = run_per_lookup(source, item_count)
+    print('%-22s %10.3f seconds %8d snapshots'
+          % ('list per lookup', elapsed, item_count * len(APPNAMES)))
+    elapsed, taken = run_snapshots(source, item_count)
+    print('%-22s %10.3f seconds %8d snapshots'
+          % ('snapshot with TTL', elapsed, taken))
+
+
+if __name__ == '__main__':
+    main()
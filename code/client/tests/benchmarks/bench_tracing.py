@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+bench_tracing.py
+
+Overhead of tracing spans. Calls a small function a large number of times
+undecorated, decorated with tracing.traced while tracing is off, and while
+tracing is on, with and without keeping trace events.
+
+Run from the code/client directory:
+
+    python -m tests.benchmarks.bench_tracing [call_count]
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+
+from munkilib import tracing
+
+
+def compare_versions(item):
+    '''Stands in for a comparison done for every installs item'''
+    return item.get('CFBundleShortVersionString', '') >= '1.0'
+
+
+@tracing.traced('installs_comparison', item=0)
+def traced_compare_versions(item):
+    '''compare_versions, traced'''
+    return item.get('CFBundleShortVersionString', '') >= '1.0'
+
+
+def run(func, count):
+    '''Returns seconds taken to call func count times'''
+    item = {'path': '/Applications/App.app',
+            'CFBundleShortVersionString': '1.2'}
+    start = time.time()
+    for _ in range(count):
+        func(item)
+    return time.time() - start
+
+
+def main():
+    '''Print the cost per call of each mode'''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print('%-24s %10s %10s %14s' % ('mode', 'calls', 'seconds',
+                                    'ns/call extra'))
+    baseline = run(compare_versions, count)
+    print('%-24s %10d %10.3f %14s' % ('undecorated', count, baseline, '-'))
+    runs = [('tracing off', None), ('tracing on', False),
+            ('tracing on, events', True)]
+    for mode, record_events in runs:
+        if record_events is None:
+            tracing.stop()
+        else:
+            tracing.start(record_events=record_events)
+        elapsed = run(traced_compare_versions, count)
+        tracing.stop()
+        print('%-24s %10d %10.3f %14.0f'
+              % (mode, count, elapsed,
+                 (elapsed - baseline) / count * 1000000000))
+
+
+if __name__ == '__main__':
+    main()
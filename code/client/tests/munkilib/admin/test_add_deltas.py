@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_add_deltas.py
+
+Unit tests for makecatalogslib.add_deltas.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import munkihash
+from munkilib.admin import makecatalogslib
+from munkilib.admin.common import HASH_CACHE_DB
+
+
+OLD = os.urandom(2 * 1024 * 1024)
+NEW = OLD[:500000] + os.urandom(4000) + OLD[500000:]
+
+
+class LocalRepo(object):
+    """Just enough of a file repo for add_deltas"""
+
+    def __init__(self, root):
+        self.root = root
+        self.put_count = 0
+
+    def local_path(self, resource_identifier):
+        return os.path.join(self.root, resource_identifier)
+
+    def put_from_local_file(self, resource_identifier, local_file_path):
+        self.put_count += 1
+        shutil.copyfile(local_file_path, self.local_path(resource_identifier))
+
+
+class TestAddDeltas(unittest.TestCase):
+    """Test delta creation and the pkginfo metadata for it."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'pkgs', 'apps'))
+        self.repo = LocalRepo(self.tmpdir)
+        self.pkgsinfo = [self.pkginfo('2.0', NEW), self.pkginfo('1.10', OLD),
+                         self.pkginfo('1.9', os.urandom(1000))]
+        patcher = mock.patch.object(makecatalogslib, 'DELTA_MINIMUM_ITEM_SIZE',
+                                    1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hash_cache = munkihash.HashCache(
+            os.path.join(self.tmpdir, 'hashes'))
+        cache_patcher = mock.patch.dict(munkihash._SHARED_HASH_CACHES,
+                                        {HASH_CACHE_DB: self.hash_cache})
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    def tearDown(self):
+        self.hash_cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def pkginfo(self, version, content):
+        location = 'apps/Thing-%s.dmg' % version
+        with open(os.path.join(self.tmpdir, 'pkgs', location), 'wb') as f:
+            f.write(content)
+        return {'name': 'Thing',
+                'version': version,
+                'installer_item_location': location,
+                'installer_item_hash': hashlib.sha256(content).hexdigest(),
+                'installer_item_size': int(len(content) / 1024)}
+
+    def test_delta_from_previous_version(self):
+        errors = []
+        makecatalogslib.add_deltas(self.repo, self.pkgsinfo, errors)
+        self.assertEqual(errors, [])
+        newest, previous = self.pkgsinfo[0], self.pkgsinfo[1]
+        deltas = newest['installer_item_deltas']
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]['base_hash'],
+                         previous['installer_item_hash'])
+        delta_path = os.path.join(
+            self.tmpdir, 'pkgs', deltas[0]['delta_location'])
+        with open(delta_path, 'rb') as fileobj:
+            self.assertEqual(hashlib.sha256(fileobj.read()).hexdigest(),
+                             deltas[0]['delta_hash'])
+        self.assertLess(deltas[0]['delta_size'],
+                        newest['installer_item_size'] / 2)
+        # 1.9 has nothing in common with 1.10, so no delta is offered
+        self.assertNotIn('installer_item_deltas', previous)
+
+    def test_existing_deltas_are_reused(self):
+        makecatalogslib.add_deltas(self.repo, self.pkgsinfo, [])
+        put_count = self.repo.put_count
+        first = self.pkgsinfo[0]['installer_item_deltas']
+        del self.pkgsinfo[0]['installer_item_deltas']
+        makecatalogslib.add_deltas(self.repo, self.pkgsinfo, [])
+        self.assertEqual(self.repo.put_count, put_count)
+        self.assertEqual(self.pkgsinfo[0]['installer_item_deltas'], first)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
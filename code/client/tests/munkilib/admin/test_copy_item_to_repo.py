@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_copy_item_to_repo.py
+
+Unit tests for munkiimportlib.copy_item_to_repo.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import munkihash
+from munkilib import munkirepo
+from munkilib.admin import munkiimportlib
+from munkilib.admin.common import HASH_CACHE_DB
+
+
+class TestCopyItemToRepo(unittest.TestCase):
+    """Test copying installer items and remembering their hashes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'repo')
+        os.makedirs(os.path.join(self.root, 'pkgs'))
+        self.item = os.path.join(self.tmpdir, 'Firefox.dmg')
+        self.content = b'Firefox' * 1000
+        with open(self.item, 'wb') as fileobj:
+            fileobj.write(self.content)
+        self.itemhash = hashlib.sha256(self.content).hexdigest()
+        self.repo = munkirepo.connect('file://' + self.root, 'FileRepo')
+        self.hash_cache = munkihash.HashCache(
+            os.path.join(self.tmpdir, 'hashcache.sqlite'))
+        patcher = mock.patch.dict(munkihash._SHARED_HASH_CACHES,
+                                  {HASH_CACHE_DB: self.hash_cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.hash_cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def copy(self):
+        with mock.patch.object(
+                self.repo, 'put_from_local_file',
+                wraps=self.repo.put_from_local_file) as plain, \
+                mock.patch.object(
+                    self.repo, 'put_from_local_file_with_hash',
+                    wraps=self.repo.put_from_local_file_with_hash) as hashed:
+            path = munkiimportlib.copy_item_to_repo(
+                self.repo, self.item, '100.0', subdirectory='apps')
+        self.assertEqual(path, 'pkgs/apps/Firefox-100.0.dmg')
+        with open(os.path.join(self.root, path), 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), self.content)
+        return path, plain.called, hashed.called
+
+    def test_hashed_item_is_copied_without_rehashing(self):
+        # as makepkginfo does
+        munkihash.cached_sha256hash(self.item, HASH_CACHE_DB)
+        path, plain, hashed = self.copy()
+        self.assertTrue(plain)
+        self.assertFalse(hashed)
+        self.assertEqual(
+            munkihash.known_sha256hash(os.path.join(self.root, path),
+                                       HASH_CACHE_DB),
+            self.itemhash)
+
+    def test_unhashed_item_is_hashed_while_copied(self):
+        path, plain, hashed = self.copy()
+        self.assertFalse(plain)
+        self.assertTrue(hashed)
+        self.assertEqual(
+            munkihash.known_sha256hash(os.path.join(self.root, path),
+                                       HASH_CACHE_DB),
+            self.itemhash)
+
+    def test_changed_item_is_hashed_again(self):
+        munkihash.cached_sha256hash(self.item, HASH_CACHE_DB)
+        with open(self.item, 'ab') as fileobj:
+            fileobj.write(b'more')
+        self.content += b'more'
+        _, plain, hashed = self.copy()
+        self.assertFalse(plain)
+        self.assertTrue(hashed)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_import_index.py
+
+Unit tests for munkiimportlib.ImportIndex and find_matching_pkginfo.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import FoundationPlist
+from munkilib import munkirepo
+from munkilib.admin import munkiimportlib
+
+
+def pkginfo(name, version, **extra):
+    '''Returns a minimal pkginfo item'''
+    item = {'name': name, 'version': version,
+            'installer_item_location': 'apps/%s-%s.dmg' % (name, version),
+            'catalogs': ['testing']}
+    item.update(extra)
+    return item
+
+
+FIREFOX = pkginfo(
+    'Firefox', '100.0', installer_item_hash='f' * 64,
+    installs=[{'type': 'application', 'path': '/Applications/Firefox.app',
+               'CFBundleShortVersionString': '100.0'}])
+CHROME = pkginfo(
+    'Chrome', '120.0',
+    receipts=[{'packageid': 'com.google.Chrome', 'version': '120.0'}])
+OFFICE = pkginfo('Office', '16.0')
+
+
+class TestImportIndex(unittest.TestCase):
+    """Test matching, persistence and rebuilding of the import index."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'repo')
+        os.makedirs(os.path.join(self.root, 'catalogs'))
+        self.database = os.path.join(self.tmpdir, 'importindex.sqlite')
+        self.repo = munkirepo.connect('file://' + self.root, 'FileRepo')
+        self.write_catalog([FIREFOX, CHROME, OFFICE])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_catalog(self, items):
+        path = os.path.join(self.root, 'catalogs', 'all')
+        with open(path, 'wb') as fileobj:
+            fileobj.write(FoundationPlist.writePlistToString(items))
+        # make sure the size/mtime signature changes
+        stat_info = os.stat(path)
+        os.utime(path, ns=(stat_info.st_atime_ns,
+                           stat_info.st_mtime_ns + 1000000000))
+
+    def index(self):
+        index = munkiimportlib.ImportIndex(self.repo, database=self.database)
+        index.load()
+        return index
+
+    def rowids(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            return dict(conn.execute(
+                'SELECT item_key, rowid FROM pkginfo_items'))
+        finally:
+            conn.close()
+
+    def test_matching(self):
+        with mock.patch.object(munkiimportlib, 'CACHE_DIR', self.tmpdir):
+            match = munkiimportlib.find_matching_pkginfo
+            self.assertEqual(
+                match(self.repo, {'installer_item_hash': 'f' * 64})['name'],
+                'Firefox')
+            self.assertEqual(
+                match(self.repo, {'receipts': [
+                    {'packageid': 'com.google.Chrome'}]})['name'],
+                'Chrome')
+            self.assertEqual(
+                match(self.repo, {'installs': [
+                    {'type': 'application',
+                     'path': '/Applications/Firefox.app'}]})['name'],
+                'Firefox')
+            self.assertEqual(
+                match(self.repo, {'installer_item_location':
+                                  'apps/Office.dmg'})['name'],
+                'Office')
+            self.assertEqual(
+                match(self.repo, {'installer_item_location': 'Nope.dmg'}),
+                {})
+
+    def test_index_persists(self):
+        index = self.index()
+        self.assertEqual(index.item(1), CHROME)
+        # an unchanged catalogs/all isn't read again
+        with mock.patch.object(self.repo, 'get',
+                               side_effect=AssertionError('read')):
+            index = self.index()
+            self.assertEqual(index.item_count, 3)
+            self.assertEqual(index.item(2), OFFICE)
+
+    def test_added_item_persists(self):
+        index = self.index()
+        new_item = pkginfo('Slack', '4.0')
+        index.add_pkginfo(
+            new_item, FoundationPlist.writePlistToString(new_item))
+        index = self.index()
+        self.assertEqual(index.item_count, 4)
+        self.assertEqual(
+            index['installer_items']['Slack.dmg']['4.0'], [3])
+        self.assertEqual(index.item(3), new_item)
+
+    def test_rebuild_rewrites_only_changed_items(self):
+        self.index()
+        before = self.rowids()
+        self.assertEqual(len(before), 3)
+        changed_office = pkginfo('Office', '16.0', description='changed')
+        self.write_catalog(
+            [pkginfo('Adobe', '1.0'), FIREFOX, CHROME, changed_office])
+        index = self.index()
+        after = self.rowids()
+        self.assertEqual(len(after), 4)
+        # items that moved but didn't change aren't rewritten
+        firefox_key = 'Firefox-100.0:apps/Firefox-100.0.dmg'
+        chrome_key = 'Chrome-120.0:apps/Chrome-120.0.dmg'
+        office_key = 'Office-16.0:apps/Office-16.0.dmg'
+        self.assertEqual(after[firefox_key], before[firefox_key])
+        self.assertEqual(after[chrome_key], before[chrome_key])
+        self.assertNotEqual(after[office_key], before[office_key])
+        self.assertEqual(index.item(1), FIREFOX)
+        self.assertEqual(index.item(3), changed_office)
+        # and removed items are dropped
+        self.write_catalog([FIREFOX])
+        self.index()
+        self.assertEqual(list(self.rowids()), [firefox_key])
+
+    def test_duplicate_items_are_kept_apart(self):
+        duplicate = pkginfo('Office', '16.0', catalogs=['production'])
+        self.write_catalog([OFFICE, duplicate])
+        index = self.index()
+        self.assertEqual(len(self.rowids()), 2)
+        self.assertEqual(self.index().item(1), duplicate)
+        self.assertEqual(index.item(0), OFFICE)
+
+    def test_database_error_falls_back_to_catalog(self):
+        index = self.index()
+        index = self.index()
+        conn = sqlite3.connect(self.database)
+        conn.execute('DROP TABLE pkginfo_items')
+        conn.commit()
+        conn.close()
+        self.assertEqual(index.item(2), OFFICE)
+        self.assertIsNone(index.conn)
+        self.assertEqual(index.item(0), FIREFOX)
+
+    def test_database_error_and_no_catalog(self):
+        with mock.patch.object(munkiimportlib, 'CACHE_DIR', self.tmpdir):
+            munkiimportlib.get_import_index(self.repo)
+            index = munkiimportlib.get_import_index(self.repo)
+            # the next lookup has to read items from the database
+            index._decoded = {}
+            conn = sqlite3.connect(index.database)
+            conn.execute('DROP TABLE pkginfo_items')
+            conn.commit()
+            conn.close()
+            with mock.patch.object(
+                    index, 'load'), mock.patch.object(
+                        self.repo, 'get',
+                        side_effect=munkirepo.RepoError('gone')):
+                self.assertEqual(
+                    munkiimportlib.find_matching_pkginfo(
+                        self.repo, {'installer_item_hash': 'f' * 64}), {})
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_verify_item_hashes.py
+
+Unit tests for makecatalogslib.verify_item_hashes.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import munkihash
+from munkilib import munkirepo
+from munkilib.admin import makecatalogslib
+from munkilib.admin.common import HASH_CACHE_DB
+
+
+class TestVerifyItemHashes(unittest.TestCase):
+    """Test verify_item_hashes against installer items in a FileRepo."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'repo')
+        os.makedirs(os.path.join(self.root, 'pkgs', 'apps'))
+        self.content = b'Firefox' * 1000
+        with open(os.path.join(self.root, 'pkgs', 'apps', 'Firefox.dmg'),
+                  'wb') as fileobj:
+            fileobj.write(self.content)
+        self.repo = munkirepo.connect('file://' + self.root, 'FileRepo')
+        self.errors = []
+        self.hash_cache = munkihash.HashCache(
+            os.path.join(self.tmpdir, 'hashcache.sqlite'))
+        patcher = mock.patch.dict(munkihash._SHARED_HASH_CACHES,
+                                  {HASH_CACHE_DB: self.hash_cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.hash_cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def verify(self, location, itemhash):
+        pkginfo = {'name': 'Firefox',
+                   'installer_item_location': location,
+                   'installer_item_hash': itemhash}
+        return makecatalogslib.verify_item_hashes(
+            self.repo, [('pkgsinfo/Firefox.plist', pkginfo)], self.errors)
+
+    def test_matching_hash(self):
+        failed = self.verify('apps/Firefox.dmg',
+                             hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(failed, set())
+        self.assertEqual(self.errors, [])
+
+    def test_mismatched_hash(self):
+        failed = self.verify('apps/Firefox.dmg',
+                             hashlib.sha256(b'something else').hexdigest())
+        self.assertEqual(failed, set(['pkgsinfo/Firefox.plist']))
+        self.assertEqual(len(self.errors), 1)
+        self.assertIn('does not match installer item', self.errors[0])
+
+    def test_missing_installer_item(self):
+        # missing items are left for verify_pkginfo to report
+        failed = self.verify('apps/Safari.dmg',
+                             hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(failed, set())
+        self.assertEqual(self.errors, [])
+
+    def test_plugin_without_local_paths_is_skipped(self):
+        class DownloadOnlyRepo(object):
+            """A repo plugin without local_path"""
+        failed = makecatalogslib.verify_item_hashes(
+            DownloadOnlyRepo(),
+            [('pkgsinfo/Firefox.plist',
+              {'installer_item_location': 'apps/Firefox.dmg',
+               'installer_item_hash': 'abc'})], self.errors)
+        self.assertEqual(failed, set())
+        self.assertIn('Skipping hash verification', self.errors[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_verify_pkginfo.py
+
+Unit tests for makecatalogslib.verify_pkginfo.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import unittest
+
+from munkilib.admin import makecatalogslib
+
+
+PKGS = ['pkgs/apps/Firefox-100.0.dmg', 'pkgs/apps/Chrome.dmg',
+        'pkgs/tools/Uninstall-Tool.pkg']
+
+
+class TestVerifyPkginfo(unittest.TestCase):
+    """Test verify_pkginfo against an indexed pkgs listing."""
+
+    def setUp(self):
+        self.index = makecatalogslib.ItemIndex(PKGS)
+        self.errors = []
+
+    def verify(self, pkginfo):
+        return makecatalogslib.verify_pkginfo(
+            'pkgsinfo/test', pkginfo, self.index, self.errors)
+
+    def test_exact_match(self):
+        self.assertTrue(
+            self.verify({'installer_item_location': 'apps/Chrome.dmg'}))
+        self.assertEqual(self.errors, [])
+
+    def test_case_insensitive_match_warns(self):
+        self.assertTrue(
+            self.verify({'installer_item_location': 'apps/chrome.DMG'}))
+        self.assertEqual(len(self.errors), 1)
+        self.assertIn('pkgs/apps/Chrome.dmg', self.errors[0])
+
+    def test_missing_item(self):
+        self.assertFalse(
+            self.verify({'installer_item_location': 'apps/Safari.dmg'}))
+        self.assertIn('missing installer item', self.errors[0])
+
+    def test_missing_uninstaller_item(self):
+        self.assertFalse(
+            self.verify({'installer_item_location': 'apps/Chrome.dmg',
+                         'uninstaller_item_location': 'tools/Nope.pkg'}))
+        self.assertIn('missing uninstaller item', self.errors[0])
+
+    def test_plain_list_still_accepted(self):
+        self.assertTrue(makecatalogslib.verify_pkginfo(
+            'pkgsinfo/test',
+            {'installer_item_location': 'tools/uninstall-tool.pkg'},
+            PKGS, self.errors))
+
+
+if __name__ == '__main__':
+    unittest.main()
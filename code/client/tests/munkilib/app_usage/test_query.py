@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_query.py
+
+Unit tests for app_usage.ApplicationUsageQuery.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from munkilib import app_usage
+
+DAY = 24 * 60 * 60
+
+
+class TestApplicationUsageQuery(unittest.TestCase):
+    """Test the bulk usage queries."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'application_usage.sqlite')
+        now = int(time.time())
+        conn = sqlite3.connect(self.database)
+        conn.execute(app_usage.APPLICATION_USAGE_TABLE_CREATE)
+        conn.execute(app_usage.INSTALL_REQUEST_TABLE_CREATE)
+        for index in range(1200):
+            conn.execute(app_usage.APPLICATION_USAGE_TABLE_INSERT,
+                         ('activate', 'com.example.App%04d' % index, '1.0',
+                          '/Applications/App%04d.app' % index,
+                          now - (index % 100) * DAY - 60, 1))
+        conn.execute(app_usage.APPLICATION_USAGE_TABLE_INSERT,
+                     ('launch', 'com.example.Old', '1.0',
+                      '/Applications/Old.app', now - 400 * DAY, 1))
+        conn.execute(app_usage.INSTALL_REQUEST_TABLE_INSERT,
+                     ('install', 'Firefox', '120.0', now - 3 * DAY, 1))
+        conn.execute(app_usage.INSTALL_REQUEST_TABLE_INSERT,
+                     ('remove', 'Chrome', '120.0', now - 3 * DAY, 1))
+        conn.commit()
+        conn.close()
+        self.query = app_usage.ApplicationUsageQuery(self.database)
+
+    def tearDown(self):
+        self.query.conn.close()
+        self.query.conn = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_days_of_data(self):
+        self.assertEqual(self.query.days_of_data(), 400)
+
+    def test_usage_events_for_bundle_ids(self):
+        bundle_ids = ['com.example.App%04d' % index
+                      for index in range(0, 1200, 2)]
+        days = self.query.days_since_last_usage_events(
+            'activate', bundle_ids + ['com.example.Missing'])
+        self.assertEqual(len(days), 600)
+        self.assertEqual(days['com.example.App0042'], 42)
+        self.assertNotIn('com.example.Missing', days)
+        self.assertEqual(
+            days['com.example.App0042'],
+            self.query.days_since_last_usage_event(
+                'activate', 'com.example.App0042'))
+
+    def test_all_usage_events(self):
+        days = self.query.days_since_last_usage_events('activate')
+        self.assertEqual(len(days), 1200)
+        self.assertNotIn('com.example.Old', days)
+
+    def test_install_events(self):
+        self.assertEqual(
+            self.query.days_since_last_install_events('install'),
+            {'Firefox': 3})
+        self.assertEqual(
+            self.query.days_since_last_install_events(
+                'install', ['Chrome', 'Firefox']),
+            {'Firefox': 3})
+
+    def test_missing_table(self):
+        conn = sqlite3.connect(self.database)
+        conn.execute('DROP TABLE install_requests')
+        conn.commit()
+        conn.close()
+        self.assertIsNone(
+            self.query.days_since_last_install_events('install'))
+
+    def test_empty_database(self):
+        query = app_usage.ApplicationUsageQuery(
+            os.path.join(self.tmpdir, 'empty.sqlite'))
+        query.conn.execute(app_usage.APPLICATION_USAGE_TABLE_CREATE)
+        self.assertEqual(query.days_of_data(), 0)
+        self.assertEqual(query.days_since_last_usage_events('activate'), {})
+        query.conn.close()
+        query.conn = None
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
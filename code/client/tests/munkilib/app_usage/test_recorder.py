@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_recorder.py
+
+Unit tests for app_usage.ApplicationUsageRecorder.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import app_usage
+
+
+class FakeClock(object):
+    """A clock that moves only when told to"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def app(bundle_id, version='1.0'):
+    """An app_dict as sent by app_usage_monitor"""
+    return {'bundle_id': bundle_id,
+            'version': version,
+            'path': '/Applications/%s.app' % bundle_id.split('.')[-1]}
+
+
+class TestApplicationUsageRecorder(unittest.TestCase):
+    """Test batching, the persistent connection and writes on exit."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'application_usage.sqlite')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def recorder(self, **options):
+        options.setdefault('batch_size', 10)
+        options.setdefault('flush_interval', 60)
+        return app_usage.ApplicationUsageRecorder(
+            self.database, clock=self.clock, **options)
+
+    def usage_rows(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            return sorted(conn.execute(
+                app_usage.APPLICATION_USAGE_TABLE_SELECT).fetchall())
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            conn.close()
+
+    def test_events_are_written_in_batches(self):
+        recorder = self.recorder()
+        for _ in range(9):
+            recorder.log_application_usage('launch', app('com.example.App'))
+        self.assertEqual(self.usage_rows(), [])
+        recorder.log_application_usage(
+            'launch', app('com.example.App', version='2.0'))
+        self.assertEqual(self.usage_rows(), [
+            ('launch', 'com.example.App', '2.0',
+             '/Applications/App.app', 1000000, 10)])
+        recorder.close()
+
+    def test_counts_add_up_across_batches(self):
+        recorder = self.recorder(batch_size=3)
+        for count in range(10):
+            self.clock.now += 1
+            recorder.log_application_usage(
+                ('activate', 'quit')[count % 2], app('com.example.App'))
+        recorder.close()
+        self.assertEqual(
+            [(row[0], row[4], row[5]) for row in self.usage_rows()],
+            [('activate', 1000009, 5), ('quit', 1000010, 5)])
+
+    def test_flush_interval(self):
+        recorder = self.recorder(batch_size=100, flush_interval=5)
+        recorder.log_application_usage('launch', app('com.example.One'))
+        self.clock.now += 4
+        recorder.log_application_usage('launch', app('com.example.Two'))
+        self.assertEqual(self.usage_rows(), [])
+        self.clock.now += 1
+        recorder.log_application_usage('launch', app('com.example.Three'))
+        self.assertEqual(len(self.usage_rows()), 3)
+        recorder.close()
+
+    def test_lone_event_is_written_by_timer(self):
+        recorder = self.recorder(batch_size=100, flush_interval=0.2)
+        recorder.log_application_usage('launch', app('com.example.App'))
+        self.assertEqual(self.usage_rows(), [])
+        deadline = time.time() + 10
+        while not self.usage_rows() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(self.usage_rows()), 1)
+        self.assertIsNone(recorder._timer)
+        recorder.close()
+
+    def test_timer_stopped_when_queue_written(self):
+        recorder = self.recorder(batch_size=2)
+        recorder.log_application_usage('launch', app('com.example.One'))
+        timer = recorder._timer
+        self.assertTrue(timer.is_alive())
+        recorder.log_application_usage('launch', app('com.example.Two'))
+        self.assertIsNone(recorder._timer)
+        timer.join(5)
+        self.assertFalse(timer.is_alive())
+        recorder.close()
+
+    def test_wal_and_schema_checked_once(self):
+        recorder = self.recorder(batch_size=1)
+        with mock.patch.object(
+                recorder, '_detect_table',
+                wraps=recorder._detect_table) as detect_table:
+            for _ in range(5):
+                recorder.log_application_usage(
+                    'launch', app('com.example.App'))
+                recorder.log_install_request(
+                    {'event': 'install', 'name': 'Firefox',
+                     'version': '120.0'})
+        self.assertEqual(detect_table.call_count, 2)
+        conn = sqlite3.connect(self.database)
+        self.assertEqual(
+            conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(
+            conn.execute(app_usage.INSTALL_REQUEST_TABLE_SELECT).fetchall(),
+            [('install', 'Firefox', '120.0', 1000000, 5)])
+        conn.close()
+        recorder.close()
+
+    def test_existing_database(self):
+        conn = sqlite3.connect(self.database)
+        conn.execute(app_usage.APPLICATION_USAGE_TABLE_CREATE)
+        conn.execute(app_usage.APPLICATION_USAGE_TABLE_INSERT,
+                     ('launch', 'com.example.App', '1.0',
+                      '/Applications/App.app', 500, 7))
+        conn.commit()
+        conn.close()
+        with self.recorder() as recorder:
+            recorder.log_application_usage('launch', app('com.example.App'))
+        self.assertEqual(self.usage_rows()[0][4:], (1000000, 8))
+
+    def test_queued_events_are_written_on_exit(self):
+        recorder = self.recorder()
+        recorder.log_application_usage('launch', app('com.example.App'))
+        recorder.log_install_request({'event': 'remove', 'name': 'Firefox'})
+        self.assertEqual(self.usage_rows(), [])
+        # what atexit calls
+        app_usage._close_recorders()
+        self.assertEqual(len(self.usage_rows()), 1)
+
+    def test_events_without_ids_are_ignored(self):
+        recorder = self.recorder(batch_size=1)
+        recorder.log_application_usage('launch', {'path': '/Applications/X'})
+        recorder.log_install_request({'name': 'Firefox'})
+        self.assertEqual(recorder.flush(), 0)
+        self.assertFalse(os.path.exists(self.database))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
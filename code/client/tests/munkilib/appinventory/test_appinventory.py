@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_appinventory.py
+
+Unit tests for appinventory.AppInventory and appinventory.AppIndex.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import plistlib
+import shutil
+import tempfile
+import threading
+import unittest
+
+from munkilib import appinventory
+
+
+class TestAppInventory(unittest.TestCase):
+    """Test that only new and changed apps are read again."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(
+            self.tmpdir, appinventory.INVENTORY_FILE_NAME)
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_app(self, name, version, mtime=1000):
+        path = os.path.join(self.tmpdir, 'Applications', name + '.app')
+        contents = os.path.join(path, 'Contents')
+        if not os.path.isdir(contents):
+            os.makedirs(contents)
+        plistpath = os.path.join(contents, 'Info.plist')
+        with open(plistpath, 'wb') as fileobj:
+            plistlib.dump({'CFBundleIdentifier': 'com.example.' + name,
+                           'CFBundleShortVersionString': version}, fileobj)
+        os.utime(plistpath, (mtime, mtime))
+        return path
+
+    def read_app(self, path):
+        with self.lock:
+            self.reads.append(path)
+        plistpath = os.path.join(path, 'Contents', 'Info.plist')
+        try:
+            with open(plistpath, 'rb') as fileobj:
+                plist = plistlib.load(fileobj)
+        except (IOError, OSError):
+            return None
+        return {'path': path,
+                'name': os.path.splitext(os.path.basename(path))[0],
+                'bundleid': plist['CFBundleIdentifier'],
+                'version': plist['CFBundleShortVersionString']}
+
+    def inventory(self):
+        return appinventory.AppInventory(self.cache_path, self.read_app)
+
+    def test_unchanged_apps_are_not_read_again(self):
+        paths = [self.make_app('App%s' % index, '1.0') for index in range(6)]
+        inventory = self.inventory()
+        self.assertEqual(len(inventory.apps(paths)), 6)
+        inventory.save()
+        self.assertEqual(len(self.reads), 6)
+
+        del self.reads[:]
+        self.make_app('App2', '2.0', mtime=2000)
+        paths.append(self.make_app('New', '1.0'))
+        inventory = self.inventory()
+        apps = inventory.apps(paths)
+        self.assertEqual(sorted(self.reads), sorted([paths[2], paths[6]]))
+        self.assertEqual((inventory.hits, inventory.misses), (5, 2))
+        self.assertEqual(
+            [item['version'] for item in apps
+             if item['name'] == 'App2'], ['2.0'])
+        self.assertEqual(len(apps), 7)
+
+    def test_removed_apps_are_forgotten(self):
+        paths = [self.make_app('App%s' % index, '1.0') for index in range(3)]
+        inventory = self.inventory()
+        inventory.apps(paths)
+        inventory.save()
+        shutil.rmtree(paths[0])
+        inventory = self.inventory()
+        self.assertEqual(len(inventory.apps(paths)), 2)
+        inventory.save()
+        with open(self.cache_path, 'rb') as fileobj:
+            self.assertEqual(sorted(plistlib.load(fileobj)['apps']),
+                             sorted(paths[1:]))
+
+    def test_unreadable_apps_are_left_out(self):
+        path = self.make_app('Broken', '1.0')
+        inventory = self.inventory()
+        inventory.read_app = lambda path: None
+        self.assertEqual(inventory.apps([path]), [])
+        self.assertEqual(inventory.apps([path]), [])
+        self.assertEqual(inventory.misses, 1)
+
+    def test_corrupt_cache_file(self):
+        with open(self.cache_path, 'wb') as fileobj:
+            fileobj.write(b'not a plist')
+        path = self.make_app('App', '1.0')
+        self.assertEqual(len(self.inventory().apps([path])), 1)
+
+
+class TestAppIndex(unittest.TestCase):
+    """Test lookups by name and bundleid."""
+
+    APPS = [
+        {'path': '/Applications/Firefox.app', 'name': 'Firefox',
+         'bundleid': 'org.mozilla.firefox', 'version': '120.0'},
+        {'path': '/Applications/Old Firefox.app', 'name': 'Firefox',
+         'bundleid': 'org.mozilla.firefox.old', 'version': '3.6'},
+        {'path': '/Applications/Tool', 'name': 'Tool',
+         'bundleid': '', 'version': '1.0'},
+        {'path': '/Applications/Nightly.app', 'name': 'Nightly',
+         'bundleid': 'org.mozilla.firefox', 'version': '121.0a1'},
+    ]
+
+    def setUp(self):
+        self.index = appinventory.AppIndex(self.APPS)
+
+    def paths(self, *args):
+        return [item['path'] for item in self.index.matching(*args)]
+
+    def test_by_bundleid_or_name(self):
+        self.assertEqual(self.paths('Firefox', 'org.mozilla.firefox'),
+                         ['/Applications/Firefox.app',
+                          '/Applications/Old Firefox.app',
+                          '/Applications/Nightly.app'])
+        self.assertEqual(self.paths('', 'org.mozilla.firefox.old'),
+                         ['/Applications/Old Firefox.app'])
+        self.assertEqual(self.paths('Nightly', 'com.example.missing'),
+                         ['/Applications/Nightly.app'])
+        self.assertEqual(self.paths('Missing', 'com.example.missing'), [])
+
+    def test_empty_bundleid(self):
+        self.assertEqual(self.paths('Firefox', ''),
+                         ['/Applications/Firefox.app',
+                          '/Applications/Old Firefox.app',
+                          '/Applications/Tool'])
+        self.assertEqual(self.paths('Firefox', None),
+                         ['/Applications/Firefox.app',
+                          '/Applications/Old Firefox.app'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
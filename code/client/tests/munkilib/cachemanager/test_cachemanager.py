@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_cachemanager.py
+
+Unit tests for cachemanager.CacheManager.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import xattr
+
+from munkilib import cachemanager
+from munkilib import contentstore
+
+
+class FakeClock(object):
+    """A clock that moves only when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestCacheManager(unittest.TestCase):
+    """Test the index, LRU eviction and the size budget."""
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def add_item(self, name, size_kb, last_used):
+        path = os.path.join(self.cachedir, name)
+        with open(path, 'wb') as fileobj:
+            fileobj.write(b'\0' * size_kb * 1024)
+        os.utime(path, (last_used, last_used))
+
+    def manager(self, budget=0):
+        return cachemanager.CacheManager(
+            self.cachedir, budget=budget, clock=self.clock)
+
+    def remaining(self):
+        return sorted(name for name in os.listdir(self.cachedir)
+                      if cachemanager.is_cache_item(name))
+
+    def test_least_recently_used_goes_first(self):
+        self.add_item('old.pkg', 10, 100)
+        self.add_item('newer.pkg', 10, 200)
+        self.add_item('newest.pkg', 10, 300)
+        freed = self.manager().evict(15)
+        self.assertEqual(freed, 20)
+        self.assertEqual(self.remaining(), ['newest.pkg'])
+
+    def test_expected_reuse_and_protected_items(self):
+        self.add_item('precache.dmg', 10, 100)
+        self.add_item('pending.pkg', 10, 50)
+        self.add_item('stale.pkg', 10, 300)
+        manager = self.manager()
+        freed = manager.evict(15, protected=['pending.pkg'],
+                              expected_reuse=['precache.dmg'])
+        self.assertEqual(freed, 20)
+        self.assertEqual(self.remaining(), ['pending.pkg'])
+
+    def test_nothing_removed_if_not_enough_can_be_freed(self):
+        self.add_item('a.pkg', 10, 100)
+        self.add_item('b.pkg', 10, 100)
+        freed = self.manager().evict(15, protected=['b.pkg'])
+        self.assertEqual(freed, 0)
+        self.assertEqual(self.remaining(), ['a.pkg', 'b.pkg'])
+
+    def test_items_used_this_session_are_kept(self):
+        self.add_item('a.pkg', 10, 100)
+        manager = self.manager()
+        self.clock.now += 10
+        manager.record_hit('a.pkg')
+        self.assertEqual(manager.evict(5), 0)
+
+    def test_make_room_within_budget(self):
+        self.add_item('a.pkg', 30, 100)
+        self.add_item('b.pkg', 30, 200)
+        manager = self.manager(budget=100)
+        self.assertTrue(manager.make_room(30))
+        self.assertEqual(self.remaining(), ['a.pkg', 'b.pkg'])
+        self.assertTrue(manager.make_room(60))
+        self.assertEqual(self.remaining(), ['b.pkg'])
+        self.assertFalse(manager.make_room(200))
+
+    def test_index_is_used_instead_of_stat(self):
+        self.add_item('a.pkg', 10, 100)
+        manager = self.manager()
+        manager.record_miss('a.pkg')
+        manager.save()
+        self.assertIn(cachemanager.INDEX_FILE_NAME,
+                      os.listdir(self.cachedir))
+        # the index wins over what's on disk for items it knows about
+        self.add_item('a.pkg', 20, 100)
+        self.add_item('b.pkg', 5, 100)
+        manager = self.manager()
+        self.assertEqual(manager.size(), 15)
+        os.unlink(os.path.join(self.cachedir, 'a.pkg'))
+        manager.reconcile()
+        self.assertEqual(manager.size(), 5)
+
+    def keep_base(self, name, size_kb):
+        """Leaves a delta base as the installer does for an installed item"""
+        content = os.urandom(size_kb * 1024)
+        path = os.path.join(self.cachedir, name + '.pkg')
+        with open(path, 'wb') as fileobj:
+            fileobj.write(content)
+        xattr.setxattr(path, contentstore.XATTR_SHA,
+                       hashlib.sha256(content).hexdigest().encode('UTF-8'))
+        store = contentstore.ContentStore(self.cachedir)
+        self.assertTrue(store.keep_base(name, path))
+        os.unlink(path)
+        return store
+
+    def test_delta_bases_count_and_go_first(self):
+        store = self.keep_base('Office', 30)
+        self.add_item('a.pkg', 30, 100)
+        manager = self.manager(budget=100)
+        self.assertEqual(manager.size(), 60)
+        self.assertTrue(manager.make_room(50))
+        self.assertEqual(self.remaining(), ['a.pkg'])
+        self.assertEqual(store.kept_bases(), [])
+        self.assertEqual(manager.size(), 30)
+        self.assertEqual(os.listdir(store.objects_dir), [])
+
+    def test_enforce_budget_drops_bases(self):
+        store = self.keep_base('Office', 30)
+        self.keep_base('Xcode', 30)
+        self.manager(budget=40).enforce_budget()
+        self.assertEqual(len(store.kept_bases()), 1)
+
+    def test_stats(self):
+        self.add_item('a.pkg', 10, 100)
+        manager = self.manager(budget=1024)
+        manager.record_hit('a.pkg')
+        manager.record_hit('a.pkg')
+        self.add_item('b.pkg', 10, 100)
+        manager.record_miss('b.pkg')
+        stats = manager.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 0.667)
+        self.assertEqual(stats['size_kb'], 20)
+        self.assertEqual(stats['budget_kb'], 1024)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
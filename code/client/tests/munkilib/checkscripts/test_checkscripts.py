@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_checkscripts.py
+
+Unit tests for checkscripts.CheckScriptResults.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from munkilib import checkscripts
+
+
+class TestCheckScriptResults(unittest.TestCase):
+    """Test running check scripts ahead of time."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def script(self, name, exit_status=0, sleep=0):
+        return ('#!/bin/sh\n'
+                'echo %s >> "%s"\n'
+                'sleep %s\n'
+                'echo checked %s\n'
+                'exit %s\n' % (name, self.log, sleep, name, exit_status))
+
+    def log_lines(self):
+        with open(self.log) as fileobj:
+            return fileobj.read().splitlines()
+
+    def test_scripts_run_concurrently(self):
+        scripts = [self.script('item%s' % index, exit_status=index, sleep=0.5)
+                   for index in range(4)]
+        results = checkscripts.CheckScriptResults()
+        start = time.time()
+        results.evaluate(scripts)
+        self.assertLess(time.time() - start, 1.5)
+        for index, script in enumerate(scripts):
+            self.assertEqual(results.result(script),
+                             (index, ['checked item%s' % index]))
+
+    def test_shared_scripts_run_once(self):
+        script = self.script('shared')
+        results = checkscripts.CheckScriptResults()
+        results.evaluate([script, script, None])
+        results.evaluate([script])
+        self.assertEqual(self.log_lines(), ['shared'])
+        self.assertIsNone(results.result(None))
+        results.clear()
+        self.assertIsNone(results.result(script))
+
+    def test_windows_line_endings(self):
+        script = self.script('crlf', exit_status=1).replace('\n', '\r\n')
+        results = checkscripts.CheckScriptResults()
+        results.evaluate([script])
+        self.assertEqual(results.result(script), (1, ['checked crlf']))
+
+    def test_scripts_that_cant_run_are_left_to_run_later(self):
+        no_interpreter = 'echo no shebang\n'
+        results = checkscripts.CheckScriptResults()
+        results.evaluate([no_interpreter])
+        self.assertIsNone(results.result(no_interpreter))
+
+    def test_slow_scripts_run_to_completion(self):
+        slow = self.script('slow', sleep=1.5)
+        results = checkscripts.CheckScriptResults()
+        results.evaluate([slow])
+        self.assertEqual(results.result(slow), (0, ['checked slow']))
+
+    def test_output_order_matches_scriptutils(self):
+        script = ('#!/bin/sh\n'
+                  'echo one\n'
+                  'echo two >&2\n'
+                  'echo three\n')
+        results = checkscripts.CheckScriptResults()
+        results.evaluate([script])
+        self.assertEqual(results.result(script), (0, ['one', 'two', 'three']))
+
+    def test_stop_requested(self):
+        scripts = [self.script('item%s' % index) for index in range(4)]
+        results = checkscripts.CheckScriptResults()
+        results.evaluate(scripts, stop_requested=lambda: True)
+        self.assertFalse(os.path.exists(self.log))
+        for script in scripts:
+            self.assertIsNone(results.result(script))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_compression.py
+
+Unit tests for precompressed catalog and manifest variants.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import plistlib
+import shutil
+import tempfile
+import unittest
+
+from munkilib import compression
+
+
+CATALOG = plistlib.dumps(
+    [{'name': 'Item%s' % count, 'version': '1.0.%s' % count,
+      'catalogs': ['production']} for count in range(5000)])
+
+
+class TestCompression(unittest.TestCase):
+    """Test compressing and streaming decompression."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.destination = os.path.join(self.tmpdir, 'all')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_variant(self, data, encoding):
+        path = self.destination + compression.SUFFIXES[encoding]
+        with open(path, 'wb') as fileobj:
+            fileobj.write(data)
+        return path
+
+    def round_trip(self, encoding):
+        compressed = compression.compress(CATALOG, encoding)
+        self.assertLess(len(compressed), len(CATALOG) / 5)
+        path = self.write_variant(compressed, encoding)
+        compression.decompress_file(path, self.destination, encoding)
+        with open(self.destination, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), CATALOG)
+
+    def test_gzip(self):
+        self.assertIn(compression.GZIP, compression.available_encodings())
+        self.round_trip(compression.GZIP)
+
+    @unittest.skipUnless(compression.zstandard, 'zstandard not installed')
+    def test_zstd(self):
+        self.assertEqual(compression.available_encodings()[0],
+                         compression.ZSTD)
+        self.round_trip(compression.ZSTD)
+
+    def test_gzip_is_reproducible(self):
+        self.assertEqual(compression.compress(CATALOG, compression.GZIP),
+                         compression.compress(CATALOG, compression.GZIP))
+
+    def test_truncated_variant_leaves_destination_alone(self):
+        with open(self.destination, 'wb') as fileobj:
+            fileobj.write(b'old catalog')
+        compressed = compression.compress(CATALOG, compression.GZIP)
+        path = self.write_variant(compressed[:len(compressed) // 2],
+                                  compression.GZIP)
+        with self.assertRaises(compression.DecompressionError):
+            compression.decompress_file(
+                path, self.destination, compression.GZIP)
+        with open(self.destination, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), b'old catalog')
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['all', 'all.gz'])
+
+    def test_not_compressed(self):
+        path = self.write_variant(CATALOG, compression.GZIP)
+        with self.assertRaises(compression.DecompressionError):
+            compression.decompress_file(
+                path, self.destination, compression.GZIP)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
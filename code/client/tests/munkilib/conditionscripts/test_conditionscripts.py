@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_conditionscripts.py
+
+Unit tests for conditionscripts.ConditionScriptRunner.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from munkilib import conditionscripts
+from munkilib import utils
+
+OWN_OUTPUT_SCRIPT = '''#!/bin/sh
+echo run >> "%(log)s"
+sleep %(sleep)s
+cat > "$MUNKI_CONDITION_OUTPUT" <<EOF
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+    <key>%(key)s</key>
+    <string>%(value)s</string>
+    %(ttl)s
+</dict>
+</plist>
+EOF
+'''
+
+SHARED_OUTPUT_SCRIPT = '''#!/bin/sh
+echo start %(name)s >> "%(log)s"
+sleep %(sleep)s
+echo end %(name)s >> "%(log)s"
+'''
+
+
+class FakeClock(object):
+    """A clock that moves only when told to"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def run_script(path, env, timeout):
+    """Runs a script without the ownership checks, which need root"""
+    return utils.runExternalScript(
+        path, allow_insecure=True, env=env, timeout=timeout)[0]
+
+
+class TestConditionScriptRunner(unittest.TestCase):
+    """Test running, merging, timeouts and cached facts."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scriptdir = os.path.join(self.tmpdir, 'conditions')
+        os.mkdir(self.scriptdir)
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.cache_path = os.path.join(
+            self.tmpdir, conditionscripts.CACHE_FILE_NAME)
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_script(self, name, template, **values):
+        path = os.path.join(self.scriptdir, name)
+        values.setdefault('log', self.log)
+        values.setdefault('sleep', 0)
+        values.setdefault('name', name)
+        values.setdefault('key', name)
+        values.setdefault('value', name)
+        values.setdefault('ttl', '')
+        with open(path, 'w') as fileobj:
+            fileobj.write(template % values)
+        os.chmod(path, 0o755)
+        return path
+
+    def runner(self, **options):
+        options.setdefault('run_script', run_script)
+        options.setdefault('clock', self.clock)
+        return conditionscripts.ConditionScriptRunner(
+            self.cache_path, **options)
+
+    def log_lines(self):
+        with open(self.log) as fileobj:
+            return fileobj.read().splitlines()
+
+    def test_scripts_with_own_output_run_concurrently(self):
+        scripts = [self.write_script('script%s' % index, OWN_OUTPUT_SCRIPT,
+                                     sleep=0.5, key='fact', value=index)
+                   for index in range(4)]
+        start = time.time()
+        facts, timings = self.runner().run(list(reversed(scripts)))
+        self.assertLess(time.time() - start, 1.5)
+        # the last script by name wins
+        self.assertEqual(facts, {'fact': '3'})
+        self.assertEqual([timing['name'] for timing in timings],
+                         ['script0', 'script1', 'script2', 'script3'])
+        for timing in timings:
+            self.assertEqual(timing['status'], 'ran')
+            self.assertEqual(timing['returncode'], 0)
+            self.assertGreaterEqual(timing['seconds'], 0.4)
+
+    def test_shared_output_scripts_run_in_turn(self):
+        scripts = [self.write_script(name, SHARED_OUTPUT_SCRIPT, sleep=0.2)
+                   for name in ('b_script', 'a_script')]
+        scripts.append(self.write_script(
+            'c_script', OWN_OUTPUT_SCRIPT, sleep=0.2))
+        facts, timings = self.runner().run(scripts)
+        self.assertEqual(facts, {'c_script': 'c_script'})
+        self.assertEqual(
+            [line for line in self.log_lines() if line != 'run'],
+            ['start a_script', 'end a_script',
+             'start b_script', 'end b_script'])
+        self.assertEqual([timing['name'] for timing in timings],
+                         ['a_script', 'b_script', 'c_script'])
+
+    def test_timeout(self):
+        script = self.write_script('slow', OWN_OUTPUT_SCRIPT, sleep=30)
+        start = time.time()
+        facts, timings = self.runner(timeout=0.5).run([script])
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(facts, {})
+        self.assertEqual(timings[0]['status'], 'timed out')
+        self.assertIn('did not finish', timings[0]['error'])
+
+    def test_failed_script(self):
+        script = self.write_script('broken', SHARED_OUTPUT_SCRIPT)
+        os.chmod(script, 0o644)
+        missing = os.path.join(self.scriptdir, 'missing')
+        facts, timings = self.runner().run([script, missing])
+        self.assertEqual(facts, {})
+        self.assertEqual(
+            [(timing['name'], timing['status']) for timing in timings],
+            [('broken', 'failed'), ('missing', 'missing')])
+        self.assertIn('not executable', timings[0]['error'])
+
+    def test_facts_cached_for_ttl(self):
+        ttl = ('<key>%s</key><integer>60</integer>'
+               % conditionscripts.TTL_KEY)
+        script = self.write_script('cached', OWN_OUTPUT_SCRIPT, ttl=ttl)
+        facts, _ = self.runner().run([script])
+        self.assertEqual(facts, {'cached': 'cached'})
+        self.clock.now += 59
+        facts, timings = self.runner().run([script])
+        self.assertEqual(facts, {'cached': 'cached'})
+        self.assertEqual(timings[0]['status'], 'cached')
+        self.assertEqual(self.log_lines(), ['run'])
+        self.clock.now += 1
+        facts, timings = self.runner().run([script])
+        self.assertEqual(timings[0]['status'], 'ran')
+        self.assertEqual(self.log_lines(), ['run', 'run'])
+
+    def test_changed_script_is_run_again(self):
+        ttl = ('<key>%s</key><integer>60</integer>'
+               % conditionscripts.TTL_KEY)
+        script = self.write_script('cached', OWN_OUTPUT_SCRIPT, ttl=ttl)
+        self.runner().run([script])
+        self.write_script('cached', OWN_OUTPUT_SCRIPT, ttl=ttl,
+                          value='changed')
+        facts, _ = self.runner().run([script])
+        self.assertEqual(facts, {'cached': 'changed'})
+
+    def test_facts_without_ttl_are_not_cached(self):
+        script = self.write_script('uncached', OWN_OUTPUT_SCRIPT)
+        self.runner().run([script])
+        self.runner().run([script])
+        self.assertEqual(self.log_lines(), ['run', 'run'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_contentstore.py
+
+Unit tests for contentstore.ContentStore.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import xattr
+
+from munkilib import contentstore
+from munkilib import deltautils
+
+
+CONTENT = b'installer item contents' * 1024
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+class TestContentStore(unittest.TestCase):
+    """Test linking, adopting and garbage collection."""
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.store = contentstore.ContentStore(self.cachedir)
+        self.repodir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+        shutil.rmtree(self.repodir)
+
+    def cached_item(self, name, content=CONTENT, verified=True):
+        """Writes an item into the cache as fetch would leave it"""
+        path = os.path.join(self.cachedir, name)
+        with open(path, 'wb') as fileobj:
+            fileobj.write(content)
+        if verified:
+            xattr.setxattr(path, contentstore.XATTR_SHA,
+                           hashlib.sha256(content).hexdigest().encode('UTF-8'))
+        return path
+
+    def test_adopt_and_link_under_another_name(self):
+        path = self.cached_item('Firefox-120.dmg')
+        self.assertTrue(self.store.adopt(path, CONTENT_HASH))
+        self.assertTrue(self.store.has(CONTENT_HASH))
+        other = os.path.join(self.cachedir, 'Firefox.dmg')
+        self.assertTrue(self.store.link_to(CONTENT_HASH, other))
+        self.assertTrue(os.path.samefile(path, other))
+        # already linked
+        self.assertTrue(self.store.link_to(CONTENT_HASH, other))
+
+    def test_adopt_requires_verified_hash(self):
+        path = self.cached_item('item.dmg', verified=False)
+        self.assertFalse(self.store.adopt(path, CONTENT_HASH))
+        path = self.cached_item('item.dmg', content=b'something else')
+        self.assertFalse(self.store.adopt(path, CONTENT_HASH))
+        self.assertFalse(self.store.has(CONTENT_HASH))
+
+    def test_link_to_missing_object(self):
+        path = os.path.join(self.cachedir, 'item.dmg')
+        self.assertFalse(self.store.link_to(CONTENT_HASH, path))
+        self.assertFalse(self.store.link_to('not-a-hash', path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_link_replaces_colliding_name(self):
+        path = self.cached_item('item.dmg')
+        self.store.adopt(path, CONTENT_HASH)
+        other_content = b'a different item with the same name'
+        other_path = self.cached_item('other.dmg', content=other_content)
+        os.rename(other_path, path)
+        self.assertTrue(self.store.link_to(CONTENT_HASH, path))
+        with open(path, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), CONTENT)
+
+    def test_adopt_dedupes_existing_content(self):
+        first = self.cached_item('one.dmg')
+        second = self.cached_item('two.dmg')
+        self.store.adopt(first, CONTENT_HASH)
+        self.assertTrue(self.store.adopt(second, CONTENT_HASH))
+        self.assertTrue(os.path.samefile(first, second))
+
+    def test_collect_garbage(self):
+        path = self.cached_item('item.dmg')
+        self.store.adopt(path, CONTENT_HASH)
+        self.assertEqual(self.store.collect_garbage(), 0)
+        self.assertTrue(self.store.has(CONTENT_HASH))
+        os.unlink(path)
+        self.assertEqual(self.store.collect_garbage(), len(CONTENT) // 1024)
+        self.assertFalse(self.store.has(CONTENT_HASH))
+        self.assertEqual(os.listdir(self.store.objects_dir), [])
+
+    def install(self, name, path):
+        """Removes an installed item from the cache as the installer does"""
+        self.store.keep_base(name, path)
+        os.unlink(path)
+        self.store.collect_garbage()
+
+    def test_install_then_update_from_delta(self):
+        path = self.cached_item('Office-16.0.pkg')
+        self.store.adopt(path, CONTENT_HASH)
+        self.install('Office', path)
+        self.assertTrue(self.store.has(CONTENT_HASH))
+        # a new version is published with a delta from the installed one
+        new_content = CONTENT[:10000] + b'new code' + CONTENT[10000:]
+        old_path = os.path.join(self.repodir, 'Office-16.0.pkg')
+        new_path = os.path.join(self.repodir, 'Office-16.1.pkg')
+        delta_path = os.path.join(self.repodir, 'Office-16.1.pkg.delta')
+        for repo_path, content in ((old_path, CONTENT),
+                                   (new_path, new_content)):
+            with open(repo_path, 'wb') as fileobj:
+                fileobj.write(content)
+        deltautils.make_delta(old_path, new_path, delta_path)
+        # the update is built from the kept base
+        updated = os.path.join(self.cachedir, 'Office-16.1.pkg')
+        deltautils.apply_delta(
+            self.store.object_path(CONTENT_HASH), delta_path, updated)
+        with open(updated, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), new_content)
+
+    def test_one_base_kept_per_item(self):
+        path = self.cached_item('Office-16.0.pkg')
+        self.install('Office', path)
+        new_content = b'the next version' * 1024
+        new_path = self.cached_item('Office-16.1.pkg', content=new_content)
+        self.install('Office', new_path)
+        self.assertFalse(self.store.has(CONTENT_HASH))
+        bases = self.store.kept_bases()
+        self.assertEqual(
+            [(base['name'], base['hash'], base['size']) for base in bases],
+            [('Office', hashlib.sha256(new_content).hexdigest(),
+              len(new_content) // 1024)])
+        self.store.drop_base('Office')
+        self.store.collect_garbage()
+        self.assertEqual(self.store.kept_bases(), [])
+        self.assertEqual(os.listdir(self.store.objects_dir), [])
+
+    def test_bases_dropped_for_items_no_longer_managed(self):
+        self.install('Office', self.cached_item('Office-16.0.pkg'))
+        other_content = b'another item' * 1024
+        self.install('Xcode', self.cached_item('Xcode.xip',
+                                               content=other_content))
+        self.store.drop_bases_except(['Xcode', 'Firefox'])
+        self.store.collect_garbage()
+        self.assertEqual([base['name'] for base in self.store.kept_bases()],
+                         ['Xcode'])
+        self.assertFalse(self.store.has(CONTENT_HASH))
+
+    def test_base_shared_with_cached_item_takes_no_space(self):
+        path = self.cached_item('Office-16.0.pkg')
+        self.store.keep_base('Office', path)
+        self.assertEqual(self.store.kept_bases()[0]['size'], 0)
+        unverified = self.cached_item('Other.pkg', verified=False)
+        self.assertFalse(self.store.keep_base('Other', unverified))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
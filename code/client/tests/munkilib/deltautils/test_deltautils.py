@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_deltautils.py
+
+Unit tests for making and applying binary deltas.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import deltautils
+
+
+# random data, like a compressed installer payload
+BASE = os.urandom(3 * 1024 * 1024)
+
+
+class TestDeltas(unittest.TestCase):
+    """Test content-defined chunking and delta round trips."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as fileobj:
+            fileobj.write(content)
+        return path
+
+    def round_trip(self, base, target):
+        base_path = self.write('base', base)
+        target_path = self.write('target', target)
+        delta_path = os.path.join(self.tmpdir, 'delta')
+        output_path = os.path.join(self.tmpdir, 'output')
+        stats = deltautils.make_delta(base_path, target_path, delta_path)
+        size = deltautils.apply_delta(base_path, delta_path, output_path)
+        self.assertEqual(size, len(target))
+        with open(output_path, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), target)
+        return stats, os.path.getsize(delta_path)
+
+    def test_chunks_cover_the_file(self):
+        offset = 0
+        for chunk_offset, data in deltautils.chunks(io.BytesIO(BASE)):
+            self.assertEqual(chunk_offset, offset)
+            self.assertLessEqual(len(data), deltautils.MAX_CHUNK_SIZE)
+            offset += len(data)
+        self.assertEqual(offset, len(BASE))
+
+    def test_insertion_only_costs_nearby_chunks(self):
+        target = BASE[:1000000] + os.urandom(5000) + BASE[1000000:]
+        stats, delta_size = self.round_trip(BASE, target)
+        self.assertGreater(stats['copied'], len(BASE) * 0.8)
+        self.assertLess(delta_size, len(target) * 0.3)
+
+    def test_unrelated_files(self):
+        target = os.urandom(len(BASE))
+        stats, delta_size = self.round_trip(BASE, target)
+        self.assertEqual(stats['copied'], 0)
+        self.assertGreater(delta_size, len(target))
+
+    def test_empty_target(self):
+        self.round_trip(BASE, b'')
+
+    def test_delta_against_wrong_base(self):
+        base_path = self.write('base', BASE)
+        target_path = self.write('target', BASE + b'more')
+        delta_path = os.path.join(self.tmpdir, 'delta')
+        deltautils.make_delta(base_path, target_path, delta_path)
+        short_base_path = self.write('short', BASE[:1000])
+        output_path = os.path.join(self.tmpdir, 'output')
+        with self.assertRaises(deltautils.DeltaError):
+            deltautils.apply_delta(short_base_path, delta_path, output_path)
+        self.assertFalse(os.path.exists(output_path))
+
+    def test_truncated_delta(self):
+        base_path = self.write('base', BASE)
+        target_path = self.write('target', BASE[::-1])
+        delta_path = os.path.join(self.tmpdir, 'delta')
+        deltautils.make_delta(base_path, target_path, delta_path)
+        with open(delta_path, 'rb+') as fileobj:
+            fileobj.truncate(os.path.getsize(delta_path) // 2)
+        with self.assertRaises(deltautils.DeltaError):
+            deltautils.apply_delta(base_path, delta_path,
+                                   os.path.join(self.tmpdir, 'output'))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_portable_backend.py
+
+Unit tests for fetchbackend.PortableBackend, against a local HTTP server.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import fetchbackend
+
+from ..http_scaffolds import LocalHTTPServer
+
+
+PAYLOAD = os.urandom(1024 * 1024 + 17)
+
+
+class TestPortableBackend(unittest.TestCase):
+    """Test downloads, conditional requests, resume and connection reuse."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.backend = fetchbackend.PortableBackend()
+        self.server = LocalHTTPServer(
+            files={'/pkgs/item.pkg': PAYLOAD,
+                   '/catalogs/all': b'<plist/>'},
+            redirects={'/moved.pkg': '/pkgs/item.pkg'})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.backend.close()
+        self.server.__exit__()
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, path, destination, **options):
+        options.setdefault('url', self.server.url(path))
+        options['file'] = destination
+        connection = self.backend.connection(options)
+        connection.start()
+        while not connection.isDone():
+            pass
+        return connection
+
+    def test_download(self):
+        destination = os.path.join(self.tmpdir, 'item.pkg')
+        connection = self.fetch('/pkgs/item.pkg', destination)
+        self.assertIsNone(connection.error)
+        self.assertEqual(connection.status, 200)
+        self.assertEqual(connection.percentComplete, 100)
+        with open(destination, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), PAYLOAD)
+        stored = fetchbackend.get_stored_headers(destination)
+        self.assertEqual(stored['etag'], self.server.etag(PAYLOAD))
+        self.assertNotIn('expected-length', stored)
+
+    def test_only_if_changed(self):
+        destination = os.path.join(self.tmpdir, 'all')
+        self.fetch('/catalogs/all', destination)
+        connection = self.fetch(
+            '/catalogs/all', destination + '.download',
+            download_only_if_changed=True,
+            cache_data=self.backend.stored_headers(destination))
+        self.assertEqual(connection.status, 304)
+        self.assertFalse(os.path.exists(destination + '.download'))
+
+    def test_resume(self):
+        destination = os.path.join(self.tmpdir, 'item.pkg')
+        with open(destination, 'wb') as fileobj:
+            fileobj.write(PAYLOAD[:1000])
+        fetchbackend.store_headers(
+            destination, {'etag': self.server.etag(PAYLOAD),
+                          'last-modified': 'Wed, 01 Jan 2025 00:00:00 GMT',
+                          'expected-length': len(PAYLOAD)})
+        connection = self.fetch('/pkgs/item.pkg', destination,
+                                can_resume=True)
+        self.assertEqual(connection.status, 206)
+        self.assertEqual(self.server.requests[-1][1].get('Range'),
+                         'bytes=1000-')
+        with open(destination, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), PAYLOAD)
+
+    def test_resume_restarts_when_item_changed(self):
+        destination = os.path.join(self.tmpdir, 'item.pkg')
+        with open(destination, 'wb') as fileobj:
+            fileobj.write(b'x' * 1000)
+        fetchbackend.store_headers(
+            destination, {'etag': '"stale"', 'expected-length': 5000})
+        connection = self.fetch('/pkgs/item.pkg', destination,
+                                can_resume=True)
+        self.assertEqual(connection.status, 200)
+        with open(destination, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), PAYLOAD)
+
+    def test_connections_are_reused(self):
+        for index in range(5):
+            self.fetch('/catalogs/all',
+                       os.path.join(self.tmpdir, 'all%s' % index))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.backend.pool.created, 1)
+        self.assertEqual(self.backend.pool.reused, 4)
+
+    def test_redirects(self):
+        destination = os.path.join(self.tmpdir, 'item.pkg')
+        connection = self.fetch('/moved.pkg', destination)
+        self.assertEqual(connection.status, 302)
+        self.assertFalse(os.path.exists(destination))
+        connection = self.fetch('/moved.pkg', destination,
+                                follow_redirects=True)
+        self.assertEqual(connection.status, 200)
+        self.assertEqual(len(connection.redirection), 1)
+
+    def test_connection_error(self):
+        connection = self.fetch(
+            None, os.path.join(self.tmpdir, 'item.pkg'),
+            url='http://127.0.0.1:1/pkgs/item.pkg')
+        self.assertEqual(connection.error.code(),
+                         fetchbackend.NSURLErrorCannotConnectToHost)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_segmented_download.py
+
+Unit tests for fetchbackend.SegmentedConnection, against a local HTTP server
+that supports byte ranges.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import plistlib
+import shutil
+import tempfile
+import time
+import unittest
+
+import xattr
+
+from munkilib import fetchbackend
+
+from ..http_scaffolds import LocalHTTPServer
+
+
+SEGMENT_SIZE = 256 * 1024
+# ten segments, the last one short
+PAYLOAD = os.urandom(SEGMENT_SIZE * 9 + 1000)
+
+
+class TestSegmentedDownload(unittest.TestCase):
+    """Test segmented downloads, resume and fallbacks."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.destination = os.path.join(self.tmpdir, 'item.dmg.download')
+        self.backend = fetchbackend.PortableBackend()
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, server, max_connections=3):
+        connection = fetchbackend.SegmentedConnection(
+            self.backend,
+            {'url': server.url('/pkgs/item.dmg'),
+             'file': self.destination,
+             'can_resume': True},
+            max_connections, segment_size=SEGMENT_SIZE)
+        connection.start()
+        deadline = time.time() + 60
+        while not connection.isDone():
+            if time.time() > deadline:
+                connection.cancel()
+                self.fail('download did not finish')
+        return connection
+
+    def assert_downloaded(self, connection):
+        self.assertIsNone(connection.error)
+        self.assertEqual(connection.status, 200)
+        with open(self.destination, 'rb') as fileobj:
+            self.assertEqual(hashlib.sha256(fileobj.read()).hexdigest(),
+                             hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertNotIn(fetchbackend.DOWNLOAD_SEGMENTS_XATTR,
+                         xattr.listxattr(self.destination))
+
+    def ranges_requested(self, server):
+        return [headers.get('Range') for dummy_path, headers
+                in server.requests]
+
+    def test_segmented_download(self):
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD}) as server:
+            connection = self.fetch(server)
+            self.assert_downloaded(connection)
+            self.assertEqual(len(server.requests), 10)
+            self.assertLessEqual(server.connections, 3)
+        stored = fetchbackend.get_stored_headers(self.destination)
+        self.assertEqual(stored['etag'], server.etag(PAYLOAD))
+
+    def test_resume_fetches_only_missing_segments(self):
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD}) as server:
+            # a preallocated file with segments 0-6 done, and junk where
+            # 7-9 should be
+            completed = bytearray([1] * 7 + [0] * 3)
+            with open(self.destination, 'wb') as fileobj:
+                fileobj.write(PAYLOAD[:7 * SEGMENT_SIZE])
+                fileobj.write(b'\0' * (len(PAYLOAD) - 7 * SEGMENT_SIZE))
+            xattr.setxattr(
+                self.destination, fetchbackend.DOWNLOAD_SEGMENTS_XATTR,
+                plistlib.dumps({'etag': server.etag(PAYLOAD),
+                                'total-length': len(PAYLOAD),
+                                'segment-size': SEGMENT_SIZE,
+                                'completed': bytes(completed)}))
+            connection = self.fetch(server)
+            self.assert_downloaded(connection)
+            self.assertTrue(connection.resume)
+            self.assertEqual(
+                sorted(self.ranges_requested(server)),
+                ['bytes=%s-%s' % (index * SEGMENT_SIZE,
+                                  min((index + 1) * SEGMENT_SIZE,
+                                      len(PAYLOAD)) - 1)
+                 for index in (7, 8, 9)])
+
+    def test_resume_uses_saved_segment_size(self):
+        saved_size = SEGMENT_SIZE * 2
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD}) as server:
+            # saved with five segments, 0-2 done
+            with open(self.destination, 'wb') as fileobj:
+                fileobj.write(PAYLOAD[:3 * saved_size])
+                fileobj.write(b'\0' * (len(PAYLOAD) - 3 * saved_size))
+            xattr.setxattr(
+                self.destination, fetchbackend.DOWNLOAD_SEGMENTS_XATTR,
+                plistlib.dumps({'etag': server.etag(PAYLOAD),
+                                'total-length': len(PAYLOAD),
+                                'segment-size': saved_size,
+                                'completed': bytes([1, 1, 1, 0, 0])}))
+            connection = self.fetch(server)
+            self.assert_downloaded(connection)
+            self.assertEqual(
+                sorted(self.ranges_requested(server)),
+                ['bytes=%s-%s' % (3 * saved_size, 4 * saved_size - 1),
+                 'bytes=%s-%s' % (4 * saved_size, len(PAYLOAD) - 1)])
+
+    def test_resume_restarts_when_item_changed(self):
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD}) as server:
+            with open(self.destination, 'wb') as fileobj:
+                fileobj.write(b'x' * len(PAYLOAD))
+            xattr.setxattr(
+                self.destination, fetchbackend.DOWNLOAD_SEGMENTS_XATTR,
+                plistlib.dumps({'etag': '"old"',
+                                'total-length': len(PAYLOAD),
+                                'segment-size': SEGMENT_SIZE,
+                                'completed': bytes([1] * 9 + [0])}))
+            connection = self.fetch(server)
+            self.assert_downloaded(connection)
+            self.assertEqual(len(server.requests), 1)
+
+    def test_server_without_ranges(self):
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD},
+                             supports_ranges=False) as server:
+            connection = self.fetch(server)
+            self.assert_downloaded(connection)
+            self.assertEqual(len(server.requests), 1)
+
+    def test_connection_cap(self):
+        with LocalHTTPServer(files={'/pkgs/item.dmg': PAYLOAD}) as server:
+            connection = self.fetch(server, max_connections=1)
+            self.assert_downloaded(connection)
+            self.assertEqual(server.connections, 1)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_scheduler.py
+
+Unit tests for fetchscheduler.Scheduler.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from munkilib import fetchscheduler
+from munkilib.fetchscheduler import (PRIORITY_METADATA, PRIORITY_INSTALLS,
+                                     PRIORITY_PRECACHE, PRIORITY_ICONS)
+
+
+class FakeClock(object):
+    """A clock that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestScheduler(unittest.TestCase):
+    """Test admission order, concurrency limits and bandwidth limits."""
+
+    def start_waiting(self, scheduler, url, priority, started, release):
+        """Starts a thread that holds a transfer until release is set"""
+        def run():
+            with scheduler.transfer(url, priority):
+                started.append(priority)
+                release.wait(5)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait_for_waiters(self, scheduler, count):
+        deadline = time.time() + 5
+        while len(scheduler._waiting) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_most_urgent_waiting_request_goes_first(self):
+        scheduler = fetchscheduler.Scheduler(max_concurrent=1,
+                                             max_per_host=0)
+        started = []
+        release = threading.Event()
+        with scheduler.transfer('http://munki/pkgs/a.pkg', PRIORITY_ICONS):
+            threads = []
+            for count, priority in enumerate(
+                    [PRIORITY_ICONS, PRIORITY_PRECACHE, PRIORITY_INSTALLS]):
+                threads.append(self.start_waiting(
+                    scheduler, 'http://munki/%s' % priority, priority,
+                    started, release))
+                self.wait_for_waiters(scheduler, count + 1)
+            self.assertEqual(started, [])
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(
+            started, [PRIORITY_INSTALLS, PRIORITY_PRECACHE, PRIORITY_ICONS])
+
+    def test_metadata_is_not_held_back(self):
+        scheduler = fetchscheduler.Scheduler(max_concurrent=1,
+                                             max_per_host=1)
+        with scheduler.transfer('http://munki/pkgs/a.pkg', PRIORITY_PRECACHE):
+            # would block forever if metadata counted against the limits
+            with scheduler.transfer('http://munki/catalogs/all',
+                                    PRIORITY_METADATA):
+                with scheduler.transfer('http://munki/catalogs/testing',
+                                        PRIORITY_METADATA):
+                    pass
+        self.assertEqual(scheduler.stats()['metadata']['requests'], 2)
+
+    def test_host_concurrency(self):
+        self.assertEqual(
+            fetchscheduler.Scheduler(max_concurrent=4,
+                                     max_per_host=2).host_concurrency(), 2)
+        self.assertEqual(
+            fetchscheduler.Scheduler(max_concurrent=1,
+                                     max_per_host=0).host_concurrency(), 1)
+        self.assertEqual(
+            fetchscheduler.Scheduler(max_concurrent=0,
+                                     max_per_host=0).host_concurrency(), 0)
+
+    def test_per_host_limit(self):
+        scheduler = fetchscheduler.Scheduler(max_concurrent=0,
+                                             max_per_host=1)
+        started = []
+        release = threading.Event()
+        with scheduler.transfer('http://munki/a', PRIORITY_INSTALLS):
+            other_host = self.start_waiting(
+                scheduler, 'http://cdn/b', PRIORITY_INSTALLS, started,
+                release)
+            same_host = self.start_waiting(
+                scheduler, 'http://munki/c', PRIORITY_ICONS, started,
+                release)
+            self.wait_for_waiters(scheduler, 1)
+            deadline = time.time() + 5
+            while not started and time.time() < deadline:
+                time.sleep(0.01)
+            # only the request for the other host got in
+            self.assertEqual(started, [PRIORITY_INSTALLS])
+        release.set()
+        other_host.join(5)
+        same_host.join(5)
+        self.assertEqual(started, [PRIORITY_INSTALLS, PRIORITY_ICONS])
+
+    def test_bandwidth_limit(self):
+        clock = FakeClock()
+        scheduler = fetchscheduler.Scheduler(
+            bandwidth_limit=1000, clock=clock, sleep=clock.sleep)
+        with scheduler.transfer('http://munki/pkgs/a.pkg',
+                                PRIORITY_INSTALLS) as transfer:
+            for dummy_chunk in range(5):
+                transfer.received(1000)
+        # the first 1000 bytes are the burst allowance
+        self.assertAlmostEqual(clock.now, 4.0)
+        stats = scheduler.stats()['installs']
+        self.assertEqual(stats['bytes'], 5000)
+        self.assertAlmostEqual(stats['throttled_seconds'], 4.0)
+
+    def test_per_host_bandwidth_limit(self):
+        clock = FakeClock()
+        scheduler = fetchscheduler.Scheduler(
+            per_host_bandwidth_limit=500, clock=clock, sleep=clock.sleep)
+        with scheduler.transfer('http://munki/a', PRIORITY_INSTALLS) as one:
+            one.received(1500)
+        self.assertAlmostEqual(clock.now, 2.0)
+        with scheduler.transfer('http://cdn/b', PRIORITY_INSTALLS) as two:
+            two.received(500)
+        # a different host has its own allowance
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_class_bandwidth_limit(self):
+        clock = FakeClock()
+        scheduler = fetchscheduler.Scheduler(
+            class_bandwidth_limits={PRIORITY_PRECACHE: 1000},
+            clock=clock, sleep=clock.sleep)
+        with scheduler.transfer('http://munki/a', PRIORITY_INSTALLS) as one:
+            one.received(3000)
+        # other classes aren't limited
+        self.assertAlmostEqual(clock.now, 0.0)
+        with scheduler.transfer('http://munki/b', PRIORITY_PRECACHE) as two:
+            two.received(3000)
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_less_urgent_transfers_yield(self):
+        scheduler = fetchscheduler.Scheduler()
+        events = []
+        metadata_started = threading.Event()
+        release = threading.Event()
+
+        def metadata():
+            with scheduler.transfer('http://munki/manifests/site',
+                                    PRIORITY_METADATA):
+                metadata_started.set()
+                release.wait(5)
+                events.append('metadata done')
+
+        thread = threading.Thread(target=metadata)
+        thread.daemon = True
+        with scheduler.transfer('http://munki/pkgs/big.pkg',
+                                PRIORITY_PRECACHE) as transfer:
+            thread.start()
+            metadata_started.wait(5)
+            threading.Timer(0.2, release.set).start()
+            transfer.received(1000)
+            events.append('precache chunk')
+        thread.join(5)
+        self.assertEqual(events, ['metadata done', 'precache chunk'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
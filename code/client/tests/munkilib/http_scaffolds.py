@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+http_scaffolds.py
+
+A local HTTP server for testing fetch code.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import email.utils
+import hashlib
+import re
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:
+    ThreadingHTTPServer = None
+
+
+LAST_MODIFIED = 'Wed, 01 Jan 2025 00:00:00 GMT'
+
+
+class LocalHTTPServer(object):
+    """Serves a dict of path: bytes on 127.0.0.1 with keep-alive, ETag,
+    Last-Modified, conditional requests and single byte ranges (with
+    If-Range).
+
+    redirects maps a path to the URL path it redirects to. If
+    supports_ranges is False, Range headers are ignored.
+    requests records (path, headers) for every request, and connections
+    counts the TCP connections accepted."""
+
+    def __init__(self, files=None, redirects=None, supports_ranges=True):
+        self.files = dict(files or {})
+        self.redirects = dict(redirects or {})
+        self.supports_ranges = supports_ranges
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        # clients that drop a connection mid-response are expected
+        self.httpd.handle_error = lambda request, client_address: None
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, path):
+        """Returns the URL for path on this server"""
+        return 'http://127.0.0.1:%s%s' % (self.httpd.server_port, path)
+
+    @staticmethod
+    def etag(content):
+        """Returns the ETag served for content"""
+        return '"%s"' % hashlib.sha256(content).hexdigest()[:16]
+
+    def _handler(self):
+        """Returns a request handler class bound to this server"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler"""
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with server._lock:
+                    server.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append((self.path, dict(self.headers)))
+                if self.path in server.redirects:
+                    self.send_response(302)
+                    self.send_header(
+                        'Location', server.url(server.redirects[self.path]))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                content = server.files.get(self.path)
+                if content is None:
+                    self.send_error(404)
+                    return
+                etag = server.etag(content)
+                if (self.headers.get('If-None-Match') == etag or
+                        self.headers.get('If-Modified-Since') ==
+                        LAST_MODIFIED):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = 0, len(content) - 1
+                status = 200
+                match = re.match(r'bytes=(\d+)-(\d*)$',
+                                 self.headers.get('Range', ''))
+                if_range = self.headers.get('If-Range')
+                if if_range and if_range not in (etag, LAST_MODIFIED):
+                    # changed since the client's copy; send all of it
+                    match = None
+                if match and server.supports_ranges:
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), end)
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header(
+                            'Content-Range', 'bytes */%s' % len(content))
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+                self.send_response(status)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', LAST_MODIFIED)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Date', email.utils.formatdate(usegmt=True))
+                if status == 206:
+                    self.send_header('Content-Range', 'bytes %s-%s/%s'
+                                     % (start, end, len(content)))
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(content[start:end + 1])
+
+        return Handler
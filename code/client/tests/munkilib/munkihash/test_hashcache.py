@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_hashcache.py
+
+Unit tests for munkihash.HashCache.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import munkihash
+
+
+class TestHashCache(unittest.TestCase):
+    """Test that cached hashes are reused only for unchanged files."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = munkihash.HashCache(
+            os.path.join(self.tmpdir, 'hashcache.sqlite'))
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.tmpdir, 'item%s.pkg' % index)
+            with open(path, 'wb') as fileobj:
+                fileobj.write(os.urandom(100000 + index))
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def expected_hash(self, path):
+        with open(path, 'rb') as fileobj:
+            return hashlib.sha256(fileobj.read()).hexdigest()
+
+    def test_hashes_match_hashlib(self):
+        hashes = self.cache.getsha256hashes(self.paths)
+        for path in self.paths:
+            self.assertEqual(hashes[path], self.expected_hash(path))
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_unchanged_files_are_not_rehashed(self):
+        self.cache.getsha256hashes(self.paths)
+        self.cache.getsha256hashes(self.paths)
+        self.assertEqual(self.cache.hits, 3)
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_changed_file_is_rehashed(self):
+        self.cache.getsha256hash(self.paths[0])
+        with open(self.paths[0], 'ab') as fileobj:
+            fileobj.write(b'more data')
+        self.assertEqual(self.cache.getsha256hash(self.paths[0]),
+                         self.expected_hash(self.paths[0]))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmpdir, 'missing.pkg')
+        self.assertEqual(self.cache.getsha256hash(missing), 'NOT A FILE')
+
+
+if __name__ == '__main__':
+    unittest.main()
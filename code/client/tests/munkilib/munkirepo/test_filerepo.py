@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_filerepo.py
+
+Unit tests for FileRepo listings and atomic, zero-copy writes.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib.munkirepo.FileRepo import FileRepo
+
+# the module, which the munkirepo package hides behind the class
+filerepo = importlib.import_module('munkilib.munkirepo.FileRepo')
+
+
+class TestFileRepoListing(unittest.TestCase):
+    """Test listing repo items through symlinked directories."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pkgs = os.path.join(self.root, 'pkgs')
+        os.makedirs(os.path.join(self.pkgs, 'apps'))
+        for name in ('apps/Firefox.dmg', 'Chrome.dmg', '.hidden'):
+            with open(os.path.join(self.pkgs, name), 'w') as fileobj:
+                fileobj.write(name)
+        self.repo = FileRepo('file://' + self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_plain_listing(self):
+        self.assertEqual(sorted(self.repo.itemlist('pkgs')),
+                         ['Chrome.dmg', 'apps/Firefox.dmg'])
+
+    def test_symlinked_alias_is_listed(self):
+        os.symlink('apps', os.path.join(self.pkgs, 'alias'))
+        self.assertEqual(sorted(self.repo.itemlist('pkgs')),
+                         ['Chrome.dmg', 'alias/Firefox.dmg',
+                          'apps/Firefox.dmg'])
+
+    def test_symlink_loop_is_not_followed(self):
+        os.symlink('apps', os.path.join(self.pkgs, 'alias'))
+        os.symlink(os.pardir, os.path.join(self.pkgs, 'apps', 'loop'))
+        self.assertEqual(sorted(self.repo.itemlist('pkgs')),
+                         ['Chrome.dmg', 'alias/Firefox.dmg',
+                          'apps/Firefox.dmg'])
+
+
+class TestAtomicCopy(unittest.TestCase):
+    """Test that writes replace files whole and keep their attributes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = self.path('source.pkg')
+        self.content = os.urandom(3 * filerepo.COPY_BUFFER_SIZE // 2)
+        with open(self.source, 'wb') as fileobj:
+            fileobj.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def read(self, path):
+        with open(path, 'rb') as fileobj:
+            return fileobj.read()
+
+    def write(self, path, content):
+        with open(path, 'wb') as fileobj:
+            fileobj.write(content)
+
+    def assertNoTempFiles(self):
+        self.assertEqual(
+            [name for name in os.listdir(self.tmpdir)
+             if name.endswith('.tmp')], [])
+
+    def test_copy(self):
+        destination = self.path('copy.pkg')
+        filerepo.atomic_copy(self.source, destination)
+        self.assertEqual(self.read(destination), self.content)
+        self.assertNoTempFiles()
+
+    def test_copy_with_hash_reads_through_buffer(self):
+        destination = self.path('copy.pkg')
+        hash_function = hashlib.sha256()
+        with mock.patch.object(filerepo, '_kernel_copy') as kernel_copy:
+            filerepo.atomic_copy(self.source, destination,
+                                 hash_function=hash_function)
+        kernel_copy.assert_not_called()
+        self.assertEqual(hash_function.hexdigest(),
+                         hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.read(destination), self.content)
+
+    def test_copy_without_hash_uses_kernel_copy(self):
+        destination = self.path('copy.pkg')
+        with mock.patch.object(filerepo, '_clonefile', return_value=False), \
+                mock.patch.object(filerepo, '_kernel_copy',
+                                  wraps=filerepo._kernel_copy) as kernel_copy:
+            filerepo.atomic_copy(self.source, destination)
+        self.assertEqual(kernel_copy.call_count, 1)
+        self.assertEqual(self.read(destination), self.content)
+
+    def test_kernel_copy(self):
+        destination = self.path('copy.pkg')
+        with open(self.source, 'rb') as source_ref:
+            with open(destination, 'wb') as dest_ref:
+                copied = filerepo._kernel_copy(
+                    source_ref.fileno(), dest_ref.fileno())
+        if not copied:
+            self.skipTest('no kernel copy on this platform')
+        self.assertEqual(self.read(destination), self.content)
+
+    def test_failed_copy_leaves_destination_alone(self):
+        destination = self.path('copy.pkg')
+        self.write(destination, b'old')
+        with self.assertRaises(IOError):
+            filerepo.atomic_copy(self.path('missing.pkg'), destination)
+        self.assertEqual(self.read(destination), b'old')
+        self.assertNoTempFiles()
+
+    def test_replacing_keeps_mode_and_owner(self):
+        destination = self.path('copy.pkg')
+        self.write(destination, b'old')
+        os.chmod(destination, 0o640)
+        if os.geteuid() == 0:
+            os.chown(destination, 1, 1)
+        before = os.stat(destination)
+        filerepo.atomic_write(destination, b'new')
+        after = os.stat(destination)
+        self.assertEqual(self.read(destination), b'new')
+        self.assertEqual(after.st_mode & 0o7777, 0o640)
+        self.assertEqual((after.st_uid, after.st_gid),
+                         (before.st_uid, before.st_gid))
+        self.assertNotEqual(after.st_ino, before.st_ino)
+
+    def test_replacing_copies_acl(self):
+        destination = self.path('copy.pkg')
+        self.write(destination, b'old')
+        with mock.patch.object(filerepo, '_copy_acl') as copy_acl:
+            filerepo.atomic_copy(self.source, destination)
+        self.assertEqual(copy_acl.call_args[0][0], destination)
+        self.assertTrue(copy_acl.call_args[0][1].endswith('.tmp'))
+
+    def test_symlinked_destination_is_kept(self):
+        target = self.path('target.plist')
+        self.write(target, b'old')
+        link = self.path('link.plist')
+        os.symlink('target.plist', link)
+        filerepo.atomic_write(link, b'new')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(target), b'new')
+        filerepo.atomic_copy(self.source, link)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(target), self.content)
+        self.assertNoTempFiles()
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
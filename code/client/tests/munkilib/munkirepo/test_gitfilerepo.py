@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_gitfilerepo.py
+
+Unit tests for GitFileRepo transactions.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from munkilib import munkirepo
+from munkilib.munkirepo.GitFileRepo import GITCMD, GitFileRepo
+
+
+@unittest.skipUnless(os.path.exists(GITCMD), 'needs %s' % GITCMD)
+class TestGitFileRepoTransaction(unittest.TestCase):
+    """Test that a transaction makes a single commit, or none at all."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for kind in ('catalogs', 'pkgsinfo'):
+            os.mkdir(os.path.join(self.root, kind))
+        for args in (['init', '-q'],
+                     ['config', 'user.name', 'test'],
+                     ['config', 'user.email', 'test@example.com'],
+                     ['commit', '-q', '--allow-empty', '-m', 'initial']):
+            self.git(*args)
+        self.repo = GitFileRepo('file://' + self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def git(self, *args):
+        return subprocess.check_output(
+            [GITCMD] + list(args), cwd=self.root).decode('UTF-8')
+
+    def commit_count(self):
+        return int(self.git('rev-list', '--count', 'HEAD'))
+
+    def committed_files(self):
+        return sorted(self.git('ls-tree', '-r', '--name-only',
+                               'HEAD').splitlines())
+
+    def test_batch_is_one_commit(self):
+        self.repo.put('pkgsinfo/Firefox.plist', b'firefox')
+        self.assertEqual(self.commit_count(), 2)
+        with munkirepo.transaction(self.repo):
+            self.repo.put('catalogs/all', b'all')
+            self.repo.put('catalogs/testing', b'testing')
+            with munkirepo.transaction(self.repo):
+                # nested blocks join the outer one
+                self.repo.put('catalogs/production', b'production')
+            self.repo.delete('pkgsinfo/Firefox.plist')
+            self.assertEqual(self.commit_count(), 2)
+        self.assertEqual(self.commit_count(), 3)
+        self.assertEqual(self.committed_files(),
+                         ['catalogs/all', 'catalogs/production',
+                          'catalogs/testing'])
+        self.assertIn('changed 4 files', self.git('log', '-1', '--format=%B'))
+        self.assertEqual(self.git('status', '--porcelain'), '')
+
+    def test_exception_leaves_no_partial_commit(self):
+        with self.assertRaises(ValueError):
+            with munkirepo.transaction(self.repo):
+                self.repo.put('catalogs/all', b'all')
+                raise ValueError('makecatalogs failed')
+        self.assertEqual(self.commit_count(), 1)
+        self.assertEqual(self.committed_files(), [])
+        # the next transaction starts afresh
+        with munkirepo.transaction(self.repo):
+            self.repo.put('catalogs/testing', b'testing')
+        self.assertEqual(self.commit_count(), 2)
+        self.assertEqual(self.committed_files(), ['catalogs/testing'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_precachequeue.py
+
+Unit tests for precachequeue.PrecacheQueue.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import precachequeue
+from munkilib.precachequeue import STATE_DONE, STATE_FAILED, STATE_STARTED
+
+
+def item(name):
+    """A precache item from InstallInfo's optional_installs"""
+    return {'name': name,
+            'version': '1.0',
+            'installer_item_location': 'apps/%s.dmg' % name,
+            'installer_item_hash': name * 4}
+
+
+ITEMS = [item('first'), item('second'), item('third'), item('fourth')]
+
+
+class TestPrecacheQueue(unittest.TestCase):
+    """Test saved progress, resume order and the disk budget."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, precachequeue.PROGRESS_FILE_NAME)
+        self.cached = set()
+        self.partial = set()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def order(self, queue, items=ITEMS):
+        return [each['name'] for each in queue.order(
+            items,
+            is_cached=lambda each: each['name'] in self.cached,
+            is_partial=lambda each: each['name'] in self.partial)]
+
+    def test_fresh_queue_keeps_priority_order(self):
+        queue = precachequeue.PrecacheQueue(self.path)
+        self.assertEqual(self.order(queue),
+                         ['first', 'second', 'third', 'fourth'])
+
+    def test_restart_resumes_where_it_left_off(self):
+        queue = precachequeue.PrecacheQueue(self.path)
+        queue.mark(ITEMS[0], STATE_DONE)
+        self.cached.add('first')
+        queue.mark(ITEMS[1], STATE_FAILED)
+        queue.mark(ITEMS[3], STATE_STARTED)
+        self.partial.add('fourth')
+        # the agent was stopped; a new one reads the saved progress
+        queue = precachequeue.PrecacheQueue(self.path)
+        self.assertEqual(self.order(queue), ['fourth', 'third', 'second'])
+
+    def test_done_items_no_longer_cached_are_redone(self):
+        queue = precachequeue.PrecacheQueue(self.path)
+        queue.mark(ITEMS[0], STATE_DONE)
+        self.assertEqual(self.order(queue)[0], 'first')
+
+    def test_items_no_longer_wanted_are_forgotten(self):
+        queue = precachequeue.PrecacheQueue(self.path)
+        queue.mark(ITEMS[0], STATE_DONE)
+        self.order(queue, items=ITEMS[1:])
+        queue = precachequeue.PrecacheQueue(self.path)
+        self.assertIsNone(queue.state(ITEMS[0]))
+
+    def test_disk_budget(self):
+        queue = precachequeue.PrecacheQueue(self.path, budget=100)
+        self.assertTrue(queue.reserve(40, already_used=20))
+        self.assertFalse(queue.reserve(50, already_used=20))
+        queue.release(40)
+        self.assertTrue(queue.reserve(50, already_used=20))
+
+    def test_no_budget(self):
+        queue = precachequeue.PrecacheQueue(self.path)
+        self.assertTrue(queue.reserve(10 ** 9))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
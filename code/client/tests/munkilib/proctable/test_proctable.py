@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_proctable.py
+
+Unit tests for proctable.ProcessTable and proctable.ProcessSnapshots.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import sys
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import proctable
+
+from ..data_scaffolds import getRunningProcessesMock
+
+
+HELPER = ('/Applications/Google Chrome.app/Contents/Frameworks/Google Chrome '
+          'Framework.framework/Helpers/Google Chrome Helper.app/Contents/'
+          'MacOS/Google Chrome Helper')
+PROC_LIST = getRunningProcessesMock() + [
+    HELPER,
+    '/Applications/Outer.app/Contents/MacOS/Inner.app/Contents/MacOS/inner']
+
+
+def linear_matching(proc_list, appname):
+    """How processes.is_app_running matched by scanning every process"""
+    if appname.startswith('/'):
+        matching_items = [item for item in proc_list if item == appname]
+    elif appname.endswith('.app'):
+        matching_items = [item for item in proc_list
+                          if '/' + appname + '/Contents/MacOS/' in item]
+    else:
+        matching_items = [item for item in proc_list
+                          if item.endswith('/' + appname)]
+    if not matching_items:
+        matching_items = [item for item in proc_list
+                          if '/' + appname + '.app/Contents/MacOS/' in item]
+    return matching_items
+
+
+class FakeClock(object):
+    """A clock that moves only when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestProcessTable(unittest.TestCase):
+    """Test indexed lookups match the way processes were always matched."""
+
+    def setUp(self):
+        self.table = proctable.ProcessTable(PROC_LIST)
+
+    def test_lookups(self):
+        for appname in ['/Applications/Firefox.app/Contents/MacOS/firefox',
+                        '/usr/local/bin/bonzi', 'Firefox.app', 'Firefox',
+                        'firefox', 'BonziBUDDY.app', 'BonziBUDDY', 'bonzi',
+                        'Google Chrome Helper.app', 'Google Chrome Helper',
+                        'Google Chrome.app', 'Outer.app', 'Inner', 'inner',
+                        'MacOS/firefox', 'Helpers/Google Chrome Helper',
+                        'mds', 'launchd', '']:
+            self.assertEqual(sorted(self.table.matching(appname)),
+                             sorted(linear_matching(PROC_LIST, appname)),
+                             appname)
+
+    def test_bundle_index(self):
+        self.assertEqual(self.table.by_bundle['Google Chrome Helper.app'],
+                         [HELPER])
+        self.assertNotIn('Google Chrome Framework.framework',
+                         self.table.by_bundle)
+
+
+class TestProcessSnapshots(unittest.TestCase):
+    """Test snapshots are reused within their TTL."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.source = mock.Mock(return_value=PROC_LIST)
+        self.snapshots = proctable.ProcessSnapshots(
+            source=self.source, ttl=2, clock=self.clock)
+
+    def test_snapshot_is_reused_within_ttl(self):
+        table = self.snapshots.get()
+        self.clock.now += 1.9
+        self.assertIs(self.snapshots.get(), table)
+        self.assertEqual(self.source.call_count, 1)
+        self.clock.now += 0.1
+        self.assertIsNot(self.snapshots.get(), table)
+        self.assertEqual(self.snapshots.snapshots_taken, 2)
+
+    def test_invalidate(self):
+        self.snapshots.get()
+        self.snapshots.invalidate()
+        self.snapshots.get()
+        self.assertEqual(self.source.call_count, 2)
+
+    def test_clock_going_backwards(self):
+        self.snapshots.get()
+        self.clock.now -= 60
+        self.snapshots.get()
+        self.assertEqual(self.source.call_count, 2)
+
+
+class TestSources(unittest.TestCase):
+    """Test the process list sources."""
+
+    def test_ps_output(self):
+        outputs = {
+            '-axo': 'launchd\n/sbin/launchd\n%s\n' % proctable.LAUNCHCFMAPP,
+            '-axwwwo': ('%s /Applications/Old.app/Contents/MacOS/Old\n'
+                        '/sbin/launchd\n' % proctable.LAUNCHCFMAPP)}
+        with mock.patch.object(proctable, '_ps',
+                               side_effect=lambda args: outputs[args[0]]):
+            self.assertEqual(proctable.ps_source(), [
+                '/sbin/launchd', proctable.LAUNCHCFMAPP,
+                '/Applications/Old.app/Contents/MacOS/Old'])
+
+    def test_ps_failed(self):
+        with mock.patch.object(proctable, '_ps', return_value=None):
+            self.assertEqual(proctable.ps_source(), [])
+
+    @unittest.skipUnless(os.path.isdir('/proc/self'), 'no /proc')
+    def test_proc(self):
+        self.assertIn(os.path.realpath(sys.executable),
+                      proctable.proc_source())
+        table = proctable.ProcessTable(proctable.proc_source())
+        self.assertTrue(table.matching(
+            os.path.basename(os.path.realpath(sys.executable))))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_sumetadata.py
+
+Unit tests for replicating Apple Software Update metadata, against a local
+stand-in for the software update server.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import copy
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from urllib.request import urlopen
+    from urllib.parse import urlsplit
+except ImportError:
+    from urllib2 import urlopen
+    from urlparse import urlsplit
+
+from munkilib import sumetadata
+
+from ..http_scaffolds import LocalHTTPServer
+
+
+PRODUCT_IDS = ['041-0001', '041-0002', '041-0003']
+LANGUAGES = ['English', 'French', 'German', 'Japanese']
+
+
+def su_files():
+    """The metadata files the stand-in server has for PRODUCT_IDS"""
+    files = {}
+    for product_key in PRODUCT_IDS:
+        base = '/content/downloads/%s/' % product_key
+        files[base + product_key + '.smd'] = b'<smd/>'
+        files[base + 'Update.pkm'] = b'<pkm/>'
+        for language in LANGUAGES:
+            files[base + product_key + '.%s.dist' % language] = b'<dist/>'
+    return files
+
+
+def su_catalog(url):
+    """An sucatalog; url(path) returns the URL for a path on the server"""
+    products = {}
+    for product_key in PRODUCT_IDS:
+        base = '/content/downloads/%s/' % product_key
+        products[product_key] = {
+            'ServerMetadataURL': url(base + product_key + '.smd'),
+            'Packages': [{'URL': url(base + 'Update.pkg'),
+                          'MetadataURL': url(base + 'Update.pkm'),
+                          'Size': 1024}],
+            'Distributions': dict(
+                (language,
+                 url(base + product_key + '.%s.dist' % language))
+                for language in LANGUAGES)}
+    # a product that isn't an available update
+    products['041-9999'] = {
+        'Packages': [{'URL': url('/other.pkg')}],
+        'Distributions': {'English': url('/other.dist')}}
+    return {'CatalogVersion': 2, 'Products': products}
+
+
+class TestReplication(unittest.TestCase):
+    """Test replicating metadata from a stand-in SU server."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = LocalHTTPServer(files=su_files())
+        self.server.__enter__()
+        self.catalog = su_catalog(self.server.url)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def tearDown(self):
+        self.server.__exit__()
+        shutil.rmtree(self.tmpdir)
+
+    def retrieve(self, url):
+        """Stores url at the same relative path under tmpdir, like
+        AppleUpdateSync.retrieve_url_to_cache_dir"""
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            # a slow link
+            time.sleep(0.02)
+            path = os.path.join(self.tmpdir, urlsplit(url)[2].lstrip('/'))
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+            response = urlopen(url)
+            with open(path, 'wb') as fileobj:
+                fileobj.write(response.read())
+            response.close()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def replicated(self):
+        found = set()
+        for dirpath, _, filenames in os.walk(self.tmpdir):
+            for filename in filenames:
+                found.add('/' + os.path.relpath(
+                    os.path.join(dirpath, filename), self.tmpdir))
+        return found
+
+    def test_metadata_files(self):
+        files, missing = sumetadata.metadata_files(
+            self.catalog, PRODUCT_IDS + ['MSU_UPDATE_20A5343i_patch'])
+        self.assertEqual(len(files), len(PRODUCT_IDS) * (2 + len(LANGUAGES)))
+        self.assertEqual(missing, ['MSU_UPDATE_20A5343i_patch'])
+        self.assertEqual([item.kind for item in files[:3]],
+                         [sumetadata.SERVER_METADATA,
+                          sumetadata.PACKAGE_METADATA,
+                          sumetadata.DISTRIBUTION])
+
+    def test_replicates_with_bounded_workers(self):
+        files, _ = sumetadata.metadata_files(self.catalog, PRODUCT_IDS)
+        self.assertTrue(sumetadata.replicate(
+            files, self.retrieve, max_workers=3))
+        self.assertEqual(self.replicated(), set(su_files()))
+        self.assertEqual(len(self.server.requests), len(files))
+        self.assertGreater(self.most_in_flight, 1)
+        self.assertLessEqual(self.most_in_flight, 3)
+
+    def test_stop_request(self):
+        files, _ = sumetadata.metadata_files(self.catalog, PRODUCT_IDS)
+        started = []
+
+        def stop_requested():
+            started.append(True)
+            return len(started) > 4
+
+        self.assertFalse(sumetadata.replicate(
+            files, self.retrieve, stop_requested=stop_requested,
+            max_workers=2))
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_stop_request_serially(self):
+        files, _ = sumetadata.metadata_files(self.catalog, PRODUCT_IDS)
+        self.assertFalse(sumetadata.replicate(
+            files, self.retrieve, stop_requested=lambda: True))
+        self.assertEqual(self.server.requests, [])
+
+    def test_missing_distribution_is_not_fatal(self):
+        del self.server.files[
+            '/content/downloads/041-0002/041-0002.French.dist']
+        files, _ = sumetadata.metadata_files(self.catalog, PRODUCT_IDS)
+        errors = []
+
+        def on_error(metadata_file, err):
+            errors.append(metadata_file)
+            return metadata_file.kind == sumetadata.DISTRIBUTION
+
+        self.assertTrue(sumetadata.replicate(
+            files, self.retrieve, on_error=on_error))
+        self.assertEqual([(item.product_key, item.language)
+                          for item in errors], [('041-0002', 'French')])
+        self.assertEqual(len(self.replicated()), len(files) - 1)
+
+    def test_missing_metadata_is_fatal(self):
+        del self.server.files['/content/downloads/041-0001/Update.pkm']
+        files, _ = sumetadata.metadata_files(self.catalog, PRODUCT_IDS)
+        with self.assertRaises(Exception):
+            sumetadata.replicate(files, self.retrieve, max_workers=2)
+        # nothing more was started after the failure
+        self.assertLess(len(self.server.requests), len(files))
+
+
+class TestLocalCatalogs(unittest.TestCase):
+    """Test building the local download and install catalogs."""
+
+    def setUp(self):
+        self.catalog = su_catalog(
+            lambda path: 'https://swscan.apple.com' + path)
+
+    @staticmethod
+    def rewrite_url(url):
+        return 'file://localhost/tmp/munki_swupd_cache' + urlsplit(url)[2]
+
+    def test_local_catalogs(self):
+        original = copy.deepcopy(self.catalog)
+        download_catalog, install_catalog = sumetadata.local_catalogs(
+            self.catalog, self.rewrite_url)
+        self.assertEqual(self.catalog, original)
+        self.assertEqual(download_catalog['CatalogVersion'], 2)
+        for product_key in PRODUCT_IDS:
+            downloaded = download_catalog['Products'][product_key]
+            installed = install_catalog['Products'][product_key]
+            for product in (downloaded, installed):
+                self.assertTrue(product['ServerMetadataURL'].startswith(
+                    'file://localhost/'))
+                self.assertTrue(product['Packages'][0][
+                    'MetadataURL'].startswith('file://localhost/'))
+                self.assertEqual(sorted(product['Distributions']), LANGUAGES)
+                self.assertEqual(product['Packages'][0]['Size'], 1024)
+            self.assertTrue(downloaded['Packages'][0]['URL'].startswith(
+                'https://swscan.apple.com/'))
+            self.assertEqual(
+                installed['Packages'][0]['URL'],
+                'file://localhost/tmp/munki_swupd_cache'
+                '/content/downloads/%s/Update.pkg' % product_key)
+
+    def test_no_products(self):
+        self.assertEqual(sumetadata.local_catalogs({}, self.rewrite_url),
+                         ({}, {}))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_tracing.py
+
+Unit tests for tracing.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import tracing
+
+
+class FakeClock(object):
+    """A clock that moves only when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@tracing.traced('process_install', item=0)
+def process_install(manifestitem, cataloglist):
+    """Something to trace"""
+    if manifestitem == 'Broken':
+        raise ValueError(manifestitem)
+    return manifestitem, cataloglist
+
+
+class TestTracer(unittest.TestCase):
+    """Test span totals, counters and trace events."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracer = tracing.Tracer(clock=self.clock)
+
+    def test_nothing_recorded_until_started(self):
+        self.assertIs(self.tracer.span('idle'), tracing.NULL_SPAN)
+        with self.tracer.span('idle'):
+            self.clock.now += 1
+        self.tracer.count('things')
+        self.assertEqual(self.tracer.timings(),
+                         {'spans': {}, 'counters': {}})
+
+    def test_spans_are_totalled(self):
+        self.tracer.start()
+        for seconds in (1, 3, 2):
+            with self.tracer.span('make_catalog_db'):
+                self.clock.now += seconds
+        self.tracer.count('catalog_items', 10)
+        self.tracer.count('catalog_items', 5)
+        self.tracer.stop()
+        with self.tracer.span('make_catalog_db'):
+            self.clock.now += 100
+        self.assertEqual(self.tracer.timings(), {
+            'spans': {'make_catalog_db': {
+                'count': 3, 'seconds': 6, 'max_seconds': 3}},
+            'counters': {'catalog_items': 15}})
+        self.assertEqual(self.tracer.chrome_trace()['traceEvents'], [])
+
+    def test_trace_events(self):
+        self.tracer.start(record_events=True)
+        self.clock.now += 0.5
+        with self.tracer.span('process_install', item={'name': 'Firefox'}):
+            self.clock.now += 0.25
+            with self.tracer.span('installs_comparison',
+                                  item={'path': '/Applications/Firefox.app'}):
+                self.clock.now += 0.125
+        self.tracer.count('check_scripts_run')
+        events = self.tracer.chrome_trace()['traceEvents']
+        self.assertEqual(
+            [(event['name'], event['ph'], event['ts'], event.get('dur'),
+              event['args']) for event in events],
+            [('installs_comparison', 'X', 750000, 125000,
+              {'item': '/Applications/Firefox.app'}),
+             ('process_install', 'X', 500000, 375000, {'item': 'Firefox'}),
+             ('check_scripts_run', 'C', 875000, None,
+              {'check_scripts_run': 1})])
+
+    def test_event_limit(self):
+        self.tracer.start(record_events=True)
+        with mock.patch.object(tracing, 'TRACE_EVENT_LIMIT', 5):
+            for _ in range(10):
+                with self.tracer.span('predicate_evaluation'):
+                    pass
+        self.assertEqual(len(self.tracer.chrome_trace()['traceEvents']), 5)
+        self.assertEqual(
+            self.tracer.timings()['spans']['predicate_evaluation']['count'],
+            10)
+
+    def test_threads(self):
+        tracer = tracing.Tracer()
+        tracer.start(record_events=True)
+
+        def work():
+            for _ in range(1000):
+                with tracer.span('download'):
+                    pass
+                tracer.count('downloads')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        timings = tracer.timings()
+        self.assertEqual(timings['spans']['download']['count'], 4000)
+        self.assertEqual(timings['counters']['downloads'], 4000)
+        self.assertEqual(len(tracer.chrome_trace()['traceEvents']), 8000)
+
+
+class TestModuleFunctions(unittest.TestCase):
+    """Test the module-level tracer and the traced decorator."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracing.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_traced_when_disabled(self):
+        self.assertFalse(tracing.enabled())
+        self.assertEqual(process_install('Firefox', ['production']),
+                         ('Firefox', ['production']))
+        self.assertEqual(process_install.__name__, 'process_install')
+        self.assertIs(tracing.span('anything'), tracing.NULL_SPAN)
+        tracing.count('anything')
+        self.assertEqual(tracing.timings()['spans'], {})
+
+    def test_traced_when_enabled(self):
+        tracing.start(record_events=True)
+        process_install('Firefox', ['production'])
+        with self.assertRaises(ValueError):
+            process_install('Broken', ['production'])
+        tracing.count('check_scripts_run_ahead', 2)
+        self.assertEqual(
+            tracing.timings()['spans']['process_install']['count'], 2)
+        self.assertEqual(tracing.timings()['counters'],
+                         {'check_scripts_run_ahead': 2})
+        path = os.path.join(self.tmpdir, 'trace.json')
+        self.assertTrue(tracing.write_chrome_trace(path))
+        with open(path) as fileobj:
+            trace = json.load(fileobj)
+        self.assertEqual(
+            [event['args'] for event in trace['traceEvents']
+             if event['ph'] == 'X'],
+            [{'item': 'Firefox'}, {'item': 'Broken'}])
+
+    def test_start_begins_afresh(self):
+        tracing.start()
+        process_install('Firefox', [])
+        tracing.start()
+        self.assertEqual(tracing.timings()['spans'], {})
+
+    def test_unwritable_trace_file(self):
+        tracing.start(record_events=True)
+        self.assertFalse(tracing.write_chrome_trace(
+            os.path.join(self.tmpdir, 'missing', 'trace.json')))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_unused_software.py
+
+Unit tests for the removal decisions in updatecheck.unused_software.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import app_usage
+from munkilib.updatecheck import unused_software
+
+DAY = 24 * 60 * 60
+
+
+def optional_item(name, bundle_id, removal_days=30):
+    """An optional install pkginfo with unused_software_removal_info"""
+    return {'name': name,
+            'installs': [{'type': 'application',
+                          'CFBundleIdentifier': bundle_id,
+                          'path': '/Applications/%s.app' % name}],
+            'unused_software_removal_info': {'removal_days': removal_days}}
+
+
+class TestRemovalDecisions(unittest.TestCase):
+    """Test deciding removals ahead of the analysis."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        database = os.path.join(self.tmpdir, 'application_usage.sqlite')
+        now = int(time.time())
+        conn = sqlite3.connect(database)
+        conn.execute(app_usage.APPLICATION_USAGE_TABLE_CREATE)
+        conn.execute(app_usage.INSTALL_REQUEST_TABLE_CREATE)
+        for bundle_id, days_ago in (('com.example.Used', 2),
+                                    ('com.example.Unused', 90),
+                                    ('com.example.Requested', 90),
+                                    ('com.example.Other', 1)):
+            conn.execute(app_usage.APPLICATION_USAGE_TABLE_INSERT,
+                         ('activate', bundle_id, '1.0', '/Applications/X.app',
+                          now - days_ago * DAY, 1))
+        conn.execute(app_usage.INSTALL_REQUEST_TABLE_INSERT,
+                     ('install', 'Requested', '1.0', now - 3 * DAY, 1))
+        conn.commit()
+        conn.close()
+        patches = [
+            mock.patch.object(app_usage, 'APPLICATION_USAGE_DB', database),
+            mock.patch.object(unused_software, 'running_bundleids',
+                              return_value=set(['com.example.Running']))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        unused_software.reset_removal_decisions()
+        self.addCleanup(unused_software.reset_removal_decisions)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_decisions(self):
+        items = [optional_item('Used', 'com.example.Used'),
+                 optional_item('Unused', 'com.example.Unused'),
+                 optional_item('Requested', 'com.example.Requested'),
+                 optional_item('Running', 'com.example.Running'),
+                 {'name': 'Kept'}]
+        self.assertEqual(unused_software.removal_decisions(items),
+                         {'Used': False, 'Unused': True, 'Requested': False,
+                          'Running': False, 'Kept': False})
+
+    def test_usage_read_once_for_the_items_only(self):
+        items = [optional_item('Used', 'com.example.Used'),
+                 optional_item('Unused', 'com.example.Unused')]
+        with mock.patch.object(
+                app_usage.ApplicationUsageQuery,
+                'days_since_last_usage_events', autospec=True,
+                side_effect=app_usage.ApplicationUsageQuery.
+                days_since_last_usage_events) as usage_events:
+            unused_software.decide_removals(items)
+            self.assertFalse(unused_software.should_be_removed(items[0]))
+            self.assertTrue(unused_software.should_be_removed(items[1]))
+        self.assertEqual(usage_events.call_count, 1)
+        self.assertEqual(sorted(usage_events.call_args[0][2]),
+                         ['com.example.Unused', 'com.example.Used'])
+
+    def test_item_not_decided_ahead(self):
+        item = optional_item('Unused', 'com.example.Unused')
+        unused_software.decide_removals([])
+        self.assertTrue(unused_software.should_be_removed(item))
+        self.assertFalse(unused_software.should_be_removed({'name': 'Kept'}))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
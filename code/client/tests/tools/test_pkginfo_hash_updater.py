@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_pkginfo_hash_updater.py
+
+Unit tests for the pkginfo_hash_updater tool.
+
+"""
+# Copyright 2026 The Munki contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import importlib.util
+import io
+import os
+import plistlib
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from munkilib import munkihash
+from munkilib import munkirepo
+from munkilib.admin.common import HASH_CACHE_DB
+
+TOOL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    os.pardir, 'tools', 'pkginfo_hash_updater.py')
+
+SPEC = importlib.util.spec_from_file_location(
+    'pkginfo_hash_updater', TOOL_PATH)
+pkginfo_hash_updater = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(pkginfo_hash_updater)
+
+
+class DownloadOnlyRepo(object):
+    """A repo plugin without local paths, like MWA2APIRepo. With info, it
+    also lists the size and mtime of its pkgs."""
+
+    def __init__(self, root, info=False):
+        self.baseurl = 'https://munki.example.com/api'
+        self.root = root
+        self.downloads = []
+        if info:
+            self.itemlist_with_info = self._itemlist_with_info
+
+    def _path(self, resource):
+        return os.path.join(self.root, resource)
+
+    def itemlist(self, kind):
+        base = self._path(kind)
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, name), base)
+            for dirpath, _, names in os.walk(base) for name in names)
+
+    def _itemlist_with_info(self, kind):
+        info = {}
+        for name in self.itemlist(kind):
+            stat_info = os.stat(os.path.join(self._path(kind), name))
+            info[name] = (stat_info.st_size, stat_info.st_mtime)
+        return info
+
+    def get(self, resource):
+        try:
+            with open(self._path(resource), 'rb') as fileobj:
+                return fileobj.read()
+        except IOError as err:
+            raise munkirepo.RepoError(err)
+
+    def get_to_local_file(self, resource, local_file_path):
+        self.downloads.append(resource)
+        try:
+            shutil.copyfile(self._path(resource), local_file_path)
+        except IOError as err:
+            raise munkirepo.RepoError(err)
+
+    def put(self, resource, content):
+        with open(self._path(resource), 'wb') as fileobj:
+            fileobj.write(content)
+
+
+class TestPkginfoHashUpdater(unittest.TestCase):
+    """Test hashing installer items through repo plugins."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'repo')
+        for kind in ('pkgs', 'pkgsinfo'):
+            os.makedirs(os.path.join(self.root, kind))
+        self.hashes = {}
+        for name in ('Firefox.dmg', 'Chrome.dmg'):
+            content = name.encode('UTF-8') * 1000
+            with open(os.path.join(self.root, 'pkgs', name), 'wb') as fileobj:
+                fileobj.write(content)
+            self.hashes[name] = hashlib.sha256(content).hexdigest()
+        self.write_pkginfo('Firefox', 'Firefox.dmg')
+        self.write_pkginfo('Chrome', 'Chrome.dmg')
+        self.write_pkginfo('Safari', 'Safari.dmg')
+        self.hash_cache = munkihash.HashCache(
+            os.path.join(self.tmpdir, 'hashcache.sqlite'))
+        patcher = mock.patch.dict(munkihash._SHARED_HASH_CACHES,
+                                  {HASH_CACHE_DB: self.hash_cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.hash_cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_pkginfo(self, name, location):
+        with open(os.path.join(self.root, 'pkgsinfo', name + '.plist'),
+                  'wb') as fileobj:
+            plistlib.dump({'name': name, 'installer_item_location': location},
+                          fileobj)
+
+    def read_pkginfo(self, name):
+        with open(os.path.join(self.root, 'pkgsinfo', name + '.plist'),
+                  'rb') as fileobj:
+            return plistlib.load(fileobj)
+
+    def update(self, repo, **options):
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout), \
+                mock.patch('sys.stderr', io.StringIO()):
+            result = pkginfo_hash_updater.UpdatePkginfoHashes(
+                repo, workers=2, **options)
+        return result, stdout.getvalue()
+
+    def test_file_repo(self):
+        repo = munkirepo.connect('file://' + self.root, 'FileRepo')
+        (changed, missing), output = self.update(repo)
+        self.assertEqual((changed, missing), (2, 1))
+        for name in ('Firefox', 'Chrome'):
+            self.assertEqual(self.read_pkginfo(name)['installer_item_hash'],
+                             self.hashes[name + '.dmg'])
+        self.assertNotIn('installer_item_hash', self.read_pkginfo('Safari'))
+        # the missing item isn't counted in the progress
+        self.assertIn('[2/2] Hashed', output)
+        self.assertNotIn('/3]', output)
+
+    def test_download_only_repo_caches_by_size_and_mtime(self):
+        repo = DownloadOnlyRepo(self.root, info=True)
+        (changed, missing), _ = self.update(repo)
+        self.assertEqual((changed, missing), (2, 1))
+        self.assertEqual(sorted(repo.downloads),
+                         ['pkgs/Chrome.dmg', 'pkgs/Firefox.dmg'])
+        self.assertEqual(self.read_pkginfo('Chrome')['installer_item_hash'],
+                         self.hashes['Chrome.dmg'])
+        # nothing has changed, so nothing is downloaded again
+        repo.downloads = []
+        (changed, missing), _ = self.update(repo, verify=True)
+        self.assertEqual((changed, missing), (0, 1))
+        self.assertEqual(repo.downloads, [])
+        # a changed item is
+        path = os.path.join(self.root, 'pkgs', 'Chrome.dmg')
+        with open(path, 'ab') as fileobj:
+            fileobj.write(b'more')
+        (changed, missing), _ = self.update(repo, verify=True)
+        self.assertEqual((changed, missing), (1, 1))
+        self.assertEqual(repo.downloads, ['pkgs/Chrome.dmg'])
+
+    def test_download_only_repo_without_info(self):
+        repo = DownloadOnlyRepo(self.root)
+        with mock.patch('tempfile.tempdir', self.tmpdir):
+            (changed, missing), _ = self.update(repo)
+        self.assertEqual((changed, missing), (2, 1))
+        self.assertEqual(self.read_pkginfo('Firefox')['installer_item_hash'],
+                         self.hashes['Firefox.dmg'])
+        # downloads are removed once hashed
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['hashcache.sqlite', 'repo'])
+
+    def test_verify_exits_nonzero_for_missing_items(self):
+        repo = munkirepo.connect('file://' + self.root, 'FileRepo')
+        self.update(repo)
+        argv = ['pkginfo_hash_updater.py', '--verify', '-r', self.root]
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch('sys.stdout', io.StringIO()), \
+                mock.patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(SystemExit) as context:
+                pkginfo_hash_updater.main()
+        self.assertEqual(context.exception.code, 1)
+        os.unlink(os.path.join(self.root, 'pkgsinfo', 'Safari.plist'))
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch('sys.stdout', io.StringIO()), \
+                mock.patch('sys.stderr', io.StringIO()):
+            pkginfo_hash_updater.main()
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
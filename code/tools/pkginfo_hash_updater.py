@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 #
 # Copyright 2010 Google Inc. All Rights Reserved.
 #
@@ -17,156 +17,389 @@
 
 """Updates all pkginfo plists '(un)installer_item_hash' key.
 
-This script will recursively update the '(un)installer_item_hash' key in all
-pkginfo plists in the pkgsinfo directory of a Munki repo with a SHA-256 hash of
+This script will update the '(un)installer_item_hash' key in all pkginfo
+plists in the pkgsinfo directory of a Munki repo with a SHA-256 hash of
 the corresponding package.
 
-This script will run from OS X or Linux alike, and it is safe to run more than
-once on any pkginfo plist(s). However, it is recommended that you backup your
-plists before running this script!
+The repo is accessed through munkilib's repo plugins, so any repo that
+makecatalogs and munkiimport can use is supported. The pkgsinfo items are
+read once, and every installer item they refer to is hashed once (no matter
+how many pkginfo items point at it), using a pool of worker processes.
+Hashes are remembered in munkilib's persistent hash cache, so re-running this
+script over an unchanged repo does not re-read any packages.
+
+With --verify, nothing is written; pkginfo items whose hashes are missing
+or no longer match their installer items, and installer items that are
+missing from the repo, are reported instead, and the script exits with a
+non-zero status if any are found.
+
+This script will run from macOS or Linux alike, and it is safe to run more
+than once on any pkginfo plist(s). However, it is recommended that you backup
+your plists before running this script!
 
 Dependencies:
-- Linux: Python2.6 or higher, or 2.4/2.5 with python-plistlib manually
-         installed: https://docs.python.org/library/plistlib.html
-- OS X: Python2.4 or higher.
+- Python 3.6 or higher.
+- munkilib, found next to this script (in a checkout of the Munki source) or
+  in /usr/local/munki.
 
 Created on 2010-09-02.
 """
 
-import optparse
+import argparse
+import concurrent.futures
 import os
-import hashlib
 import sys
+import tempfile
+import time
+
+# find munkilib next to this script (source checkout) or where it's installed
+for _munkilib_parent in (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 os.pardir, 'client'),
+    '/usr/local/munki'):
+  if os.path.isdir(os.path.join(_munkilib_parent, 'munkilib')):
+    sys.path.insert(0, _munkilib_parent)
+    break
+
 try:
-  import plistlib
-except ImportError:
-  print ('ERROR: could not import module "plistlib." Please install it and '
-         'try again.')
+  from munkilib import munkihash
+  from munkilib.admin.common import HASH_CACHE_DB
+  from munkilib import munkirepo
+  from munkilib.wrappers import (readPlistFromString, writePlistToString,
+                                 PlistReadError, PlistWriteError)
+except ImportError as err:
+  print('ERROR: could not import munkilib: %s' % err, file=sys.stderr)
   sys.exit(1)
 
 
 MUNKI_ROOT_PATH = '/var/www/munki/repo'
-MUNKI_PKGS_DIR_NAME = 'pkgs'
-MUNKI_PKGSINFO_DIR_NAME = 'pkgsinfo'
 
+# pkginfo keys: (location key, hash key)
+ITEM_KEYS = (('installer_item_location', 'installer_item_hash'),
+             ('uninstaller_item_location', 'uninstaller_item_hash'))
 
-def GetHash(filename, hash_function):
-  """Calculates the hashvalue of the given file with the given hash_function.
-  
-  Args:
-    filename: The file name to calculate the hash value of.
-    hash_function: The hash function object to use, which was instantiated
-        before calling this function, e.g. hashlib.md5().
-  
-  Returns:
-    The hashvalue of the given file as hex string.
+HASH_KEY_DESCRIPTIONS = {'installer_item_hash': 'Installer item',
+                         'uninstaller_item_hash': 'Uninstaller item'}
+
+
+def FormatBytes(count):
+  """Returns a human-readable string for a count of bytes."""
+  for unit in ('bytes', 'KB', 'MB', 'GB'):
+    if count < 1024:
+      return '%.1f %s' % (count, unit)
+    count /= 1024.0
+  return '%.1f TB' % count
+
+
+class InstallerItemFetcher(object):
+  """Gets installer items for hashing.
+
+  Repo plugins with a local_path method have their items hashed in place.
+  Other plugins' items are each downloaded to a temporary file that is
+  removed as soon as it is hashed. If such a plugin can list the size and
+  mtime of its pkgs (itemlist_with_info), the hash cache is keyed on the repo
+  URL, item path, size and mtime, so unchanged items aren't downloaded again.
   """
-  if not os.path.isfile(filename):
+
+  def __init__(self, repo):
+    self.repo = repo
+    self.has_local_paths = hasattr(repo, 'local_path')
+    self.repo_id = getattr(repo, 'baseurl', None) or type(repo).__name__
+    self.item_info = None
+    if not self.has_local_paths:
+      try:
+        self.item_info = repo.itemlist_with_info('pkgs')
+      except AttributeError:
+        pass
+      except munkirepo.RepoError as err:
+        print('WARNING: could not get list of pkgs: %s' % err,
+              file=sys.stderr)
+
+  def LocalPath(self, item_location):
+    """Returns a local path to the installer item, or None if unavailable."""
+    local_path = self.repo.local_path(os.path.join('pkgs', item_location))
+    if local_path and os.path.isfile(local_path):
+      return local_path
     return None
-  
-  f = open(filename, 'rb')
-  while 1:
-    chunk = f.read(2**16)
-    if not chunk:
-      break
-    hash_function.update(chunk)
-  f.close()
-  return hash_function.hexdigest()
-
-
-def GetSHA256Hash(filename):
-  """Returns the SHA-256 hash value of a file as a hex string."""
-  hash_function = hashlib.sha256()
-  return GetHash(filename, hash_function)
-
-
-def AddHashesToPkginfoPlists(pkgsinfo_path, pkgs_path, update_existing=False):
-  """Recursively updates plists' '(un)installer_item_hash' kay with pkg hash.
-  
-  Args:
-    pkgsinfo_path: root dir to start updating from.
-    pkgs_path: root dir where Munki pkgs live.
+
+  def IsListed(self, item_location):
+    """Returns False if the repo's pkgs listing lacks the installer item."""
+    return self.item_info is None or item_location in self.item_info
+
+  def CachedHash(self, cache, item_location):
+    """Returns the cached hash of an installer item without a local path."""
+    if not self.item_info or item_location not in self.item_info:
+      return None
+    size, mtime = self.item_info[item_location]
+    return cache.resource_hash(
+        self._ResourceId(item_location), size, mtime)
+
+  def RememberHash(self, cache, item_location, itemhash):
+    """Caches the hash of an installer item without a local path."""
+    if self.item_info and item_location in self.item_info:
+      size, mtime = self.item_info[item_location]
+      cache.remember_resource(
+          self._ResourceId(item_location), size, mtime, itemhash)
+
+  def DownloadHash(self, item_location):
+    """Downloads and hashes an installer item without a local path.
+
+    Returns:
+      A tuple of the SHA-256 hash (or None if the item couldn't be got) and
+      the number of bytes read.
+    """
+    resource = os.path.join('pkgs', item_location)
+    fileref, local_path = tempfile.mkstemp(prefix='pkginfo_hash_updater.')
+    os.close(fileref)
+    try:
+      try:
+        self.repo.get_to_local_file(resource, local_path)
+      except munkirepo.RepoError as err:
+        print('WARNING: could not get %s: %s' % (resource, err),
+              file=sys.stderr)
+        return None, 0
+      itemhash = munkihash.getsha256hash(local_path)
+      size = os.path.getsize(local_path)
+    finally:
+      os.unlink(local_path)
+    if itemhash in ('NOT A FILE', 'HASH_ERROR'):
+      return None, 0
+    return itemhash, size
+
+  def _ResourceId(self, item_location):
+    """Returns the hash cache key for an installer item."""
+    return '%s/pkgs/%s' % (self.repo_id.rstrip('/'), item_location)
+
+
+def ReadPkgsinfo(repo):
+  """Reads every pkginfo item in the repo.
+
+  Returns:
+    A list of (pkginfo_ref, pkginfo) tuples.
   """
-  for f_path in os.listdir(pkgsinfo_path):
-    if f_path.startswith("._") or f_path == ".DS_Store":
-      # don't process these
+  pkgsinfo = []
+  try:
+    pkgsinfo_list = sorted(repo.itemlist('pkgsinfo'))
+  except munkirepo.RepoError as err:
+    print('ERROR: could not get list of pkgsinfo: %s' % err, file=sys.stderr)
+    return pkgsinfo
+  for name in pkgsinfo_list:
+    pkginfo_ref = os.path.join('pkgsinfo', name)
+    try:
+      pkginfo = readPlistFromString(repo.get(pkginfo_ref))
+    except (munkirepo.RepoError, PlistReadError) as err:
+      print('WARNING: pkginfo plist failed to open: %s\n%s'
+            % (pkginfo_ref, err), file=sys.stderr)
       continue
-    f_path = os.path.join(pkgsinfo_path, f_path)
-    # if a directory is found, recursively call this function on that dir.
-    if os.path.isdir(f_path):
-      AddHashesToPkginfoPlists(f_path, pkgs_path)
-    elif os.path.islink(f_path):
-      print 'WARNING: symlinks not supported; skipping: %s' % f_path
+    if not isinstance(pkginfo, dict):
+      print('WARNING: %s is not a pkginfo dictionary' % pkginfo_ref,
+            file=sys.stderr)
       continue
-    elif os.path.isfile(f_path):
-      # read plist
-      try:
-        plist = plistlib.readPlist(f_path)
-      except IOError as e:
-        print 'WARNING: pkginfo plist failed to open: %s\n%s' % (f_path,
-                                                                 str(e))
+    pkgsinfo.append((pkginfo_ref, pkginfo))
+  return pkgsinfo
+
+
+def ItemsNeedingHashes(pkgsinfo, update_existing=False):
+  """Works out which installer items we need to hash.
+
+  Args:
+    pkgsinfo: list of (pkginfo_ref, pkginfo) tuples.
+    update_existing: if False, items that already have a hash are skipped.
+
+  Returns:
+    A dict of item_location: list of (pkginfo_ref, hash_key) tuples.
+  """
+  needed = {}
+  for pkginfo_ref, pkginfo in pkgsinfo:
+    for location_key, hash_key in ITEM_KEYS:
+      location = pkginfo.get(location_key)
+      if not location:
+        continue
+      if hash_key in pkginfo and not update_existing:
         continue
-      
+      needed.setdefault(location, []).append((pkginfo_ref, hash_key))
+  return needed
+
+
+def HashInstallerItems(repo, item_locations, workers):
+  """Hashes each installer item once, across a pool of workers.
+
+  Returns:
+    A dict of item_location: SHA-256 hash (or None if the item is missing).
+  """
+  hashes = {}
+  start_time = time.time()
+  stats = {'done': 0, 'bytes': 0}
+  cache = munkihash.shared_hash_cache(HASH_CACHE_DB)
+  hits_before = cache.hits
+  fetcher = InstallerItemFetcher(repo)
+
+  local_paths = {}
+  downloads = []
+  for location in item_locations:
+    if fetcher.has_local_paths:
+      local_path = fetcher.LocalPath(location)
+      if local_path:
+        local_paths[local_path] = location
+      else:
+        hashes[location] = None
+    elif not fetcher.IsListed(location):
+      hashes[location] = None
+    else:
+      itemhash = fetcher.CachedHash(cache, location)
+      if itemhash:
+        hashes[location] = itemhash
+      else:
+        downloads.append(location)
+  # only count the items that are there to be hashed
+  total = len(local_paths) + len(downloads)
+
+  def Progress(location, size):
+    """Prints progress for each item actually read."""
+    stats['done'] += 1
+    stats['bytes'] += size
+    elapsed = max(time.time() - start_time, 0.001)
+    print('[%s/%s] Hashed %s (%s/s)'
+          % (stats['done'], total, location,
+             FormatBytes(stats['bytes'] / elapsed)))
+
+  def LocalProgress(local_path, dummy_itemhash):
+    """Progress for items hashed in place."""
+    try:
+      size = os.path.getsize(local_path)
+    except OSError:
+      size = 0
+    Progress(local_paths[local_path], size)
+
+  if local_paths:
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers) as executor:
+      local_hashes = cache.getsha256hashes(
+          list(local_paths), progress_fn=LocalProgress, executor=executor)
+    for local_path, itemhash in local_hashes.items():
+      hashes[local_paths[local_path]] = itemhash
+
+  if downloads:
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers or os.cpu_count()) as executor:
+      results = executor.map(fetcher.DownloadHash, downloads)
+      for location, (itemhash, size) in zip(downloads, results):
+        hashes[location] = itemhash
+        if itemhash:
+          # the cache's database connection belongs to this thread
+          fetcher.RememberHash(cache, location, itemhash)
+          Progress(location, size)
+
+  elapsed = time.time() - start_time
+  print('\nHashed %s item(s), %s, in %.1f seconds (%s/s); %s item(s) '
+        'unchanged since last run.'
+        % (stats['done'], FormatBytes(stats['bytes']), elapsed,
+           FormatBytes(stats['bytes'] / max(elapsed, 0.001)),
+           cache.hits - hits_before))
+  return hashes
+
+
+def UpdatePkginfoHashes(repo, update_existing=False, verify=False,
+                        workers=None):
+  """Updates (or with verify, checks) '(un)installer_item_hash' keys.
+
+  Returns:
+    A tuple of the number of pkginfo items that were (or in verify mode,
+    would be) changed and the number of installer items that are missing.
+  """
+  pkgsinfo = ReadPkgsinfo(repo)
+  needed = ItemsNeedingHashes(pkgsinfo, update_existing=update_existing or
+                              verify)
+  hashes = HashInstallerItems(repo, sorted(needed), workers)
+
+  # work out what changes for each pkginfo item
+  changes = {}
+  for location, refs in needed.items():
+    for pkginfo_ref, hash_key in refs:
+      changes.setdefault(pkginfo_ref, []).append((hash_key, location))
+
+  changed_count = 0
+  missing = set()
+  # write all the changes as one batch (a single commit for GitFileRepo)
+  with munkirepo.transaction(repo):
+    for pkginfo_ref, pkginfo in pkgsinfo:
       updated_hash = False
-      # generate the package path from the pkginfo plist
-      # installer_item_location.
-      if not 'installer_item_hash' in plist or update_existing:
-          pkg_path = os.path.join(pkgs_path, plist['installer_item_location'])
-          # display warning for items that cannot be found.
-          if not os.path.isfile(pkg_path):
-            print >> sys.stderr, ('WARNING: Installer item (%s) not found '
-                                  'as specified in %s') % (pkg_path, f_path)
-            continue
-          # generate the package hash
-          plist['installer_item_hash'] = GetSHA256Hash(pkg_path)
-          updated_hash = True
-      
-      # check for and update uninstaller_item_hash if needed
-      if 'uninstaller_item_location' in plist:
-        if not 'uninstaller_item_hash' in plist or update_existing:
-          pkg_path = os.path.join(pkgs_path,
-                                  plist['uninstaller_item_location'])
-          # display warning for items that cannot be found.
-          if not os.path.isfile(pkg_path):
-              print >> sys.stderr, ('WARNING: Uninstaller item (%s) not '
-                                    'found as specified in %s') % (pkg_path,
-                                                                   f_path)
-              continue
-          
-          # generate the package hash
-          plist['uninstaller_item_hash'] = GetSHA256Hash(pkg_path)
-          updated_hash = True
-          
-      # write the plist file.
+      for hash_key, location in changes.get(pkginfo_ref, []):
+        itemhash = hashes.get(location)
+        if itemhash is None or itemhash in ('NOT A FILE', 'HASH_ERROR'):
+          print('WARNING: %s (%s) not found as specified in %s'
+                % (HASH_KEY_DESCRIPTIONS[hash_key], location, pkginfo_ref),
+                file=sys.stderr)
+          missing.add(location)
+          continue
+        if pkginfo.get(hash_key) == itemhash:
+          continue
+        if verify:
+          if hash_key in pkginfo:
+            print('STALE: %s %s does not match %s'
+                  % (pkginfo_ref, hash_key, location))
+          else:
+            print('MISSING: %s has no %s' % (pkginfo_ref, hash_key))
+        pkginfo[hash_key] = itemhash
+        updated_hash = True
+
       if updated_hash:
-        plistlib.writePlist(plist, f_path)
-        print '- Wrote hash to plist: %s' % f_path
+        changed_count += 1
+        if verify:
+          continue
+        try:
+          repo.put(pkginfo_ref, writePlistToString(pkginfo))
+          print('- Wrote hash to plist: %s' % pkginfo_ref)
+        except (munkirepo.RepoError, PlistWriteError) as err:
+          print('ERROR: could not write %s: %s' % (pkginfo_ref, err),
+                file=sys.stderr)
+  return changed_count, len(missing)
 
 
 def main():
-  usage = 'usage: %prog [options]'
-  p = optparse.OptionParser(usage=usage)
-  p.add_option('-r', '--munki_root', default=MUNKI_ROOT_PATH,
-               help='Munki repo root path where pkginfo and pkgs dirs live; '
-               'default "/var/www/munki/repo"')
-  p.add_option('-p', '--pkgsinfo_dir_name', default=MUNKI_PKGSINFO_DIR_NAME,
-               help='Munki pkgsinfo dir name; default "pkgsinfo".')
-  p.add_option('-f', '--pkgs_dir_name', default=MUNKI_PKGS_DIR_NAME,
-               help='Munki packages dir name; default "pkgs".')
-  p.add_option('-u', "--update_existing", action='store_true',
-                help='Update existing hashes.')
-  options, dummy_arguments = p.parse_args()
-  
-  pkgsinfo_path = os.path.join(options.munki_root, options.pkgsinfo_dir_name)
-  pkgs_path = os.path.join(options.munki_root, options.pkgs_dir_name)
-  if not os.path.isdir(pkgsinfo_path) or not os.listdir(pkgsinfo_path):
-    print 'Pkgsinfo directory not found or is empty: %s' % pkgsinfo_path
-  elif not os.path.isdir(pkgs_path) or not os.listdir(pkgs_path):
-    print 'Pkgs directory not found or is empty: %s' % pkgs_path
-  else:
-    AddHashesToPkginfoPlists(pkgsinfo_path, pkgs_path,
-                             options.update_existing)
-    print '\nYou must run makecatalogs to update catalogs with pkginfo changes.'
+  parser = argparse.ArgumentParser(
+      description='Updates (un)installer_item_hash in pkginfo files.')
+  parser.add_argument('--repo_url', '--repo-url',
+                      help='Munki repo URL; default "file://" + munki_root')
+  parser.add_argument('--plugin', default='FileRepo',
+                      help='Munki repo plugin; default "FileRepo".')
+  parser.add_argument('-r', '--munki_root', default=MUNKI_ROOT_PATH,
+                      help='Munki repo root path where pkginfo and pkgs '
+                      'dirs live; default "%s"' % MUNKI_ROOT_PATH)
+  parser.add_argument('-u', '--update_existing', action='store_true',
+                      help='Update existing hashes.')
+  parser.add_argument('--verify', action='store_true',
+                      help='Report missing or stale hashes without '
+                      'changing any pkginfo.')
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                      help='Number of installer items to hash at once; '
+                      'default is the number of CPUs.')
+  options = parser.parse_args()
+
+  repo_url = options.repo_url or 'file://' + os.path.abspath(
+      options.munki_root)
+  try:
+    repo = munkirepo.connect(repo_url, options.plugin)
+  except munkirepo.RepoError as err:
+    print('Could not connect to munki repo: %s' % err, file=sys.stderr)
+    sys.exit(1)
+
+  changed_count, missing_count = UpdatePkginfoHashes(
+      repo, update_existing=options.update_existing, verify=options.verify,
+      workers=options.jobs)
+  if options.verify:
+    if changed_count:
+      print('\n%s pkginfo item(s) have missing or stale hashes.'
+            % changed_count)
+    if missing_count:
+      print('\n%s installer item(s) are missing from the repo.'
+            % missing_count)
+    if changed_count or missing_count:
+      sys.exit(1)
+    print('\nAll pkginfo hashes are up to date.')
+  elif changed_count:
+    print('\nYou must run makecatalogs to update catalogs with pkginfo '
+          'changes.')
 
 
 if __name__ == '__main__':